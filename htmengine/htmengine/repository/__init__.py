@@ -21,9 +21,12 @@
 
 import logging
 import os
+import threading
+import time
 import traceback
 
 from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
 
 from nta.utils import sqlalchemy_utils
 
@@ -31,6 +34,7 @@ from htmengine.repository.queries import (
   addMetric,
   addMetricData,
   deleteMetric,
+  deleteMetricDataRows,
   deleteModel,
   getCustomMetricByName,
   getCustomMetrics,
@@ -45,16 +49,22 @@ from htmengine.repository.queries import (
   getMetricCountForServer,
   getMetricData,
   getMetricDataCount,
+  getMetricDataStats,
+  getMetricDataWithSharedLock,
   getProcessedMetricDataCount,
   getMetricDataWithRawAnomalyScoresTail,
   getMetricIdsSortedByDisplayValue,
   getMetricStats,
   getUnprocessedModelDataCount,
+  insertMetricData,
   listMetricIDsForInstance,
+  refreshMetricDataStats,
+  reserveMetricRowids,
   saveMetricInstanceStatus,
   setMetricCollectorError,
   setMetricLastTimestamp,
   setMetricStatus,
+  subtractFromMetricDataStats,
   updateMetricColumns,
   updateMetricColumnsForRefStatus,
   updateMetricDataColumns,
@@ -74,6 +84,14 @@ DB_DSN_FORMAT = "mysql://%(user)s:%(passwd)s@%(host)s:%(port)s/%(db)s"
 g_log = logging.getLogger("htmengine.repository")
 
 
+# Connection pool defaults; may be overridden by the optional `pool_size`,
+# `max_overflow` and `pool_recycle` options in the `[repository]` config
+# section. NOTE: pool_size=0 with max_overflow=-1 means an unbounded pool.
+_DEFAULT_POOL_SIZE = 0
+_DEFAULT_MAX_OVERFLOW = -1
+_DEFAULT_POOL_RECYCLE_SEC = 179
+
+
 
 def getBaseConnectionArgsDict(config):
   """Return a dictonary of common database connection arguments."""
@@ -88,6 +106,82 @@ def getBaseConnectionArgsDict(config):
 
 
 
+class ConnectionPoolStats(object):
+  """ Connection pool gauges and checkout latency counters maintained by
+  _InstrumentedQueuePool. Counters are cumulative since the last call to
+  `snapshot(reset=True)`.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._checkouts = 0
+    self._totalCheckoutSec = 0.0
+    self._maxCheckoutSec = 0.0
+    self._peakInUse = 0
+
+
+  def recordCheckout(self, latencySec, inUse):
+    """ Record the completion of a connection checkout
+
+    :param float latencySec: time spent waiting for the connection, including
+      time to open a new DBAPI connection, if one was needed
+    :param int inUse: number of connections checked out of the pool
+    """
+    with self._lock:
+      self._checkouts += 1
+      self._totalCheckoutSec += latencySec
+      if latencySec > self._maxCheckoutSec:
+        self._maxCheckoutSec = latencySec
+      if inUse > self._peakInUse:
+        self._peakInUse = inUse
+
+
+  def snapshot(self, pool, reset=False):
+    """
+    :param pool: the pool that maintains these stats
+    :param bool reset: reset the cumulative counters after taking the snapshot
+    :returns: dict of pool gauges and checkout latency counters
+    """
+    with self._lock:
+      stats = dict(
+        inUse=pool.checkedout(),
+        idle=pool.checkedin(),
+        overflow=pool.overflow(),
+        peakInUse=self._peakInUse,
+        checkouts=self._checkouts,
+        meanCheckoutSec=(self._totalCheckoutSec / self._checkouts
+                         if self._checkouts else 0.0),
+        maxCheckoutSec=self._maxCheckoutSec)
+
+      if reset:
+        self._checkouts = 0
+        self._totalCheckoutSec = 0.0
+        self._maxCheckoutSec = 0.0
+        self._peakInUse = stats["inUse"]
+
+    return stats
+
+
+
+class _InstrumentedQueuePool(QueuePool):
+  """ QueuePool that measures checkout latency and tracks the number of
+  connections in use
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(_InstrumentedQueuePool, self).__init__(*args, **kwargs)
+    self.stats = ConnectionPoolStats()
+
+
+  def _do_get(self):
+    startTime = time.time()
+    conn = super(_InstrumentedQueuePool, self)._do_get()
+    self.stats.recordCheckout(latencySec=time.time() - startTime,
+                              inUse=self.checkedout())
+    return conn
+
+
+
 class _EngineSingleton(object):
 
   _dsn = None
@@ -169,11 +263,37 @@ def getDbDSN(config):
 
 
 
+def getPoolSettings(config):
+  """Return the connection pool settings for engineFactory from the optional
+  `pool_size`, `max_overflow` and `pool_recycle` options of the `[repository]`
+  config section.
+
+  Individual services may tune these via the config's environment variable
+  overrides (e.g., in the service's supervisord `environment`); see
+  nta.utils.config.Config.
+
+  :returns: dict of create_engine() keyword args
+  """
+  def getOptionalInt(option, default):
+    if config.has_option("repository", option):
+      return config.getint("repository", option)
+    return default
+
+  return dict(
+    pool_size=getOptionalInt("pool_size", _DEFAULT_POOL_SIZE),
+    max_overflow=getOptionalInt("max_overflow", _DEFAULT_MAX_OVERFLOW),
+    pool_recycle=getOptionalInt("pool_recycle", _DEFAULT_POOL_RECYCLE_SEC))
+
+
+
 def engineFactory(config, reset=False):
   """SQLAlchemy engine factory method
 
   See http://docs.sqlalchemy.org/en/rel_0_9/core/connections.html
 
+  The engine's pool is sized per `getPoolSettings()` and maintains
+  `ConnectionPoolStats` (see `getPoolStats()`).
+
   :param reset: Force a new engine instance.  By default, the same instance is
     reused when possible.
   :returns: SQLAlchemy engine object
@@ -187,5 +307,161 @@ def engineFactory(config, reset=False):
   if reset:
     _EngineSingleton.reset()
 
-  return _EngineSingleton(getDbDSN(config), pool_recycle=179, pool_size=0,
-                          max_overflow=-1)
+  return _EngineSingleton(getDbDSN(config),
+                          poolclass=_InstrumentedQueuePool,
+                          **getPoolSettings(config))
+
+
+
+def getPoolStats(engine, reset=False):
+  """Return connection pool gauges and checkout latency counters of an engine
+  created by engineFactory; intended for profiling logs.
+
+  :param engine: SQLAlchemy engine object from engineFactory
+  :param bool reset: reset cumulative counters after taking the snapshot, so
+    that the next call reports on the interval since this one
+  :returns: dict with keys inUse, idle, overflow, peakInUse, checkouts,
+    meanCheckoutSec and maxCheckoutSec; None if the engine's pool isn't
+    instrumented
+  """
+  pool = engine.pool
+  if not isinstance(pool, _InstrumentedQueuePool):
+    return None
+  return pool.stats.snapshot(pool, reset=reset)
+
+
+
+def formatPoolStats(stats):
+  """Format the result of getPoolStats for logging"""
+  return ("inUse=%(inUse)d; idle=%(idle)d; overflow=%(overflow)d; "
+          "peakInUse=%(peakInUse)d; checkouts=%(checkouts)d; "
+          "meanCheckout=%(meanCheckoutSec).4fs; "
+          "maxCheckout=%(maxCheckoutSec).4fs" % stats)
+
+
+
+class SharedConnection(object):
+  """Engine-like wrapper that reuses one pooled connection for all `connect()`
+  and `begin()` requests made through it, so that a batch of operations
+  performs a single pool checkout.
+
+  Pass it in place of an engine to code that uses the `engine.connect()` and
+  `engine.begin()` idioms. Connections returned by `connect()` are branches of
+  the shared connection: closing them doesn't return the connection to the
+  pool.
+
+  Usage::
+
+      with repository.SharedConnection(engine) as batchEngine:
+        with batchEngine.connect() as conn:
+          metricObj = repository.getMetric(conn, metricId)
+        with batchEngine.begin() as conn:
+          repository.setMetricStatus(conn, metricId, MetricStatus.ACTIVE)
+
+  NOTE: like a connection returned to the pool, the shared connection's
+  implicit transaction left by statements executed outside of an explicit
+  transaction is rolled back before each `connect()`, `begin()` and `execute()`
+  request unless a transaction begun through a branch is still open, so that
+  each request starts with a fresh REPEATABLE READ snapshot instead of the one
+  taken by the batch's first read.
+  """
+
+  def __init__(self, engine):
+    """
+    :param engine: SQLAlchemy engine object
+    :type engine: sqlalchemy.engine.Engine
+    """
+    self._engine = engine
+    self._connection = None
+
+    # Branches of the shared connection that haven't been closed yet
+    self._branches = []
+
+
+  def __enter__(self):
+    self._connection = self._engine.connect()
+    return self
+
+
+  def __exit__(self, *_args):
+    try:
+      self._connection.close()
+    finally:
+      self._connection = None
+      self._branches = []
+
+
+  def connect(self):
+    """ Emulates `Engine.connect()`
+
+    :returns: a branch of the shared connection
+    :rtype: sqlalchemy.engine.Connection
+    """
+    return self._createBranch()
+
+
+  def begin(self):
+    """ Emulates `Engine.begin()`: returns a context manager that yields a
+    branch of the shared connection inside a transaction that's committed on
+    success or rolled back on error
+    """
+    return _SharedConnectionTransactionContext(self._createBranch())
+
+
+  def execute(self, *args, **kwargs):
+    """ Emulates `Engine.execute()` """
+    return self._getConnection().execute(*args, **kwargs)
+
+
+  def _createBranch(self):
+    """
+    :returns: a new branch of the shared connection
+    :rtype: sqlalchemy.engine.Connection
+    """
+    branch = self._getConnection().connect()
+    self._branches.append(branch)
+    return branch
+
+
+  def _getConnection(self):
+    """ Get the shared connection for a new request, ending its implicit
+    transaction unless a transaction begun through a branch is still open
+
+    :returns: the shared connection, replacing it first if it was invalidated
+      (e.g., lost due to a transient error being retried by the caller)
+    """
+    if self._connection.invalidated:
+      self._connection.close()
+      self._connection = self._engine.connect()
+      self._branches = []
+      return self._connection
+
+    self._branches = [branch for branch in self._branches if not branch.closed]
+    if not any(branch.in_transaction() for branch in self._branches):
+      self._connection.connection.rollback()
+
+    return self._connection
+
+
+
+class _SharedConnectionTransactionContext(object):
+  """ Context manager returned by SharedConnection.begin() """
+
+  def __init__(self, conn):
+    self._conn = conn
+    self._transaction = None
+
+
+  def __enter__(self):
+    self._transaction = self._conn.begin()
+    return self._conn
+
+
+  def __exit__(self, excType, _excValue, _traceback):
+    try:
+      if excType is None:
+        self._transaction.commit()
+      else:
+        self._transaction.rollback()
+    finally:
+      self._conn.close()
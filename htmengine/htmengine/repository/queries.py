@@ -20,7 +20,7 @@
 # ----------------------------------------------------------------------
 from datetime import datetime
 
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 from sqlalchemy.sql import select
 from sqlalchemy.engine.base import Connection
 
@@ -89,6 +89,14 @@ def deleteMetric(conn, metricId):
     # is kept by deleting any related data when necessary
     deleteModel(conn, metricId)
 
+    # Delete metric data explicitly, because partitioned metric_data tables
+    # can't rely on the metric_data_to_metric_fk "ON DELETE CASCADE"
+    conn.execute(schema.metric_data.delete() # pylint: disable=E1120
+                 .where(schema.metric_data.c.uid == metricId))
+
+    conn.execute(schema.metric_data_stats.delete() # pylint: disable=E1120
+                 .where(schema.metric_data_stats.c.uid == metricId))
+
     # Delete metric
     result = (conn.execute(schema.metric.delete() # pylint: disable=E1120
                            .where(schema.metric.c.uid == metricId)))
@@ -143,7 +151,7 @@ def addMetric(conn, # pylint: disable=C0103
               parameters=None, status=None, message=None, collector_error=None,
               last_timestamp=None, poll_interval=None,
               tag_name=None, model_params=None, last_rowid=0):
-  """Add metric
+  """Add metric along with its empty metric_data_stats row
 
   :param conn: SQLAlchemy connection object
   :type conn: sqlalchemy.engine.base.Connection
@@ -175,7 +183,13 @@ def addMetric(conn, # pylint: disable=C0103
                                       model_params=model_params,
                                       last_rowid=last_rowid)
 
-  return conn.execute(ins).last_inserted_params()
+  with conn.begin():
+    insertedParams = conn.execute(ins).last_inserted_params()
+
+    conn.execute(schema.metric_data_stats.insert() # pylint: disable=E1120
+                 .values(uid=uid))
+
+  return insertedParams
 
 
 
@@ -588,8 +602,115 @@ def incrementMetricRowid(conn, metricId, amount=1):
 
 
 
+def reserveMetricRowids(conn, metricId, amount, lastTimestamp):
+  """ Atomically reserve a block of consecutive rowids for the given metric's
+  data by advancing its last_rowid in a single statement, and record the
+  timestamp of the sample that the last rowid of the block is reserved for in
+  the metric's last_rowid_timestamp.
+
+  Outside of a transaction, the statement is autocommitted, so that the metric
+  row's lock is held only for that statement; the rows are then inserted via
+  insertMetricData in a separate transaction. Inside of a transaction, the
+  metric row remains locked until the transaction ends, which allows callers
+  that check new samples against last_rowid_timestamp under the metric row's
+  lock (e.g., the metric streamer) to do so before reserving their rowids.
+
+  Rowids are reserved in ascending order, but a block that isn't used (e.g.,
+  because the transaction that inserts the rows fails) leaves a gap in the
+  metric's rowids, and blocks reserved by concurrent writers may be committed
+  out of order. last_rowid_timestamp reflects the latest reservation, whether
+  or not its rows have been committed.
+
+  NOTE: uses MySQL's LAST_INSERT_ID(expr) to retrieve the updated last_rowid
+  on the same connection.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  :type metricId: str
+  :param amount: Number of rowids to reserve
+  :type amount: integer
+  :param lastTimestamp: Timestamp of the sample to be stored at the last rowid
+    of the block
+  :type lastTimestamp: datetime.datetime
+
+  :returns: the last rowid of the reserved block; the block consists of rowids
+    (lastRowid - amount + 1) through lastRowid
+  :rtype: int
+
+  :raises ObjectNotFoundError: if a row with the requested metricId wasn't found
+  """
+  assert type(conn) is Connection
+
+  if amount < 1:
+    raise ValueError("Expected positive integer amount for reserving rowids, "
+                     "but got: %r" % (amount,))
+
+  update = (schema.metric.update() # pylint: disable=E1120
+            .where(schema.metric.c.uid == metricId)
+            .values(last_rowid=func.last_insert_id(
+                      schema.metric.c.last_rowid + amount),
+                    last_rowid_timestamp=lastTimestamp))
+
+  if conn.execute(update).rowcount == 0:
+    raise ObjectNotFoundError("Metric not found for uid=%s" % (metricId,))
+
+  return conn.execute(select([func.last_insert_id()])).scalar()
+
+
+
+def insertMetricData(conn, metricId, data, lastRowid):
+  """ Insert metric data rows at a block of rowids that was reserved via
+  reserveMetricRowids, and update the metric's metric_data_stats row with them
+  in the same transaction.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  :type metricId: str
+  :param data: A sequence of metric data sample pairs (value, datetime.datetime)
+  :param lastRowid: Last rowid of the reserved block; the rows are inserted at
+    rowids (lastRowid - len(data) + 1) through lastRowid
+  :type lastRowid: int
+  :returns: Sequence of metric data rows ordered by rowid in ascending order.
+    each row is a dict of column names/values
+  """
+  assert type(conn) is Connection
+
+  numRows = len(data)
+
+  if numRows == 0:
+    return []
+
+  rows = [
+    dict(uid=metricId,
+         rowid=rowid,
+         timestamp=timestamp,
+         metric_value=metricValue)
+    for rowid, (metricValue, timestamp) in enumerate(data,
+                                                     lastRowid - numRows + 1)
+  ]
+
+  with conn.begin():
+    conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
+                 rows)
+
+    _addToMetricDataStats(conn, metricId,
+                          fromRowid=lastRowid - numRows + 1,
+                          toRowid=lastRowid)
+
+  return rows
+
+
+
 def addMetricData(conn, metricId, data):
   """ Add Metric Data
+
+  The rowids are reserved via reserveMetricRowids and the rows are then
+  inserted via insertMetricData, so that, outside of a transaction, concurrent
+  writers to the same metric don't serialize on the metric row for the
+  duration of their inserts; rowids of a failed insert are then left unused.
+
   :param conn: SQLAlchemy connection object
   :type conn: sqlalchemy.engine.Connection
   :param metricId: Metric uid
@@ -605,22 +726,255 @@ def addMetricData(conn, metricId, data):
   if numRows == 0:
     return []
 
+  lastRowid = reserveMetricRowids(conn, metricId, amount=numRows,
+                                  lastTimestamp=data[-1][1])
+
+  return insertMetricData(conn, metricId, data, lastRowid)
+
+
+
+def _getMetricDataAggregateColumns():
+  """
+  :returns: the aggregates of metric_data rows that are tracked by
+    metric_data_stats, labeled num_rows, min_value, max_value, value_sum,
+    value_sum_squares, first_timestamp and last_timestamp
+  :rtype: list
+  """
+  value = schema.metric_data.c.metric_value
+  timestamp = schema.metric_data.c.timestamp
+
+  return [func.count().label("num_rows"),
+          func.min(value).label("min_value"),
+          func.max(value).label("max_value"),
+          func.sum(value).label("value_sum"),
+          func.sum(value * value, type_=value.type).label("value_sum_squares"),
+          func.min(timestamp).label("first_timestamp"),
+          func.max(timestamp).label("last_timestamp")]
+
+
+
+def _selectMetricDataAggregates(metricId, fromRowid=None, toRowid=None):
+  """ Build a query of the aggregates of the given metric's metric_data rows
+  that are tracked by metric_data_stats
+
+  :param metricId: Metric uid
+  :param fromRowid: Optional lowest rowid of the rows to aggregate
+  :param toRowid: Optional highest rowid of the rows to aggregate
+  :returns: select statement producing a single row with the columns num_rows,
+    min_value, max_value, value_sum, value_sum_squares, first_timestamp and
+    last_timestamp; all but num_rows are NULL if there are no matching rows
+  :rtype: sqlalchemy.sql.selectable.Select
+  """
+  sel = (select(_getMetricDataAggregateColumns())
+         .where(schema.metric_data.c.uid == metricId))
+
+  if fromRowid is not None:
+    sel = sel.where(schema.metric_data.c.rowid >= fromRowid)
+
+  if toRowid is not None:
+    sel = sel.where(schema.metric_data.c.rowid <= toRowid)
+
+  return sel
+
+
+
+def _addToMetricDataStats(conn, metricId, fromRowid, toRowid):
+  """ Merge the given range of newly-added metric_data rows into the metric's
+  metric_data_stats row
+
+  NOTE: the aggregates of the new rows are computed by the database from the
+  inserted rows, so that they reflect the stored (converted) values and
+  timestamps
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  :param fromRowid: lowest rowid of the new rows
+  :param toRowid: highest rowid of the new rows
+  """
+  batch = conn.execute(
+    _selectMetricDataAggregates(metricId, fromRowid, toRowid)).first()
+
+  if not batch.num_rows:
+    return
+
+  stats = schema.metric_data_stats
+
+  update = (stats.update() # pylint: disable=E1120
+            .where(stats.c.uid == metricId)
+            .values(
+              num_rows=stats.c.num_rows + batch.num_rows,
+              min_value=func.least(
+                func.coalesce(stats.c.min_value, batch.min_value),
+                batch.min_value),
+              max_value=func.greatest(
+                func.coalesce(stats.c.max_value, batch.max_value),
+                batch.max_value),
+              value_sum=(func.coalesce(stats.c.value_sum, 0) +
+                         batch.value_sum),
+              value_sum_squares=(func.coalesce(stats.c.value_sum_squares, 0) +
+                                 batch.value_sum_squares),
+              first_timestamp=func.least(
+                func.coalesce(stats.c.first_timestamp, batch.first_timestamp),
+                batch.first_timestamp),
+              last_timestamp=func.greatest(
+                func.coalesce(stats.c.last_timestamp, batch.last_timestamp),
+                batch.last_timestamp)))
+
+  conn.execute(update)
+
+
+
+def subtractFromMetricDataStats(conn, metricId, deleted):
+  """ Remove deleted metric_data rows from the metric's metric_data_stats row.
+
+  The count, sum and sum of squares are maintained by subtracting the deleted
+  rows' aggregates. The minimum and maximum value and the first and last
+  timestamp can't be maintained this way; if the deleted rows include any of
+  them, the statistics must be recomputed via refreshMetricDataStats after the
+  deletion is committed.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  :param deleted: aggregates of the deleted rows of the metric, with the
+    columns num_rows, min_value, max_value, value_sum, value_sum_squares,
+    first_timestamp and last_timestamp (see _getMetricDataAggregateColumns)
+  :returns: True if the statistics need to be refreshed; False if not
+  :rtype: bool
+  """
+  if not deleted.num_rows:
+    return False
+
+  stats = schema.metric_data_stats
+
   with conn.begin():
-    lastRowid = incrementMetricRowid(conn, metricId, amount=numRows)
+    current = conn.execute(select([stats])
+                           .where(stats.c.uid == metricId)
+                           .with_for_update(read=False)).first()
+
+    if current is None:
+      # The metric has been deleted
+      return False
+
+    if deleted.num_rows >= current.num_rows:
+      # No data left
+      conn.execute(stats.update() # pylint: disable=E1120
+                   .where(stats.c.uid == metricId)
+                   .values(num_rows=0,
+                           min_value=None,
+                           max_value=None,
+                           value_sum=None,
+                           value_sum_squares=None,
+                           first_timestamp=None,
+                           last_timestamp=None))
+      return False
+
+    conn.execute(
+      stats.update() # pylint: disable=E1120
+      .where(stats.c.uid == metricId)
+      .values(num_rows=stats.c.num_rows - deleted.num_rows,
+              value_sum=stats.c.value_sum - deleted.value_sum,
+              value_sum_squares=(stats.c.value_sum_squares -
+                                 deleted.value_sum_squares)))
+
+  return (deleted.min_value == current.min_value or
+          deleted.max_value == current.max_value or
+          deleted.first_timestamp == current.first_timestamp or
+          deleted.last_timestamp == current.last_timestamp)
+
+
+
+def deleteMetricDataRows(conn, uidRowidPairs):
+  """ Delete metric_data rows with the given uid/rowid pairs, and subtract them
+  from their metrics' metric_data_stats rows in the same transaction (see
+  subtractFromMetricDataStats).
 
-    rows = [
-      dict(uid=metricId,
-           rowid=rowid,
-           timestamp=timestamp,
-           metric_value=metricValue)
-      for rowid, (metricValue, timestamp) in enumerate(data,
-                                                       lastRowid - numRows + 1)
-    ]
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param uidRowidPairs: sequence of uid/rowid pairs of metric_data rows to
+    delete
+  :returns: a pair <numDeleted, staleMetricIds>;
+    numDeleted: number of rows actually deleted; this may be less than
+      requested if something else deleted some of the requested rows
+    staleMetricIds: sorted uids of metrics whose statistics need to be
+      refreshed via refreshMetricDataStats after the transaction is committed
+  """
+  predicate = tuple_(schema.metric_data.c.uid,
+                     schema.metric_data.c.rowid).in_(uidRowidPairs)
 
-    conn.execute(schema.metric_data.insert(), # pylint: disable=E1120
-                 rows)
+  with conn.begin():
+    # Lock the rows, so that the aggregates match the rows that are deleted
+    deletedByMetric = conn.execute(
+      select([schema.metric_data.c.uid] + _getMetricDataAggregateColumns())
+      .where(predicate)
+      .group_by(schema.metric_data.c.uid)
+      .order_by(schema.metric_data.c.uid)
+      .with_for_update(read=False)).fetchall()
 
-  return rows
+    numDeleted = conn.execute(
+      schema.metric_data.delete() # pylint: disable=E1120
+      .where(predicate)).rowcount
+
+    staleMetricIds = [
+      deleted.uid for deleted in deletedByMetric
+      if subtractFromMetricDataStats(conn, deleted.uid, deleted)]
+
+  return numDeleted, staleMetricIds
+
+
+
+def refreshMetricDataStats(conn, metricId):
+  """ Recompute the metric's metric_data_stats row from its metric_data rows;
+  this is a scan of all of the metric's rows, so it's only needed when deleted
+  rows included the metric's minimum or maximum value or first or last
+  timestamp (see subtractFromMetricDataStats).
+
+  NOTE: the metric_data_stats row is locked before the metric_data rows are
+  aggregated, so that concurrent addMetricData calls that haven't committed
+  yet apply their rows on top of the refreshed statistics.
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  """
+  stats = schema.metric_data_stats
+
+  with conn.begin():
+    conn.execute(select([stats.c.uid])
+                 .where(stats.c.uid == metricId)
+                 .with_for_update(read=False))
+
+    aggregates = conn.execute(_selectMetricDataAggregates(metricId)).first()
+
+    conn.execute(stats.update() # pylint: disable=E1120
+                 .where(stats.c.uid == metricId)
+                 .values(dict(aggregates.items())))
+
+
+
+def getMetricDataStats(conn, metricId):
+  """ Get the running statistics of the metric's metric_data rows
+
+  :param conn: SQLAlchemy connection object
+  :type conn: sqlalchemy.engine.Connection
+  :param metricId: Metric uid
+  :returns: metric_data_stats row with the columns num_rows, min_value,
+    max_value, value_sum, value_sum_squares, first_timestamp and
+    last_timestamp; all but num_rows are None while the metric has no data
+  :rtype: sqlalchemy.engine.RowProxy
+  :raises htmengine.exceptions.ObjectNotFoundError: if the metric's
+    metric_data_stats row doesn't exist
+  """
+  stats = schema.metric_data_stats
+
+  result = conn.execute(select([stats]).where(stats.c.uid == metricId)).first()
+
+  if result is None:
+    raise ObjectNotFoundError("Metric data stats not found for uid=%s"
+                              % (metricId,))
+
+  return result
 
 
 
@@ -695,6 +1049,32 @@ def getMetricData(conn,
 
 
 
+def getMetricDataWithSharedLock(conn, metricId, fields=None):
+  """ Perform SELECT ... LOCK IN SHARE MODE on all metric_data rows of the
+  given metric, ordered by rowid.
+
+  Unlike a consistent read, this waits for concurrent inserts of the metric's
+  rows (see insertMetricData) to commit and returns them, and blocks further
+  inserts until the caller's transaction ends.
+
+  :param conn: SQLAlchemy connection object in a transaction
+  :type conn: sqlalchemy.engine.base.Connection
+  :param metricId: Metric uid
+  :type metricId: str
+  :param fields: Sequence of columns to be returned by underlying query
+  :returns: Metric data
+  :rtype: sqlalchemy.engine.ResultProxy
+  """
+  fields = fields or [schema.metric_data]
+
+  sel = (select(fields, order_by=schema.metric_data.c.rowid.asc())
+         .where(schema.metric_data.c.uid == metricId)
+         .with_for_update(read=_SelectLock.SHARED))
+
+  return conn.execute(sel)
+
+
+
 def getMetricDataWithRawAnomalyScoresTail(conn, metricId, limit):
   """Get MetricData ordered by timestamp, descending
 
@@ -765,22 +1145,25 @@ def updateMetricDataColumns(conn, metricDataObj, fields):
 
 
 def getMetricStats(conn, metricId):
-  """
+  """ Get the minimum and maximum of the metric's values from its
+  metric_data_stats row
+
   :param conn: SQLAlchemy connection object
   :type conn: sqlalchemy.engine.base.Connection
+  :returns: {"min": <min-value>, "max": <max-value>}
   :raises: htmengine.exceptions.MetricStatisticsNotReadyError if there are no
     or insufficent samples at this time; this may also happen if the metric
     and its data were deleted by another process in the meantime
   """
-  sel = (select([func.min(schema.metric_data.c.metric_value),
-                 func.max(schema.metric_data.c.metric_value)],
-                from_obj=schema.metric_data)
-         .where(schema.metric_data.c.uid == metricId))
+  stats = schema.metric_data_stats
 
-  result = conn.execute(sel)
+  sel = (select([stats.c.min_value, stats.c.max_value])
+         .where(stats.c.uid == metricId))
+
+  result = conn.execute(sel).first()
 
-  if result.rowcount > 0:
-    statMin, statMax = result.first().values()
+  if result is not None:
+    statMin, statMax = result.values()
 
     if statMin is not None and statMax is not None:
       return {"min": statMin, "max": statMax}
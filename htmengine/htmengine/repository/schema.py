@@ -98,6 +98,10 @@ metric = Table("metric",
                Column("last_rowid",
                       INTEGER(),
                       autoincrement=False),
+               # Timestamp of the metric_data row reserved at last_rowid, which
+               # may not be committed yet; see queries.reserveMetricRowids
+               Column("last_rowid_timestamp",
+                      DATETIME()),
                schema=None)
 
 Index("datasource_idx", metric.c.datasource)
@@ -106,6 +110,15 @@ Index("server_idx", metric.c.server)
 
 
 
+# NOTE: applications that range-partition metric_data for the metric garbage
+# collector's "partitions" mode diverge from this definition: e.g.,
+# taurus_engine migration 3f3c2b9ad1e4 drops metric_data_to_metric_fk, since
+# MySQL doesn't support foreign keys on partitioned tables, and extends the
+# primary key to (uid, rowid, timestamp). Such applications must create their
+# schema with their migrations rather than metadata.create_all(), must review
+# alembic autogenerate output against this divergence, and don't get the
+# cascading deletes of metric_data; deleteMetric deletes metric_data rows
+# explicitly for this reason.
 metric_data = Table(  # pylint: disable=C0103
     "metric_data",
     metadata,
@@ -145,6 +158,40 @@ Index("anomaly_score_idx", metric_data.c.anomaly_score)
 
 
 
+# Running statistics of each metric's metric_data rows, maintained by
+# addMetricData and refreshed after metric_data rows are deleted; the nullable
+# columns are NULL while the metric has no data
+metric_data_stats = Table(  # pylint: disable=C0103
+    "metric_data_stats",
+    metadata,
+    Column("uid",
+           VARCHAR(length=40),
+           ForeignKey(metric.c.uid, name="metric_data_stats_to_metric_fk",
+                      onupdate="CASCADE", ondelete="CASCADE"),
+           primary_key=True,
+           nullable=False),
+    Column("num_rows",
+           INTEGER(),
+           autoincrement=False,
+           nullable=False,
+           server_default="0"),
+    Column("min_value",
+           DOUBLE(asdecimal=False)),
+    Column("max_value",
+           DOUBLE(asdecimal=False)),
+    Column("value_sum",
+           DOUBLE(asdecimal=False)),
+    Column("value_sum_squares",
+           DOUBLE(asdecimal=False)),
+    Column("first_timestamp",
+           DATETIME()),
+    Column("last_timestamp",
+           DATETIME()),
+    schema=None,
+)
+
+
+
 lock = Table("lock",
              metadata,
              Column("name",
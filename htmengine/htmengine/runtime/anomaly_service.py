@@ -63,6 +63,9 @@ config = raiseExceptionOnMissingRequiredApplicationConfigPath(Config)(
 
 _MODULE_NAME = "htmengine.anomaly"
 
+# How often to report repository connection pool stats when profiling
+_POOL_STATS_LOG_INTERVAL_SEC = 60
+
 
 # Sort order code ported from Android app
 GREEN_BAR_FLOOR = 1000
@@ -191,6 +194,24 @@ class AnomalyService(object):
 
     self.likelihoodHelper = AnomalyLikelihoodHelper(self._log, config)
 
+    # Time of the last "{TAG:ANOM.POOL}" profiling report
+    self._lastPoolStatsLogTime = time.time()
+
+
+  def _logPoolStatsIfDue(self):
+    """ Log repository connection pool stats for the interval since the last
+    report if at least _POOL_STATS_LOG_INTERVAL_SEC have elapsed
+    """
+    now = time.time()
+    if now - self._lastPoolStatsLogTime < _POOL_STATS_LOG_INTERVAL_SEC:
+      return
+
+    self._lastPoolStatsLogTime = now
+    stats = repository.getPoolStats(repository.engineFactory(config),
+                                    reset=True)
+    if stats is not None:
+      self._log.info("{TAG:ANOM.POOL} %s", repository.formatPoolStats(stats))
+
 
   def _processModelCommandResult(self, metricID, result):
     """
@@ -293,8 +314,25 @@ class AnomalyService(object):
       model's initial "catch-up" phase when large inference result batches are
       prevalent.
     """
-    engine = repository.engineFactory(config)
-
+    # Perform all of the batch's database operations over a single pooled
+    # connection
+    with repository.SharedConnection(
+        repository.engineFactory(config)) as engine:
+      return self._processModelInferenceResultsWithEngine(engine,
+                                                          inferenceResults,
+                                                          metricID)
+
+
+  def _processModelInferenceResultsWithEngine(self, engine, inferenceResults,
+                                              metricID):
+    """ Implementation of `_processModelInferenceResults`
+
+    :param engine: SQLAlchemy engine object or engine-like
+      `repository.SharedConnection`
+    :param inferenceResults: see `_processModelInferenceResults`
+    :param metricID: see `_processModelInferenceResults`
+    :returns: see `_processModelInferenceResults`
+    """
     # Validate model ID
     try:
       with engine.connect() as conn:
@@ -471,6 +509,35 @@ class AnomalyService(object):
     )
 
 
+  @staticmethod
+  def _composeModelInferenceResultsHeaders(resultsMessage):
+    """ Create AMQP message headers that summarize a model inference results
+    message, so that consumers may filter messages without deserializing the
+    body.
+
+    :param dict resultsMessage: model inference results message from
+      _composeModelInferenceResultsMessage
+    :returns: dict of headers:
+      metricUid: the metric's uid
+      lastRowTimestamp: "ts" of the message's last results row; omitted if
+        there are no rows
+      userInfoKeys: comma-separated keys with non-empty values of the metric
+        spec's "userInfo", in sorted order
+    :rtype: dict
+    """
+    userInfo = resultsMessage["metric"]["spec"].get("userInfo") or {}
+
+    headers = dict(
+      metricUid=resultsMessage["metric"]["uid"],
+      userInfoKeys=",".join(sorted(key for key, value in userInfo.iteritems()
+                                   if value)))
+
+    if resultsMessage["results"]:
+      headers["lastRowTimestamp"] = resultsMessage["results"][-1]["ts"]
+
+    return headers
+
+
   @classmethod
   def _composeModelCommandResultMessage(cls, modelID, cmdResult):
     """ Compose message corresponding to the completion of a model command
@@ -643,10 +710,6 @@ class AnomalyService(object):
       deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
       headers=dict(dataType="model-cmd-result"))
 
-    # Properties for publishing model inference results on RabbitMQ exchange
-    modelInferenceResultProperties = MessageProperties(
-      deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
-
     # Declare an exchange for forwarding our results
     with amqp.synchronous_amqp_client.SynchronousAmqpClient(
         amqp.connection.getRabbitmqConnectionParameters()) as amqpClient:
@@ -702,6 +765,14 @@ class AnomalyService(object):
 
               payload = self._serializeModelResult(resultsMessage)
 
+              # Properties for publishing model inference results on RabbitMQ
+              # exchange
+              modelInferenceResultProperties = MessageProperties(
+                deliveryMode=(
+                  amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE),
+                headers=self._composeModelInferenceResultsHeaders(
+                  resultsMessage))
+
               bus.publishExg(
                 exchange=self._modelResultsExchange,
                 routingKey="",
@@ -733,6 +804,8 @@ class AnomalyService(object):
                 "numItems=%d; duration=%.4fs", batch.modelID,
                 len(batch.objects), time.time() - batchStartTime)
 
+            self._logPoolStatsIfDue()
+
     self._log.info("Stopped processing model results")
 
 
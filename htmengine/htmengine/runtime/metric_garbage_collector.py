@@ -23,9 +23,16 @@
 """Service for deleting old metric data rows. NOTE: This may not be appropriate
 for all applications, particularly those that accept custom metric data with
 arbitrary timestamps that are possibly in the past or future, such as HTM-IT.
+
+In the default "rows" mode, old rows are deleted in small batches. In
+"partitions" mode, which requires metric_data to be range-partitioned by
+TO_DAYS(timestamp) with a catch-all p_future partition (e.g., taurus_engine
+migration 3f3c2b9ad1e4), old rows are purged by dropping whole partitions and
+new partitions are created ahead of time.
 """
 
 import argparse
+import datetime
 import logging
 import sys
 import time
@@ -54,6 +61,29 @@ _PAUSE_INTERVAL_SEC = 3600
 
 
 
+# Garbage collection modes
+_MODE_ROWS = "rows"
+_MODE_PARTITIONS = "partitions"
+
+
+# Default number of days of metric data per partition in "partitions" mode
+_DEFAULT_PARTITION_INTERVAL_DAYS = 7
+
+
+# How many partition intervals beyond the current one to create ahead of time
+_NUM_PARTITIONS_AHEAD = 2
+
+
+# Name of the catch-all MAXVALUE partition of metric_data
+_FUTURE_PARTITION_NAME = "p_future"
+
+
+# Difference between MySQL's TO_DAYS() day number and the proleptic Gregorian
+# ordinal of the same date used by python's datetime.date
+_MYSQL_DAY_NUMBER_TO_ORDINAL_OFFSET = 365
+
+
+
 g_log = logging.getLogger(__name__)
 
 
@@ -67,6 +97,9 @@ def _parseArgs(args):
     with the following attributes:
       thresholdDays: Metric data rows with timestamps older than this number of
         days will be purged.
+      mode: _MODE_ROWS or _MODE_PARTITIONS
+      partitionIntervalDays: number of days of metric data per partition
+        created in _MODE_PARTITIONS
 
   """
   parser = argparse.ArgumentParser(description=__doc__)
@@ -81,6 +114,25 @@ def _parseArgs(args):
           "will be purged. The metric data timestamps are assumed to be "
           "UTC."))
 
+  parser.add_argument(
+    "--mode",
+    choices=[_MODE_ROWS, _MODE_PARTITIONS],
+    default=_MODE_ROWS,
+    dest="mode",
+    help=("How to purge old rows: \"%(default)s\" deletes them in batches; "
+          "\"{}\" drops whole partitions of metric_data, which must be "
+          "partitioned by TO_DAYS(timestamp) [default: %(default)s]").format(
+            _MODE_PARTITIONS))
+
+  parser.add_argument(
+    "--partition-interval-days",
+    type=int,
+    default=_DEFAULT_PARTITION_INTERVAL_DAYS,
+    dest="partitionIntervalDays",
+    metavar="N",
+    help=("Number of days of metric data per partition created in \"{}\" "
+          "mode [default: %(default)s]").format(_MODE_PARTITIONS))
+
 
   args = parser.parse_args()
 
@@ -89,6 +141,10 @@ def _parseArgs(args):
     parser.error("--days value must be greater than zero, but got {}".format(
       args.thresholdDays))
 
+  if args.partitionIntervalDays <= 0:
+    parser.error("--partition-interval-days value must be greater than zero, "
+                 "but got {}".format(args.partitionIntervalDays))
+
 
   return args
 
@@ -135,6 +191,10 @@ def purgeOldMetricDataRows(thresholdDays):
   # the operation is "stuck".
   totalDeleted = 0
 
+  # Uids of metrics whose metric data stats need to be refreshed once the rows
+  # are purged
+  staleMetricIds = set()
+
   while totalDeleted < estimate:
     # NOTE: we're dealing with a couple of issues here:
     #
@@ -153,7 +213,9 @@ def purgeOldMetricDataRows(thresholdDays):
                                         limit=limit)
 
     if uidRowidPairs:
-      numDeleted = _deleteRows(sqlEngine=sqlEngine, uidRowidPairs=uidRowidPairs)
+      numDeleted, batchStaleMetricIds = _deleteRows(
+        sqlEngine=sqlEngine, uidRowidPairs=uidRowidPairs)
+      staleMetricIds.update(batchStaleMetricIds)
     else:
       # This could happen if something else deleted rows in our range
       break
@@ -167,10 +229,264 @@ def purgeOldMetricDataRows(thresholdDays):
   g_log.info("Purged numRows=%s of estimated=%s old metric data rows from "
              "table=%s", totalDeleted, estimate, schema.metric_data)
 
+  _refreshStaleMetricDataStats(sqlEngine, staleMetricIds)
+
   return totalDeleted
 
 
 
+def purgeOldMetricDataPartitions(thresholdDays, partitionIntervalDays):
+  """ Purge old rows from the partitioned metric data table by dropping the
+  partitions whose rows are all older than the given number of days, and create
+  partitions for upcoming metric data ahead of time.
+
+  Partitions cover partitionIntervalDays each and are named after their
+  exclusive upper bound date (e.g., p20160919); the catch-all p_future
+  partition must always be last.
+
+  :param int thresholdDays: Metric data rows with timestamps older than this
+    number of days will be purged.
+  :param int partitionIntervalDays: number of days of metric data per
+    partition to create
+
+  :returns: estimated number of rows that were purged (per information_schema
+    row count estimates)
+
+  """
+  sqlEngine = htmengine.repository.engineFactory(htmengine.APP_CONFIG)
+
+  partitions = _queryPartitions(sqlEngine)
+
+  if not partitions:
+    raise ValueError("Table={} is not partitioned; use --mode={}".format(
+      schema.metric_data, _MODE_ROWS))
+
+  if partitions[-1].name != _FUTURE_PARTITION_NAME:
+    raise ValueError("Expected catch-all partition={} of table={}, but got "
+                     "partitions={}".format(_FUTURE_PARTITION_NAME,
+                                            schema.metric_data, partitions))
+
+  today = datetime.datetime.utcnow().date()
+
+  # Drop partitions with upper bounds at or below the cutoff date; all of their
+  # rows are older than thresholdDays
+  cutoffDayNumber = _dayNumberFromDate(
+    today - datetime.timedelta(days=thresholdDays))
+
+  expiredPartitions = [partition for partition in partitions[:-1]
+                       if partition.bound <= cutoffDayNumber]
+
+  numPurged = sum(partition.numRows for partition in expiredPartitions)
+
+  if expiredPartitions:
+    g_log.info("Dropping partitions=%s with estimated numRows=%s older than "
+               "numDays=%s from table=%s",
+               [partition.name for partition in expiredPartitions], numPurged,
+               thresholdDays, schema.metric_data)
+
+    expiredPartitionNames = [partition.name for partition in expiredPartitions]
+
+    metricIds = _queryPartitionMetricIds(sqlEngine, expiredPartitionNames)
+
+    _dropPartitions(sqlEngine, expiredPartitionNames)
+
+    # NOTE: the stats of the affected metrics are recomputed from the remaining
+    # rows rather than decremented, so that this is safe to retry
+    _refreshStaleMetricDataStats(sqlEngine, metricIds)
+  else:
+    g_log.info("No partitions older than numDays=%s in table=%s",
+               thresholdDays, schema.metric_data)
+
+  # Create partitions for upcoming metric data, so that new rows don't land in
+  # the catch-all partition
+  lastBound = (partitions[-2].bound if len(partitions) > 1
+               else _dayNumberFromDate(today))
+  targetBound = (_dayNumberFromDate(today) +
+                 _NUM_PARTITIONS_AHEAD * partitionIntervalDays)
+
+  newBounds = range(lastBound + partitionIntervalDays,
+                    targetBound + partitionIntervalDays,
+                    partitionIntervalDays)
+
+  if newBounds:
+    g_log.info("Adding partitions with upper bounds=%s to table=%s",
+               [_dateFromDayNumber(bound).isoformat() for bound in newBounds],
+               schema.metric_data)
+
+    _addPartitions(sqlEngine, newBounds)
+
+  return numPurged
+
+
+
+def _dayNumberFromDate(date):
+  """
+  :param datetime.date date:
+  :returns: MySQL TO_DAYS() day number of the given date
+  """
+  return date.toordinal() + _MYSQL_DAY_NUMBER_TO_ORDINAL_OFFSET
+
+
+
+def _dateFromDayNumber(dayNumber):
+  """
+  :param int dayNumber: MySQL TO_DAYS() day number
+  :returns: the corresponding datetime.date
+  """
+  return datetime.date.fromordinal(
+    dayNumber - _MYSQL_DAY_NUMBER_TO_ORDINAL_OFFSET)
+
+
+
+def _getPartitionName(bound):
+  """
+  :param int bound: partition's exclusive upper bound as TO_DAYS() day number
+  :returns: partition name
+  """
+  return "p" + _dateFromDayNumber(bound).strftime("%Y%m%d")
+
+
+
+class _PartitionInfo(object):
+  """ metric_data partition attributes """
+
+  __slots__ = ("name", "bound", "numRows")
+
+  def __init__(self, name, bound, numRows):
+    """
+    :param str name: partition name
+    :param bound: exclusive upper bound of TO_DAYS(timestamp); None for the
+      MAXVALUE partition
+    :param int numRows: estimated number of rows in the partition
+    """
+    self.name = name
+    self.bound = bound
+    self.numRows = numRows
+
+
+  def __repr__(self):
+    return "{}<name={}, bound={}, numRows={}>".format(
+      self.__class__.__name__, self.name, self.bound, self.numRows)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _queryPartitions(sqlEngine):
+  """Query partitions of the metric data table
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+
+  :returns: sequence of _PartitionInfo objects ordered by bound; empty if the
+    table isn't partitioned
+  """
+  results = sqlEngine.execute(
+    sql.text("SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS "
+             "FROM information_schema.PARTITIONS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+             "AND PARTITION_NAME IS NOT NULL "
+             "ORDER BY PARTITION_ORDINAL_POSITION"),
+    table=schema.metric_data.name
+  ).fetchall()
+
+  return tuple(
+    _PartitionInfo(name=row[0],
+                   bound=None if row[1] == "MAXVALUE" else int(row[1]),
+                   numRows=row[2] or 0)
+    for row in results)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _dropPartitions(sqlEngine, partitionNames):
+  """Drop the given partitions of the metric data table along with their rows;
+  partitions that no longer exist (e.g., dropped by a previous attempt) are
+  skipped
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param partitionNames: sequence of partition names
+  """
+  existingNames = set(partition.name for partition in
+                      _queryPartitions(sqlEngine))
+
+  partitionNames = [name for name in partitionNames if name in existingNames]
+
+  if not partitionNames:
+    return
+
+  sqlEngine.execute(
+    "ALTER TABLE {} DROP PARTITION {}".format(schema.metric_data,
+                                              ", ".join(partitionNames)))
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _queryPartitionMetricIds(sqlEngine, partitionNames):
+  """Query the uids of metrics with rows in the given partitions of the metric
+  data table
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param partitionNames: sequence of partition names
+
+  :returns: sequence of metric uids
+  """
+  return tuple(
+    row[0] for row in sqlEngine.execute(
+      "SELECT DISTINCT uid FROM {} PARTITION ({})".format(
+        schema.metric_data, ", ".join(partitionNames))).fetchall())
+
+
+
+def _refreshStaleMetricDataStats(sqlEngine, metricIds):
+  """Recompute the metric data stats of metrics whose deleted rows couldn't
+  simply be subtracted from them
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param metricIds: metric uids
+  """
+  if not metricIds:
+    return
+
+  g_log.info("Refreshing metric data stats of numMetrics=%s", len(metricIds))
+
+  for metricId in sorted(metricIds):
+    _refreshMetricDataStats(sqlEngine, metricId)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _refreshMetricDataStats(sqlEngine, metricId):
+  """Recompute the metric data stats of the given metric
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param metricId: metric uid
+  """
+  with sqlEngine.connect() as conn:
+    htmengine.repository.refreshMetricDataStats(conn, metricId)
+
+
+
+@sqlalchemy_utils.retryOnTransientErrors
+def _addPartitions(sqlEngine, bounds):
+  """Split new partitions with the given upper bounds off the catch-all
+  partition of the metric data table
+
+  :param sqlalchemy.engine.Engine sqlEngine:
+  :param bounds: ascending sequence of exclusive upper bounds as TO_DAYS() day
+    numbers; each must be greater than the bound of the last existing partition
+  """
+  newPartitions = ", ".join(
+    "PARTITION {} VALUES LESS THAN ({:d})".format(_getPartitionName(bound),
+                                                  bound)
+    for bound in bounds)
+
+  sqlEngine.execute(
+    "ALTER TABLE {table} REORGANIZE PARTITION {future} INTO ({new}, "
+    "PARTITION {future} VALUES LESS THAN MAXVALUE)".format(
+      table=schema.metric_data, future=_FUTURE_PARTITION_NAME,
+      new=newPartitions))
+
+
+
 @sqlalchemy_utils.retryOnTransientErrors
 def _estimateNumRowsToDelete(sqlEngine, selectionPredicate):
   """
@@ -210,21 +526,21 @@ def _queryCandidateRows(sqlEngine, selectionPredicate, limit):
 
 @sqlalchemy_utils.retryOnTransientErrors
 def _deleteRows(sqlEngine, uidRowidPairs):
-  """Delete metric data rows with the given uid/rowid pairs
+  """Delete metric data rows with the given uid/rowid pairs, and subtract them
+  from the metric data stats of the affected metrics in the same transaction
 
   :param sqlalchemy.engine.Engine sqlEngine:
   :param uidRowidPairs: sequence of uid/rowid pairs of metric data rows to
     delete
 
-  :returns: number of rows actually deleted; this may be less than requested if
-    something else deleted some of the requested rows
+  :returns: a pair <numDeleted, staleMetricIds>; numDeleted is the number of
+    rows actually deleted, which may be less than requested if something else
+    deleted some of the requested rows; staleMetricIds are the uids of metrics
+    whose stats need to be refreshed; see
+    htmengine.repository.deleteMetricDataRows
   """
-  return sqlEngine.execute(
-    schema.metric_data.delete()  # pylint: disable=E1120
-    .where(
-      sql.tuple_(schema.metric_data.c.uid, schema.metric_data.c.rowid).in_(
-        uidRowidPairs))
-  ).rowcount
+  with sqlEngine.connect() as conn:
+    return htmengine.repository.deleteMetricDataRows(conn, uidRowidPairs)
 
 
 
@@ -243,7 +559,11 @@ def main():
 
 
     while True:
-      purgeOldMetricDataRows(args.thresholdDays)
+      if args.mode == _MODE_PARTITIONS:
+        purgeOldMetricDataPartitions(args.thresholdDays,
+                                     args.partitionIntervalDays)
+      else:
+        purgeOldMetricDataRows(args.thresholdDays)
 
       g_log.info("Resuming in %s seconds...", _PAUSE_INTERVAL_SEC)
       time.sleep(_PAUSE_INTERVAL_SEC)
@@ -73,6 +73,11 @@ class Protocol(object):
 
   PLAIN = "plain"
 
+  # Samples grouped by metric name: {<metric-name>: [[<value>, <epoch>], ...]};
+  # accepted by metric_storer from the message bus only, so it's not among
+  # the listener's `values()`
+  COMPACT = "compact"
+
   current = None
 
   @classmethod
@@ -113,6 +118,36 @@ def parsePlaintext(data):
 
 
 
+def parseCompact(data):
+  """ Parse metric data samples in the compact encoding
+
+  :param data: a dict mapping metric names to sequences of
+    [<data-value>, <unix-timestamp>] pairs
+
+  :raises: ValueError when input data doesn't match the expected type and
+      format
+
+  :returns: a list of three-item sequences, in the same format as returned
+    by `parsePlaintext`:
+    [<metric-name>, <floating-point-value>, <datetime-timestamp>]
+  """
+  try:
+    output = []
+    for metricName, samples in data.iteritems():
+      if not isinstance(metricName, basestring) or not metricName:
+        raise ValueError("Invalid metric name")
+      for value, timestamp in samples:
+        output.append(
+          [metricName,
+           float(value),
+           datetime.datetime.utcfromtimestamp(float(timestamp))])
+  except (AttributeError, LookupError, TypeError, ValueError):
+    raise ValueError(
+        "Unable to parse input of type %r: %.255r" % (type(data), data))
+  return output
+
+
+
 class Transport(object):
   __slots__ = ("UDP", "TCP")
   UDP = "udp"
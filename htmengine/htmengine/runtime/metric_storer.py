@@ -42,7 +42,9 @@ from htmengine import (raiseExceptionOnMissingRequiredApplicationConfigPath,
 from htmengine.adapters.datasource import createCustomDatasourceAdapter
 import htmengine.exceptions
 from htmengine.htmengine_logging import getExtendedLogger
-from htmengine.runtime.metric_listener import parsePlaintext, Protocol
+from htmengine.runtime.metric_listener import (parseCompact,
+                                               parsePlaintext,
+                                               Protocol)
 from htmengine.runtime.metric_streamer_util import MetricStreamer
 from htmengine.model_swapper.model_swapper_interface import (
     MessageBusConnector, ModelSwapperInterface)
@@ -58,6 +60,8 @@ MAX_CACHED_METRICS = 15000
 CACHED_METRICS_TO_KEEP = 10000
 MAX_MESSAGES_PER_BATCH = 200
 POLL_DELAY_SEC = 1
+# How often to report repository connection pool stats when profiling
+POOL_STATS_LOG_INTERVAL_SEC = 60
 
 # Dict mapping metric name to [metric, lastAccessedDatetime]
 gCustomMetrics = None
@@ -67,6 +71,19 @@ gProfiling = False
 
 
 
+def _logDataRx(row, rxTime):
+  """Log receipt of a metric data sample when profiling
+
+  :param row: parsed sample [metricName, value, metricTimestamp]
+  :param rxTime: message-receive time (from time.time())
+  """
+  metricName, _value, metricTimestamp = row
+  LOGGER.info(
+    "{TAG:CUSSTR.DATA.RX} metricName=%s; timestamp=%s; rxTime=%.4f",
+    metricName, metricTimestamp.isoformat() + "Z", rxTime)
+
+
+
 def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
                  modelSwapper):
   """Process a batch of messages from the queue.
@@ -103,13 +120,21 @@ def _handleBatch(engine, messages, messageRxTimes, metricStreamer,
         try:
           data.append(parsePlaintext(row))
           if gProfiling and rxTime is not None:
-            metricName, _value, metricTimestamp = data[-1]
-            LOGGER.info(
-              "{TAG:CUSSTR.DATA.RX} metricName=%s; timestamp=%s; rxTime=%.4f",
-              metricName, metricTimestamp.isoformat() + "Z", rxTime)
+            _logDataRx(data[-1], rxTime)
         except ValueError:
           LOGGER.warn("Discarding plaintext message that can't be parsed: %s",
                       row.strip())
+    elif protocol == Protocol.COMPACT:
+      try:
+        rows = parseCompact(rawData)
+      except ValueError:
+        LOGGER.warn("Discarding compact message that can't be parsed: %.255s",
+                    m.body)
+        continue
+      data.extend(rows)
+      if gProfiling and rxTime is not None:
+        for row in rows:
+          _logDataRx(row, rxTime)
     else:
       LOGGER.warn("Discarding message with unknown protocol: %s", protocol)
       return
@@ -239,6 +264,7 @@ def runServer():
     with bus.consume(queueName) as consumer:
       messages = []
       messageRxTimes = []
+      lastPoolStatsLogTime = time.time()
       while True:
         message = consumer.pollOneMessage()
         if message is not None:
@@ -265,6 +291,15 @@ def runServer():
             # Clear the message buffer
             messages = []
             messageRxTimes = []
+
+            if (gProfiling and
+                time.time() - lastPoolStatsLogTime >=
+                POOL_STATS_LOG_INTERVAL_SEC):
+              lastPoolStatsLogTime = time.time()
+              poolStats = repository.getPoolStats(engine, reset=True)
+              if poolStats is not None:
+                LOGGER.info("{TAG:CUSSTR.POOL} %s",
+                            repository.formatPoolStats(poolStats))
           else:
             # Queue is empty, wait before retrying
             time.sleep(POLL_DELAY_SEC)
@@ -26,7 +26,6 @@ writing data to queue
 import itertools
 import logging
 import os
-import time
 
 from nta.utils.config import Config
 from nta.utils.date_time_utils import epochFromNaiveUTCDatetime
@@ -49,7 +48,6 @@ config = Config("application.conf", os.environ.get("APPLICATION_CONFIG_PATH"))
 
 
 class MetricStreamer(object):
-  _TAIL_INPUT_TIMESTAMP_GC_INTERVAL_SEC = 7 * 24 * 60 * 60
 
   def __init__(self):
     super(MetricStreamer, self).__init__()
@@ -66,17 +64,8 @@ class MetricStreamer(object):
     self._metricDataOutputChunkSize = config.getint(
       "metric_streamer", "chunk_size")
 
-    # Cache of latest metric_data timestamps for each metric; used for filtering
-    # out duplicate/re-delivered input metric data so it won't be saved again
-    # in the metric_data table. Each key is a metric id and the corresponding
-    # value is a datetime.datetime timestamp of the last metric_data stored by
-    # us in metric_data table.
-    self._tailInputMetricDataTimestamps = dict()
-    # Last garbage-collection time; seconds since unix epoch (time.time())
-    self._lastTailInputMetricDataTimestampsGCTime = 0
 
-
-  def _scrubDataSamples(self, data, metricID, conn, lastDataRowID):
+  def _scrubDataSamples(self, data, metricID, conn, metricObj):
     """ Filter out metric data samples that are out of order or have duplicate
     timestamps.
 
@@ -84,8 +73,8 @@ class MetricStreamer(object):
                   (datetime.datetime, float)
     :param metricID: unique metric id
     :param sqlalchemy.engine.Connection conn: A sqlalchemy connection object
-    :param lastDataRowID: last metric data row identifier for metric with given
-      metric id
+    :param metricObj: the metric's row with last_rowid and last_rowid_timestamp
+      fields, loaded under the metric row's update lock
 
     :returns: a (possibly empty) sequence of metric data samples that passed
       the scrubbing.
@@ -94,7 +83,7 @@ class MetricStreamer(object):
     passingSamples = []
     rejectedDataTimestamps = []
     prevSampleTimestamp = self._getTailMetricRowTimestamp(conn, metricID,
-                                                          lastDataRowID)
+                                                          metricObj)
     for sample in data:
       timestamp, metricValue = sample
       # Filter out those whose timestamp is not newer than previous sampale's
@@ -132,12 +121,14 @@ class MetricStreamer(object):
     return passingSamples
 
 
-  def _storeDataSamples(self, data, metricID, conn):
+  def _storeDataSamples(self, data, metricID, conn, lastRowid):
     """ Store the given metric data samples in metric_data table
     :param data: A sequence of data samples; each data sample is a pair:
                   (datetime.datetime, float)
     :param metricID: unique metric id
     :param sqlalchemy.engine.Connection conn: A sqlalchemy connection object
+    :param lastRowid: last rowid of the block reserved for the samples via
+      repository.reserveMetricRowids
 
     :returns: a (possibly empty) tuple of ModelInputRow objects corresponding
         to the samples that were stored; ordered by rowid.
@@ -145,14 +136,12 @@ class MetricStreamer(object):
     """
 
     if data:
-      # repository.addMetricData expects samples as pairs of (value, timestamp)
+      # repository.insertMetricData expects samples as pairs of
+      # (value, timestamp)
       data = tuple((value, ts) for (ts, value) in data)
 
       # Save new metric data in metric table
-      rows = repository.addMetricData(conn, metricID, data)
-
-      # Update tail metric data timestamp cache for metrics stored by us
-      self._tailInputMetricDataTimestamps[metricID] = rows[-1]["timestamp"]
+      rows = repository.insertMetricData(conn, metricID, data, lastRowid)
 
       # Add newly-stored records to batch for sending to CLA model
       modelInputRows = tuple(
@@ -180,43 +169,36 @@ class MetricStreamer(object):
       profiling=self._profiling)
 
 
-  def _getTailMetricRowTimestamp(self, conn, metricID, lastDataRowID):
+  def _getTailMetricRowTimestamp(self, conn, metricID, metricObj):
     """
     :param sqlalchemy.engine.Connection conn: A sqlalchemy connection object
     :param metricID: unique metric id
-    :param lastDataRowID: last metric data row identifier for metric with given
-      metric id
+    :param metricObj: the metric's row with last_rowid and last_rowid_timestamp
+      fields, loaded under the metric row's update lock
 
-    :returns: timestamp of the last metric data row that *we* stored in
-        metric_data table for the given metric id, or None if none have been
-        stored
+    :returns: timestamp of the metric data row at the metric's last reserved
+        rowid, whether or not its insert has been committed (see
+        repository.reserveMetricRowids), or None if no rows have been stored
     :rtype: datetime.datetime or None
-
-    TODO: unit-test
     """
-    if (time.time() - self._lastTailInputMetricDataTimestampsGCTime >
-        self._TAIL_INPUT_TIMESTAMP_GC_INTERVAL_SEC):
-      # Garbage-collect our cache
-      # TODO: unit-test
-      self._tailInputMetricDataTimestamps.clear()
-      self._lastTailInputMetricDataTimestampsGCTime = time.time()
-      self._log.info("Garbage-collected tailInputMetricDataTimestamps cache")
+    if metricObj.last_rowid_timestamp is not None:
+      return metricObj.last_rowid_timestamp
 
-    timestamp = None
-    try:
-      # First try to get it from cache
-      timestamp = self._tailInputMetricDataTimestamps[metricID]
-    except KeyError:
-      # Not in cache, so try to load it from db
-      rows = repository.getMetricData(conn,
-                                      metricID,
-                                      rowid=lastDataRowID)
+    if not metricObj.last_rowid:
+      return None
 
-      if rows.rowcount > 0 and rows.returns_rows:
-        timestamp = next(iter(rows)).timestamp
-        self._tailInputMetricDataTimestamps[metricID] = timestamp
+    # The tail wasn't recorded (e.g., the row at last_rowid was never
+    # committed before last_rowid_timestamp was added), so fall back to the
+    # latest row that exists
+    row = repository.getMetricData(
+      conn,
+      metricID,
+      fields=[schema.metric_data.c.timestamp],
+      stop=metricObj.last_rowid,
+      limit=1,
+      sort=schema.metric_data.c.rowid.desc()).first()
 
-    return timestamp
+    return row.timestamp if row is not None else None
 
 
   def streamMetricData(self, data, metricID, modelSwapper):
@@ -246,27 +228,52 @@ class MetricStreamer(object):
     :type modelSwapper: an instance of ModelSwapperInterface
 
     :raises: ObjectNotFoundError when the metric for the data doesn't exist
+
+    NOTE: rowids are reserved and the rows inserted in separate transactions
+    (see repository.reserveMetricRowids), which has these consequences for
+    consumers of the metric's data:
+      - A block of rowids whose insert fails is abandoned, leaving a permanent
+        gap in the metric's rowids. Rowids thus aren't row counts (e.g., see
+        the PENDING_DATA check below), and results of the rows sent to the
+        model still match them by rowid (see AnomalyService).
+      - Blocks reserved by concurrent writers to the same metric may commit,
+        and be forwarded to the model, out of rowid order; a reader may see a
+        rowid before lower ones are committed (e.g., see the metric order
+        monitor in taurus_monitoring). Timestamps increase with rowids
+        regardless, since samples are checked against the latest reservation.
+      - A model's backlog (see scalar_metric_utils.sendBacklogDataToModel)
+        waits for in-flight inserts, so each row is sent to the model either
+        with the backlog or by its writer, but not both.
     """
     if not data:
       self._log.warn("Empty input metric data batch for metric=%s", metricID)
       return
 
     @repository.retryOnTransientErrors
-    def storeDataWithRetries():
-      """
-      :returns: a three-tuple <modelInputRows, datasource, metricStatus>;
-        modelInputRows: None if model was in state not suitable for streaming;
-          otherwise a (possibly empty) tuple of ModelInputRow objects
-          corresponding to the samples that were stored; ordered by rowid
+    def reserveRowidsWithRetries(engine):
+      """ Scrub the data samples and reserve rowids for those that pass in a
+      short transaction under the metric row's lock, so that concurrent writers
+      to the same metric check their samples against each other's reservations
+      without holding the lock while inserting.
+
+      :param engine: SQLAlchemy engine object or engine-like
+        `repository.SharedConnection`
+      :returns: a three-tuple <passingSamples, lastRowid, datasource>;
+        passingSamples: None if metric was in state not suitable for streaming;
+          otherwise a (possibly empty) sequence of samples that passed the
+          scrubbing
+        lastRowid: last rowid of the block reserved for passingSamples; None if
+          there are none
       """
-      with repository.engineFactory(config).connect() as conn:
+      with engine.connect() as conn:
         with conn.begin():
-          # Synchronize with adapter's monitorMetric
+          # Synchronize with adapter's monitorMetric and with other writers
           metricObj = repository.getMetricWithUpdateLock(
             conn,
             metricID,
             fields=[schema.metric.c.status,
                     schema.metric.c.last_rowid,
+                    schema.metric.c.last_rowid_timestamp,
                     schema.metric.c.datasource])
 
           if (metricObj.status != MetricStatus.UNMONITORED and
@@ -275,35 +282,86 @@ class MetricStreamer(object):
               metricObj.status != MetricStatus.CREATE_PENDING):
             self._log.error("Can't stream: metric=%s has unexpected status=%s",
                             metricID, metricObj.status)
-            modelInputRows = None
-          else:
-            # TODO: unit-test
-            passingSamples = self._scrubDataSamples(data,
-                                                    metricID,
-                                                    conn,
-                                                    metricObj.last_rowid)
-            if passingSamples:
-              modelInputRows = self._storeDataSamples(passingSamples, metricID,
-                                                      conn)
-            else:
-              modelInputRows = tuple()
-
-      return (modelInputRows, metricObj.datasource, metricObj.status)
-
-
-    (modelInputRows,
-     datasource,
-     metricStatus) = storeDataWithRetries()
-
-    if modelInputRows is None:
-      # Metric was in state not suitable for streaming
-      return
+            return (None, None, metricObj.datasource)
 
-    if not modelInputRows:
-      # TODO: unit-test
-      # Nothing was added, so nothing further to do
-      self._log.error("No records to stream to model=%s", metricID)
-      return
+          # TODO: unit-test
+          passingSamples = self._scrubDataSamples(data,
+                                                  metricID,
+                                                  conn,
+                                                  metricObj)
+          lastRowid = None
+          if passingSamples:
+            lastRowid = repository.reserveMetricRowids(
+              conn,
+              metricID,
+              amount=len(passingSamples),
+              lastTimestamp=passingSamples[-1][0])
+
+      return (passingSamples, lastRowid, metricObj.datasource)
+
+
+    @repository.retryOnTransientErrors
+    def storeDataWithRetries(engine, samples, lastRowid):
+      """
+      :param engine: SQLAlchemy engine object or engine-like
+        `repository.SharedConnection`
+      :returns: a pair <modelInputRows, metricStatus>;
+        modelInputRows: tuple of ModelInputRow objects corresponding to the
+          samples that were stored; ordered by rowid
+        metricStatus: metric status as of the insert, which determines whether
+          the rows are forwarded by us or as part of the model's backlog (see
+          scalar_metric_utils.sendBacklogDataToModel)
+      """
+      with engine.connect() as conn:
+        with conn.begin():
+          modelInputRows = self._storeDataSamples(samples, metricID, conn,
+                                                  lastRowid)
+
+          # NOTE: read after the insert, so that a concurrent status change
+          # either committed before it or is waiting for our rows to commit in
+          # order to include them in the backlog
+          metricStatus = repository.getMetric(
+            conn,
+            metricID,
+            fields=[schema.metric.c.status]).status
+
+      return (modelInputRows, metricStatus)
+
+
+    @repository.retryOnTransientErrors
+    def getMetricDataCountWithRetries(engine):
+      with engine.connect() as conn:
+        return repository.getMetricDataCount(conn, metricID)
+
+
+    # Perform the batch's database operations over a single pooled connection
+    with repository.SharedConnection(
+        repository.engineFactory(config)) as engine:
+      (passingSamples,
+       lastRowid,
+       datasource) = reserveRowidsWithRetries(engine)
+
+      if passingSamples is None:
+        # Metric was in state not suitable for streaming
+        return
+
+      if not passingSamples:
+        # TODO: unit-test
+        # Nothing was added, so nothing further to do
+        self._log.error("No records to stream to model=%s", metricID)
+        return
+
+      (modelInputRows,
+       metricStatus) = storeDataWithRetries(engine, passingSamples, lastRowid)
+
+      # NOTE: the last rowid is an upper bound of the number of rows, which may
+      # be smaller due to gaps in the rowids, so count the rows once the rowid
+      # passes the threshold for activating a model that's waiting for data
+      hasEnoughDataForModel = (
+        metricStatus == MetricStatus.PENDING_DATA and
+        modelInputRows[-1].rowID >= MODEL_CREATION_RECORD_THRESHOLD and
+        getMetricDataCountWithRetries(engine) >=
+        MODEL_CREATION_RECORD_THRESHOLD)
 
     if metricStatus == MetricStatus.UNMONITORED:
       # Metric was not monitored during storage, so we're done
@@ -314,11 +372,9 @@ class MetricStreamer(object):
       #               modelInputRows[0].data, modelInputRows[-1].data)
       return
 
-    lastDataRowID = modelInputRows[-1].rowID
-
     # Check models that are waiting for activation upon sufficient data
     if metricStatus == MetricStatus.PENDING_DATA:
-      if lastDataRowID >= MODEL_CREATION_RECORD_THRESHOLD:
+      if hasEnoughDataForModel:
         try:
           # Activate metric that is supported by Datasource Adapter
           createDatasourceAdapter(datasource).activateModel(metricID)
@@ -287,6 +287,12 @@ def sendBacklogDataToModel(conn, metricId, logger):
   """ Send backlog data to OPF/CLA model. Do not call this before starting the
   model.
 
+  NOTE: the backlog is loaded via a locking read in the caller's transaction,
+  which must have already changed the metric's status: this waits for rows
+  that MetricStreamer is concurrently inserting under the previous status,
+  which it won't forward to the model itself, and blocks inserts of rows that
+  it will forward under the new status until the transaction ends.
+
   :param conn: SQLAlchemy Connection object for executing SQL
   :type conn: sqlalchemy.engine.Connection
 
@@ -298,7 +304,7 @@ def sendBacklogDataToModel(conn, metricId, logger):
   backlogData = tuple(
     model_swapper_interface.ModelInputRow(
       rowID=md.rowid, data=(md.timestamp, md.metric_value,))
-    for md in repository.getMetricData(
+    for md in repository.getMetricDataWithSharedLock(
       conn,
       metricId,
       fields=[schema.metric_data.c.rowid,
@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Integration test of concurrent rowid allocation by
+htmengine.repository.addMetricData
+"""
+
+from datetime import datetime, timedelta
+import threading
+import unittest
+import uuid
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+from htmengine.test_utils import repository_test_utils
+import htmengine.repository
+from htmengine.repository import queries, schema
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class AddMetricDataConcurrencyTestCase(unittest.TestCase):
+
+  NUM_WRITERS = 8
+  NUM_BATCHES_PER_WRITER = 20
+  BATCH_SIZE = 5
+
+  # Every this many batches, a writer reserves a block of rowids without
+  # inserting any rows, as when the insert fails after reservation
+  ABANDONED_BATCH_INTERVAL = 7
+
+
+  def _runWriter(self, engine, metricId, writerIndex, results, errors):
+    """ Add batches of metric data rows; the rowids of each batch are appended
+    to results[writerIndex]. Odd-numbered writers add their rows within their
+    own transactions.
+    """
+    try:
+      baseTimestamp = datetime(2016, 1, 1) + timedelta(days=writerIndex)
+      with engine.connect() as conn:  # pylint: disable=E1101
+        for batchIndex in xrange(self.NUM_BATCHES_PER_WRITER):
+          data = [
+            (float(writerIndex),
+             baseTimestamp + timedelta(
+               minutes=batchIndex * self.BATCH_SIZE + i))
+            for i in xrange(self.BATCH_SIZE)]
+
+          if (batchIndex + 1) % self.ABANDONED_BATCH_INTERVAL == 0:
+            queries.reserveMetricRowids(conn, metricId, self.BATCH_SIZE,
+                                        lastTimestamp=data[-1][1])
+            continue
+
+          if writerIndex % 2:
+            with conn.begin():
+              rows = htmengine.repository.addMetricData(conn, metricId, data)
+          else:
+            rows = htmengine.repository.addMetricData(conn, metricId, data)
+
+          results[writerIndex].append([row["rowid"] for row in rows])
+    except Exception as e:  # pylint: disable=W0703
+      errors.append(e)
+
+
+  def testConcurrentAddMetricData(self):
+    metricId = uuid.uuid1().hex
+
+    # Use a temporary database
+    with repository_test_utils.HtmengineManagedTempRepository("add_data"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=metricId)
+
+      results = [[] for _ in xrange(self.NUM_WRITERS)]
+      errors = []
+      threads = [
+        threading.Thread(target=self._runWriter,
+                         args=(engine, metricId, i, results, errors))
+        for i in xrange(self.NUM_WRITERS)]
+
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+      self.assertEqual(errors, [])
+
+      allRowids = []
+      for batches in results:
+        for i, rowids in enumerate(batches):
+          # Contiguous within a batch
+          self.assertEqual(
+            rowids, range(rowids[0], rowids[0] + self.BATCH_SIZE))
+
+          # Increasing across a writer's successive batches
+          if i > 0:
+            self.assertGreater(rowids[0], batches[i - 1][-1])
+
+        allRowids.extend(rowid for rowids in batches for rowid in rowids)
+
+      # Unique across writers
+      self.assertEqual(len(allRowids), len(set(allRowids)))
+
+      numBatches = self.NUM_WRITERS * self.NUM_BATCHES_PER_WRITER
+      with engine.connect() as conn:  # pylint: disable=E1101
+        metricObj = htmengine.repository.getMetric(
+          conn, metricId, fields=[schema.metric.c.last_rowid])
+        storedRowids = [
+          row.rowid for row in htmengine.repository.getMetricData(
+            conn, metricId, fields=[schema.metric_data.c.rowid])]
+
+      # Abandoned reservations are accounted for in last_rowid
+      self.assertEqual(metricObj.last_rowid, numBatches * self.BATCH_SIZE)
+
+      self.assertItemsEqual(storedRowids, allRowids)
+
+
+  def testReservationRecordsLastRowidTimestamp(self):
+    metricId = uuid.uuid1().hex
+    timestamp = datetime(2016, 1, 1)
+
+    # Use a temporary database
+    with repository_test_utils.HtmengineManagedTempRepository("add_data"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        htmengine.repository.addMetric(conn, uid=metricId)
+
+        htmengine.repository.addMetricData(
+          conn, metricId, [(1.0, timestamp),
+                           (2.0, timestamp + timedelta(minutes=5))])
+
+        metricObj = htmengine.repository.getMetric(
+          conn, metricId, fields=[schema.metric.c.last_rowid,
+                                  schema.metric.c.last_rowid_timestamp])
+        self.assertEqual(metricObj.last_rowid, 2)
+        self.assertEqual(metricObj.last_rowid_timestamp,
+                         timestamp + timedelta(minutes=5))
+
+        # A reservation whose rows haven't been inserted (yet) still counts
+        lastRowid = htmengine.repository.reserveMetricRowids(
+          conn, metricId, 3, lastTimestamp=timestamp + timedelta(minutes=20))
+        self.assertEqual(lastRowid, 5)
+
+        metricObj = htmengine.repository.getMetric(
+          conn, metricId, fields=[schema.metric.c.last_rowid,
+                                  schema.metric.c.last_rowid_timestamp])
+        self.assertEqual(metricObj.last_rowid, 5)
+        self.assertEqual(metricObj.last_rowid_timestamp,
+                         timestamp + timedelta(minutes=20))
+
+        rows = htmengine.repository.insertMetricData(
+          conn,
+          metricId,
+          [(3.0, timestamp + timedelta(minutes=10)),
+           (4.0, timestamp + timedelta(minutes=15)),
+           (5.0, timestamp + timedelta(minutes=20))],
+          lastRowid)
+        self.assertEqual([row["rowid"] for row in rows], [3, 4, 5])
+
+        self.assertEqual(
+          htmengine.repository.getMetricDataStats(conn, metricId).num_rows, 5)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
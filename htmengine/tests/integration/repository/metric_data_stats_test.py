@@ -0,0 +1,190 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Integration test of the metric_data_stats maintained by
+htmengine.repository
+"""
+
+from datetime import datetime, timedelta
+import random
+import unittest
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy.sql import select
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+import htmengine
+from htmengine.exceptions import MetricStatisticsNotReadyError
+from htmengine.test_utils import repository_test_utils
+import htmengine.repository
+from htmengine.repository import schema
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class MetricDataStatsTestCase(unittest.TestCase):
+
+
+  def _assertStatsMatchFullScan(self, conn, metricId):
+    """ Compare the metric's stats with aggregates computed over all of its
+    metric_data rows
+    """
+    value = schema.metric_data.c.metric_value
+    timestamp = schema.metric_data.c.timestamp
+
+    fullScan = conn.execute(
+      select([func.count(), func.min(value), func.max(value), func.sum(value),
+              func.sum(value * value), func.min(timestamp),
+              func.max(timestamp)])
+      .where(schema.metric_data.c.uid == metricId)).first()
+
+    stats = htmengine.repository.getMetricDataStats(conn, metricId)
+
+    self.assertEqual(stats.num_rows, fullScan[0])
+
+    if fullScan[0] == 0:
+      self.assertIsNone(stats.min_value)
+      self.assertIsNone(stats.max_value)
+      self.assertIsNone(stats.first_timestamp)
+      self.assertIsNone(stats.last_timestamp)
+
+      with self.assertRaises(MetricStatisticsNotReadyError):
+        htmengine.repository.getMetricStats(conn, metricId)
+      return
+
+    self.assertEqual(stats.min_value, fullScan[1])
+    self.assertEqual(stats.max_value, fullScan[2])
+    self.assertAlmostEqual(stats.value_sum, float(fullScan[3]), places=6)
+    self.assertAlmostEqual(stats.value_sum_squares, float(fullScan[4]),
+                           places=4)
+    self.assertEqual(stats.first_timestamp, fullScan[5])
+    self.assertEqual(stats.last_timestamp, fullScan[6])
+
+    self.assertEqual(htmengine.repository.getMetricStats(conn, metricId),
+                     {"min": fullScan[1], "max": fullScan[2]})
+
+
+  def testStatsMatchFullScan(self):
+    randomState = random.Random(42)
+    metricIds = [uuid.uuid1().hex for _ in xrange(3)]
+    baseTimestamp = datetime(2016, 1, 1)
+
+    # Use a temporary database
+    with repository_test_utils.HtmengineManagedTempRepository("data_stats"):
+      engine = htmengine.repository.engineFactory(config=htmengine.APP_CONFIG)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        for metricId in metricIds:
+          htmengine.repository.addMetric(conn, uid=metricId)
+          self._assertStatsMatchFullScan(conn, metricId)
+
+        # Add batches with out-of-order timestamps, with and without an outer
+        # transaction
+        for i in xrange(30):
+          metricId = metricIds[i % len(metricIds)]
+          data = [
+            (randomState.uniform(-1000, 1000),
+             baseTimestamp + timedelta(minutes=randomState.randint(0, 10000)))
+            for _ in xrange(randomState.randint(1, 20))]
+
+          if i % 2:
+            with conn.begin():
+              htmengine.repository.addMetricData(conn, metricId, data)
+          else:
+            htmengine.repository.addMetricData(conn, metricId, data)
+
+          self._assertStatsMatchFullScan(conn, metricId)
+
+      with engine.connect() as conn:  # pylint: disable=E1101
+        rowsByMetric = dict(
+          (metricId,
+           htmengine.repository.getMetricData(
+             conn, metricId,
+             fields=[schema.metric_data.c.rowid,
+                     schema.metric_data.c.metric_value,
+                     schema.metric_data.c.timestamp]).fetchall())
+          for metricId in metricIds)
+
+        # Delete some rows that include none of the metrics' minimum or maximum
+        # value or first or last timestamp, which are subtracted exactly
+        uidRowidPairs = []
+        for metricId, rows in rowsByMetric.iteritems():
+          extremes = set(
+            min(rows, key=key).rowid for key in (lambda row: row.metric_value,
+                                                 lambda row: row.timestamp))
+          extremes.update(
+            max(rows, key=key).rowid for key in (lambda row: row.metric_value,
+                                                 lambda row: row.timestamp))
+          victims = randomState.sample(
+            [row for row in rows if row.rowid not in extremes], 5)
+          uidRowidPairs.extend((metricId, row.rowid) for row in victims)
+          rows[:] = [row for row in rows if row not in victims]
+
+        numDeleted, staleMetricIds = (
+          htmengine.repository.deleteMetricDataRows(conn, uidRowidPairs))
+        self.assertEqual(numDeleted, len(uidRowidPairs))
+        self.assertEqual(staleMetricIds, [])
+
+        for metricId in metricIds:
+          self._assertStatsMatchFullScan(conn, metricId)
+
+        # Delete each metric's minimum and maximum value, which must be
+        # refreshed
+        uidRowidPairs = []
+        for metricId, rows in rowsByMetric.iteritems():
+          rows.sort(key=lambda row: row.metric_value)
+          uidRowidPairs.extend((metricId, row.rowid)
+                               for row in (rows[0], rows[-1]))
+
+        numDeleted, staleMetricIds = (
+          htmengine.repository.deleteMetricDataRows(conn, uidRowidPairs))
+        self.assertEqual(numDeleted, len(uidRowidPairs))
+        self.assertEqual(staleMetricIds, sorted(metricIds))
+
+        for metricId in staleMetricIds:
+          htmengine.repository.refreshMetricDataStats(conn, metricId)
+          self._assertStatsMatchFullScan(conn, metricId)
+
+        # Delete all of a metric's data
+        numDeleted, staleMetricIds = htmengine.repository.deleteMetricDataRows(
+          conn, [(metricIds[0], row.rowid)
+                 for row in rowsByMetric[metricIds[0]][1:-1]])
+        self.assertEqual(numDeleted, len(rowsByMetric[metricIds[0]]) - 2)
+        self.assertEqual(staleMetricIds, [])
+        self._assertStatsMatchFullScan(conn, metricIds[0])
+
+        # Statistics are removed along with the metric
+        htmengine.repository.deleteMetric(conn, metricIds[1])
+        self.assertIsNone(
+          conn.execute(select([schema.metric_data_stats.c.uid])
+                       .where(schema.metric_data_stats.c.uid == metricIds[1]))
+          .first())
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,174 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2015, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit tests for htmengine.repository connection pool configuration,
+instrumentation and connection sharing
+"""
+
+# Suppress pylint warnings concerning access to protected member
+# pylint: disable=W0212
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+from sqlalchemy import create_engine
+
+from nta.utils.logging_support_raw import LoggingSupport
+
+from htmengine import repository
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+class PoolSettingsTestCase(unittest.TestCase):
+
+
+  @staticmethod
+  def _createConfigMock(options):
+    config = Mock(spec_set=["has_option", "getint"])
+    config.has_option.side_effect = lambda _section, option: option in options
+    config.getint.side_effect = lambda _section, option: options[option]
+    return config
+
+
+  def testDefaultPoolSettings(self):
+    settings = repository.getPoolSettings(self._createConfigMock({}))
+
+    self.assertEqual(settings, dict(pool_size=0,
+                                    max_overflow=-1,
+                                    pool_recycle=179))
+
+
+  def testConfiguredPoolSettings(self):
+    settings = repository.getPoolSettings(
+      self._createConfigMock(dict(pool_size=5,
+                                  max_overflow=10,
+                                  pool_recycle=3600)))
+
+    self.assertEqual(settings, dict(pool_size=5,
+                                    max_overflow=10,
+                                    pool_recycle=3600))
+
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    tempDir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempDir)
+
+    self.engine = create_engine(
+      "sqlite:///" + os.path.join(tempDir, "test.db"),
+      poolclass=repository._InstrumentedQueuePool,
+      pool_size=2,
+      max_overflow=1)
+    self.addCleanup(self.engine.dispose)
+
+    self.engine.execute("CREATE TABLE t (x INTEGER)")
+
+
+  def testPoolStats(self):
+    repository.getPoolStats(self.engine, reset=True)
+
+    with self.engine.connect():
+      with self.engine.connect():
+        stats = repository.getPoolStats(self.engine)
+        self.assertEqual(stats["inUse"], 2)
+        self.assertEqual(stats["peakInUse"], 2)
+        self.assertEqual(stats["checkouts"], 2)
+
+    stats = repository.getPoolStats(self.engine, reset=True)
+    self.assertEqual(stats["inUse"], 0)
+    self.assertEqual(stats["idle"], 2)
+    self.assertEqual(stats["peakInUse"], 2)
+    self.assertGreaterEqual(stats["maxCheckoutSec"], stats["meanCheckoutSec"])
+
+    # Cumulative counters are reset
+    stats = repository.getPoolStats(self.engine)
+    self.assertEqual(stats["checkouts"], 0)
+    self.assertEqual(stats["peakInUse"], 0)
+
+    self.assertIn("inUse=0;", repository.formatPoolStats(stats))
+
+
+  def testPoolStatsOfUninstrumentedEngine(self):
+    self.assertIsNone(repository.getPoolStats(create_engine("sqlite://")))
+
+
+  def testSharedConnectionPerformsSingleCheckout(self):
+    repository.getPoolStats(self.engine, reset=True)
+
+    with repository.SharedConnection(self.engine) as batchEngine:
+      with batchEngine.connect() as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+
+      with batchEngine.begin() as conn:
+        conn.execute("INSERT INTO t VALUES (2)")
+
+      with self.assertRaises(ZeroDivisionError):
+        with batchEngine.begin() as conn:
+          conn.execute("INSERT INTO t VALUES (3)")
+          1 / 0
+
+      self.assertEqual(
+        batchEngine.execute("SELECT COUNT(*) FROM t").scalar(), 2)
+
+      self.assertEqual(repository.getPoolStats(self.engine)["inUse"], 1)
+
+    stats = repository.getPoolStats(self.engine)
+    self.assertEqual(stats["checkouts"], 1)
+    self.assertEqual(stats["inUse"], 0)
+
+    self.assertEqual(
+      [row.x for row in self.engine.execute("SELECT x FROM t ORDER BY x")],
+      [1, 2])
+
+
+
+  def testSharedConnectionEndsImplicitTransactionBetweenRequests(self):
+    with repository.SharedConnection(self.engine) as batchEngine:
+      with batchEngine.connect() as conn:
+        # Leave an implicit transaction open, as a read would in MySQL
+        conn.connection.cursor().execute("INSERT INTO t VALUES (1)")
+
+      with batchEngine.begin() as conn:
+        conn.execute("INSERT INTO t VALUES (2)")
+
+        # A request made while the transaction is open doesn't end it
+        with batchEngine.connect() as innerConn:
+          self.assertEqual(
+            innerConn.execute("SELECT COUNT(*) FROM t").scalar(), 1)
+
+    self.assertEqual(
+      [row.x for row in self.engine.execute("SELECT x FROM t ORDER BY x")],
+      [2])
+
+
+if __name__ == "__main__":
+  unittest.main()
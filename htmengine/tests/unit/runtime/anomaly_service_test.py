@@ -591,6 +591,45 @@ class InferenceResultTestCase(unittest.TestCase):
       return data
 
 
+  def testComposeModelInferenceResultsHeaders(self, *_args):
+    """ Validate AnomalyService._composeModelInferenceResultsHeaders result
+    """
+    msg = dict(
+      metric=dict(
+        uid="abcdef",
+        spec=dict(
+          metric="MY.METRIC.STOCK.VOLUME",
+          userInfo=dict(
+            symbol="AAPL",
+            metricType="StockVolume",
+            displayName=""
+          )
+        )
+      ),
+      results=[
+        dict(rowid=1, ts=1429272215.0),
+        dict(rowid=2, ts=1429272515.0)
+      ]
+    )
+
+    headers = (
+      anomaly_service.AnomalyService._composeModelInferenceResultsHeaders(msg))
+
+    self.assertEqual(headers,
+                     dict(metricUid="abcdef",
+                          lastRowTimestamp=1429272515.0,
+                          userInfoKeys="metricType,symbol"))
+
+    # No userInfo and no rows
+    del msg["metric"]["spec"]["userInfo"]
+    msg["results"] = []
+
+    headers = (
+      anomaly_service.AnomalyService._composeModelInferenceResultsHeaders(msg))
+
+    self.assertEqual(headers, dict(metricUid="abcdef", userInfoKeys=""))
+
+
   def testRejectionOfInferenceResultsForInactiveMetric(
       self, repoMock, *_args):
     """Calling _processModelInferenceResults against a metric that is not in
@@ -822,6 +861,47 @@ class InferenceResultTestCase(unittest.TestCase):
                   cm.exception.args[0])
 
 
+  def testScrubInferenceResultsWithRowidGaps(self, *_args):
+    """Metric data rowids may have gaps, e.g., where a writer's reserved rowids
+    were abandoned (see repository.reserveMetricRowids); results of the rows
+    that were stored and sent to the model still match them by rowid
+    """
+
+    class MetricRowSpec(object):
+      uid = None
+      status = None
+      parameters = None
+      server = None
+
+    metricRowMock = Mock(spec_set=MetricRowSpec, status=MetricStatus.ACTIVE,
+                         parameters=None)
+
+    rowids = [1, 2, 5]
+
+    def createMetricDataRow(rowid):
+      columns = dict(uid="abc", rowid=rowid, timestamp=None,
+                     metric_value=rowid, raw_anomaly_score=None,
+                     anomaly_score=None, display_value=None,
+                     multi_step_best_predictions=None)
+      return Mock(items=Mock(return_value=columns.items()), **columns)
+
+    metricDataRows = [createMetricDataRow(rowid) for rowid in rowids]
+
+    runner = anomaly_service.AnomalyService()
+
+    runner._scrubInferenceResultsAndInitMetricData(
+      engine=Mock(),
+      inferenceResults=[ModelInferenceResult(rowID=rowid, status=0,
+                                             anomalyScore=rowid / 10.0)
+                        for rowid in rowids],
+      metricDataRows=metricDataRows,
+      metricObj=metricRowMock)
+
+    self.assertEqual([row.rowid for row in metricDataRows], rowids)
+    self.assertEqual([row.raw_anomaly_score for row in metricDataRows],
+                     [0.1, 0.2, 0.5])
+
+
   def testErrorResultAndActiveModelInScrubInferenceResults(
       self, repoMock, *_args):
     """Calling _scrubInferenceResultsAndInitMetricData with a failed inference
@@ -27,6 +27,7 @@ htmengine.runtime.metric_garbage_collector.purgeOldMetricDataRows
 # pylint: disable=W0212
 
 
+import datetime
 import itertools
 import unittest
 
@@ -40,11 +41,18 @@ from htmengine.runtime import metric_garbage_collector
 
 
 
+# The unpatched function, for testing it in a test case that patches it
+_dropPartitions = metric_garbage_collector._dropPartitions
+
+
+
 def setUpModule():
   LoggingSupport.initTestApp()
 
 
 
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._refreshMetricDataStats", autospec=True)
 @patch("htmengine.runtime.metric_garbage_collector"
        "._deleteRows", autospec=True)
 @patch("htmengine.runtime.metric_garbage_collector"
@@ -61,7 +69,8 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
   def testPurgeOldMetricDataRowsWithoutOldRecords(self,
                                                   estimateNumRowsToDeleteMock,
                                                   queryCandidateRowsMock,
-                                                  deleteRowsMock):
+                                                  deleteRowsMock,
+                                                  refreshStatsMock):
     estimateNumRowsToDeleteMock.return_value = 0
 
     # These should not be called in this test
@@ -77,13 +86,15 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
 
     self.assertEqual(queryCandidateRowsMock.call_count, 0)
     self.assertEqual(deleteRowsMock.call_count, 0)
+    self.assertEqual(refreshStatsMock.call_count, 0)
 
 
   def testPurgeOldMetricDataRowsDeletedLessThanExpected(
       self,
       estimateNumRowsToDeleteMock,
       queryCandidateRowsMock,
-      deleteRowsMock):
+      deleteRowsMock,
+      refreshStatsMock):
 
     estimate = metric_garbage_collector._MAX_DELETE_BATCH_SIZE * 3
 
@@ -101,7 +112,9 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
       metric_garbage_collector._MAX_DELETE_BATCH_SIZE
     ]
 
-    deleteRowsMock.side_effect = iter(deletedCounts)
+    # Each batch reports the metrics whose stats need to be refreshed
+    deleteRowsMock.side_effect = iter(
+      zip(deletedCounts, [["uid2", "uid1"], ["uid1"], []]))
 
     # Execute
     numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
@@ -114,12 +127,17 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
     self.assertEqual(queryCandidateRowsMock.call_count, 4)
     self.assertEqual(deleteRowsMock.call_count, 3)
 
+    # Stats are refreshed once per metric after all batches are deleted
+    self.assertEqual(refreshStatsMock.call_args_list,
+                     [mock.call(mock.ANY, "uid1"), mock.call(mock.ANY, "uid2")])
+
 
   def testPurgeOldMetricDataRowsFewerCandidatesThanExpected(
       self,
       estimateNumRowsToDeleteMock,
       queryCandidateRowsMock,
-      deleteRowsMock):
+      deleteRowsMock,
+      refreshStatsMock):
 
     estimate = metric_garbage_collector._MAX_DELETE_BATCH_SIZE * 2
 
@@ -133,7 +151,7 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
       lambda limit, **kwargs: tuple(itertools.islice(candidatesIter, limit)))
 
     deleteRowsMock.side_effect = (
-      lambda uidRowidPairs, **kwargs: len(uidRowidPairs))
+      lambda uidRowidPairs, **kwargs: (len(uidRowidPairs), []))
 
     # Execute
     numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
@@ -151,7 +169,8 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
       self,
       estimateNumRowsToDeleteMock,
       queryCandidateRowsMock,
-      deleteRowsMock):
+      deleteRowsMock,
+      refreshStatsMock):
 
     estimate = metric_garbage_collector._MAX_DELETE_BATCH_SIZE * 2
 
@@ -165,7 +184,7 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
       lambda limit, **kwargs: tuple(itertools.islice(candidatesIter, limit)))
 
     deleteRowsMock.side_effect = (
-      lambda uidRowidPairs, **kwargs: len(uidRowidPairs))
+      lambda uidRowidPairs, **kwargs: (len(uidRowidPairs), []))
 
     # Execute
     numDeleted = metric_garbage_collector.purgeOldMetricDataRows(
@@ -180,3 +199,142 @@ class PurgeOldMetricDataRowsUnitTestCase(unittest.TestCase):
 
     # Make sure it didn't try to retrieve candidates beyond estimated number
     self.assertEqual(len(tuple(candidatesIter)), 1)
+
+
+
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._refreshMetricDataStats", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._queryPartitionMetricIds", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._addPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._dropPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       "._queryPartitions", autospec=True)
+@patch("htmengine.runtime.metric_garbage_collector"
+       ".htmengine.repository",
+       new=mock.Mock(spec_set=htmengine.repository))
+class PurgeOldMetricDataPartitionsUnitTestCase(unittest.TestCase):
+
+
+  @staticmethod
+  def _createPartitions(today, boundOffsetDays, numRows=10):
+    """ Create _PartitionInfo sequence with the given bounds relative to today
+    followed by the catch-all partition
+    """
+    todayDayNumber = metric_garbage_collector._dayNumberFromDate(today)
+    partitions = [
+      metric_garbage_collector._PartitionInfo(
+        name=metric_garbage_collector._getPartitionName(
+          todayDayNumber + offset),
+        bound=todayDayNumber + offset,
+        numRows=numRows)
+      for offset in boundOffsetDays
+    ]
+    partitions.append(
+      metric_garbage_collector._PartitionInfo(
+        name=metric_garbage_collector._FUTURE_PARTITION_NAME,
+        bound=None,
+        numRows=0))
+    return tuple(partitions)
+
+
+  def testDayNumberConversion(self, *_args):
+    # Per MySQL: SELECT TO_DAYS('2016-09-12') -> 736584
+    self.assertEqual(
+      metric_garbage_collector._dayNumberFromDate(datetime.date(2016, 9, 12)),
+      736584)
+    self.assertEqual(metric_garbage_collector._dateFromDayNumber(736584),
+                     datetime.date(2016, 9, 12))
+    self.assertEqual(metric_garbage_collector._getPartitionName(736584),
+                     "p20160912")
+
+
+  def testPurgeOldMetricDataPartitionsDropsExpiredPartitions(
+      self, queryPartitionsMock, dropPartitionsMock, addPartitionsMock,
+      queryMetricIdsMock, refreshStatsMock):
+    today = datetime.datetime.utcnow().date()
+
+    partitions = self._createPartitions(
+      today, boundOffsetDays=[-104, -97, -90, -83, 7, 14])
+    queryPartitionsMock.return_value = partitions
+    queryMetricIdsMock.return_value = ("uid2", "uid1")
+
+    # The partitions' metrics are queried before they're dropped, and their
+    # stats are refreshed afterwards
+    dropPartitionsMock.side_effect = (
+      lambda *_args: (self.assertEqual(queryMetricIdsMock.call_count, 1),
+                      self.assertEqual(refreshStatsMock.call_count, 0)))
+
+    numPurged = metric_garbage_collector.purgeOldMetricDataPartitions(
+      thresholdDays=90, partitionIntervalDays=7)
+
+    # Partitions with bounds at or below the cutoff are dropped
+    self.assertEqual(numPurged, 30)
+    dropPartitionsMock.assert_called_once_with(
+      mock.ANY, [partition.name for partition in partitions[:3]])
+
+    queryMetricIdsMock.assert_called_once_with(
+      mock.ANY, [partition.name for partition in partitions[:3]])
+
+    # The stats of the dropped rows' metrics are recomputed
+    self.assertEqual(refreshStatsMock.call_args_list,
+                     [mock.call(mock.ANY, "uid1"), mock.call(mock.ANY, "uid2")])
+
+    # Enough partitions exist already
+    self.assertEqual(addPartitionsMock.call_count, 0)
+
+
+  def testPurgeOldMetricDataPartitionsAddsUpcomingPartitions(
+      self, queryPartitionsMock, dropPartitionsMock, addPartitionsMock,
+      queryMetricIdsMock, refreshStatsMock):
+    today = datetime.datetime.utcnow().date()
+    todayDayNumber = metric_garbage_collector._dayNumberFromDate(today)
+
+    queryPartitionsMock.return_value = self._createPartitions(
+      today, boundOffsetDays=[-7, 0])
+
+    numPurged = metric_garbage_collector.purgeOldMetricDataPartitions(
+      thresholdDays=90, partitionIntervalDays=7)
+
+    self.assertEqual(numPurged, 0)
+    self.assertEqual(dropPartitionsMock.call_count, 0)
+    self.assertEqual(queryMetricIdsMock.call_count, 0)
+    self.assertEqual(refreshStatsMock.call_count, 0)
+
+    addPartitionsMock.assert_called_once_with(
+      mock.ANY, [todayDayNumber + 7, todayDayNumber + 14])
+
+
+  def testPurgeOldMetricDataPartitionsWithUnpartitionedTable(
+      self, queryPartitionsMock, dropPartitionsMock, addPartitionsMock,
+      queryMetricIdsMock, refreshStatsMock):
+    queryPartitionsMock.return_value = tuple()
+
+    with self.assertRaises(ValueError):
+      metric_garbage_collector.purgeOldMetricDataPartitions(
+        thresholdDays=90, partitionIntervalDays=7)
+
+    self.assertEqual(dropPartitionsMock.call_count, 0)
+    self.assertEqual(addPartitionsMock.call_count, 0)
+
+
+
+  def testDropPartitionsSkipsPartitionsAlreadyDropped(
+      self, queryPartitionsMock, *_args):
+    today = datetime.datetime.utcnow().date()
+
+    partitions = self._createPartitions(today, boundOffsetDays=[-90, 7])
+    queryPartitionsMock.return_value = partitions[1:]
+
+    sqlEngineMock = mock.Mock()
+
+    # The first partition is gone already, e.g., dropped by a previous attempt
+    _dropPartitions(sqlEngineMock, [partitions[0].name])
+    self.assertEqual(sqlEngineMock.execute.call_count, 0)
+
+    _dropPartitions(sqlEngineMock,
+                    [partition.name for partition in partitions[:2]])
+    sqlEngineMock.execute.assert_called_once_with(
+      "ALTER TABLE metric_data DROP PARTITION {}".format(partitions[1].name))
@@ -22,6 +22,7 @@
 
 """Tests the metric listener."""
 
+import datetime
 import socket
 import unittest
 
@@ -51,6 +52,24 @@ class MetricListenerTest(unittest.TestCase):
     self.assertEqual(dt.second, 55)
 
 
+  def testParseCompact(self):
+    data = {"test.metric": [[4.0, 1386792175], [5, 1386792475]],
+            "test.metric2": [[-1.5, 1386792175]]}
+    result = sorted(metric_listener.parseCompact(data))
+    self.assertEqual(
+      result,
+      [["test.metric", 4.0, datetime.datetime(2013, 12, 11, 20, 2, 55)],
+       ["test.metric", 5.0, datetime.datetime(2013, 12, 11, 20, 7, 55)],
+       ["test.metric2", -1.5, datetime.datetime(2013, 12, 11, 20, 2, 55)]])
+
+    for badData in ({"test.metric": [[4.0]]},
+                    {"test.metric": [["abc", 1386792175]]},
+                    {"": [[4.0, 1386792175]]},
+                    ["test.metric 4.0 1386792175"]):
+      with self.assertRaises(ValueError):
+        metric_listener.parseCompact(badData)
+
+
   @patch.object(metric_listener, "MessageBusConnector", autospec=True)
   @patch.object(metric_listener, "_forwardData", autospec=True)
   def testPlaintextTCP(self, forwardDataMock,
@@ -80,6 +80,58 @@ class MetricStorerTest(unittest.TestCase):
                      "datetime.datetime(2013, 12, 11, 20, 2, 55)")
     self.assertAlmostEqual(data[0][1], 4.0)
 
+  @patch("htmengine.runtime.metric_storer._addMetricData")
+  @patch("sqlalchemy.engine")
+  def testHandleBatchCompact(self, mockEngine, addMetricDataMock):
+    plainMessage = MagicMock()
+    plainMessage.body = (
+      '{"protocol": "plain", "data": ["test.metric 4.0 1386792175"]}')
+
+    compactMessage = MagicMock()
+    compactMessage.body = (
+      '{"protocol": "compact", "data": {'
+      '"test.metric": [[5.0, 1386792475]],'
+      '"test.metric2": [[1.5, 1386792175], [2.5, 1386792475]]}}')
+
+    metricStreamerMock = MagicMock()
+    modelSwapperMock = MagicMock()
+
+    # Call the function under test
+    metric_storer._handleBatch(mockEngine, [plainMessage, compactMessage], [],
+                               metricStreamerMock, modelSwapperMock)
+
+    # Check the results
+    addMetricDataMock.assert_called_once_with(mockEngine, mock.ANY,
+                                              metricStreamerMock,
+                                              modelSwapperMock)
+    dataDict = addMetricDataMock.call_args[0][1]
+    self.assertEqual(
+      dict(dataDict),
+      {
+        "test.metric": [
+          ["test.metric", 4.0, datetime.datetime(2013, 12, 11, 20, 2, 55)],
+          ["test.metric", 5.0, datetime.datetime(2013, 12, 11, 20, 7, 55)]],
+        "test.metric2": [
+          ["test.metric2", 1.5, datetime.datetime(2013, 12, 11, 20, 2, 55)],
+          ["test.metric2", 2.5, datetime.datetime(2013, 12, 11, 20, 7, 55)]]
+      })
+
+
+  @patch.object(metric_storer, "LOGGER")
+  @patch("sqlalchemy.engine")
+  def testHandleDataInvalidCompactBody(self, mockEngine, loggingMock):
+    """Make sure _handleData doesn't throw an exception for invalid compact
+    data."""
+    # Call the function under test
+    body = '{"protocol": "compact", "data": {"test.metric": [[4.0]]}}'
+    message = MagicMock()
+    message.body = body
+    metric_storer._handleBatch(mockEngine, [message], [], MagicMock(),
+                               MagicMock())
+    # Check the results
+    self.assertTrue(loggingMock.warn.called)
+
+
   @patch.object(metric_storer, "LOGGER")
   @patch("sqlalchemy.engine")
   def testHandleDataInvalidProtocol(self, mockEngine, loggingMock):
@@ -73,12 +73,140 @@ class MetricStreamerTestCase(unittest.TestCase):
         data=taintedSamples,
         metricID=Mock(name="MetricID"),
         conn=Mock(name="SqlalchemyConnection"),
-        lastDataRowID=Mock(name="lastDataRowID")
+        metricObj=Mock(name="metricObj")
       )
 
     self.assertSequenceEqual(passingData, expectedPassingSamples)
 
 
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testGetTailMetricRowTimestamp(self, repositoryMock):
+    streamer = metric_streamer_util.MetricStreamer()
+
+    now = datetime.utcnow()
+    conn = Mock(name="SqlalchemyConnection")
+
+    # Recorded with the metric's last reservation
+    metricObj = Mock(last_rowid=5, last_rowid_timestamp=now)
+    self.assertEqual(
+      streamer._getTailMetricRowTimestamp(conn, "abcdef", metricObj), now)
+    self.assertFalse(repositoryMock.getMetricData.called)
+
+    # No rows
+    metricObj = Mock(last_rowid=None, last_rowid_timestamp=None)
+    self.assertIsNone(
+      streamer._getTailMetricRowTimestamp(conn, "abcdef", metricObj))
+    self.assertFalse(repositoryMock.getMetricData.called)
+
+    # Not recorded, so it falls back to the latest existing row through
+    # last_rowid
+    metricObj = Mock(last_rowid=5, last_rowid_timestamp=None)
+    repositoryMock.getMetricData.return_value.first.return_value = Mock(
+      timestamp=now)
+    self.assertEqual(
+      streamer._getTailMetricRowTimestamp(conn, "abcdef", metricObj), now)
+    self.assertEqual(repositoryMock.getMetricData.call_count, 1)
+    self.assertEqual(repositoryMock.getMetricData.call_args[1]["stop"], 5)
+    self.assertEqual(repositoryMock.getMetricData.call_args[1]["limit"], 1)
+
+
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testStreamMetricDataForwardsByStatusAtInsert(self, repositoryMock):
+    """ Rows whose rowids were reserved while the metric was UNMONITORED are
+    forwarded to the model if its status changed before they were inserted
+    """
+    repositoryMock.retryOnTransientErrors.side_effect = lambda f: f
+    repositoryMock.getMetricWithUpdateLock.return_value = Mock(
+      status=metric_streamer_util.MetricStatus.UNMONITORED,
+      last_rowid=4,
+      last_rowid_timestamp=None,
+      datasource="custom")
+    repositoryMock.getMetricData.return_value.first.return_value = None
+    repositoryMock.reserveMetricRowids.return_value = 6
+    repositoryMock.insertMetricData.side_effect = (
+      lambda conn, metricId, data, lastRowid: [
+        dict(rowid=rowid, timestamp=timestamp, metric_value=value)
+        for rowid, (value, timestamp)
+        in enumerate(data, lastRowid - len(data) + 1)])
+    repositoryMock.getMetric.return_value = Mock(
+      status=metric_streamer_util.MetricStatus.ACTIVE)
+
+    now = datetime.utcnow()
+    data = [(now, 1.0), (now + timedelta(seconds=300), 2.0)]
+
+    streamer = metric_streamer_util.MetricStreamer()
+    modelSwapper = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    with patch.object(streamer, "_sendInputRowsToModel",
+                      autospec=True) as sendInputRowsToModelMock:
+      streamer.streamMetricData(data, "abcdef", modelSwapper)
+
+    # The rowids were reserved for the samples under the metric row's lock,
+    # over the batch's shared connection
+    repositoryMock.SharedConnection.assert_called_once_with(
+      repositoryMock.engineFactory.return_value)
+    repositoryMock.reserveMetricRowids.assert_called_once_with(
+      repositoryMock.SharedConnection.return_value.__enter__.return_value
+      .connect.return_value.__enter__.return_value,
+      "abcdef",
+      amount=2,
+      lastTimestamp=now + timedelta(seconds=300))
+
+    # And the rows were inserted at the reserved rowids
+    self.assertEqual(repositoryMock.insertMetricData.call_count, 1)
+    self.assertEqual(repositoryMock.insertMetricData.call_args[0][3], 6)
+
+    sendInputRowsToModelMock.assert_called_once_with(
+      inputRows=(
+        model_swapper_interface.ModelInputRow(rowID=5, data=(now, 1.0)),
+        model_swapper_interface.ModelInputRow(
+          rowID=6, data=(now + timedelta(seconds=300), 2.0))),
+      metricID="abcdef",
+      modelSwapper=modelSwapper)
+
+
+  @patch.object(metric_streamer_util, "createDatasourceAdapter", autospec=True)
+  @patch.object(metric_streamer_util, "repository", autospec=True)
+  def testStreamMetricDataActivatesPendingModelByRowCount(
+      self, repositoryMock, createDatasourceAdapterMock):
+    """ A PENDING_DATA model is activated once its metric has enough rows,
+    which may be fewer than its last rowid due to gaps in its rowids
+    """
+    threshold = metric_streamer_util.MODEL_CREATION_RECORD_THRESHOLD
+
+    repositoryMock.retryOnTransientErrors.side_effect = lambda f: f
+    repositoryMock.getMetricWithUpdateLock.return_value = Mock(
+      status=metric_streamer_util.MetricStatus.PENDING_DATA,
+      last_rowid=threshold,
+      last_rowid_timestamp=None,
+      datasource="custom")
+    repositoryMock.getMetricData.return_value.first.return_value = None
+    repositoryMock.reserveMetricRowids.return_value = threshold + 1
+    repositoryMock.insertMetricData.side_effect = (
+      lambda conn, metricId, data, lastRowid: [dict(rowid=lastRowid)])
+    repositoryMock.getMetric.return_value = Mock(
+      status=metric_streamer_util.MetricStatus.PENDING_DATA)
+
+    streamer = metric_streamer_util.MetricStreamer()
+    modelSwapper = Mock(
+      spec_set=model_swapper_interface.ModelSwapperInterface)
+
+    now = datetime.utcnow()
+
+    # The rowids have gaps, so there aren't enough rows yet
+    repositoryMock.getMetricDataCount.return_value = threshold - 1
+    streamer.streamMetricData([(now, 1.0)], "abcdef", modelSwapper)
+    self.assertFalse(createDatasourceAdapterMock.called)
+
+    # Now there are
+    repositoryMock.getMetricDataCount.return_value = threshold
+    streamer.streamMetricData([(now, 1.0)], "abcdef", modelSwapper)
+    createDatasourceAdapterMock.assert_called_once_with("custom")
+    (createDatasourceAdapterMock.return_value.activateModel
+     .assert_called_once_with("abcdef"))
+
+
   def testSendInputRowsToModel(self):
     """ Test MetricStreamer._sendInputRowsToModel """
     metricDataOutputChunkSize = metric_streamer_util.config.getint(
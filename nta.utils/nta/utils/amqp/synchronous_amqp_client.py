@@ -27,6 +27,7 @@ TODO need unit tests
 from collections import deque
 from datetime import datetime
 import logging
+import select
 import socket
 
 from haigha.connections.rabbit_connection import RabbitConnection
@@ -65,12 +66,28 @@ class _CallbackSink(object):
 
 
 class _PubackState(_CallbackSink):
+  """Collects publisher acknowledgments of one message (see
+  `SynchronousAmqpClient.publish`) or of a group of messages published
+  back-to-back without waiting for each one individually (see
+  `SynchronousAmqpClient.publishMany`)
+  """
 
-  __slots__ = ()
+  __slots__ = ("numExpected",)
 
   ACK = 1
   NACK = 2
 
+  def __init__(self, numExpected=1):
+    """
+    :param int numExpected: number of messages to be ACKed or NACKed
+    """
+    super(_PubackState, self).__init__()
+    self.numExpected = numExpected
+
+  @property
+  def ready(self):
+    return len(self.values) >= self.numExpected
+
   def handleAck(self, deliveryTag):
     """Message Ack'ed in RabbitMQ Publisher Acknowledgments mode"""
     g_log.debug("Message ACKed: tag=%s", deliveryTag)
@@ -79,9 +96,11 @@ class _PubackState(_CallbackSink):
 
     self(self.ACK, deliveryTag)
 
-  def handleNack(self, deliveryTag):
-    """Message Nack'ed in RabbitMQ Publisher Acknowledgments mode"""
-    g_log.error("Message NACKed: tag=%s", deliveryTag)
+  def handleNack(self, deliveryTag, requeue=False):
+    """Message Nack'ed in RabbitMQ Publisher Acknowledgments mode; haigha
+    calls nack listeners with the delivery tag and the broker's requeue flag
+    """
+    g_log.error("Message NACKed: tag=%s; requeue=%s", deliveryTag, requeue)
 
     assert not self.ready, (deliveryTag, self.values)
 
@@ -524,6 +543,73 @@ class SynchronousAmqpClient(object):
                                            mandatory=mandatory)
 
 
+  def publishMany(self, messages, exchange, routingKey, mandatory=False):
+    """ Publish a sequence of messages, pipelining publisher acknowledgments:
+    in publisher-acknowledgments mode, all messages are sent before waiting for
+    the broker to ACK or NACK them, so the round-trip to the broker is paid
+    once per call instead of once per message. In
+    non-publisher-acknowledgments mode, this is equivalent to calling `publish`
+    for each message.
+
+    :param messages: sequence of nta.utils.amqp.messages.Message objects
+    :param str exchange: destination exchange name; "" for default exchange
+    :param str routingKey: Message routing key
+    :param bool mandatory: See `publish`
+
+    :raises nta.utils.amqp.exceptions.UnroutableError: see `publish`; in
+      publisher-acknowledgments mode, raised if any of the given messages is
+      returned as unroutable.
+    :raises nta.utils.amqp.exceptions.NackError: when any of the given
+      messages is NACKed by broker while channel is in RabbitMQ
+      publisher-acknowledgments mode
+    :raises nta.utils.amqp.exceptions.AmqpChannelError:
+    """
+    channelContext = self._liveChannelContext
+
+    if not channelContext.pubacksSelected:
+      for message in messages:
+        self.publish(message, exchange, routingKey, mandatory=mandatory)
+      return
+
+    if not messages:
+      return
+
+    assert not channelContext.returnedMessages, (
+      len(channelContext.returnedMessages),
+      channelContext.returnedMessages)
+
+    pubackState = _PubackState(numExpected=len(messages))
+    channelContext.channel.basic.set_ack_listener(pubackState.handleAck)
+    channelContext.channel.basic.set_nack_listener(pubackState.handleNack)
+
+    deliveryTags = []
+    for message in messages:
+      deliveryTags.append(
+        channelContext.channel.basic.publish(
+          HaighaMessage(body=message.body,
+                        **self._makeHaighaPropertiesDict(message.properties)),
+          exchange=exchange,
+          routing_key=routingKey,
+          mandatory=mandatory))
+
+    # Wait for ACKs or NACKs of all the messages
+    while not pubackState.ready:
+      self._connection.read_frames()
+
+    responseTags = [responseTag for _how, responseTag in pubackState.values]
+    assert responseTags == deliveryTags, (pubackState.values, deliveryTags)
+
+    if any(how == _PubackState.NACK for how, _tag in pubackState.values):
+      # Raise NackError with returned messages
+      returnedMessages = channelContext.returnedMessages
+      channelContext.returnedMessages = []
+
+      raise amqp_exceptions.NackError(returnedMessages)
+
+    # Raise if any of the messages was returned as unroutable
+    self._raiseAndClearIfReturnedMessages()
+
+
   def requestQoS(self, prefetchSize=0, prefetchCount=0, entireConnection=False):
     """This method requests a specific quality of service. The QoS can be
     specified for the current channel or for all channels on the connection. The
@@ -613,6 +699,51 @@ class SynchronousAmqpClient(object):
     return bool(channelContext is not None and channelContext.pendingEvents)
 
 
+  def pollEvents(self, timeout=0):
+    """Like `hasEvent()`, but also reads frames that have already arrived on
+    the connection (or that arrive within the given timeout) when there are no
+    events ready for consumption yet, without blocking any longer.
+
+    :param float timeout: max seconds to wait for incoming data; 0 polls
+      without waiting
+    :returns: True if there is at least one event ready for consumption, in
+      which case `getNextEvent()` may be called once without blocking.
+    :rtype: bool
+
+    :raises AttributeError: if haigha's socket transport doesn't keep its socket
+      where expected (see `_getTransportSocket()`)
+    """
+    channelContext = self._channelContextInstance
+
+    if channelContext is not None and not channelContext.pendingEvents:
+      # NOTE: haigha's synchronous socket transport doesn't support
+      # non-blocking reads, so check its socket for readability first
+      sock = self._getTransportSocket()
+      if sock is not None and select.select([sock], [], [], timeout)[0]:
+        self._connection.read_frames()
+
+    return self.hasEvent()
+
+
+  def _getTransportSocket(self):
+    """ Get the socket of the connection's haigha socket transport. haigha
+    doesn't expose it publicly, so this relies on the transport's private
+    `_sock` attribute, failing loudly instead of silently never reading if a
+    haigha upgrade changes that.
+
+    :returns: the transport's socket; None if the transport is disconnected
+    :raises AttributeError: if the transport has no `_sock` attribute
+    """
+    transport = self._connection.transport
+    try:
+      return transport._sock  # pylint: disable=W0212
+    except AttributeError:
+      g_log.error("haigha transport=%r has no _sock attribute; the "
+                  "installed haigha version is not supported by pollEvents",
+                  transport)
+      raise
+
+
   def getNextEvent(self):
     """Get next event, blocking if there isn't one yet. See `hasEvent()`. You
     MUST have an active consumer (`createConsumer`) or other event source before
@@ -86,19 +86,216 @@ package in test code...
         manager>
 
 
+Snapshot usage in hot paths...
+
+  Config.get() and friends go through ConfigParser and look up the environment
+  variable override of each option on every call. Code that reads settings
+  repeatedly (e.g., per batch) may instead use an immutable snapshot of the
+  config with the overrides already applied. The snapshot is replaced when the
+  override config changes, as detected by a throttled loadConfig() check in
+  getSnapshot(), or when reloadSnapshot() is called.
+
+  Example::
+
+      from <application> import Config
+      config = Config("application.conf")
+
+      # Per batch
+      settings = config.getSnapshot()
+      chunkSize = settings.metric_streamer.getint("chunk_size")
+      exchangeName = settings.metric_streamer.results_exchange_name
+
 """
 
-from ConfigParser import ConfigParser
+from ConfigParser import ConfigParser, NoOptionError, NoSectionError
 import errno
 import functools
 import os
 import shutil
+import time
 import types
 
 from nta.utils import file_lock, makeDirectoryFromAbsolutePath
 
 
 
+class ConfigSectionSnapshot(object):
+  """ Immutable snapshot of the options of a config section, with environment
+  variable-based overrides applied. Option values are accessible as attributes
+  (e.g., section.host), except for options whose names collide with the
+  methods of this class, and as items (e.g., section["host"]); typed values
+  via getint(), getfloat() and getboolean(), which parse the same way as their
+  ConfigParser counterparts.
+  """
+
+  def __init__(self, name, options):
+    """
+    :param name: section name
+    :param options: sequence of (option, value) pairs
+    """
+    options = dict(options)
+
+    # Options are also stored as instance attributes so that attribute access
+    # doesn't incur a __getattr__ call
+    self.__dict__.update(
+      (option, value) for option, value in options.iteritems()
+      if not hasattr(self.__class__, option))
+
+    self.__dict__["_name"] = name
+    self.__dict__["_options"] = options
+
+
+  def __repr__(self):
+    return "{cls}<name={name}, options={options}>".format(
+      cls=self.__class__.__name__,
+      name=self._name,
+      options=sorted(self._options))
+
+
+  def __setattr__(self, name, value):
+    raise AttributeError("%s is immutable" % (self.__class__.__name__,))
+
+
+  def __delattr__(self, name):
+    raise AttributeError("%s is immutable" % (self.__class__.__name__,))
+
+
+  def __getitem__(self, option):
+    try:
+      return self._options[option]
+    except KeyError:
+      raise NoOptionError(option, self._name)
+
+
+  def __contains__(self, option):
+    return option in self._options
+
+
+  def __iter__(self):
+    return iter(self._options)
+
+
+  @property
+  def name(self):
+    return self._name
+
+
+  def items(self):
+    """
+    :returns: list of (option, value) pairs
+    """
+    return self._options.items()
+
+
+  def getint(self, option):
+    return int(self[option])
+
+
+  def getfloat(self, option):
+    return float(self[option])
+
+
+  def getboolean(self, option):
+    value = self[option]
+    try:
+      return ConfigParser._boolean_states[value.lower()]
+    except KeyError:
+      raise ValueError("Not a boolean: %s" % (value,))
+
+
+
+class ConfigSnapshot(object):
+  """ Immutable snapshot of a config's sections, with environment
+  variable-based overrides applied; see Config.getSnapshot(). Sections are
+  accessible as attributes (e.g., snapshot.rabbit), except for sections whose
+  names collide with the methods of this class, and as items (e.g.,
+  snapshot["rabbit"]). The snapshot also supports the read-only subset of the
+  Config API: get(), getint(), getfloat(), getboolean(), items(), sections(),
+  has_section() and has_option().
+  """
+
+  def __init__(self, configName, sections):
+    """
+    :param configName: Name of the configuration object; e.g.,
+      "application.conf".
+    :param sections: sequence of ConfigSectionSnapshot objects
+    """
+    sections = dict((section.name, section) for section in sections)
+
+    # Sections are also stored as instance attributes so that attribute access
+    # doesn't incur a __getattr__ call
+    self.__dict__.update(
+      (name, section) for name, section in sections.iteritems()
+      if not hasattr(self.__class__, name))
+
+    self.__dict__["_configName"] = configName
+    self.__dict__["_sections"] = sections
+
+
+  def __repr__(self):
+    return "{cls}<name={name}, sections={sections}>".format(
+      cls=self.__class__.__name__,
+      name=self._configName,
+      sections=sorted(self._sections))
+
+
+  def __setattr__(self, name, value):
+    raise AttributeError("%s is immutable" % (self.__class__.__name__,))
+
+
+  def __delattr__(self, name):
+    raise AttributeError("%s is immutable" % (self.__class__.__name__,))
+
+
+  def __getitem__(self, section):
+    try:
+      return self._sections[section]
+    except KeyError:
+      raise NoSectionError(section)
+
+
+  def __contains__(self, section):
+    return section in self._sections
+
+
+  @property
+  def configName(self):
+    return self._configName
+
+
+  def sections(self):
+    return self._sections.keys()
+
+
+  def has_section(self, section):
+    return section in self._sections
+
+
+  def has_option(self, section, option):
+    return section in self._sections and option in self._sections[section]
+
+
+  def items(self, section):
+    return self[section].items()
+
+
+  def get(self, section, option):
+    return self[section][option]
+
+
+  def getint(self, section, option):
+    return self[section].getint(option)
+
+
+  def getfloat(self, section, option):
+    return self[section].getfloat(option)
+
+
+  def getboolean(self, section, option):
+    return self[section].getboolean(option)
+
+
+
 class Config(ConfigParser, object):
   """Config class that customizes the built-in ConfigParser for use in
   applications.
@@ -121,6 +318,11 @@ class Config(ConfigParser, object):
   # directory)
   _CONFIG_OVERRIDE_DIR_NAME = "overrides"
 
+  # Default minimum number of seconds between the checks of getSnapshot() for
+  # changes of the override config; matches the resolution of the change
+  # detection in loadConfig()
+  SNAPSHOT_RELOAD_CHECK_INTERVAL_SEC = 1
+
 
   def __init__(self, configName, baseConfigDir, mode=MODE_LOGICAL):
     """
@@ -160,6 +362,14 @@ class Config(ConfigParser, object):
     # Value of getmtime at the time when override config was last loaded
     self._lastModTime = 0
 
+    # Snapshot returned by getSnapshot(); None when the config has changed
+    # since the snapshot was taken
+    self._snapshot = None
+
+    # time.time() of the last check of getSnapshot() for override config
+    # changes
+    self._lastSnapshotReloadCheckTime = 0
+
     self.baseConfigDir = baseConfigDir
 
     self.loadConfig()
@@ -228,6 +438,80 @@ class Config(ConfigParser, object):
     return result
 
 
+  @functools.wraps(ConfigParser.add_section)
+  def add_section(self, *args, **kwargs):
+    self._snapshot = None
+    return ConfigParser.add_section(self, *args, **kwargs)
+
+
+  @functools.wraps(ConfigParser.remove_section)
+  def remove_section(self, *args, **kwargs):
+    self._snapshot = None
+    return ConfigParser.remove_section(self, *args, **kwargs)
+
+
+  @functools.wraps(ConfigParser.set)
+  def set(self, *args, **kwargs):
+    self._snapshot = None
+    return ConfigParser.set(self, *args, **kwargs)
+
+
+  @functools.wraps(ConfigParser.remove_option)
+  def remove_option(self, *args, **kwargs):
+    self._snapshot = None
+    return ConfigParser.remove_option(self, *args, **kwargs)
+
+
+  def _read(self, *args, **kwargs):
+    """ Override ConfigParser.ConfigParser._read(), which implements read() and
+    readfp(), in order to invalidate the snapshot
+    """
+    self._snapshot = None
+    return ConfigParser._read(self, *args, **kwargs)
+
+
+  def getSnapshot(self,
+                  reloadCheckIntervalSec=SNAPSHOT_RELOAD_CHECK_INTERVAL_SEC):
+    """ Get an immutable snapshot of the config, with environment
+    variable-based overrides applied, for fast repeated access to settings. The
+    snapshot is taken on first use and retaken after the config changes.
+
+    NOTE: environment variable overrides are resolved when the snapshot is
+    taken; use reloadSnapshot() to pick up changes of the environment.
+
+    :param reloadCheckIntervalSec: minimum number of seconds between checks
+      for changes of the override config via loadConfig(); 0 to check on every
+      call; None to not check.
+    :returns: ConfigSnapshot
+    """
+    if reloadCheckIntervalSec is not None:
+      now = time.time()
+      if now - self._lastSnapshotReloadCheckTime >= reloadCheckIntervalSec:
+        self._lastSnapshotReloadCheckTime = now
+        self.loadConfig()
+
+    snapshot = self._snapshot
+    if snapshot is None:
+      snapshot = ConfigSnapshot(
+        self._configName,
+        [ConfigSectionSnapshot(section, self.items(section))
+         for section in self.sections()])
+      self._snapshot = snapshot
+
+    return snapshot
+
+
+  def reloadSnapshot(self):
+    """ Reload the configuration object from disk if its override has changed,
+    and retake the snapshot, resolving environment variable overrides anew
+
+    :returns: ConfigSnapshot
+    """
+    self.loadConfig()
+    self._snapshot = None
+    return self.getSnapshot(reloadCheckIntervalSec=None)
+
+
   def loadConfig(self):
     """
     Reload the configuration object from disk if its override has changed. The
@@ -262,6 +546,7 @@ class Config(ConfigParser, object):
       # Reset config cache
       self._sections.clear()
       self._defaults.clear()
+      self._snapshot = None
 
       if self._mode == self.MODE_LOGICAL:
         # Load baseline config
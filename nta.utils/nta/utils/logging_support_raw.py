@@ -66,6 +66,20 @@ console output (including stderr):
     def setUpModule():
       LoggingSupport.initTestApp()
 
+
+
+4. A service whose message processing must not be stalled by slow log output
+(e.g., a slow disk or syslog):
+
+    if __name__ == "__main__":
+      LoggingSupport.initService(nonBlocking=True)
+
+  The output handlers are then fed from a bounded in-process queue by a
+  background thread; records that don't fit in the queue are dropped and
+  counted. Non-blocking mode may also be enabled without code changes by
+  setting the NTA_LOGGING_NON_BLOCKING environment variable to "1" (e.g., in
+  the service's supervisord `environment`).
+
 """
 
 from ConfigParser import ConfigParser
@@ -74,8 +88,10 @@ import logging.config
 import logging.handlers
 import os
 from pkg_resources import resource_filename, get_distribution
+import Queue
 from StringIO import StringIO
 import sys
+import threading
 import time
 
 from nta.utils import makeDirectoryFromAbsolutePath
@@ -88,6 +104,17 @@ distribution = get_distribution("nta.utils")
 
 _APPLICATION_CONF_DIR = os.path.join(distribution.location, "conf")
 
+# Environment variable that enables non-blocking logging when set to "1" and
+# the nonBlocking arg of LoggingSupport.initLogging() is None
+_NON_BLOCKING_ENV_VAR = "NTA_LOGGING_NON_BLOCKING"
+
+# Default maximum number of log records pending output in non-blocking mode
+_NON_BLOCKING_QUEUE_MAX_RECORDS = 10000
+
+# Maximum number of seconds to wait for pending log records to be output when
+# closing a QueueingHandler
+_QUEUEING_HANDLER_CLOSE_TIMEOUT_SEC = 30
+
 
 
 def setLogDir(logDir):
@@ -103,10 +130,187 @@ def setLogDir(logDir):
 
 
 
+class QueueingHandler(logging.Handler):
+  """ Logging handler that doesn't block the logging thread on output: it
+  appends log records to a bounded in-process queue, and a background thread
+  dispatches them to the target handlers. When the queue is full, records are
+  dropped and counted, and the count is logged via the target handlers once
+  the queue drains. close() outputs the pending records before closing the
+  target handlers; logging.shutdown() closes the handler at exit.
+
+  NOTE: the background thread doesn't survive fork(); a forked child needs to
+  initialize its own logging.
+  """
+
+  # Sentinel that stops the background thread
+  _STOP = object()
+
+
+  def __init__(self, targetHandlers,
+               maxQueueSize=_NON_BLOCKING_QUEUE_MAX_RECORDS):
+    """
+    :param targetHandlers: sequence of logging.Handler objects to dispatch log
+      records to; each target handler filters records by its own level.
+    :param maxQueueSize: maximum number of log records pending output
+    """
+    logging.Handler.__init__(
+      self,
+      level=min(handler.level for handler in targetHandlers))
+
+    self._targetHandlers = tuple(targetHandlers)
+
+    self._queue = Queue.Queue(maxsize=maxQueueSize)
+
+    # Number of log records dropped because the queue was full, and the part
+    # of it already logged; guarded by _droppedLock
+    self._droppedLock = threading.Lock()
+    self._numDropped = 0
+    self._numDroppedReported = 0
+
+    self._closed = False
+
+    self._thread = threading.Thread(target=self._runOutputLoop,
+                                    name="QueueingHandler")
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+
+  @property
+  def targetHandlers(self):
+    return self._targetHandlers
+
+
+  @property
+  def numDropped(self):
+    """ Number of log records dropped because the queue was full """
+    return self._numDropped
+
+
+  def emit(self, record):
+    if self._closed:
+      # Output directly after close
+      self._dispatch(record)
+      return
+
+    try:
+      self._queue.put_nowait(self._prepare(record))
+    except Queue.Full:
+      with self._droppedLock:
+        self._numDropped += 1
+    except Exception:  # pylint: disable=W0703
+      self.handleError(record)
+
+
+  def flush(self):
+    """ Wait for the pending log records to be output, then flush the target
+    handlers
+    """
+    if not self._closed and self._thread.is_alive():
+      self._queue.join()
+
+    for handler in self._targetHandlers:
+      handler.flush()
+
+
+  def close(self):
+    """ Output the pending log records, stop the background thread and close
+    the target handlers
+    """
+    self.acquire()
+    try:
+      if self._closed:
+        return
+      self._closed = True
+    finally:
+      self.release()
+
+    if self._thread.is_alive():
+      self._queue.put(self._STOP)
+      self._thread.join(_QUEUEING_HANDLER_CLOSE_TIMEOUT_SEC)
+
+    # Output records that were queued while closing
+    while True:
+      try:
+        record = self._queue.get_nowait()
+      except Queue.Empty:
+        break
+      if record is not self._STOP:
+        self._dispatch(record)
+
+    self._reportDropped()
+
+    for handler in self._targetHandlers:
+      handler.flush()
+      handler.close()
+
+    logging.Handler.close(self)
+
+
+  def _prepare(self, record):
+    """ Merge the message with its args and format the exception info, if any,
+    now, since args may be mutated by the caller and tracebacks reference the
+    caller's frames
+
+    :returns: the prepared record
+    """
+    record.msg = record.getMessage()
+    record.args = None
+
+    if record.exc_info:
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+
+    return record
+
+
+  def _dispatch(self, record):
+    """ Output the record via the target handlers that accept its level """
+    for handler in self._targetHandlers:
+      if record.levelno >= handler.level:
+        handler.handle(record)
+
+
+  def _reportDropped(self):
+    """ Log the number of records dropped since the last report, if any """
+    with self._droppedLock:
+      numDropped = self._numDropped - self._numDroppedReported
+      self._numDroppedReported = self._numDropped
+
+    if numDropped:
+      self._dispatch(logging.LogRecord(
+        name=__name__,
+        level=logging.WARNING,
+        pathname=__file__,
+        lineno=0,
+        msg="Dropped %d log records because the logging queue was full",
+        args=(numDropped,),
+        exc_info=None))
+
+
+  def _runOutputLoop(self):
+    """ Output queued log records until stopped """
+    while True:
+      record = self._queue.get()
+      try:
+        if record is self._STOP:
+          return
+
+        try:
+          self._dispatch(record)
+        except Exception:  # pylint: disable=W0703
+          self.handleError(record)
+
+        if self._numDropped != self._numDroppedReported and self._queue.empty():
+          self._reportDropped()
+      finally:
+        self._queue.task_done()
+
+
+
 class LoggingSupport(object):
 
   @classmethod
-  def initTool(cls, loggingLevel=None):
+  def initTool(cls, loggingLevel=None, nonBlocking=None):
     """ Initialize python logging for a tool (e.g., set_edition, pavement) to
     output log messages to stderr and a tool-specific log file.
 
@@ -126,15 +330,18 @@ class LoggingSupport(object):
         output handlers; one of: "DEBUG", "INFO", "WARNING", "WARN", "ERROR",
         "CRITICAL" or "FATAL" that correspond to logging.DEBUG, logging.INFO,
         etc. Defaults to "INFO".
+
+    :param nonBlocking: see initLogging()
     """
     cls.initLogging(loggingLevel=loggingLevel,
                     console="stderr",
-                    logToFile=True)
+                    logToFile=True,
+                    nonBlocking=nonBlocking)
 
 
 
   @classmethod
-  def initService(cls, loggingLevel=None):
+  def initService(cls, loggingLevel=None, nonBlocking=None):
     """ Initialize python logging for a Service (e.g., taurus_metric_collector,
     model_scheduler) to output log messages to stderr only (and not to a file).
 
@@ -153,10 +360,13 @@ class LoggingSupport(object):
         output handlers; one of: "DEBUG", "INFO", "WARNING", "WARN", "ERROR",
         "CRITICAL" or "FATAL" that correspond to logging.DEBUG, logging.INFO,
         etc. Defaults to "INFO".
+
+    :param nonBlocking: see initLogging()
     """
     cls.initLogging(loggingLevel=loggingLevel,
                     console="stderr",
-                    logToFile=False)
+                    logToFile=False,
+                    nonBlocking=nonBlocking)
 
 
 
@@ -189,7 +399,7 @@ class LoggingSupport(object):
 
   @classmethod
   def initLogging(cls, loggingLevel=None, console="stderr",
-                  logToFile=False):
+                  logToFile=False, nonBlocking=None):
     """ A lower-level function to initialize python logging for the calling
     process. Supports logging output to a console (stderr or stdout) and/or log
     file.
@@ -211,6 +421,11 @@ class LoggingSupport(object):
     :param logToFile: True to output logs to a file. If enalbed, a log file
         specific to the calling app instance will be created at file path
         generated by our getApplicationLogFilePath method.
+
+    :param nonBlocking: True to output logs from a background thread fed by a
+        bounded queue, dropping records when the queue is full, so that
+        logging never blocks on output; see QueueingHandler. None to enable it
+        only if the NTA_LOGGING_NON_BLOCKING environment variable is "1".
     """
     validLoggingLevels = ["DEBUG", "INFO", "WARNING", "WARN", "ERROR",
                           "CRITICAL", "FATAL"]
@@ -282,9 +497,27 @@ class LoggingSupport(object):
     config.write(customConfigFile)
     customConfigFile.seek(0)
 
+    # Stop the background thread of a previous non-blocking initialization,
+    # which fileConfig would otherwise leave behind
+    rootLogger = logging.getLogger()
+    for handler in rootLogger.handlers[:]:
+      if isinstance(handler, QueueingHandler):
+        rootLogger.removeHandler(handler)
+        handler.close()
+
     # Initialize logging from StringIO file object
     logging.config.fileConfig(customConfigFile, disable_existing_loggers=False)
 
+    if nonBlocking is None:
+      nonBlocking = os.environ.get(_NON_BLOCKING_ENV_VAR) == "1"
+
+    if nonBlocking:
+      # Feed the output handlers from a queue
+      targetHandlers = rootLogger.handlers[:]
+      for handler in targetHandlers:
+        rootLogger.removeHandler(handler)
+      rootLogger.addHandler(QueueingHandler(targetHandlers))
+
 
 
   @classmethod
@@ -327,6 +327,40 @@ class MessageBusConnector(object):
                                  % (mqName,))
 
 
+  @_RETRY_ON_AMQP_ERROR
+  def publishMany(self, mqName, bodies, persistent):
+    """ Publish a sequence of messages to the queue, waiting for the broker's
+    publisher acknowledgments once for the whole sequence instead of once per
+    message. Delivers the messages to the queue or "dies" trying. See
+    `MessageBusConnector.publish`
+
+    NOTE: provides an "at-least-once" delivery guarantee on success; on
+      retry following a transient error, all the messages are published again.
+
+    mqName: name of the existing destination message queue
+    bodies: sequence of message bodies (strings)
+    persistent: True to have the messages backed up to disk; see `publish`
+
+    raises: MessageQueueNotFound
+    """
+    if not mqName:
+      raise ValueError("Name cannot be empty or None: %r" % (mqName,))
+
+    properties = (self._PERSISTENT_PUBLISH_PROPERTIES if persistent else None)
+    messages = [amqp.messages.Message(body, properties=properties)
+                for body in bodies]
+
+    try:
+      self._channelMgr.client.publishMany(messages,
+                                          exchange="",
+                                          routingKey=mqName,
+                                          mandatory=True)
+    except amqp.exceptions.UnroutableError:
+      raise MessageQueueNotFound("Could not deliver messages to mq=%s; did "
+                                 "you delete the mq or forget to create it?"
+                                 % (mqName,))
+
+
   @_RETRY_ON_AMQP_ERROR
   def publishExg(self,
                  exchange,
@@ -366,6 +400,47 @@ class MessageBusConnector(object):
     return True
 
 
+  @_RETRY_ON_AMQP_ERROR
+  def publishExgMany(self,
+                     exchange,
+                     routingKey,
+                     bodies,
+                     properties=None,
+                     mandatory=False):
+    """ Publish a sequence of messages to an exchange with retries on transient
+    errors, waiting for the broker's publisher acknowledgments once for the
+    whole sequence instead of once per message. See
+    `MessageBusConnector.publishExg`
+
+    NOTE: on retry following a transient error, all the messages are
+      published again.
+
+    :param str exchange: Name of destination exchange; the exchange name can be
+      empty string, meaning the default exchange.
+    :param str routingKey: Routing key for the messages
+    :param bodies: sequence of message bodies (byte strings)
+    :param message_bus_connector.MessageProperties properties: message
+      properties applied to all the messages
+    :param bool mandatory: see `publishExg`
+
+    :returns: True on success, False if any of the messages couldn't be routed
+      (applies only when `mandatory` is True)
+    :rtype: bool
+    """
+    messages = [amqp.messages.Message(body, properties=properties)
+                for body in bodies]
+    try:
+      self._channelMgr.client.publishMany(
+        messages,
+        exchange=exchange,
+        routingKey=routingKey,
+        mandatory=mandatory)
+    except amqp.exceptions.UnroutableError:
+      return False
+
+    return True
+
+
   def consume(self, mqName, blocking=True):
     """ Create an instance of _QueueConsumer iterable for consuming messages.
     The iterable yields an instance of _ConsumedMessage.
@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Microbenchmark of the per-lookup cost of config settings: Config.get() and
+Config.getint() versus attribute and typed access via Config.getSnapshot().
+
+Usage:
+
+$ python -m nta.utils.tools.config_benchmark [--lookups=1000000]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+from nta.utils.config import Config
+
+
+
+_DEFAULT_NUM_LOOKUPS = 1000000
+
+_CONFIG_NAME = "benchmark.conf"
+
+_CONFIG_CONTENTS = """
+[metric_streamer]
+chunk_size = 1440
+results_exchange_name = htmengine.model.results
+
+[debugging]
+profiling = false
+"""
+
+
+
+def runBenchmark(numLookups):
+  """ Time lookups of the same settings via each access method
+
+  :param int numLookups: number of lookups per access method
+  :returns: sequence of (<access method>, <microseconds per lookup>) pairs
+  """
+  baseConfigDir = tempfile.mkdtemp()
+  try:
+    with open(os.path.join(baseConfigDir, _CONFIG_NAME), "w") as fileObj:
+      fileObj.write(_CONFIG_CONTENTS)
+
+    config = Config(_CONFIG_NAME, baseConfigDir)
+    snapshot = config.getSnapshot()
+
+    statements = (
+      ("Config.get",
+       lambda: config.get("metric_streamer", "results_exchange_name")),
+      ("Config.getint",
+       lambda: config.getint("metric_streamer", "chunk_size")),
+      ("Config.loadConfig + Config.getint",
+       lambda: (config.loadConfig(),
+                config.getint("metric_streamer", "chunk_size"))),
+      ("snapshot attribute",
+       lambda: snapshot.metric_streamer.results_exchange_name),
+      ("snapshot getint",
+       lambda: snapshot.metric_streamer.getint("chunk_size")),
+      ("Config.getSnapshot + attribute",
+       lambda: config.getSnapshot().metric_streamer.results_exchange_name),
+    )
+
+    return [
+      (label, timeit.timeit(statement, number=numLookups) * 1e6 / numLookups)
+      for label, statement in statements
+    ]
+  finally:
+    shutil.rmtree(baseConfigDir)
+
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Measures the per-lookup cost of config settings via Config "
+                "and via its snapshots.")
+
+  parser.add_argument(
+    "--lookups",
+    type=int,
+    default=_DEFAULT_NUM_LOOKUPS,
+    dest="numLookups",
+    help="Number of lookups per access method [default: %(default)s]")
+
+  options = parser.parse_args()
+
+  for label, usecPerLookup in runBenchmark(options.numLookups):
+    print "{}: {:.3f} usec/lookup".format(label, usecPerLookup)
+
+
+
+if __name__ == "__main__":
+  main()
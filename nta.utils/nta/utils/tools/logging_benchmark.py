@@ -0,0 +1,174 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Benchmark of the logging overhead per batch of a service's message processing
+when the log output is slow (e.g., a slow disk or syslog): compares the
+synchronous handlers with non-blocking output via QueueingHandler, using a
+stand-in handler that sleeps on every record.
+
+Usage:
+
+$ python -m nta.utils.tools.logging_benchmark [--batches=1000]
+    [--recordsPerBatch=3] [--sinkDelayMs=1] [--batchWorkMs=5]
+"""
+
+import argparse
+import logging
+import time
+
+from nta.utils.logging_support_raw import QueueingHandler
+
+
+
+_DEFAULT_NUM_BATCHES = 1000
+
+# E.g., the {TAG:...} timing lines of AnomalyService per batch
+_DEFAULT_RECORDS_PER_BATCH = 3
+
+_DEFAULT_SINK_DELAY_MS = 1.0
+
+_DEFAULT_BATCH_WORK_MS = 5.0
+
+_DEFAULT_QUEUE_SIZE = 10000
+
+
+
+class _SlowSinkHandler(logging.Handler):
+  """ Stand-in for a slow log output: formats each record, then sleeps """
+
+  def __init__(self, delaySec):
+    logging.Handler.__init__(self)
+    self.setFormatter(logging.Formatter(
+      "%(asctime)s - %(name)s(%(process)d) - %(levelname)s - %(message)s"))
+    self._delaySec = delaySec
+    self.numRecords = 0
+
+
+  def emit(self, record):
+    self.format(record)
+    time.sleep(self._delaySec)
+    self.numRecords += 1
+
+
+
+def runBenchmark(numBatches, recordsPerBatch, sinkDelayMs, batchWorkMs,
+                 queueSize, nonBlocking):
+  """ Simulate batch processing that logs per batch
+
+  :param int numBatches: number of batches
+  :param int recordsPerBatch: number of INFO log records per batch
+  :param float sinkDelayMs: output delay per record
+  :param float batchWorkMs: processing time per batch, excluding logging
+  :param int queueSize: queue size of the QueueingHandler
+  :param bool nonBlocking: True to log via a QueueingHandler
+  :returns: dict of results: logUsecPerBatch, numOutput, numDropped,
+    closeSec (time to output the pending records at close)
+  """
+  sink = _SlowSinkHandler(delaySec=sinkDelayMs / 1000.0)
+  if nonBlocking:
+    handler = QueueingHandler([sink], maxQueueSize=queueSize)
+  else:
+    handler = sink
+
+  logger = logging.Logger("benchmark")
+  logger.addHandler(handler)
+
+  logSec = 0
+  for batch in xrange(numBatches):
+    # Stand-in for processing the batch
+    time.sleep(batchWorkMs / 1000.0)
+
+    startTime = time.time()
+    for i in xrange(recordsPerBatch):
+      logger.info("{TAG:ANOM.BATCH.INF.DONE} batch=%d; record=%d", batch, i)
+    logSec += time.time() - startTime
+
+  startTime = time.time()
+  handler.close()
+  closeSec = time.time() - startTime
+
+  return dict(
+    logUsecPerBatch=logSec * 1e6 / numBatches,
+    numOutput=sink.numRecords,
+    numDropped=handler.numDropped if nonBlocking else 0,
+    closeSec=closeSec)
+
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Measures the logging overhead per batch with a slow log "
+                "output in blocking and non-blocking modes.")
+
+  parser.add_argument(
+    "--batches",
+    type=int,
+    default=_DEFAULT_NUM_BATCHES,
+    dest="numBatches",
+    help="Number of batches [default: %(default)s]")
+
+  parser.add_argument(
+    "--recordsPerBatch",
+    type=int,
+    default=_DEFAULT_RECORDS_PER_BATCH,
+    help="Number of log records per batch [default: %(default)s]")
+
+  parser.add_argument(
+    "--sinkDelayMs",
+    type=float,
+    default=_DEFAULT_SINK_DELAY_MS,
+    help="Output delay per log record [default: %(default)s]")
+
+  parser.add_argument(
+    "--batchWorkMs",
+    type=float,
+    default=_DEFAULT_BATCH_WORK_MS,
+    help="Processing time per batch [default: %(default)s]")
+
+  parser.add_argument(
+    "--queueSize",
+    type=int,
+    default=_DEFAULT_QUEUE_SIZE,
+    help="Non-blocking mode queue size [default: %(default)s]")
+
+  options = parser.parse_args()
+
+  for label, nonBlocking in (("blocking", False), ("nonBlocking", True)):
+    results = runBenchmark(numBatches=options.numBatches,
+                           recordsPerBatch=options.recordsPerBatch,
+                           sinkDelayMs=options.sinkDelayMs,
+                           batchWorkMs=options.batchWorkMs,
+                           queueSize=options.queueSize,
+                           nonBlocking=nonBlocking)
+
+    print ("{}: logUsecPerBatch={:.1f}; output={}; dropped={}; "
+           "closeSec={:.3f}".format(label,
+                                    results["logUsecPerBatch"],
+                                    results["numOutput"],
+                                    results["numDropped"],
+                                    results["closeSec"]))
+
+
+
+if __name__ == "__main__":
+  main()
@@ -494,5 +494,183 @@ class ConfigTest(unittest.TestCase):
 
 
 
+  def testSnapshotMatchesConfig(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      envVarName = config.Config("test.conf",
+                                 baseConfigDir)._getEnvVarOverrideName(
+        configName, "rabbit", "host")
+
+      with patch.dict(config.os.environ, values={envVarName: "rabbit-host"}):
+        c = config.Config(configName, baseConfigDir)
+        snapshot = c.getSnapshot()
+
+        self.assertItemsEqual(snapshot.sections(), c.sections())
+        for section in c.sections():
+          self.assertItemsEqual(snapshot.items(section), c.items(section))
+          for option, value in c.items(section):
+            self.assertEqual(getattr(snapshot[section], option), value)
+            self.assertEqual(snapshot.get(section, option), value)
+
+      # Environment variable overrides are applied
+      self.assertEqual(snapshot.rabbit.host, "rabbit-host")
+      self.assertEqual(snapshot.config_test_database.db, "htm-it")
+
+      # Typed access
+      self.assertEqual(snapshot.rabbit.getint("port"), 5672)
+      self.assertEqual(snapshot.getint("rabbit", "port"), 5672)
+      self.assertEqual(snapshot.getfloat("rabbit", "port"), 5672.0)
+
+
+  def testSnapshotGetBoolean(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(
+        configName,
+        "[flags]\non = on\nno = no\nbad = maybe\n") as baseConfigDir:
+      snapshot = config.Config(configName, baseConfigDir).getSnapshot()
+
+      self.assertIs(snapshot.flags.getboolean("on"), True)
+      self.assertIs(snapshot.getboolean("flags", "no"), False)
+
+      with self.assertRaises(ValueError):
+        snapshot.flags.getboolean("bad")
+
+
+  def testSnapshotMissingSectionAndOption(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      snapshot = config.Config(configName, baseConfigDir).getSnapshot()
+
+      self.assertFalse(snapshot.has_section("no_such_section"))
+      self.assertFalse(snapshot.has_option("rabbit", "no_such_option"))
+      self.assertTrue(snapshot.has_option("rabbit", "host"))
+
+      with self.assertRaises(AttributeError):
+        snapshot.no_such_section
+
+      with self.assertRaises(ConfigParser.NoSectionError):
+        snapshot.get("no_such_section", "host")
+
+      with self.assertRaises(AttributeError):
+        snapshot.rabbit.no_such_option
+
+      with self.assertRaises(ConfigParser.NoOptionError):
+        snapshot.getint("rabbit", "no_such_option")
+
+
+  def testSnapshotIsImmutable(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      snapshot = config.Config(configName, baseConfigDir).getSnapshot()
+
+      with self.assertRaises(AttributeError):
+        snapshot.rabbit = None
+
+      with self.assertRaises(AttributeError):
+        snapshot.rabbit.host = "other-host"
+
+      with self.assertRaises(AttributeError):
+        del snapshot.rabbit.host
+
+      self.assertEqual(snapshot.rabbit.host, "localhost")
+
+
+  def testSnapshotIsRetakenAfterConfigChanges(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      c = config.Config(configName, baseConfigDir)
+      snapshot = c.getSnapshot()
+
+      self.assertIs(c.getSnapshot(), snapshot)
+
+      c.set("rabbit", "host", "new_host")
+      newSnapshot = c.getSnapshot()
+
+      self.assertIsNot(newSnapshot, snapshot)
+      self.assertEqual(newSnapshot.rabbit.host, "new_host")
+      self.assertEqual(snapshot.rabbit.host, "localhost")
+
+
+  @patch.object(config.time, "time", autospec=True)
+  def testGetSnapshotThrottlesOverrideConfigChecks(self, timeMock):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      timeMock.return_value = 1000
+      c1 = config.Config(configName, baseConfigDir)
+      snapshot = c1.getSnapshot()
+      self.assertEqual(snapshot.rabbit.host, "localhost")
+
+      c2 = config.Config(configName,
+                         baseConfigDir,
+                         mode=config.Config.MODE_OVERRIDE_ONLY)
+      c2.add_section("rabbit")
+      c2.set("rabbit", "host", "new_host")
+      c2.save()
+      del c2
+
+      # The override config isn't checked again within the check interval
+      timeMock.return_value = (
+        1000 + config.Config.SNAPSHOT_RELOAD_CHECK_INTERVAL_SEC - 0.01)
+      self.assertIs(c1.getSnapshot(), snapshot)
+
+      # ... unless asked to
+      self.assertEqual(c1.getSnapshot(reloadCheckIntervalSec=0).rabbit.host,
+                       "new_host")
+
+
+  @patch.object(config.time, "time", autospec=True)
+  def testGetSnapshotReloadsChangedOverrideConfig(self, timeMock):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      timeMock.return_value = 1000
+      c1 = config.Config(configName, baseConfigDir)
+      snapshot = c1.getSnapshot()
+
+      c2 = config.Config(configName,
+                         baseConfigDir,
+                         mode=config.Config.MODE_OVERRIDE_ONLY)
+      c2.add_section("rabbit")
+      c2.set("rabbit", "host", "new_host")
+      c2.save()
+      del c2
+
+      timeMock.return_value = (
+        1000 + config.Config.SNAPSHOT_RELOAD_CHECK_INTERVAL_SEC)
+      newSnapshot = c1.getSnapshot()
+
+      self.assertIsNot(newSnapshot, snapshot)
+      self.assertEqual(newSnapshot.rabbit.host, "new_host")
+      self.assertEqual(newSnapshot.rabbit.port, "5672")
+
+      # Unchanged since
+      self.assertIs(c1.getSnapshot(reloadCheckIntervalSec=0), newSnapshot)
+
+
+  def testReloadSnapshotResolvesEnvVarOverrides(self):
+    configName = "test.conf"
+    with self._redirectConfigBase(configName,
+                                  _SAMPLE_CONF_CONTENTS) as baseConfigDir:
+      c = config.Config(configName, baseConfigDir)
+      snapshot = c.getSnapshot()
+
+      envVarName = c._getEnvVarOverrideName(configName, "rabbit", "host")
+
+      with patch.dict(config.os.environ, values={envVarName: "rabbit-host"}):
+        # Environment variable overrides are resolved when the snapshot is
+        # taken
+        self.assertIs(c.getSnapshot(reloadCheckIntervalSec=0), snapshot)
+
+        newSnapshot = c.reloadSnapshot()
+
+      self.assertEqual(newSnapshot.rabbit.host, "rabbit-host")
+      self.assertEqual(snapshot.rabbit.host, "localhost")
+
+
 if __name__ == '__main__':
   unittest.main()
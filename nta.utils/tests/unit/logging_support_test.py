@@ -30,6 +30,8 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 import unittest
 
 from mock import patch
@@ -195,3 +197,170 @@ class LoggingSupportTest(unittest.TestCase):
                                                     appName + ".log")),
                        tempLS.getApplicationLogFilePath())
     self.assertIn(appName, ["py", "run_tests"])
+
+
+
+class _ListHandler(logging.Handler):
+  """ Collects the records that it handles; may be made to block on output """
+
+  def __init__(self, level=logging.NOTSET):
+    logging.Handler.__init__(self, level=level)
+    self.records = []
+    self.unblocked = threading.Event()
+    self.unblocked.set()
+    self.closed = False
+
+
+  def emit(self, record):
+    self.unblocked.wait()
+    self.records.append(record)
+
+
+  def close(self):
+    self.closed = True
+    logging.Handler.close(self)
+
+
+
+class QueueingHandlerTest(unittest.TestCase):
+  """ Unit tests for the non-blocking logging handler """
+
+  @staticmethod
+  def _createLogger(handler):
+    logger = logging.Logger("queueing_handler_test")
+    logger.addHandler(handler)
+    return logger
+
+
+  def testRecordsAreOutputInOrderPerTargetLevel(self):
+    infoTarget = _ListHandler(level=logging.INFO)
+    warningTarget = _ListHandler(level=logging.WARNING)
+    handler = logging_support_raw.QueueingHandler([infoTarget, warningTarget])
+    self.addCleanup(handler.close)
+
+    logger = self._createLogger(handler)
+    logger.debug("debug")
+    for i in xrange(100):
+      logger.info("info %d", i)
+    logger.warning("warning")
+
+    handler.flush()
+
+    self.assertEqual([record.getMessage() for record in infoTarget.records],
+                     ["info %d" % (i,) for i in xrange(100)] + ["warning"])
+    self.assertEqual([record.getMessage() for record in warningTarget.records],
+                     ["warning"])
+    self.assertEqual(handler.numDropped, 0)
+
+
+  def testRecordsAreDetachedFromCallerState(self):
+    target = _ListHandler()
+    handler = logging_support_raw.QueueingHandler([target])
+    self.addCleanup(handler.close)
+
+    logger = self._createLogger(handler)
+
+    target.unblocked.clear()
+    args = ["before"]
+    logger.info("args=%s", args)
+    args[0] = "after"
+
+    try:
+      raise ValueError("failure")
+    except ValueError:
+      logger.exception("exception")
+
+    target.unblocked.set()
+    handler.flush()
+
+    self.assertEqual(target.records[0].getMessage(), "args=['before']")
+    self.assertIsNone(target.records[1].exc_info)
+    self.assertIn("ValueError: failure",
+                  logging.Formatter().format(target.records[1]))
+
+
+  def testOverflowDropsAndCountsRecords(self):
+    target = _ListHandler()
+    handler = logging_support_raw.QueueingHandler([target], maxQueueSize=5)
+    self.addCleanup(handler.close)
+
+    logger = self._createLogger(handler)
+
+    # Block output of the first record, then overflow the queue
+    target.unblocked.clear()
+    logger.info("first")
+    while not handler._queue.empty():
+      time.sleep(0.001)
+
+    for i in xrange(10):
+      logger.info("queued %d", i)
+
+    self.assertEqual(handler.numDropped, 5)
+
+    target.unblocked.set()
+    handler.flush()
+
+    self.assertEqual(
+      [record.getMessage() for record in target.records],
+      ["first"] + ["queued %d" % (i,) for i in xrange(5)] +
+      ["Dropped 5 log records because the logging queue was full"])
+    self.assertEqual(target.records[-1].levelno, logging.WARNING)
+
+
+  def testCloseOutputsPendingRecords(self):
+    target = _ListHandler()
+    handler = logging_support_raw.QueueingHandler([target])
+
+    logger = self._createLogger(handler)
+
+    target.unblocked.clear()
+    for i in xrange(10):
+      logger.info("pending %d", i)
+
+    threading.Timer(0.1, target.unblocked.set).start()
+    handler.close()
+
+    self.assertEqual([record.getMessage() for record in target.records],
+                     ["pending %d" % (i,) for i in xrange(10)])
+    self.assertTrue(target.closed)
+    self.assertFalse(handler._thread.is_alive())
+
+    # Records are output directly after close
+    logger.info("after close")
+    self.assertEqual(target.records[-1].getMessage(), "after close")
+
+
+  @patch("logging.config.fileConfig", autospec=True)
+  def testInitLoggingNonBlocking(self, fileConfigMock):
+    target = _ListHandler()
+    rootLogger = logging.getLogger()
+
+    # Restore the root logger's handlers
+    self.addCleanup(setattr, rootLogger, "handlers", rootLogger.handlers[:])
+
+    fileConfigMock.side_effect = (
+      lambda *args, **kwargs: setattr(rootLogger, "handlers", [target]))
+
+    LS.initService(nonBlocking=True)
+
+    self.assertEqual(len(rootLogger.handlers), 1)
+    handler = rootLogger.handlers[0]
+    self.assertIsInstance(handler, logging_support_raw.QueueingHandler)
+    self.assertEqual(handler.targetHandlers, (target,))
+
+    # Reinitializing stops the previous handler's background thread
+    with patch.dict(logging_support_raw.os.environ,
+                    values={logging_support_raw._NON_BLOCKING_ENV_VAR: "0"}):
+      LS.initService()
+
+    self.assertFalse(handler._thread.is_alive())
+    self.assertEqual(rootLogger.handlers, [target])
+
+    # Non-blocking mode may be enabled via the environment
+    with patch.dict(logging_support_raw.os.environ,
+                    values={logging_support_raw._NON_BLOCKING_ENV_VAR: "1"}):
+      LS.initService()
+
+    self.assertIsInstance(rootLogger.handlers[0],
+                          logging_support_raw.QueueingHandler)
+    rootLogger.handlers[0].close()
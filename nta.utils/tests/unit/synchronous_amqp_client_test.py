@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Unit tests for nta.utils.amqp.synchronous_amqp_client
+"""
+
+# Suppress pylint warnings concerning access to protected member
+# pylint: disable=W0212
+
+import socket
+import unittest
+
+from mock import Mock, patch
+
+from nta.utils.amqp import synchronous_amqp_client
+from nta.utils.amqp.synchronous_amqp_client import SynchronousAmqpClient
+from nta.utils.logging_support_raw import LoggingSupport
+
+
+
+def setUpModule():
+  LoggingSupport.initTestApp()
+
+
+
+@patch.object(synchronous_amqp_client, "RabbitConnection", autospec=True)
+class SynchronousAmqpClientPollEventsTest(unittest.TestCase):
+  """ Unit tests for SynchronousAmqpClient.pollEvents """
+
+  @staticmethod
+  def _createClient():
+    client = SynchronousAmqpClient()
+    client._channelContextInstance = synchronous_amqp_client._ChannelContext(
+      Mock())
+    return client
+
+
+  def testPollEventsReadsFramesWhenSocketIsReadable(self, _connectionClass):
+    client = self._createClient()
+
+    readSock, writeSock = socket.socketpair()
+    self.addCleanup(readSock.close)
+    self.addCleanup(writeSock.close)
+
+    client._connection.transport = Mock(_sock=readSock)
+
+    # Nothing to read yet
+    self.assertFalse(client.pollEvents())
+    self.assertFalse(client._connection.read_frames.called)
+
+    writeSock.sendall("x")
+
+    message = Mock()
+    client._connection.read_frames.side_effect = (
+      lambda: client._channelContextInstance.pendingEvents.append(message))
+
+    self.assertTrue(client.pollEvents())
+    self.assertEqual(client._connection.read_frames.call_count, 1)
+    self.assertIs(client.getNextEvent(), message)
+
+
+  def testPollEventsWithDisconnectedTransport(self, _connectionClass):
+    client = self._createClient()
+
+    client._connection.transport = Mock(_sock=None)
+
+    self.assertFalse(client.pollEvents())
+    self.assertFalse(client._connection.read_frames.called)
+
+
+  def testPollEventsFailsWithoutTransportSocket(self, _connectionClass):
+    client = self._createClient()
+
+    # E.g., a haigha version that keeps its socket elsewhere
+    client._connection.transport = Mock(spec_set=["read", "write"])
+
+    with patch.object(synchronous_amqp_client, "g_log",
+                      autospec=True) as logMock:
+      with self.assertRaises(AttributeError):
+        client.pollEvents()
+
+    self.assertEqual(logMock.error.call_count, 1)
+    self.assertFalse(client._connection.read_frames.called)
+
+
+
+class PubackStateTest(unittest.TestCase):
+  """ Unit tests for _PubackState """
+
+  def testSingleMessage(self):
+    pubackState = synchronous_amqp_client._PubackState()
+    self.assertFalse(pubackState.ready)
+
+    pubackState.handleAck(1)
+
+    self.assertTrue(pubackState.ready)
+    self.assertEqual(pubackState.values,
+                     [(synchronous_amqp_client._PubackState.ACK, 1)])
+
+
+  def testMultipleMessages(self):
+    pubackState = synchronous_amqp_client._PubackState(numExpected=3)
+
+    pubackState.handleAck(1)
+    self.assertFalse(pubackState.ready)
+
+    # haigha calls the nack listener with the delivery tag and requeue flag
+    with patch.object(synchronous_amqp_client, "g_log", autospec=True):
+      pubackState.handleNack(2, False)
+    self.assertFalse(pubackState.ready)
+
+    pubackState.handleAck(3)
+    self.assertTrue(pubackState.ready)
+
+    self.assertEqual(pubackState.values,
+                     [(synchronous_amqp_client._PubackState.ACK, 1),
+                      (synchronous_amqp_client._PubackState.NACK, 2),
+                      (synchronous_amqp_client._PubackState.ACK, 3)])
+
+
+  def testUnexpectedAckFails(self):
+    pubackState = synchronous_amqp_client._PubackState(numExpected=1)
+    pubackState.handleAck(1)
+
+    with self.assertRaises(AssertionError):
+      pubackState.handleAck(2)
+
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -34,6 +34,7 @@ import htmengine.repository
 from htmengine.repository import (addMetric,
                                   addMetricData,
                                   deleteMetric,
+                                  deleteMetricDataRows,
                                   deleteModel,
                                   getCustomMetricByName,
                                   getCustomMetrics,
@@ -48,16 +49,22 @@ from htmengine.repository import (addMetric,
                                   getMetricCountForServer,
                                   getMetricData,
                                   getMetricDataCount,
+                                  getMetricDataStats,
+                                  getMetricDataWithSharedLock,
                                   getProcessedMetricDataCount,
                                   getMetricDataWithRawAnomalyScoresTail,
                                   getMetricIdsSortedByDisplayValue,
                                   getMetricStats,
                                   getUnprocessedModelDataCount,
+                                  insertMetricData,
                                   listMetricIDsForInstance,
+                                  refreshMetricDataStats,
+                                  reserveMetricRowids,
                                   saveMetricInstanceStatus,
                                   setMetricCollectorError,
                                   setMetricLastTimestamp,
                                   setMetricStatus,
+                                  subtractFromMetricDataStats,
                                   updateMetricColumns,
                                   updateMetricColumnsForRefStatus,
                                   updateMetricDataColumns,
@@ -0,0 +1,116 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Range-partition metric_data table by timestamp, so that old rows may be
+purged by dropping partitions (see htmengine.runtime.metric_garbage_collector
+--mode=partitions).
+
+MySQL doesn't support foreign keys on partitioned tables, and requires every
+unique key to include the partitioning column, so this drops
+metric_data_to_metric_fk (htmengine.repository.deleteMetric deletes the
+metric's data rows explicitly) and adds timestamp to the primary key.
+
+The existing rows are spread over partitions of _INTERVAL_DAYS each (up to
+_MAX_INITIAL_PARTITIONS, the oldest of which also holds any older rows), the
+last of which extends through the next _INTERVAL_DAYS, so that the garbage
+collector may drop expired rows right away; it creates subsequent partitions
+ahead of time by splitting the catch-all p_future partition.
+
+Revision ID: 3f3c2b9ad1e4
+Revises: 2695f59d78bd
+Create Date: 2016-09-12 11:02:47.310417
+"""
+
+import datetime
+
+from alembic import context, op
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '3f3c2b9ad1e4'
+down_revision = '2695f59d78bd'
+
+
+# Initial partition interval; must match the garbage collector's
+# --partition-interval-days
+_INTERVAL_DAYS = 7
+
+# Max number of partitions for the existing rows (about two years' worth)
+_MAX_INITIAL_PARTITIONS = 104
+
+
+
+def upgrade():
+    """ Partition metric_data table by TO_DAYS(timestamp) """
+    op.drop_constraint("metric_data_to_metric_fk", "metric_data",
+                       type_="foreignkey")
+
+    op.execute("ALTER TABLE metric_data "
+               "DROP PRIMARY KEY, ADD PRIMARY KEY (uid, rowid, timestamp)")
+
+    if context.is_offline_mode():
+        oldestTimestamp = None
+    else:
+        oldestTimestamp = op.get_bind().execute(
+            "SELECT MIN(timestamp) FROM metric_data").scalar()
+
+    bounds = _getInitialPartitionBounds(
+        today=datetime.datetime.utcnow().date(),
+        oldestDate=(oldestTimestamp.date() if oldestTimestamp is not None
+                    else None))
+
+    partitions = "".join(
+        "PARTITION p{name} VALUES LESS THAN (TO_DAYS('{bound}')), ".format(
+            name=bound.strftime("%Y%m%d"), bound=bound.isoformat())
+        for bound in bounds)
+
+    op.execute(
+        "ALTER TABLE metric_data "
+        "PARTITION BY RANGE (TO_DAYS(timestamp)) ("
+        "{partitions}"
+        "PARTITION p_future VALUES LESS THAN MAXVALUE)".format(
+            partitions=partitions))
+
+
+
+def _getInitialPartitionBounds(today, oldestDate):
+    """ Compute exclusive upper bounds of the partitions for the existing rows,
+    _INTERVAL_DAYS apart, with the last one _INTERVAL_DAYS after today
+
+    :param datetime.date today:
+    :param oldestDate: date of the oldest existing row; None if there are none
+    :returns: ascending list of datetime.date bounds
+    """
+    interval = datetime.timedelta(days=_INTERVAL_DAYS)
+
+    bounds = [today + interval]
+
+    while (oldestDate is not None and
+           len(bounds) < _MAX_INITIAL_PARTITIONS and
+           bounds[0] - interval > oldestDate):
+        bounds.insert(0, bounds[0] - interval)
+
+    return bounds
+
+
+
+def downgrade():
+    raise NotImplementedError("Rollback is not supported.")
@@ -0,0 +1,80 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Adds metric_data_stats table with running statistics of each metric's
+metric_data rows (see htmengine.repository.queries.getMetricDataStats), and
+backfills it from the existing metric_data rows.
+
+Revision ID: 7b1d4e9c2a53
+Revises: 3f3c2b9ad1e4
+Create Date: 2016-10-18 10:21:37.402816
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '7b1d4e9c2a53'
+down_revision = '3f3c2b9ad1e4'
+
+
+# Populates metric_data_stats from the existing metric_data rows; metrics
+# without data get num_rows=0 and NULL statistics
+_BACKFILL_SQL = (
+    "INSERT INTO metric_data_stats "
+    "(uid, num_rows, min_value, max_value, value_sum, value_sum_squares, "
+    "first_timestamp, last_timestamp) "
+    "SELECT metric.uid, COUNT(metric_data.uid), "
+    "MIN(metric_data.metric_value), MAX(metric_data.metric_value), "
+    "SUM(metric_data.metric_value), "
+    "SUM(metric_data.metric_value * metric_data.metric_value), "
+    "MIN(metric_data.timestamp), MAX(metric_data.timestamp) "
+    "FROM metric LEFT JOIN metric_data ON metric_data.uid = metric.uid "
+    "GROUP BY metric.uid")
+
+
+
+def upgrade():
+    """ Creates metric_data_stats table and populates it for all metrics """
+    op.create_table('metric_data_stats',
+        sa.Column('uid', sa.VARCHAR(length=40), nullable=False),
+        sa.Column('num_rows', sa.INTEGER(), server_default='0',
+                  autoincrement=False, nullable=False),
+        sa.Column('min_value', mysql.DOUBLE(), nullable=True),
+        sa.Column('max_value', mysql.DOUBLE(), nullable=True),
+        sa.Column('value_sum', mysql.DOUBLE(), nullable=True),
+        sa.Column('value_sum_squares', mysql.DOUBLE(), nullable=True),
+        sa.Column('first_timestamp', sa.DATETIME(), nullable=True),
+        sa.Column('last_timestamp', sa.DATETIME(), nullable=True),
+        sa.ForeignKeyConstraint(['uid'], [u'metric.uid'],
+                                name='metric_data_stats_to_metric_fk',
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('uid')
+    )
+
+    op.execute(_BACKFILL_SQL)
+
+
+
+def downgrade():
+    raise NotImplementedError("Rollback is not supported.")
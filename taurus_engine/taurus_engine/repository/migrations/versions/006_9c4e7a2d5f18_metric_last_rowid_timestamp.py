@@ -0,0 +1,59 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Adds last_rowid_timestamp column to metric table with the timestamp of the
+metric_data row at the metric's last_rowid (see
+htmengine.repository.queries.reserveMetricRowids), and backfills it from the
+existing metric_data rows.
+
+Revision ID: 9c4e7a2d5f18
+Revises: 7b1d4e9c2a53
+Create Date: 2016-10-19 09:12:44.518203
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Revision identifiers, used by Alembic. Do not change.
+revision = '9c4e7a2d5f18'
+down_revision = '7b1d4e9c2a53'
+
+
+# Populates last_rowid_timestamp of metrics whose last_rowid row exists
+_BACKFILL_SQL = (
+    "UPDATE metric JOIN metric_data "
+    "ON metric_data.uid = metric.uid AND metric_data.rowid = metric.last_rowid "
+    "SET metric.last_rowid_timestamp = metric_data.timestamp")
+
+
+
+def upgrade():
+    """ Adds column 'last_rowid_timestamp' to metric table and populates it """
+    op.add_column('metric', sa.Column('last_rowid_timestamp', sa.DATETIME(),
+                                      nullable=True))
+
+    op.execute(_BACKFILL_SQL)
+
+
+
+def downgrade():
+    raise NotImplementedError("Rollback is not supported.")
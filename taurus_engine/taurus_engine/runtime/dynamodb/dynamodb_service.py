@@ -27,11 +27,16 @@ fanout exchanges and forwards data to dynamodb for consumption by mobile
 client.
 """
 
+from collections import deque, namedtuple
+import copy
 from datetime import datetime, timedelta
-from decimal import Context, Underflow, Clamped, Overflow
+from decimal import Context, Decimal, Underflow, Clamped, Overflow
 import json
 import os
+import Queue
 import sys
+import threading
+import time
 
 import boto.dynamodb2
 from boto.dynamodb2.exceptions import (
@@ -133,6 +138,337 @@ def convertInferenceResultRowToMetricDataItem(metricId, row):
 
 
 
+def _getHourlyMaxAnomalyScores(rows):
+  """ Aggregate max anomaly likelihood scores of model inference result rows by
+  hour
+
+  :param rows: model inference result rows per "results" property of
+    htmengine/runtime/json_schema/model_inference_results_msg_schema.json
+  :type rows: Sequence of dicts
+  :returns: dict mapping hour (naive UTC datetime truncated to the hour) to the
+    max anomaly likelihood score of the rows in that hour
+  """
+  hourToMaxScore = {}
+  for row in rows:
+    # row.timestamp is a datetime instance
+    ts = datetime.utcfromtimestamp(row["ts"]).replace(minute=0,
+                                                      second=0,
+                                                      microsecond=0)
+    # Store the max anomaly likelihood for the period
+    hourToMaxScore[ts] = max(hourToMaxScore.get(ts, 0.0),
+                             row["anomaly"])
+  return hourToMaxScore
+
+
+
+def _makeInstanceDataHourlyItem(instanceName, ts, scores):
+  """ Create an `instance_data_hourly` item in DynamoDB wire format
+
+  :param str instanceName: name of the instance
+  :param datetime ts: hour of the item
+  :param dict scores: mapping of metric type to max anomaly score as Decimal
+  :returns: item suitable for `DynamoDBConnection.put_item()`
+  :rtype: dict
+  """
+  data = {
+      "instance_id": {"S": instanceName},
+      "date_hour": {"S": ts.strftime("%Y-%m-%dT%H")},
+      "date": {"S": ts.strftime("%Y-%m-%d")},
+      "hour": {"S": ts.strftime("%H")},
+      "anomaly_score": {"M": dict((metricType, {"N": str(score)})
+                                  for metricType, score in scores.iteritems())},
+  }
+  # Validate the data fields against the schema
+  InstanceDataHourlyDynamoDBDefinition().Item(**data)
+
+  return data
+
+
+
+class InstanceDataHourlyBuffer(object):
+  """ Coalesces max anomaly scores destined for the `instance_data_hourly`
+  table across model inference result batches, so that they may be written
+  with as few DynamoDB calls as possible (see
+  `DynamoDBService.flushInstanceDataHourly()`).
+  """
+
+  def __init__(self):
+    # Mapping of (instanceName, hour) to {metricType: max anomaly score}
+    self._scores = dict()
+
+    # time.time() when the first score was added since the last drain(); None
+    # if empty
+    self.startTime = None
+
+
+  def __len__(self):
+    return len(self._scores)
+
+
+  def add(self, instanceName, metricType, rows):
+    """ Merge scores from the given model inference results, keeping the max
+    score per instance, hour and metric type
+
+    :param str instanceName: name of the instance
+    :param str metricType: the metric type identifier
+    :param rows: model inference result rows per "results" property of
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json
+    :type rows: Sequence of dicts
+    """
+    if self.startTime is None:
+      self.startTime = time.time()
+
+    for ts, score in _getHourlyMaxAnomalyScores(rows).iteritems():
+      metricScores = self._scores.setdefault((instanceName, ts), {})
+      metricScores[metricType] = max(metricScores.get(metricType, 0.0), score)
+
+
+  def drain(self):
+    """ Remove and return the coalesced scores
+
+    :returns: dict mapping (instanceName, hour) to {metricType: max score}
+    """
+    scores = self._scores
+    self._scores = dict()
+    self.startTime = None
+    return scores
+
+
+
+# Kinds of messages consumed from the dynamodb queue; see
+# DynamoDBService._getMessageKind()
+_MESSAGE_KIND_MODEL_INFERENCE_RESULTS = "model-inference-results"
+_MESSAGE_KIND_MODEL_COMMAND_RESULT = "model-cmd-result"
+_MESSAGE_KIND_TWEETS = "tweets"
+
+
+
+# Validated model inference results batch that is ready to be published; see
+# DynamoDBService._prepareModelInferenceResults()
+_ModelInferenceResultsBatch = namedtuple(
+  "_ModelInferenceResultsBatch", "metricId instanceName metricType rows")
+
+
+
+class _PublishingPipeline(object):
+  """ Publishes messages from the dynamodb queue to DynamoDB on a pool of
+  worker threads, while the consumer thread keeps reading messages and acks
+  them in delivery order as they complete.
+
+  Model inference results are assigned to workers by instance name, so that
+  results of any given metric are published in the order received and each
+  worker coalesces the `instance_data_hourly` scores of its own instances.
+  Tweets are spread over the workers round-robin. All other messages (e.g.,
+  model command results that purge deleted metrics) are barriers: they are
+  handled on the consumer thread after all prior messages complete.
+
+  The number of messages in flight is bounded by the channel's prefetch count.
+
+  Each worker publishes via its own copy of the service with its own DynamoDB
+  connection (see `DynamoDBService._copyForPublisherThread()`), since boto
+  connections aren't thread-safe.
+
+  NOTE: only the consumer thread may use the AMQP client, including acks.
+  """
+
+  # Signals a worker thread to stop
+  _STOP = object()
+
+
+  def __init__(self, service, numWorkers, coalesceWindowSec):
+    """
+    :param DynamoDBService service:
+    :param int numWorkers: number of worker threads
+    :param float coalesceWindowSec: max seconds that a worker coalesces
+      `instance_data_hourly` scores before writing them
+    """
+    self._service = service
+    self._coalesceWindowSec = coalesceWindowSec
+
+    # Delivered, unacked messages in delivery order, each as [message, done]
+    self._inFlight = deque()
+
+    # Guards _inFlight and _workerError; notified on completions and errors
+    self._cond = threading.Condition()
+
+    # sys.exc_info() of the first failed worker
+    self._workerError = None
+
+    self._nextTweetsWorker = 0
+
+    self._workQueues = []
+    self._workers = []
+    for i in xrange(numWorkers):
+      workQueue = Queue.Queue()
+      worker = threading.Thread(target=self._runWorker,
+                                args=(workQueue,),
+                                name="%s-%d" % (self.__class__.__name__, i))
+      worker.setDaemon(True)
+      worker.start()
+
+      self._workQueues.append(workQueue)
+      self._workers.append(worker)
+
+
+  @property
+  def numInFlight(self):
+    """ Number of delivered messages that haven't been acked yet """
+    return len(self._inFlight)
+
+
+  def submit(self, message):
+    """ Dispatch a message for publishing; called on the consumer thread.
+
+    :param amqp.messages.ConsumerMessage message:
+    """
+    self._raiseIfWorkerFailed()
+
+    kind = self._service._getMessageKind(message)
+
+    if kind == _MESSAGE_KIND_MODEL_INFERENCE_RESULTS:
+      if self._service._isModelInferenceResultsSkippable(message):
+        batch = None
+      else:
+        batch = self._service._prepareModelInferenceResults(message.body)
+      entry = self._addInFlight(message, done=batch is None)
+      if batch is not None:
+        self._workQueues[
+          hash(batch.instanceName) % len(self._workQueues)].put((entry, batch))
+
+    elif kind == _MESSAGE_KIND_TWEETS:
+      entry = self._addInFlight(message, done=False)
+      self._workQueues[self._nextTweetsWorker].put((entry, message.body))
+      self._nextTweetsWorker = ((self._nextTweetsWorker + 1) %
+                                len(self._workQueues))
+
+    else:
+      # Barrier
+      self.drain()
+      self._service._handleMessageOfKind(message, kind)
+      message.ack()
+
+
+  def ackCompleted(self):
+    """ Ack the completed messages that precede the oldest incomplete one;
+    called on the consumer thread.
+    """
+    lastCompleted = None
+    with self._cond:
+      while self._inFlight and self._inFlight[0][1]:
+        lastCompleted = self._inFlight.popleft()[0]
+
+    if lastCompleted is not None:
+      lastCompleted.ack(multiple=True)
+
+
+  def waitForProgress(self, timeout=None):
+    """ Block until a message in flight completes, unless the oldest one is
+    already complete, then ack completed messages; called on the consumer
+    thread.
+
+    :param timeout: max seconds to wait; None to wait indefinitely
+    :raises: exception of a failed worker thread
+    """
+    with self._cond:
+      if (self._inFlight and not self._inFlight[0][1] and
+          self._workerError is None):
+        self._cond.wait(timeout)
+
+    self._raiseIfWorkerFailed()
+    self.ackCompleted()
+
+
+  def drain(self):
+    """ Block until all messages in flight are completed and acked; called on
+    the consumer thread.
+    """
+    while self._inFlight:
+      self.waitForProgress()
+
+
+  def stop(self):
+    """ Stop worker threads without waiting for messages in flight. Unacked
+    messages will be redelivered by the broker.
+    """
+    for workQueue in self._workQueues:
+      workQueue.put(self._STOP)
+
+    for worker in self._workers:
+      worker.join()
+
+
+  def _addInFlight(self, message, done):
+    entry = [message, done]
+    with self._cond:
+      self._inFlight.append(entry)
+    return entry
+
+
+  def _complete(self, entries):
+    with self._cond:
+      for entry in entries:
+        entry[1] = True
+      self._cond.notify()
+
+
+  def _raiseIfWorkerFailed(self):
+    if self._workerError is not None:
+      raise self._workerError[0], self._workerError[1], self._workerError[2]
+
+
+  def _runWorker(self, workQueue):
+    """ Worker thread: publishes work items in order, coalescing
+    `instance_data_hourly` scores until the work queue runs dry or the
+    coalescing window elapses.
+    """
+    buf = InstanceDataHourlyBuffer()
+
+    # In-flight entries whose scores are in buf
+    awaitingFlush = []
+
+    try:
+      publisher = self._service._copyForPublisherThread()
+
+      while True:
+        if buf:
+          try:
+            task = workQueue.get(
+              timeout=max(0, (buf.startTime + self._coalesceWindowSec -
+                              time.time())))
+          except Queue.Empty:
+            task = None
+        else:
+          task = workQueue.get()
+
+        if task is self._STOP:
+          return
+
+        if task is not None:
+          entry, payload = task
+          if isinstance(payload, _ModelInferenceResultsBatch):
+            publisher._publishModelInferenceResults(payload, buf)
+            awaitingFlush.append(entry)
+          else:
+            publisher._handleNonMetricTweetData(payload)
+            self._complete([entry])
+
+        if buf and (workQueue.empty() or
+                    time.time() - buf.startTime >= self._coalesceWindowSec):
+          publisher._writeInstanceDataHourly(
+            buf.drain(), numMessages=len(awaitingFlush))
+
+        if awaitingFlush and not buf:
+          self._complete(awaitingFlush)
+          awaitingFlush = []
+    except Exception:
+      g_log.exception("DynamoDB publisher thread failed")
+      with self._cond:
+        if self._workerError is None:
+          self._workerError = sys.exc_info()
+        self._cond.notify()
+
+
+
 class DynamoDBService(object):
   """ Binds a "dynamodb" queue to:
       - The model results fanout exchange defined in the
@@ -147,6 +483,20 @@ class DynamoDBService(object):
 
   _INPUT_QUEUE_NAME = "dynamodb"
 
+  # Max number of keys per DynamoDB BatchGetItem request
+  _MAX_BATCH_GET_ITEM_KEYS = 100
+
+  # userInfo keys that a metric must have for its data to be published
+  _REQUIRED_USER_INFO_KEYS = frozenset(["metricType", "metricTypeName",
+                                        "symbol"])
+
+  # Interval between reports of model inference results skipped by headers
+  _SKIPPED_RESULTS_LOG_INTERVAL_SEC = 60
+
+  # Max seconds that the consumer thread waits for publisher completions before
+  # polling for more deliveries
+  _DELIVERY_POLL_INTERVAL_SEC = 0.05
+
 
   def __init__(self):
     self._modelResultsExchange = (
@@ -161,6 +511,28 @@ class DynamoDBService(object):
     self._metric_tweets = None
     self.createDynamoDBSchema()
 
+    # instance_data_hourly updates are coalesced across messages for up to
+    # _coalesceWindowSec or until _maxUnackedMessages (matching the channel's
+    # prefetch count) messages await their acks; see messageHandler
+    self._instanceDataHourlyBuffer = InstanceDataHourlyBuffer()
+    self._coalesceWindowSec = taurus_engine.config.getfloat(
+      "dynamodb", "instance_data_hourly_coalesce_window_sec")
+    self._maxUnackedMessages = taurus_engine.config.getint("dynamodb",
+                                                           "prefetch_count")
+    self._unackedMessages = []
+
+    # Number of _PublishingPipeline worker threads used by run(); 0 publishes
+    # on the consumer thread
+    self._numPublisherThreads = taurus_engine.config.getint(
+      "dynamodb", "num_publisher_threads")
+
+    # Model inference results skipped by headers since the last report; see
+    # _isModelInferenceResultsSkippable
+    self._numSkippedStaleResults = 0
+    self._numSkippedIneligibleResults = 0
+    self._numSkippedResultsBytes = 0
+    self._lastSkippedResultsLogTime = time.time()
+
 
   def _gracefulCreateTable(self, definition):
     """ Create dynamodb table.  Return pre-existing table if `table_name`
@@ -200,6 +572,26 @@ class DynamoDBService(object):
         InstanceDataHourlyDynamoDBDefinition())
 
 
+  def _copyForPublisherThread(self):
+    """ Copy the service for a `_PublishingPipeline` worker thread, with its own
+    DynamoDB connection and table objects; boto connections aren't
+    thread-safe.
+
+    NOTE: the copy shares all other state with this service, so worker threads
+    may only use its publishing methods, which don't modify that state.
+
+    :rtype: DynamoDBService
+    """
+    publisher = copy.copy(self)
+    publisher.dynamodb = self.connectDynamoDB()
+    for attr in ("_metric", "_metric_data", "_metric_tweets",
+                 "_instance_data_hourly"):
+      setattr(publisher, attr, Table(getattr(self, attr).table_name,
+                                     connection=publisher.dynamodb))
+
+    return publisher
+
+
   @staticmethod
   def connectDynamoDB():
     """ Get DynamoDB connection using Taurus config for credentials
@@ -296,105 +688,278 @@ class DynamoDBService(object):
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json
     :type rows: Sequence of dicts
     """
-    hourToMaxScore = {}
-    for row in rows:
-      # row.timestamp is a datetime instance
-      ts = datetime.utcfromtimestamp(row["ts"]).replace(minute=0,
-                                                        second=0,
-                                                        microsecond=0)
-      # Store the max anomaly likelihood for the period
-      hourToMaxScore[ts] = max(hourToMaxScore.get(ts, 0.0),
-                               row["anomaly"])
-    for ts, score in sorted(hourToMaxScore.iteritems()):
-      score = FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score)
-      dateHour = ts.strftime("%Y-%m-%dT%H")
-
-      data = {
-          "instance_id": {"S": instanceName},
-          "date_hour": {"S": dateHour},
-          "date": {"S": ts.strftime("%Y-%m-%d")},
-          "hour": {"S": ts.strftime("%H")},
-          "anomaly_score": {"M": {metricType: {"N": str(score)}}},
-      }
-      # Validate the data fields against the schema
-      InstanceDataHourlyDynamoDBDefinition().Item(**data)
+    for ts, score in sorted(_getHourlyMaxAnomalyScores(rows).iteritems()):
+      self._publishInstanceDataHourlyScore(
+        instanceName, metricType, ts,
+        FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score))
 
-      # First try a conditional update for the anomaly score for this metric
-      updateKey = {"instance_id": data["instance_id"],
-                   "date_hour": data["date_hour"]}
-      anomalyScoreMetric = "anomaly_score.%s" % metricType
-      updateCondition = ("attribute_not_exists(%(asm)s) or "
-                         "%(asm)s < :value" % {"asm": anomalyScoreMetric})
-      updateValues = {":value": {"N": str(score)}}
-      updateExpression = "SET %s = :value" % anomalyScoreMetric
 
-      @retryOnTransientDynamoDBError(g_log)
-      def updateItemWithRetries():
-        self.dynamodb.update_item(self._instance_data_hourly.table_name,
-                                  key=updateKey,
-                                  update_expression=updateExpression,
-                                  condition_expression=updateCondition,
-                                  expression_attribute_values=updateValues)
+  def _publishInstanceDataHourlyScore(self, instanceName, metricType, ts,
+                                      score):
+    """ Update the max anomaly score of one metric type in an
+    `instance_data_hourly` item, creating the item if necessary.
+
+    :param str instanceName: name of the instance
+    :param str metricType: the metric type identifier
+    :param datetime ts: hour of the item
+    :param Decimal score: max anomaly score of the metric type in that hour
+    """
+    data = _makeInstanceDataHourlyItem(instanceName, ts, {metricType: score})
+
+    # First try a conditional update for the anomaly score for this metric
+    updateKey = {"instance_id": data["instance_id"],
+                 "date_hour": data["date_hour"]}
+    anomalyScoreMetric = "anomaly_score.%s" % metricType
+    updateCondition = ("attribute_not_exists(%(asm)s) or "
+                       "%(asm)s < :value" % {"asm": anomalyScoreMetric})
+    updateValues = {":value": {"N": str(score)}}
+    updateExpression = "SET %s = :value" % anomalyScoreMetric
+
+    @retryOnTransientDynamoDBError(g_log)
+    def updateItemWithRetries():
+      self.dynamodb.update_item(self._instance_data_hourly.table_name,
+                                key=updateKey,
+                                update_expression=updateExpression,
+                                condition_expression=updateCondition,
+                                expression_attribute_values=updateValues)
+
+    try:
+      updateItemWithRetries()
+    except ResourceNotFoundException:
+      # There is no row yet, so continue on to PutItem
+      pass
+    except ValidationException:
+      # It's OK, let's continue and try the PutItem
+      pass
+    except ConditionalCheckFailedException:
+      # The existing value is larger so we are done
+      return
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
+    else:
+      # There was no exception, the update succeeded, we are done
+      return
+
+    # If the UpdateItem failed with ResourceNotFoundException, put the row
+
+    putCondition = "attribute_not_exists(instance_id)"
+
+    @retryOnTransientDynamoDBError(g_log)
+    def putItemWithRetries(item, condition):
+      self.dynamodb.put_item(
+        self._instance_data_hourly.table_name,
+        item=item,
+        condition_expression=condition)
+
+    try:
+      putItemWithRetries(data, putCondition)
+    except ConditionalCheckFailedException:
+      # No problem, row already exists!
+      pass
+    except Exception:
+      g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
+                      self._instance_data_hourly.table_name, putCondition,
+                      data)
+      raise
+    else:
+      # There was no exception, the put succeeded, we are done
+      return
+
+    # In the case that a parallel process beat us to it
+    try:
+      updateItemWithRetries()
+    except ConditionalCheckFailedException:
+      # The existing value is larger so we are done
+      return
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
 
-      try:
-        updateItemWithRetries()
-      except ResourceNotFoundException:
-        # There is no row yet, so continue on to PutItem
-        pass
-      except ValidationException:
-        # It's OK, let's continue and try the PutItem
-        pass
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
-      else:
-        # There was no exception, the update succeeded, we are done
-        continue
 
-      # If the UpdateItem failed with ResourceNotFoundException, put the row
-      # and continue to next iteration of the loop
+  def flushInstanceDataHourly(self):
+    """ Write the coalesced `instance_data_hourly` scores to DynamoDB, then ack
+    the messages that they were derived from.
 
+    Current max scores of all buffered items are fetched with BatchGetItem.
+    Items that don't exist yet are created with one conditional PutItem each,
+    and existing items with one conditional UpdateItem covering all of their
+    increased scores; items whose stored scores are already at least as large
+    aren't written at all. If a conditional write loses a race with another
+    writer, the item falls back to per-metric conditional updates, preserving
+    max-wins semantics.
+    """
+    scores = self._instanceDataHourlyBuffer.drain()
+
+    if scores:
+      self._writeInstanceDataHourly(scores,
+                                    numMessages=len(self._unackedMessages))
+
+    if self._unackedMessages:
+      self._unackedMessages[-1].ack(multiple=True)
+      self._unackedMessages = []
+
+
+  def _writeInstanceDataHourly(self, scores, numMessages):
+    """ Implementation of flushInstanceDataHourly's writes
+
+    :param dict scores: mapping of (instanceName, hour) to
+      {metricType: max anomaly score} from `InstanceDataHourlyBuffer.drain()`
+    :param int numMessages: number of messages the scores were coalesced from;
+      for logging
+    """
+    keys = sorted(scores)
+
+    storedScores = self._getInstanceDataHourlyScores(
+      [(instanceName, ts.strftime("%Y-%m-%dT%H")) for instanceName, ts in keys])
+
+    numWrites = 0
+    for instanceName, ts in keys:
+      itemScores = dict(
+        (metricType, FIXED_DYNAMODB_CONTEXT.create_decimal_from_float(score))
+        for metricType, score in scores[(instanceName, ts)].iteritems())
+
+      stored = storedScores.get((instanceName, ts.strftime("%Y-%m-%dT%H")))
+
+      if stored is not None:
+        # Only write the scores that increased
+        itemScores = dict(
+          (metricType, score) for metricType, score in itemScores.iteritems()
+          if metricType not in stored or stored[metricType] < score)
+
+        if not itemScores:
+          continue
+
+      numWrites += 1
+      if not self._writeInstanceDataHourlyItem(instanceName, ts, itemScores,
+                                               exists=stored is not None):
+        # Lost a race with another writer; fall back to per-metric max-wins
+        # updates
+        for metricType, score in sorted(itemScores.iteritems()):
+          self._publishInstanceDataHourlyScore(instanceName, metricType, ts,
+                                               score)
+
+    g_log.info("Flushed instance_data_hourly: numMessages=%d; numItems=%d; "
+               "numWrites=%d", numMessages, len(keys), numWrites)
+
+
+  def _writeInstanceDataHourlyItem(self, instanceName, ts, scores, exists):
+    """ Conditionally write max anomaly scores of an `instance_data_hourly`
+    item in one call
+
+    :param str instanceName: name of the instance
+    :param datetime ts: hour of the item
+    :param dict scores: mapping of metric type to max anomaly score as Decimal
+    :param bool exists: whether the item was found in DynamoDB; if False, the
+      item is created only if it still doesn't exist; if True, the scores are
+      updated only if they are all still greater than the stored ones
+
+    :returns: True if written; False if the condition failed
+    """
+    data = _makeInstanceDataHourlyItem(instanceName, ts, scores)
+
+    if not exists:
       putCondition = "attribute_not_exists(instance_id)"
 
       @retryOnTransientDynamoDBError(g_log)
-      def putItemWithRetries(item, condition):
-        self.dynamodb.put_item(
-          self._instance_data_hourly.table_name,
-          item=item,
-          condition_expression=condition)
+      def putItemWithRetries():
+        self.dynamodb.put_item(self._instance_data_hourly.table_name,
+                               item=data,
+                               condition_expression=putCondition)
 
       try:
-        putItemWithRetries(data, putCondition)
+        putItemWithRetries()
       except ConditionalCheckFailedException:
-        # No problem, row already exists!
-        pass
+        return False
       except Exception:
         g_log.exception("put_item failed: table=%s; condition=%s; item=%s",
                         self._instance_data_hourly.table_name, putCondition,
                         data)
         raise
-      else:
-        # There was no exception, the put succeeded, we are done
-        continue
 
-      # In the case that a parallel process beat us to it
-      try:
-        updateItemWithRetries()
-      except ConditionalCheckFailedException:
-        # The existing value is larger so we are done
-        continue
-      except Exception:
-        g_log.exception("update_item failed: table=%s; updateKey=%s; "
-                        "update=%s; condition=%s; values=%s",
-                        self._instance_data_hourly.table_name, updateKey,
-                        updateExpression, updateCondition, updateValues)
-        raise
+      return True
+
+    updateKey = {"instance_id": data["instance_id"],
+                 "date_hour": data["date_hour"]}
+    updateValues = {}
+    assignments = []
+    conditions = []
+    for i, (metricType, score) in enumerate(sorted(scores.iteritems())):
+      anomalyScoreMetric = "anomaly_score.%s" % metricType
+      value = ":value%d" % i
+      updateValues[value] = {"N": str(score)}
+      assignments.append("%s = %s" % (anomalyScoreMetric, value))
+      conditions.append("(attribute_not_exists(%(asm)s) or %(asm)s < %(v)s)" %
+                        {"asm": anomalyScoreMetric, "v": value})
+    updateExpression = "SET " + ", ".join(assignments)
+    updateCondition = " and ".join(conditions)
+
+    @retryOnTransientDynamoDBError(g_log)
+    def updateItemWithRetries():
+      self.dynamodb.update_item(self._instance_data_hourly.table_name,
+                                key=updateKey,
+                                update_expression=updateExpression,
+                                condition_expression=updateCondition,
+                                expression_attribute_values=updateValues)
+
+    try:
+      updateItemWithRetries()
+    except (ConditionalCheckFailedException, ValidationException):
+      return False
+    except Exception:
+      g_log.exception("update_item failed: table=%s; updateKey=%s; "
+                      "update=%s; condition=%s; values=%s",
+                      self._instance_data_hourly.table_name, updateKey,
+                      updateExpression, updateCondition, updateValues)
+      raise
+
+    return True
+
+
+  def _getInstanceDataHourlyScores(self, keys):
+    """ Fetch stored anomaly scores of `instance_data_hourly` items via
+    BatchGetItem
+
+    :param keys: sequence of (instanceName, dateHour) pairs
+    :returns: dict mapping (instanceName, dateHour) of existing items to
+      {metricType: anomaly score as Decimal}
+    """
+    tableName = self._instance_data_hourly.table_name
+
+    @retryOnTransientDynamoDBError(g_log)
+    def batchGetItemWithRetries(requestItems):
+      return self.dynamodb.batch_get_item(requestItems)
+
+    storedScores = {}
+    for i in xrange(0, len(keys), self._MAX_BATCH_GET_ITEM_KEYS):
+      requestItems = {
+        tableName: {
+          "Keys": [{"instance_id": {"S": instanceName},
+                    "date_hour": {"S": dateHour}}
+                   for instanceName, dateHour in
+                   keys[i:i + self._MAX_BATCH_GET_ITEM_KEYS]],
+          "ProjectionExpression": "instance_id, date_hour, anomaly_score"
+        }
+      }
+
+      while requestItems:
+        response = batchGetItemWithRetries(requestItems)
+
+        for item in response.get("Responses", {}).get(tableName, []):
+          storedScores[(item["instance_id"]["S"], item["date_hour"]["S"])] = (
+            dict((metricType, Decimal(value["N"]))
+                 for metricType, value in
+                 item.get("anomaly_score", {}).get("M", {}).iteritems()))
+
+        requestItems = response.get("UnprocessedKeys")
+
+    return storedScores
 
 
 
@@ -406,6 +971,71 @@ class DynamoDBService(object):
       htmengine/runtime/json_schema/model_inference_results_msg_schema.json.
     :type body: str
     """
+    batch = self._prepareModelInferenceResults(body)
+    if batch is not None:
+      self._publishModelInferenceResults(batch,
+                                         self._instanceDataHourlyBuffer)
+
+
+  def _isModelInferenceResultsSkippable(self, message):
+    """ Check whether a model inference results message may be skipped
+    without deserializing it, based on the headers that AnomalyService adds
+    (see `AnomalyService._composeModelInferenceResultsHeaders()`). Messages
+    without those headers aren't skippable.
+
+    :param amqp.messages.ConsumerMessage message:
+    :returns: True if the message's batch is stale or its metric lacks
+      Taurus-specific user info
+    """
+    headers = message.properties.headers or {}
+    lastRowTimestamp = headers.get("lastRowTimestamp")
+    userInfoKeys = headers.get("userInfoKeys")
+
+    skip = False
+    if lastRowTimestamp is not None and (
+        datetime.utcfromtimestamp(lastRowTimestamp) <
+        (datetime.utcnow() - timedelta(days=self._FRESH_DATA_THRESHOLD_DAYS))):
+      self._numSkippedStaleResults += 1
+      skip = True
+    elif (userInfoKeys is not None and
+          not self._REQUIRED_USER_INFO_KEYS.issubset(userInfoKeys.split(","))):
+      self._numSkippedIneligibleResults += 1
+      skip = True
+
+    if skip:
+      self._numSkippedResultsBytes += len(message.body)
+      g_log.debug("Skipping model inference results of model=%s per "
+                  "headers=%s", headers.get("metricUid"), headers)
+
+    now = time.time()
+    if now - self._lastSkippedResultsLogTime >= (
+        self._SKIPPED_RESULTS_LOG_INTERVAL_SEC):
+      if self._numSkippedStaleResults or self._numSkippedIneligibleResults:
+        g_log.info("Skipped model inference results in last %ds: "
+                   "numStale=%d; numIneligible=%d; numBytes=%d",
+                   now - self._lastSkippedResultsLogTime,
+                   self._numSkippedStaleResults,
+                   self._numSkippedIneligibleResults,
+                   self._numSkippedResultsBytes)
+      self._numSkippedStaleResults = 0
+      self._numSkippedIneligibleResults = 0
+      self._numSkippedResultsBytes = 0
+      self._lastSkippedResultsLogTime = now
+
+    return skip
+
+
+  def _prepareModelInferenceResults(self, body):
+    """ Deserialize and validate a model inference results batch
+
+    :param body: Serialized message payload; the message is compliant with
+      htmengine/runtime/json_schema/model_inference_results_msg_schema.json.
+    :type body: str
+
+    :returns: the batch to publish; None if it is empty, stale or lacks
+      Taurus-specific user info
+    :rtype: _ModelInferenceResultsBatch
+    """
     try:
       batch = AnomalyService.deserializeModelResult(body)
     except Exception:
@@ -461,9 +1091,22 @@ class DynamoDBService(object):
                     metricId, metricName)
       return
 
-    self._publishMetricData(metricId, batch["results"])
-    self._publishInstanceDataHourly(instanceName, metricType,
-                                    batch["results"])
+    return _ModelInferenceResultsBatch(metricId=metricId,
+                                       instanceName=instanceName,
+                                       metricType=metricType,
+                                       rows=batch["results"])
+
+
+  def _publishModelInferenceResults(self, batch, instanceDataHourlyBuffer):
+    """ Publish metric data of a model inference results batch and add its
+    scores to the given `instance_data_hourly` buffer
+
+    :param _ModelInferenceResultsBatch batch:
+    :param InstanceDataHourlyBuffer instanceDataHourlyBuffer:
+    """
+    self._publishMetricData(batch.metricId, batch.rows)
+    instanceDataHourlyBuffer.add(batch.instanceName, batch.metricType,
+                                 batch.rows)
 
 
   def _handleNonMetricTweetData(self, body):
@@ -550,21 +1193,71 @@ class DynamoDBService(object):
           objects, with each object formatted per
           ``taurus_engine/metric_collectors/twitterdirect/tweet_export_schema.json``
     """
+    self._handleMessage(message)
+
+    if not self._instanceDataHourlyBuffer:
+      message.ack()
+      return
+
+    # Defer the ack until the coalesced instance_data_hourly scores are written
+    # (messages must be acked in order, so this includes messages that didn't
+    # contribute to the buffer)
+    self._unackedMessages.append(message)
+
+    if (len(self._unackedMessages) >= self._maxUnackedMessages or
+        (time.time() - self._instanceDataHourlyBuffer.startTime >=
+         self._coalesceWindowSec)):
+      self.flushInstanceDataHourly()
+
+
+  @staticmethod
+  def _getMessageKind(message):
+    """ Determine the kind of a message from the dynamodb queue
+
+    :param amqp.messages.ConsumerMessage message:
+    :returns: one of the _MESSAGE_KIND_* values; None if unrecognized
+    """
     if message.methodInfo.routingKey == "taurus.data.non-metric.twitter":
-      self._handleNonMetricTweetData(message.body)
+      return _MESSAGE_KIND_TWEETS
     elif message.methodInfo.routingKey is None:
       g_log.warning("Unrecognized routing key.")
+      return None
+
+    dataType = (message.properties.headers.get("dataType")
+                if message.properties.headers else None)
+    if not dataType:
+      return _MESSAGE_KIND_MODEL_INFERENCE_RESULTS
+    elif dataType == "model-cmd-result":
+      return _MESSAGE_KIND_MODEL_COMMAND_RESULT
     else:
-      dataType = (message.properties.headers.get("dataType")
-                  if message.properties.headers else None)
-      if not dataType:
-        self._handleModelInferenceResults(message.body)
-      elif dataType == "model-cmd-result":
-        self._handleModelCommandResult(message.body)
-      else:
-        g_log.warning("Unexpected message header dataType=%s", dataType)
+      g_log.warning("Unexpected message header dataType=%s", dataType)
+      return None
+
 
-    message.ack()
+  def _handleMessage(self, message):
+    """ Route a message to its handler on the calling thread without acking it;
+    see messageHandler
+
+    :param amqp.messages.ConsumerMessage message:
+    """
+    self._handleMessageOfKind(message, self._getMessageKind(message))
+
+
+  def _handleMessageOfKind(self, message, kind):
+    """ Route a message that was already classified to its handler on the
+    calling thread without acking it
+
+    :param amqp.messages.ConsumerMessage message:
+    :param kind: one of the _MESSAGE_KIND_* values or None, per
+      _getMessageKind()
+    """
+    if kind == _MESSAGE_KIND_TWEETS:
+      self._handleNonMetricTweetData(message.body)
+    elif kind == _MESSAGE_KIND_MODEL_INFERENCE_RESULTS:
+      if not self._isModelInferenceResultsSkippable(message):
+        self._handleModelInferenceResults(message.body)
+    elif kind == _MESSAGE_KIND_MODEL_COMMAND_RESULT:
+      self._handleModelCommandResult(message.body)
 
 
   def _declareExchanges(self, amqpClient):
@@ -610,10 +1303,17 @@ class DynamoDBService(object):
   def run(self):
     g_log.info("Running")
 
+    prefetchCount = taurus_engine.config.getint("dynamodb", "prefetch_count")
+    if prefetchCount < self._numPublisherThreads:
+      g_log.warning("prefetch_count=%d is less than num_publisher_threads=%d; "
+                    "using the latter", prefetchCount,
+                    self._numPublisherThreads)
+      prefetchCount = self._numPublisherThreads
+
     def _configChannel(amqpClient):
-      amqpClient.requestQoS(
-          prefetchCount=taurus_engine.config.getint("dynamodb",
-                                                    "prefetch_count"))
+      amqpClient.requestQoS(prefetchCount=prefetchCount)
+
+    pipeline = None
 
     try:
       # Open connection to rabbitmq
@@ -625,10 +1325,33 @@ class DynamoDBService(object):
         self._declareQueueAndBindToExchanges(amqpClient)
         consumer = amqpClient.createConsumer(self._INPUT_QUEUE_NAME)
 
+        if self._numPublisherThreads:
+          pipeline = _PublishingPipeline(
+            self,
+            numWorkers=self._numPublisherThreads,
+            coalesceWindowSec=self._coalesceWindowSec)
+
         # Start consuming messages
         for evt in amqpClient.readEvents():
           if isinstance(evt, amqp.messages.ConsumerMessage):
-            self.messageHandler(evt)
+            if pipeline is None:
+              self.messageHandler(evt)
+
+              if not amqpClient.hasEvent():
+                # Don't hold on to coalesced data while waiting for more
+                # messages
+                self.flushInstanceDataHourly()
+            else:
+              pipeline.submit(evt)
+              pipeline.ackCompleted()
+
+              # Dispatch deliveries as soon as they arrive, including those
+              # already buffered on the connection, to keep the publishers
+              # busy; in between, ack completed messages, so that the broker
+              # may deliver more once prefetch_count is reached
+              while pipeline.numInFlight and not amqpClient.pollEvents():
+                pipeline.waitForProgress(
+                  timeout=self._DELIVERY_POLL_INTERVAL_SEC)
           elif isinstance(evt, amqp.consumer.ConsumerCancellation):
             # Bad news: this likely means that our queue was deleted externally
             msg = "Consumer cancelled by broker: %r (%r)" % (evt, consumer)
@@ -650,6 +1373,8 @@ class DynamoDBService(object):
       g_log.info("Stopping Taurus DynamoDB Service", exc_info=True)
     finally:
       g_log.info("Stopping Taurus DynamoDB Service")
+      if pipeline is not None:
+        pipeline.stop()
 
 
 
@@ -69,11 +69,6 @@ def replayMetricDataToModelResultsExchange(messageBus,
       deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
       headers=dict(dataType="model-cmd-result"))
 
-  # Properties for publishing model inference results on RabbitMQ exchange
-  # (same as AnomalyService)
-  modelInferenceResultProperties = MessageProperties(
-    deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE)
-
   g_log.info("Getting metric data...")
   result = repository.getMetricData(engine,
                                     score=0,
@@ -159,6 +154,14 @@ def replayMetricDataToModelResultsExchange(messageBus,
         datetime.datetime.utcfromtimestamp(
           inferenceResultsMessage["results"][-1].timestamp))
 
+      # Properties for publishing model inference results on RabbitMQ
+      # exchange (same as AnomalyService)
+      modelInferenceResultProperties = MessageProperties(
+        deliveryMode=amqp.constants.AMQPDeliveryModes.PERSISTENT_MESSAGE,
+        headers=(anomaly_service.AnomalyService
+                 ._composeModelInferenceResultsHeaders(
+                   inferenceResultsMessage)))
+
       messageBus.publishExg(
         exchange=config.get("metric_streamer", "results_exchange_name"),
         routingKey="",
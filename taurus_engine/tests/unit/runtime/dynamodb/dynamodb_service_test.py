@@ -27,13 +27,15 @@ Unit tests for taurus_engine.runtime.dynamodb.dynamodb_runtime
 from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
 import json
+import threading
 import time
 
 from mock import ANY, MagicMock, Mock, patch
 import unittest
 
 from boto.dynamodb2.layer1 import DynamoDBConnection
-from boto.dynamodb2.exceptions import ResourceNotFoundException
+from boto.dynamodb2.exceptions import (ConditionalCheckFailedException,
+                                       ResourceNotFoundException)
 from boto.dynamodb2.table import BatchTable
 
 from nta.utils import amqp
@@ -339,6 +341,70 @@ class DynamoDBServiceTestCase(unittest.TestCase):
       self.assertEqual(publishInstanceMock.call_count, 0)
 
 
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  @patch("taurus_engine.runtime.dynamodb.dynamodb_service.amqp",
+         autospec=True)
+  def testMessageHandlerSkipsModelResultsPerHeaders(
+      self, _amqpUtilsMock,
+      deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    """ Stale batches and batches of metrics that lack Taurus-specific
+    userInfo are skipped on the basis of message headers, without
+    deserialization
+    """
+    freshTs = epochFromNaiveUTCDatetime(
+      datetime.utcnow().replace(microsecond=0))
+    staleTs = epochFromNaiveUTCDatetime(
+      datetime.utcnow().replace(microsecond=0) -
+      timedelta(days=DynamoDBService._FRESH_DATA_THRESHOLD_DAYS + 1))
+
+    def makeMessage(headers):
+      return amqp.messages.ConsumerMessage(
+        body="x" * 10,
+        properties=Mock(headers=headers),
+        methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                     deliveryTag=Mock(),
+                                                     redelivered=False,
+                                                     exchange=Mock(),
+                                                     routingKey=""),
+        ackImpl=Mock(),
+        nackImpl=Mock())
+
+    service = DynamoDBService()
+
+    staleMessage = makeMessage(
+      dict(metricUid="abc",
+           lastRowTimestamp=staleTs,
+           userInfoKeys="metricType,metricTypeName,symbol"))
+    service.messageHandler(staleMessage)
+
+    ineligibleMessage = makeMessage(
+      dict(metricUid="abc",
+           lastRowTimestamp=freshTs,
+           userInfoKeys="displayName,symbol"))
+    service.messageHandler(ineligibleMessage)
+
+    self.assertFalse(deserializeModelResult.called)
+    staleMessage._ackImpl.assert_called_once_with(
+      staleMessage.methodInfo.deliveryTag, False)
+    ineligibleMessage._ackImpl.assert_called_once_with(
+      ineligibleMessage.methodInfo.deliveryTag, False)
+
+    self.assertEqual(service._numSkippedStaleResults, 1)
+    self.assertEqual(service._numSkippedIneligibleResults, 1)
+    self.assertEqual(service._numSkippedResultsBytes, 20)
+
+    # Fresh, eligible batches are deserialized
+    deserializeModelResult.return_value = dict(
+      metric=dict(uid="abc", name="XIGNITE.AGN.VOLUME"),
+      results=[])
+    service.messageHandler(makeMessage(
+      dict(metricUid="abc",
+           lastRowTimestamp=freshTs,
+           userInfoKeys="metricType,metricTypeName,symbol")))
+    self.assertEqual(deserializeModelResult.call_count, 1)
+
+
   #zzz
   @patch("taurus_engine.runtime.dynamodb.dynamodb_service.amqp",
          autospec=True)
@@ -506,5 +572,487 @@ class DynamoDBServiceTestCase(unittest.TestCase):
     self.assertEqual(kwargs1["condition_expression"], condition)
 
 
+  def testInstanceDataHourlyBufferKeepsMaxScores(self, connectDynamoDB,
+                                                 _gracefulCreateTable):
+    buf = dynamodb_service.InstanceDataHourlyBuffer()
+    self.assertEqual(len(buf), 0)
+    self.assertIsNone(buf.startTime)
+
+    ts0 = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 0, 46, 28))
+    ts1 = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 1, 1, 38))
+
+    buf.add("AAPL", "StockPrice", [dict(ts=ts0, anomaly=0.5),
+                                   dict(ts=ts1, anomaly=0.25)])
+    buf.add("AAPL", "StockPrice", [dict(ts=ts0 + 60, anomaly=0.75),
+                                   dict(ts=ts1 + 60, anomaly=0.125)])
+    buf.add("AAPL", "TwitterVolume", [dict(ts=ts0, anomaly=0.1)])
+    buf.add("IBM", "StockPrice", [dict(ts=ts0, anomaly=0.9)])
+
+    self.assertEqual(len(buf), 3)
+    self.assertIsNotNone(buf.startTime)
+
+    self.assertEqual(
+      buf.drain(),
+      {
+        ("AAPL", datetime(2015, 2, 20, 0)): {"StockPrice": 0.75,
+                                             "TwitterVolume": 0.1},
+        ("AAPL", datetime(2015, 2, 20, 1)): {"StockPrice": 0.25},
+        ("IBM", datetime(2015, 2, 20, 0)): {"StockPrice": 0.9}
+      })
+
+    self.assertEqual(len(buf), 0)
+    self.assertIsNone(buf.startTime)
+
+
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  @patch("taurus_engine.runtime.dynamodb.dynamodb_service.amqp",
+         autospec=True)
+  def testMessageHandlerCoalescesInstanceDataHourly(
+      self, _amqpUtilsMock,
+      deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    """ Scores for the same instance and hour from several messages are
+    written with one PutItem, after which the messages are acked together
+    """
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    tableName = InstanceDataHourlyDynamoDBDefinition().tableName
+    connectionMock.batch_get_item.return_value = {"Responses": {tableName: []}}
+    connectDynamoDB.return_value = connectionMock
+
+    ackImpl = Mock()
+    messages = [
+      amqp.messages.ConsumerMessage(
+        body=Mock(),
+        properties=Mock(headers=dict()),
+        methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                     deliveryTag=i,
+                                                     redelivered=False,
+                                                     exchange=Mock(),
+                                                     routingKey=""),
+        ackImpl=ackImpl,
+        nackImpl=Mock())
+      for i in xrange(1, 4)]
+
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+    def makeBatch(metricType, anomaly):
+      return dict(
+        metric=dict(
+          uid="3b035a5916994f2bb950f5717138f94b",
+          name="XIGNITE.AGN.%s" % metricType,
+          description="XIGNITE.AGN.%s" % metricType,
+          resource="AGN",
+          location="",
+          datasource="custom",
+          spec=dict(
+            userInfo=dict(
+              symbol="AGN",
+              metricType=metricType,
+              metricTypeName=metricType
+            )
+          )
+        ),
+        results=[dict(rowid=1, ts=epochFromNaiveUTCDatetime(now), value=1.0,
+                      rawAnomaly=0.5, anomaly=anomaly)]
+      )
+
+    deserializeModelResult.side_effect = [makeBatch("StockPrice", 0.5),
+                                          makeBatch("StockPrice", 0.75),
+                                          makeBatch("StockVolume", 0.25)]
+
+    service = DynamoDBService()
+    service._maxUnackedMessages = 3
+
+    service.messageHandler(messages[0])
+    service.messageHandler(messages[1])
+
+    # Nothing written or acked yet
+    self.assertFalse(connectionMock.put_item.called)
+    self.assertFalse(ackImpl.called)
+
+    service.messageHandler(messages[2])
+
+    connectionMock.batch_get_item.assert_called_once_with(
+      {tableName: {"Keys": [{"instance_id": {"S": "AGN"},
+                             "date_hour": {"S": now.strftime("%Y-%m-%dT%H")}}],
+                   "ProjectionExpression": ANY}})
+    self.assertFalse(connectionMock.update_item.called)
+    connectionMock.put_item.assert_called_once_with(
+      tableName, item=ANY,
+      condition_expression="attribute_not_exists(instance_id)")
+    item = connectionMock.put_item.call_args[1]["item"]
+    self.assertEqual(item["anomaly_score"],
+                     {"M": {"StockPrice": {"N": "0.75"},
+                            "StockVolume": {"N": "0.25"}}})
+
+    # All three messages acked with one call
+    ackImpl.assert_called_once_with(3, True)
+
+
+  def testFlushInstanceDataHourlyUpdatesOnlyIncreasedScores(
+      self, connectDynamoDB, _gracefulCreateTable):
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    tableName = InstanceDataHourlyDynamoDBDefinition().tableName
+    connectionMock.batch_get_item.return_value = {
+      "Responses": {
+        tableName: [
+          {"instance_id": {"S": "AGN"},
+           "date_hour": {"S": "2015-02-20T00"},
+           "anomaly_score": {"M": {"StockPrice": {"N": "0.9"},
+                                   "StockVolume": {"N": "0.1"}}}},
+          {"instance_id": {"S": "AGN"},
+           "date_hour": {"S": "2015-02-20T01"},
+           "anomaly_score": {"M": {"StockPrice": {"N": "0.9"}}}}
+        ]
+      }
+    }
+    connectDynamoDB.return_value = connectionMock
+
+    service = DynamoDBService()
+    ts0 = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 0, 46, 28))
+    ts1 = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 1, 1, 38))
+    service._instanceDataHourlyBuffer.add("AGN", "StockPrice",
+                                          [dict(ts=ts0, anomaly=0.5),
+                                           dict(ts=ts1, anomaly=0.5)])
+    service._instanceDataHourlyBuffer.add("AGN", "StockVolume",
+                                          [dict(ts=ts0, anomaly=0.5),
+                                           dict(ts=ts1, anomaly=0.25)])
+    service.flushInstanceDataHourly()
+
+    self.assertFalse(connectionMock.put_item.called)
+
+    # Hour 0 has only a greater StockVolume score; Hour 1 has a new StockVolume
+    # score; stored StockPrice scores are greater in both
+    self.assertEqual(connectionMock.update_item.call_count, 2)
+    kwargs0 = connectionMock.update_item.call_args_list[0][1]
+    self.assertEqual(kwargs0["key"], {"instance_id": {"S": "AGN"},
+                                      "date_hour": {"S": "2015-02-20T00"}})
+    self.assertEqual(kwargs0["update_expression"],
+                     "SET anomaly_score.StockVolume = :value0")
+    self.assertEqual(kwargs0["expression_attribute_values"],
+                     {":value0": {"N": "0.5"}})
+    kwargs1 = connectionMock.update_item.call_args_list[1][1]
+    self.assertEqual(kwargs1["key"], {"instance_id": {"S": "AGN"},
+                                      "date_hour": {"S": "2015-02-20T01"}})
+    self.assertEqual(kwargs1["expression_attribute_values"],
+                     {":value0": {"N": "0.25"}})
+
+
+  def testFlushInstanceDataHourlyFallsBackOnConditionFailure(
+      self, connectDynamoDB, _gracefulCreateTable):
+    """ When another writer creates the item between BatchGetItem and PutItem,
+    scores are written with per-metric conditional updates
+    """
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    tableName = InstanceDataHourlyDynamoDBDefinition().tableName
+    connectionMock.batch_get_item.return_value = {"Responses": {tableName: []}}
+    connectionMock.put_item.side_effect = ConditionalCheckFailedException(
+      400, "conditional check failed")
+    connectDynamoDB.return_value = connectionMock
+
+    service = DynamoDBService()
+    ts = epochFromNaiveUTCDatetime(datetime(2015, 2, 20, 0, 46, 28))
+    service._instanceDataHourlyBuffer.add("AGN", "StockPrice",
+                                          [dict(ts=ts, anomaly=0.5)])
+    service._instanceDataHourlyBuffer.add("AGN", "StockVolume",
+                                          [dict(ts=ts, anomaly=0.25)])
+    service.flushInstanceDataHourly()
+
+    self.assertEqual(connectionMock.put_item.call_count, 1)
+    self.assertEqual(connectionMock.update_item.call_count, 2)
+    self.assertEqual(
+      [kwargs["update_expression"]
+       for _args, kwargs in connectionMock.update_item.call_args_list],
+      ["SET anomaly_score.StockPrice = :value",
+       "SET anomaly_score.StockVolume = :value"])
+
+
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  def testPublishingPipelineKeepsMetricOrderAndAcksInOrder(
+      self, deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    tableName = InstanceDataHourlyDynamoDBDefinition().tableName
+    connectionMock.batch_get_item.return_value = {"Responses": {tableName: []}}
+    connectDynamoDB.return_value = connectionMock
+
+    now = datetime.utcnow().replace(microsecond=0)
+    numMessages = 30
+
+    def makeBatch(i):
+      instanceName = "INSTANCE%d" % (i % 3)
+      return dict(
+        metric=dict(
+          uid="uid-%s" % instanceName,
+          name="XIGNITE.%s.CLOSINGPRICE" % instanceName,
+          resource=instanceName,
+          spec=dict(
+            userInfo=dict(
+              symbol=instanceName,
+              metricType="StockPrice",
+              metricTypeName="Stock Price"
+            )
+          )
+        ),
+        results=[dict(rowid=i, ts=epochFromNaiveUTCDatetime(now), value=1.0,
+                      rawAnomaly=0.5, anomaly=0.5)]
+      )
+
+    deserializeModelResult.side_effect = [makeBatch(i)
+                                          for i in xrange(numMessages)]
+
+    ackImpl = Mock()
+    messages = [
+      amqp.messages.ConsumerMessage(
+        body=Mock(),
+        properties=Mock(headers=dict()),
+        methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                     deliveryTag=i + 1,
+                                                     redelivered=False,
+                                                     exchange=Mock(),
+                                                     routingKey=""),
+        ackImpl=ackImpl,
+        nackImpl=Mock())
+      for i in xrange(numMessages)]
+
+    service = DynamoDBService()
+
+    published = []
+    def publishMetricData(metricId, rows):
+      time.sleep(0.001)
+      published.extend((metricId, row["rowid"]) for row in rows)
+
+    with patch.object(service, "_publishMetricData", autospec=True,
+                      side_effect=publishMetricData):
+      pipeline = dynamodb_service._PublishingPipeline(service,
+                                                      numWorkers=3,
+                                                      coalesceWindowSec=5)
+      try:
+        for message in messages:
+          pipeline.submit(message)
+          pipeline.ackCompleted()
+
+        pipeline.drain()
+      finally:
+        pipeline.stop()
+
+    self.assertEqual(pipeline.numInFlight, 0)
+    self.assertEqual(len(published), numMessages)
+
+    # Results of each metric were published in the order received
+    for uid in set(uid for uid, _ in published):
+      rowids = [rowid for metricId, rowid in published if metricId == uid]
+      self.assertEqual(rowids, sorted(rowids))
+
+    # Acks are cumulative and in delivery order, ending with the last message
+    ackedTags = [args[0] for args, _ in ackImpl.call_args_list]
+    self.assertEqual(ackedTags, sorted(ackedTags))
+    self.assertEqual(ackedTags[-1], numMessages)
+    for args, _ in ackImpl.call_args_list:
+      self.assertTrue(args[1])
+
+    # One instance_data_hourly item per instance
+    self.assertEqual(connectionMock.put_item.call_count, 3)
+
+
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  def testPublishingPipelineRaisesWorkerError(
+      self, deserializeModelResult, connectDynamoDB, _gracefulCreateTable):
+    now = datetime.utcnow().replace(microsecond=0)
+    deserializeModelResult.return_value = dict(
+      metric=dict(
+        uid="3b035a5916994f2bb950f5717138f94b",
+        name="XIGNITE.AGN.CLOSINGPRICE",
+        resource="AGN",
+        spec=dict(
+          userInfo=dict(
+            symbol="AGN",
+            metricType="StockPrice",
+            metricTypeName="Stock Price"
+          )
+        )
+      ),
+      results=[dict(rowid=1, ts=epochFromNaiveUTCDatetime(now), value=1.0,
+                    rawAnomaly=0.5, anomaly=0.5)]
+    )
+
+    ackImpl = Mock()
+    message = amqp.messages.ConsumerMessage(
+      body=Mock(),
+      properties=Mock(headers=dict()),
+      methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                   deliveryTag=1,
+                                                   redelivered=False,
+                                                   exchange=Mock(),
+                                                   routingKey=""),
+      ackImpl=ackImpl,
+      nackImpl=Mock())
+
+    class PublishError(Exception):
+      pass
+
+    service = DynamoDBService()
+    with patch.object(service, "_publishMetricData", autospec=True,
+                      side_effect=PublishError):
+      pipeline = dynamodb_service._PublishingPipeline(service,
+                                                      numWorkers=2,
+                                                      coalesceWindowSec=5)
+      try:
+        pipeline.submit(message)
+        with self.assertRaises(PublishError):
+          pipeline.drain()
+      finally:
+        pipeline.stop()
+
+    self.assertFalse(ackImpl.called)
+
+
+  def testPublishingPipelineWorkersUseOwnConnections(
+      self, connectDynamoDB, _gracefulCreateTable):
+    connectDynamoDB.side_effect = (
+      lambda: Mock(spec_set=DynamoDBConnection))
+
+    service = DynamoDBService()
+
+    publishers = []
+    def copyForPublisherThread(copyImpl=service._copyForPublisherThread):
+      publisher = copyImpl()
+      publishers.append(publisher)
+      return publisher
+
+    with patch.object(service, "_copyForPublisherThread", autospec=True,
+                      side_effect=copyForPublisherThread):
+      pipeline = dynamodb_service._PublishingPipeline(service,
+                                                      numWorkers=3,
+                                                      coalesceWindowSec=5)
+      pipeline.stop()
+
+    self.assertEqual(len(publishers), 3)
+
+    # Each worker has its own connection and tables bound to it
+    connections = [publisher.dynamodb for publisher in publishers]
+    self.assertEqual(len(set(id(conn) for conn in connections + [
+      service.dynamodb])), 4)
+    for publisher in publishers:
+      for table in (publisher._metric, publisher._metric_data,
+                    publisher._metric_tweets, publisher._instance_data_hourly):
+        self.assertIs(table.connection, publisher.dynamodb)
+
+
+  def testPublishingPipelineClassifiesBarrierOnce(
+      self, connectDynamoDB, _gracefulCreateTable):
+    ackImpl = Mock()
+    message = amqp.messages.ConsumerMessage(
+      body=Mock(),
+      properties=Mock(headers=dict(dataType="unexpected")),
+      methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                   deliveryTag=1,
+                                                   redelivered=False,
+                                                   exchange=Mock(),
+                                                   routingKey=""),
+      ackImpl=ackImpl,
+      nackImpl=Mock())
+
+    service = DynamoDBService()
+    with patch.object(dynamodb_service, "g_log", autospec=True) as logMock:
+      pipeline = dynamodb_service._PublishingPipeline(service,
+                                                      numWorkers=2,
+                                                      coalesceWindowSec=5)
+      try:
+        pipeline.submit(message)
+      finally:
+        pipeline.stop()
+
+    # The unrecognized message was reported once and acked
+    self.assertEqual(logMock.warning.call_count, 1)
+    ackImpl.assert_called_once_with(1, False)
+
+
+  @patch("taurus_engine.runtime.dynamodb.dynamodb_service.amqp."
+         "synchronous_amqp_client.SynchronousAmqpClient",
+         autospec=True)
+  @patch.object(AnomalyService, "deserializeModelResult",
+                spec_set=AnomalyService.deserializeModelResult)
+  def testRunDispatchesBufferedDeliveriesWhilePublishing(
+      self, deserializeModelResult, amqpClientClassMock, connectDynamoDB,
+      _gracefulCreateTable):
+    connectionMock = Mock(spec_set=DynamoDBConnection)
+    tableName = InstanceDataHourlyDynamoDBDefinition().tableName
+    connectionMock.batch_get_item.return_value = {"Responses": {tableName: []}}
+    connectDynamoDB.return_value = connectionMock
+
+    now = datetime.utcnow().replace(microsecond=0)
+    numMessages = 8
+
+    deserializeModelResult.side_effect = [
+      dict(
+        metric=dict(
+          uid="uid%d" % (i,),
+          name="XIGNITE.INSTANCE%d.CLOSINGPRICE" % (i,),
+          resource="INSTANCE%d" % (i,),
+          spec=dict(
+            userInfo=dict(
+              symbol="INSTANCE%d" % (i,),
+              metricType="StockPrice",
+              metricTypeName="Stock Price"
+            )
+          )
+        ),
+        results=[dict(rowid=1, ts=epochFromNaiveUTCDatetime(now), value=1.0,
+                      rawAnomaly=0.5, anomaly=0.5)]
+      )
+      for i in xrange(numMessages)]
+
+    pendingMessages = [
+      amqp.messages.ConsumerMessage(
+        body=Mock(),
+        properties=Mock(headers=dict()),
+        methodInfo=amqp.messages.MessageDeliveryInfo(consumerTag=Mock(),
+                                                     deliveryTag=i + 1,
+                                                     redelivered=False,
+                                                     exchange=Mock(),
+                                                     routingKey=""),
+        ackImpl=Mock(),
+        nackImpl=Mock())
+      for i in xrange(numMessages)]
+
+    allDispatched = threading.Event()
+
+    def readEvents():
+      while pendingMessages:
+        message = pendingMessages.pop(0)
+        if not pendingMessages:
+          allDispatched.set()
+        yield message
+
+    # All deliveries are buffered on the connection, but not parsed yet, so
+    # only pollEvents may report them
+    amqpClientMock = MagicMock(
+      spec_set=(
+        dynamodb_service.amqp.synchronous_amqp_client.SynchronousAmqpClient))
+    amqpClientMock.__enter__.return_value = amqpClientMock
+    amqpClientMock.readEvents.side_effect = readEvents
+    amqpClientMock.hasEvent.return_value = False
+    amqpClientMock.pollEvents.side_effect = lambda: bool(pendingMessages)
+    amqpClientClassMock.return_value = amqpClientMock
+
+    # Publishing of the first messages doesn't complete until the consumer
+    # thread has dispatched all of them
+    publishedAfterDispatch = []
+    def publishMetricData(metricId, rows):  # pylint: disable=W0613
+      publishedAfterDispatch.append(allDispatched.wait(5))
+
+    service = DynamoDBService()
+    service._numPublisherThreads = 4
+
+    with patch.object(service, "_publishMetricData", autospec=True,
+                      side_effect=publishMetricData):
+      service.run()
+
+    self.assertEqual(len(publishedAfterDispatch), numMessages)
+    self.assertTrue(all(publishedAfterDispatch))
+
+
 if __name__ == "__main__":
   unittest.main()
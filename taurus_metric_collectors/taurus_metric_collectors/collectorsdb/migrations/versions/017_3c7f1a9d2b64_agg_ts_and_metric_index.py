@@ -0,0 +1,27 @@
+"""Index tweet samples on aggregation timestamp and metric
+
+Replaces agg_ts_idx with a composite (agg_ts, metric) index so that tweet
+volume range aggregations (GROUP BY agg_ts, metric) are served by an ordered
+index scan without touching the table rows.
+
+Revision ID: 3c7f1a9d2b64
+Revises: 5519e3ac1db9
+Create Date: 2026-10-18 10:12:31.508127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c7f1a9d2b64'
+down_revision = '5519e3ac1db9'
+
+from alembic import op
+
+
+def upgrade():
+  op.create_index("agg_ts_and_metric_idx", "twitter_tweet_samples",
+                  ["agg_ts", "metric"])
+  op.drop_index("agg_ts_idx", "twitter_tweet_samples")
+
+
+def downgrade():
+  raise NotImplementedError("Rollback is not supported.")
@@ -301,7 +301,9 @@ twitterTweetSamples = Table(
   mysql_CHARSET=MYSQL_CHARSET,
 )
 
-Index("agg_ts_idx", twitterTweetSamples.c.agg_ts)
+Index("agg_ts_and_metric_idx",
+      twitterTweetSamples.c.agg_ts,
+      twitterTweetSamples.c.metric)
 Index("metric_and_msg_uid_idx",
       twitterTweetSamples.c.metric,
       twitterTweetSamples.c.msg_uid,
@@ -24,6 +24,7 @@ from datetime import datetime, timedelta
 import json
 import logging
 import os
+import threading
 import time
 
 import requests
@@ -714,25 +715,200 @@ def aggTimestampFromSampleTimestamp(sampleDatetime, aggRefDatetime, aggSec):
   return datetime.utcfromtimestamp(aggEpoch)
 
 
-# Number of data samples per batch; used by metricDataBatchWrite
-_METRIC_DATA_BATCH_WRITE_SIZE = 200
+# Name of the message queue consumed by Taurus Engine's metric storer
+_METRIC_DATA_MQ_NAME = "taurus.metric.custom.data"
+
+# Metric data encodings supported by the metric storer; "plain" is the
+# Carbon-style "<metric-name> <value> <epoch>" string per sample and "compact"
+# groups samples by metric as {<metric-name>: [[<value>, <epoch>], ...]}
+METRIC_DATA_PROTOCOL_PLAIN = "plain"
+METRIC_DATA_PROTOCOL_COMPACT = "compact"
+
+# Maximum number of data samples per batch; used by metricDataBatchWrite
+_METRIC_DATA_BATCH_WRITE_SIZE = 1000
+
+# Maximum approximate size of a serialized batch in bytes; used by
+# metricDataBatchWrite to cut batches of long metric names short of
+# _METRIC_DATA_BATCH_WRITE_SIZE samples
+_METRIC_DATA_BATCH_WRITE_MAX_BYTES = 64 * 1024
+
+# Maximum number of batches that metricDataBatchWrite publishes back-to-back
+# before waiting for the broker's publisher acknowledgments
+_METRIC_DATA_PUBLISH_PIPELINE_DEPTH = 8
+
+# Maximum number of idle message bus connections retained for reuse by
+# metricDataBatchWrite
+_METRIC_DATA_PUBLISHER_POOL_MAX_IDLE = 4
+
+
+
+class _MessageBusConnectorPool(object):
+  """ Process-wide pool of idle MessageBusConnector instances that lets
+  metricDataBatchWrite reuse a broker connection across calls instead of
+  connecting anew on every entry.
+
+  MessageBusConnector is not thread-safe, so each instance is checked out by
+  a single caller at a time. Connections inherited from a parent process
+  are abandoned (not closed, since the socket is shared with the parent).
+  """
+
+  def __init__(self, maxIdle):
+    """
+    :param int maxIdle: maximum number of idle connectors to retain; excess
+      connectors are closed on release.
+    """
+    self._maxIdle = maxIdle
+    self._lock = threading.Lock()
+    self._pid = os.getpid()
+    self._idle = []
+
+
+  def acquire(self):
+    """ Check out a connector, creating a new one if none are idle
+
+    :rtype: message_bus_connector.MessageBusConnector
+    """
+    with self._lock:
+      self._abandonInheritedConnectorsNoLock()
+      if self._idle:
+        return self._idle.pop()
+
+    return message_bus_connector.MessageBusConnector()
+
+
+  def release(self, bus):
+    """ Return a healthy connector to the pool
+
+    :param message_bus_connector.MessageBusConnector bus: connector previously
+      returned by `acquire()`
+    """
+    with self._lock:
+      self._abandonInheritedConnectorsNoLock()
+      if len(self._idle) < self._maxIdle:
+        self._idle.append(bus)
+        return
+
+    bus.close()
+
+
+  @staticmethod
+  def discard(bus):
+    """ Close a connector that may be in a bad state instead of returning it
+    to the pool
+
+    :param message_bus_connector.MessageBusConnector bus: connector previously
+      returned by `acquire()`
+    """
+    try:
+      bus.close()
+    except Exception:  # pylint: disable=W0703
+      g_log.exception("Failed to close discarded message bus connector")
+
+
+  def _abandonInheritedConnectorsNoLock(self):
+    if self._pid != os.getpid():
+      self._idle = []
+      self._pid = os.getpid()
+
+
+
+_metricDataPublisherPool = _MessageBusConnectorPool(
+  maxIdle=_METRIC_DATA_PUBLISHER_POOL_MAX_IDLE)
+
+
+
+class _PlainMetricDataBatch(object):
+  """ Accumulates metric data samples in the metric storer's "plain" encoding
+  """
+
+  __slots__ = ("numSamples", "numBytes", "_rows")
+
+  def __init__(self):
+    self.numSamples = 0
+    self.numBytes = 0
+    self._rows = []
+
+
+  def add(self, metricName, value, epochTimestamp):
+    # NOTE: we use %r for value to avoid loss of accuracy in floats
+    row = "%s %r %d" % (metricName, value, epochTimestamp)
+    self._rows.append(row)
+    self.numSamples += 1
+    # Account for the JSON string quotes and list separator
+    self.numBytes += len(row) + 4
+
+
+  def serialize(self):
+    return json.dumps(dict(protocol=METRIC_DATA_PROTOCOL_PLAIN,
+                           data=self._rows))
+
+
+  def describe(self):
+    return "first=%r; last=%r" % (self._rows[0], self._rows[-1])
+
+
+
+class _CompactMetricDataBatch(object):
+  """ Accumulates metric data samples in the metric storer's "compact"
+  encoding, which spells out each metric name once per batch
+  """
+
+  __slots__ = ("numSamples", "numBytes", "_samplesByMetric")
+
+  def __init__(self):
+    self.numSamples = 0
+    self.numBytes = 0
+    self._samplesByMetric = dict()
+
+
+  def add(self, metricName, value, epochTimestamp):
+    samples = self._samplesByMetric.get(metricName)
+    if samples is None:
+      samples = self._samplesByMetric[metricName] = []
+      # Account for the quoted metric name key and its list delimiters
+      self.numBytes += len(metricName) + 8
+
+    samples.append((value, epochTimestamp))
+    self.numSamples += 1
+    # A [value, epoch] pair with separators; 17 significant digits of a float
+    # plus a 10-digit epoch is the typical upper bound
+    self.numBytes += 36
+
+
+  def serialize(self):
+    return json.dumps(dict(protocol=METRIC_DATA_PROTOCOL_COMPACT,
+                           data=self._samplesByMetric))
+
+
+  def describe(self):
+    return "numMetrics=%d" % (len(self._samplesByMetric),)
+
 
 
 @contextlib.contextmanager
-def metricDataBatchWrite(log):
+def metricDataBatchWrite(log, compact=False):
   """ Context manager for sending metric data samples more efficiently using
   batches.
 
   :param log: logger object for logging
+  :param bool compact: True to encode batches in the metric storer's "compact"
+    protocol, which is smaller and cheaper to parse when batches contain
+    multiple samples per metric; False (default) for the "plain" protocol
 
   On entry, it yields a callable putSample for putting metric data samples:
 
     putSample(metricName, value, epochTimestamp)
 
   The user calls putSample for each metricDataSample that it wants to send;
-  putSample accumulates incoming samples into a batch and sends each batch to
-  Taurus server when optimal batch size is reached. At normal exit, the context
-  manager sends remaining samples, if any
+  putSample accumulates incoming samples into a batch until either
+  _METRIC_DATA_BATCH_WRITE_SIZE samples or _METRIC_DATA_BATCH_WRITE_MAX_BYTES
+  is reached. Completed batches are published to Taurus server in groups of up
+  to _METRIC_DATA_PUBLISH_PIPELINE_DEPTH, waiting for the broker's
+  acknowledgments once per group. At normal exit, the context manager sends
+  remaining samples, if any.
+
+  The message bus connection is borrowed from a process-wide pool and returned
+  on exit, so repeated calls don't pay for connection setup each time.
 
   Usage example:
 
@@ -746,34 +922,58 @@ def metricDataBatchWrite(log):
 
   # __enter__ part begins here:
 
-  batch = []
+  batchClass = _CompactMetricDataBatch if compact else _PlainMetricDataBatch
+
+  # Batch being accumulated; a single-element list so the nested functions can
+  # replace it
+  currentBatch = [batchClass()]
 
-  bus = message_bus_connector.MessageBusConnector()
+  # Completed batches pending publishing
+  pendingBatches = []
 
-  def sendBatch():
+  def publishPendingBatches():
     try:
-      msg = json.dumps(dict(protocol="plain", data=batch))
-      bus.publish(mqName="taurus.metric.custom.data", body=msg, persistent=True)
-      log.info("Published numSamples=%d: first=%r; last=%r",
-               len(batch), str(batch[0]), str(batch[-1]))
+      bus.publishMany(mqName=_METRIC_DATA_MQ_NAME,
+                      bodies=[batch.serialize() for batch in pendingBatches],
+                      persistent=True)
+      log.info("Published numBatches=%d; numSamples=%d: %s .. %s",
+               len(pendingBatches),
+               sum(batch.numSamples for batch in pendingBatches),
+               pendingBatches[0].describe(), pendingBatches[-1].describe())
     finally:
-      del batch[:]
+      del pendingBatches[:]
+
+
+  def completeBatch():
+    pendingBatches.append(currentBatch[0])
+    currentBatch[0] = batchClass()
+    if len(pendingBatches) >= _METRIC_DATA_PUBLISH_PIPELINE_DEPTH:
+      publishPendingBatches()
 
 
   def putSample(metricName, value, epochTimestamp):
-    # NOTE: we use %r for value to avoid loss of accuracy in floats;
     # NOTE: we cast value to float to deal with values like the long 72001L that
     #   would fail the parsing back to float in the receiver.
-    batch.append("%s %r %d" % (metricName, float(value), epochTimestamp))
-    if len(batch) >= _METRIC_DATA_BATCH_WRITE_SIZE:
-      sendBatch()
+    batch = currentBatch[0]
+    batch.add(metricName, float(value), epochTimestamp)
+    if (batch.numSamples >= _METRIC_DATA_BATCH_WRITE_SIZE or
+        batch.numBytes >= _METRIC_DATA_BATCH_WRITE_MAX_BYTES):
+      completeBatch()
 
 
-  with bus:
+  bus = _metricDataPublisherPool.acquire()
+  try:
     yield putSample
 
     # __exit__ part begins here:
 
     # Send remnants, if any
-    if batch:
-      sendBatch()
+    if currentBatch[0].numSamples:
+      completeBatch()
+    if pendingBatches:
+      publishPendingBatches()
+  except:
+    _metricDataPublisherPool.discard(bus)
+    raise
+  else:
+    _metricDataPublisherPool.release(bus)
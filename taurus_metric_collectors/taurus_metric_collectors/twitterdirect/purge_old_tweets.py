@@ -29,6 +29,7 @@ installer.
 
 import logging
 from optparse import OptionParser
+import time
 
 import sqlalchemy as sql
 
@@ -40,6 +41,12 @@ from taurus_metric_collectors import collectorsdb, logging_support
 # MySQL "Lock wait timeout exceeded" error
 _MAX_DELETE_BATCH_SIZE = 1000
 
+# Default upper bound on the fraction of time spent deleting rows; after each
+# batch, the purge pauses in proportion to the duration of the batch's delete
+# so that twitter_direct_agent's tweet storer threads aren't starved of locks on
+# the twitter tables while a large backlog of old tweets is purged
+_DEFAULT_MAX_DUTY_CYCLE = 0.5
+
 
 
 g_log = logging.getLogger("purge_old_tweets")
@@ -50,6 +57,7 @@ def _parseArgs():
   """
   :returns: dict of arg names and values:
     days - Messages older than this number of days will be purged
+    maxDutyCycle - Upper bound on fraction of time spent deleting rows
   """
   helpString = ("%prog [options] Purges old records from {} table.").format(
     collectorsdb.schema.twitterTweets)
@@ -63,6 +71,15 @@ def _parseArgs():
     dest="days",
     help="Messages older than this number of days will be purged")
 
+  parser.add_option(
+    "--max-duty-cycle",
+    action="store",
+    type="float",
+    dest="maxDutyCycle",
+    default=_DEFAULT_MAX_DUTY_CYCLE,
+    help=("Upper bound on the fraction of time spent deleting rows, between 0 "
+          "(exclusive) and 1 (no throttling) [default: %default]"))
+
   options, remainingArgs = parser.parse_args()
   if remainingArgs:
     parser.error("Unexpected remaining args: {}".format(remainingArgs))
@@ -70,39 +87,42 @@ def _parseArgs():
   if options.days is None:
     parser.error("Required \"--days\" option was not specified")
 
+  if not 0 < options.maxDutyCycle <= 1:
+    parser.error("--max-duty-cycle must be greater than 0 and at most 1")
+
   return dict(
-    days=options.days)
+    days=options.days,
+    maxDutyCycle=options.maxDutyCycle)
 
 
 
-def purgeOldTweets(thresholdDays):
+def purgeOldTweets(thresholdDays, maxDutyCycle=_DEFAULT_MAX_DUTY_CYCLE):
   """ Purge tweets from twitter_tweets table that are older than the given
-  number of days.
+  number of days. The corresponding twitter_tweet_samples rows are deleted via
+  the cascading foreign key.
+
+  Old tweets are swept in a single pass over the created_at index, resuming
+  each batch just past the last candidate of the previous one, and every batch
+  is deleted by primary key in its own short transaction. This keeps the cost
+  of each batch bounded regardless of the number of old tweets or of rows
+  deleted by previous batches but not yet purged by innodb.
 
   :param int thresholdDays: tweets older than this many days will be deleted
+  :param float maxDutyCycle: upper bound on the fraction of time spent deleting
+    rows, greater than 0 and at most 1; 1 disables throttling
 
   :returns: number of rows that were deleted
 
   """
   twitterTweetsSchema = collectorsdb.schema.twitterTweets
 
-  g_log.info("Estimating number of tweets in table=%s older than numDays=%s",
-             twitterTweetsSchema, thresholdDays)
-
   sqlEngine = collectorsdb.engineFactory()
 
-  selectionPredicate = (
-    twitterTweetsSchema.c.created_at <
-    sql.func.date_sub(sql.func.utc_timestamp(),
-                      sql.text("INTERVAL {:d} DAY".format(thresholdDays)))
-  )
-
-  estimate = _estimateNumTweetsToDelete(sqlEngine, selectionPredicate)
-
-  g_log.info("Number of candidate old tweets to purge: estimate=%s", estimate)
+  thresholdDatetime = _queryThresholdDatetime(sqlEngine=sqlEngine,
+                                              thresholdDays=thresholdDays)
 
-  if estimate == 0:
-    return 0
+  g_log.info("Purging tweets from table=%s created before %s (numDays=%s)",
+             twitterTweetsSchema, thresholdDatetime, thresholdDays)
 
   # NOTE: We'll be deleting in smaller batches to avoid "Lock wait timeout
   # exceeded".
@@ -115,8 +135,10 @@ def purgeOldTweets(thresholdDays):
   # also doesn't facilitate progress update, thus creating the perception that
   # the operation is "stuck".
   totalDeleted = 0
+  numBatches = 0
+  resumeAfter = None
 
-  while totalDeleted < estimate:
+  while True:
     # NOTE: we're dealing with a couple of issues here:
     #
     # 1. sqlalchemy core doesn't support LIMIT in delete statements, so we can't
@@ -125,71 +147,107 @@ def purgeOldTweets(thresholdDays):
     #    MySQL doesn't yet support 'LIMIT & IN/ALL/ANY/SOME subquery"
     #
     # So, we're going to stick with sqlalchemy, and break the operation into two
-    # queries: get the candidate uids, then delete rows with those uids
+    # queries: get the candidate rows, then delete rows with their uids
 
-    limit = min(_MAX_DELETE_BATCH_SIZE, estimate - totalDeleted)
+    candidates = _queryCandidateRows(sqlEngine=sqlEngine,
+                                     thresholdDatetime=thresholdDatetime,
+                                     resumeAfter=resumeAfter,
+                                     limit=_MAX_DELETE_BATCH_SIZE)
 
-    uids = _queryCandidateRows(sqlEngine=sqlEngine,
-                               selectionPredicate=selectionPredicate,
-                               limit=limit)
-
-    if uids:
-      numDeleted = _deleteRows(sqlEngine=sqlEngine, uids=uids)
-    else:
-      # This could happen if something else deleted tweets in our range, such
-      # as the process_tweet_deletions service that services deletion requests
-      # from Twitter.
+    if not candidates:
       break
 
+    resumeAfter = candidates[-1]
+
+    deleteStartTime = time.time()
+
+    # NOTE: some of the rows may be gone already if something else deleted
+    # tweets in our range, such as the process_tweet_deletions service that
+    # services deletion requests from Twitter.
+    numDeleted = _deleteRows(sqlEngine=sqlEngine,
+                             uids=tuple(uid for _createdAt, uid in candidates))
+
+    deleteDurationSec = time.time() - deleteStartTime
+
     totalDeleted += numDeleted
+    numBatches += 1
+
+    g_log.info("Purged %s old tweets [%s so far] created through %s",
+               numDeleted, totalDeleted, resumeAfter[0])
+
+    if len(candidates) < _MAX_DELETE_BATCH_SIZE:
+      # That was the last batch
+      break
 
-    g_log.info("Purged %s old tweets [%s of %s]", numDeleted, totalDeleted,
-               estimate)
+    # Throttle to yield the twitter tables to ingest
+    time.sleep(deleteDurationSec * (1.0 - maxDutyCycle) / maxDutyCycle)
 
 
-  g_log.info("Purged numRows=%s of estimated=%s old tweets from table=%s",
-             totalDeleted, estimate, twitterTweetsSchema)
+  g_log.info("Purged numRows=%s old tweets in numBatches=%s from table=%s",
+             totalDeleted, numBatches, twitterTweetsSchema)
 
   return totalDeleted
 
 
 
 @collectorsdb.retryOnTransientErrors
-def _estimateNumTweetsToDelete(sqlEngine, selectionPredicate):
+def _queryThresholdDatetime(sqlEngine, thresholdDays):
   """
   :param sqlalchemy.engine.Engine sqlEngine:
-  :param selectionPredicate: predicate for where clause that selects the desired
-    tweets for purging
+  :param int thresholdDays: number of days before the database server's current
+    UTC time
+
+  :returns: UTC datetime that is the given number of days before the database
+    server's current UTC time; tweets created before it are to be purged
+  :rtype: datetime.datetime
   """
-  # This may take a very long time (beyond retry timeout) if the number of old
-  # tweets is "huge"
   return sqlEngine.execute(
-    sql.select([sql.func.count()])
-    .where(selectionPredicate)).scalar()
+    sql.select([
+      sql.func.date_sub(sql.func.utc_timestamp(),
+                        sql.text("INTERVAL {:d} DAY".format(thresholdDays)))
+    ])).scalar()
 
 
 
 @collectorsdb.retryOnTransientErrors
-def _queryCandidateRows(sqlEngine, selectionPredicate, limit):
-  """Query candidate uid's of tweets to delete.
+def _queryCandidateRows(sqlEngine, thresholdDatetime, resumeAfter, limit):
+  """Query the next batch of tweets to delete in (created_at, uid) order.
 
   :param sqlalchemy.engine.Engine sqlEngine:
-  :param selectionPredicate: predicate for where clause that selects the desired
-    tweets for purging
-  :param int limit: max number of rows to delete
-
-  :returns: sequence of matching UID values (may be empty)
+  :param datetime.datetime thresholdDatetime: select tweets created before this
+    UTC datetime
+  :param resumeAfter: (created_at, uid) pair of the last candidate returned by
+    the previous call to resume after; None to start from the oldest tweet
+  :param int limit: max number of rows to return
+
+  :returns: sequence of (created_at, uid) pairs of matching tweets (may be
+    empty)
   """
   twitterTweetsSchema = collectorsdb.schema.twitterTweets
 
+  createdAtColumn = twitterTweetsSchema.c.created_at
+  uidColumn = twitterTweetsSchema.c.uid
+
+  predicate = createdAtColumn < thresholdDatetime
+
+  if resumeAfter is not None:
+    lastCreatedAt, lastUid = resumeAfter
+    predicate = sql.and_(
+      predicate,
+      sql.or_(createdAtColumn > lastCreatedAt,
+              sql.and_(createdAtColumn == lastCreatedAt,
+                       uidColumn > lastUid)))
+
+  # NOTE: created_at_idx includes the uid primary key, so this is an index-only
+  # range scan
   results = sqlEngine.execute(
-    sql.select([twitterTweetsSchema.c.uid])
-    .where(selectionPredicate)
-    .order_by(twitterTweetsSchema.c.created_at.asc())
+    sql.select([createdAtColumn, uidColumn])
+    .where(predicate)
+    .order_by(createdAtColumn.asc(), uidColumn.asc())
     .limit(limit)
   ).fetchall()
 
-  return tuple(str(row[0]) for row in results)
+  return tuple((row[0], str(row[1])) for row in results)
 
 
 
@@ -227,7 +285,7 @@ def main():
         g_log.exception("Failed!")
       raise
 
-    purgeOldTweets(options["days"])
+    purgeOldTweets(options["days"], maxDutyCycle=options["maxDutyCycle"])
   except Exception:
     g_log.exception("Failed!")
     raise
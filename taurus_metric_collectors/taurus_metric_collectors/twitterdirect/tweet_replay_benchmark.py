@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Record/replay harness for throughput testing of the twitter_direct_agent
+pipeline (stream listener -> TweetStorer -> TweetForwarder and
+MetricDataForwarder) without the live Twitter stream.
+
+Recording mode saves the raw twitter stream of the configured twitter metrics as
+newline-delimited status JSON, and the twitter user ids of the metrics'
+screen names in <file>.userids.json; it requires twitter credentials (see
+twitter_direct_agent).
+
+Replay mode feeds the recorded statuses into a TweetStorer's message holding
+queue at the recorded pace sped up by a rate multiplier (or as fast as
+possible), waits for the tagged tweets to be saved, then forwards the replayed
+tweets and their tweet volume metrics via the message bus, and reports
+end-to-end tweets/sec, tagging time, tweet insert latency and forwarding lag.
+Tweets are replayed with fresh ids and creation times, so a recording may be
+replayed repeatedly.
+
+WARNING: replay saves tweets in the configured collectorsdb, advances its
+tweet forwarding tracker and publishes to the configured RabbitMQ broker; use
+local stand-ins. Replay refuses to run against non-local hosts unless
+--allow-remote is specified.
+"""
+
+from datetime import datetime
+import json
+import logging
+from optparse import OptionParser
+import os
+import Queue
+import threading
+import time
+
+import sqlalchemy as sql
+import tweepy
+
+from nta.utils import amqp
+from nta.utils.message_bus_connector import MessageBusConnector
+
+from taurus_metric_collectors import collectorsdb
+from taurus_metric_collectors.collectorsdb import schema
+from taurus_metric_collectors import logging_support
+from taurus_metric_collectors import metric_utils
+from taurus_metric_collectors.twitterdirect import twitter_direct_agent
+
+
+
+g_log = logging.getLogger("tweet_replay_benchmark")
+
+
+_DEFAULT_RECORD_DURATION_SEC = 600
+
+_DEFAULT_RATE_MULTIPLIER = 1.0
+
+_DEFAULT_AGG_PERIOD_SEC = 300
+
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# Format of the "created_at" field of twitter statuses
+_CREATED_AT_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+
+
+def _parseArgs():
+  """
+  :returns: dict of arg names and values:
+    path - recording file path
+    record - True to record; False to replay
+    durationSec - recording duration in seconds
+    rateMultiplier - replay speed relative to the recording; 0 for unthrottled
+    aggPeriod - tweet volume aggregation period in seconds
+    allowRemote - True to allow replay against non-local hosts
+  """
+  helpString = ("%prog [options] Records the twitter stream of the configured "
+                "twitter metrics, or replays a recording through the "
+                "twitter_direct_agent pipeline and measures its throughput.")
+
+  parser = OptionParser(helpString)
+
+  parser.add_option(
+    "--file",
+    action="store",
+    type="string",
+    dest="path",
+    help="Recording file of newline-delimited status JSON")
+
+  parser.add_option(
+    "--record",
+    action="store_true",
+    default=False,
+    dest="record",
+    help="Record the live twitter stream instead of replaying")
+
+  parser.add_option(
+    "--duration",
+    action="store",
+    type="int",
+    dest="durationSec",
+    default=_DEFAULT_RECORD_DURATION_SEC,
+    help="Recording duration in seconds [default: %default]")
+
+  parser.add_option(
+    "--rate",
+    action="store",
+    type="float",
+    dest="rateMultiplier",
+    default=_DEFAULT_RATE_MULTIPLIER,
+    help=("Replay speed relative to the recording, e.g., 10 replays ten times "
+          "faster; 0 replays as fast as possible [default: %default]"))
+
+  parser.add_option(
+    "--period",
+    action="store",
+    type="int",
+    dest="aggPeriod",
+    default=_DEFAULT_AGG_PERIOD_SEC,
+    help="Volume aggregation period in seconds [default: %default]")
+
+  parser.add_option(
+    "--allow-remote",
+    action="store_true",
+    default=False,
+    dest="allowRemote",
+    help=("Allow replay against non-local collectorsdb and RabbitMQ hosts "
+          "[default: %default]"))
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: {}".format(remainingArgs))
+
+  if not options.path:
+    parser.error("Required \"--file\" option was not specified")
+
+  if options.durationSec <= 0:
+    parser.error("--duration must be positive")
+
+  if options.rateMultiplier < 0:
+    parser.error("--rate must not be negative")
+
+  return dict(
+    path=options.path,
+    record=options.record,
+    durationSec=options.durationSec,
+    rateMultiplier=options.rateMultiplier,
+    aggPeriod=options.aggPeriod,
+    allowRemote=options.allowRemote)
+
+
+
+def _getUserIdsPath(path):
+  """
+  :returns: path of the twitter user id mappings file of the given recording
+  """
+  return path + ".userids.json"
+
+
+
+class _StatusRecorder(tweepy.StreamListener):
+  """ Writes raw stream data to a file until the given time """
+
+  def __init__(self, outFile, stopEpoch):
+    """
+    :param outFile: file object open for writing
+    :param float stopEpoch: stop recording at this UNIX time
+    """
+    super(_StatusRecorder, self).__init__()
+    self._outFile = outFile
+    self._stopEpoch = stopEpoch
+    self.numRecorded = 0
+
+
+  def on_data(self, data):
+    """ tweepy.StreamListener data sink
+
+    :returns: False to stop stream and close
+    """
+    data = data.strip()
+    if data:
+      self._outFile.write(data + "\n")
+      self.numRecorded += 1
+
+    return time.time() < self._stopEpoch
+
+
+  def on_error(self, status):
+    g_log.error("tweepy.Streamer httpError=%s", status)
+
+
+
+def recordStatuses(path, durationSec):
+  """ Record the raw twitter stream of the configured twitter metrics
+
+  :param str path: recording file path
+  :param int durationSec: recording duration in seconds
+
+  :returns: number of recorded messages
+  """
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+
+  authHandler = tweepy.OAuthHandler(
+    twitter_direct_agent.DEFAULT_CONSUMER_KEY,
+    twitter_direct_agent.DEFAULT_CONSUMER_SECRET)
+  authHandler.set_access_token(
+    twitter_direct_agent.DEFAULT_ACCESS_TOKEN,
+    twitter_direct_agent.DEFAULT_ACCESS_TOKEN_SECRET)
+
+  userIdToMetricsMap = twitter_direct_agent.lookupUserIdToMetricsMap(
+    metricSpecs, authHandler)
+
+  with open(_getUserIdsPath(path), "w") as outFile:
+    json.dump(
+      dict((userId, sorted(metrics))
+           for userId, metrics in userIdToMetricsMap.iteritems()),
+      outFile, indent=2, sort_keys=True)
+
+  streamFilterParams = twitter_direct_agent.buildStreamFilterParams(
+    metricSpecs, userIdToMetricsMap)
+
+  with open(path, "w") as outFile:
+    recorder = _StatusRecorder(outFile, stopEpoch=time.time() + durationSec)
+
+    g_log.info("Recording for durationSec=%d into file=%s", durationSec, path)
+
+    tweepy.Stream(authHandler, recorder).filter(**streamFilterParams)
+
+  return recorder.numRecorded
+
+
+
+def _getRecordedEpoch(msg):
+  """
+  :param dict msg: decoded stream message
+  :returns: UNIX time when the message was streamed per its "timestamp_ms"
+    field, which notifications carry in their only top-level object; None if
+    not available
+  """
+  timestampMs = msg.get("timestamp_ms")
+  if timestampMs is None and len(msg) == 1:
+    body = msg.values()[0]
+    if isinstance(body, dict):
+      timestampMs = body.get("timestamp_ms")
+
+  return int(timestampMs) / 1000.0 if timestampMs is not None else None
+
+
+
+def _loadStatuses(path, rateMultiplier, replayStartEpoch):
+  """ Load recorded stream messages and prepare them for replay: tweets get
+  fresh ids and creation times corresponding to their scheduled replay times.
+
+  :param str path: recording file path
+  :param float rateMultiplier: replay speed relative to the recording; 0 for
+    unthrottled
+  :param float replayStartEpoch: UNIX time when replay is to start
+
+  :returns: sequence of (<replay epoch>, <raw message>) pairs
+  """
+  # Tweet ids in the style of twitter's, which are based on creation time
+  nextTweetId = int(replayStartEpoch * 1000) << 22
+
+  firstRecordedEpoch = None
+  recordedEpoch = None
+
+  statuses = []
+  with open(path) as inFile:
+    for line in inFile:
+      line = line.strip()
+      if not line:
+        continue
+
+      try:
+        msg = json.loads(line)
+      except ValueError:
+        g_log.warning("Skipping undecodable message=%r", line[:100])
+        continue
+
+      recordedEpoch = _getRecordedEpoch(msg) or recordedEpoch
+      if firstRecordedEpoch is None:
+        firstRecordedEpoch = recordedEpoch
+
+      if rateMultiplier and recordedEpoch is not None:
+        replayEpoch = (replayStartEpoch +
+                       (recordedEpoch - firstRecordedEpoch) / rateMultiplier)
+      else:
+        replayEpoch = replayStartEpoch
+
+      if "in_reply_to_status_id" in msg:
+        msg["id"] = nextTweetId
+        msg["id_str"] = str(nextTweetId)
+        nextTweetId += 1
+        msg["created_at"] = datetime.utcfromtimestamp(replayEpoch).strftime(
+          _CREATED_AT_FORMAT)
+        line = json.dumps(msg)
+
+      statuses.append((replayEpoch, line))
+
+  return statuses
+
+
+
+def _feedStatuses(msgQ, statuses):
+  """ Feed stream messages to the message holding queue at their replay times
+  like TwitterStreamListener.on_data, blocking when the queue is full
+
+  :param Queue.Queue msgQ: TweetStorer's message holding queue
+  :param statuses: sequence of (<replay epoch>, <raw message>) pairs
+
+  :returns: two-tuple (<number of times blocked on full queue>, <total seconds
+    blocked>)
+  """
+  numStalls = 0
+  stallSec = 0
+
+  msgQ.put(twitter_direct_agent.TwitterStreamListener.ConnectionMarker)
+
+  for replayEpoch, data in statuses:
+    delaySec = replayEpoch - time.time()
+    if delaySec > 0:
+      time.sleep(delaySec)
+
+    try:
+      msgQ.put_nowait(data)
+    except Queue.Full:
+      stallStart = time.time()
+      msgQ.put(data)
+      numStalls += 1
+      stallSec += time.time() - stallStart
+
+  return numStalls, stallSec
+
+
+
+def _checkLocalHosts():
+  """
+  :raises ValueError: if collectorsdb or RabbitMQ is configured on a non-local
+    host
+  """
+  dbHost = collectorsdb.CollectorsDbConfig().get("repository", "host")
+  amqpHost = amqp.connection.getRabbitmqConnectionParameters().host
+
+  for name, host in (("collectorsdb", dbHost), ("RabbitMQ", amqpHost)):
+    if host not in _LOCAL_HOSTS:
+      raise ValueError("Refusing to replay against {} on non-local host={}; "
+                       "use --allow-remote to override".format(name, host))
+
+
+
+def _declareMessageBusTargets():
+  """ Declare the message queue and exchange that the forwarders publish to,
+  in case the broker is a fresh stand-in
+  """
+  # pylint: disable=W0212
+
+  with MessageBusConnector() as bus:
+    bus.createMessageQueue(metric_utils._METRIC_DATA_MQ_NAME, durable=True)
+
+  with amqp.synchronous_amqp_client.SynchronousAmqpClient(
+      amqp.connection.getRabbitmqConnectionParameters()) as amqpClient:
+    amqpClient.declareExchange(
+      exchange=twitter_direct_agent.TweetForwarder._NON_METRIC_EXCHANGE,
+      exchangeType="topic",
+      durable=True)
+
+
+
+def runReplay(path, rateMultiplier, aggSec):
+  """ Replay a recording through the twitter_direct_agent pipeline
+
+  :param str path: recording file path
+  :param float rateMultiplier: replay speed relative to the recording; 0 for
+    unthrottled
+  :param int aggSec: tweet volume aggregation period in seconds
+
+  :returns: dict of results
+  """
+  # pylint: disable=W0212
+
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+
+  userIdToMetricsMap = dict()
+  userIdsPath = _getUserIdsPath(path)
+  if os.path.exists(userIdsPath):
+    with open(userIdsPath) as inFile:
+      userIdToMetricsMap = dict(
+        (userId, set(metrics))
+        for userId, metrics in json.load(inFile).iteritems())
+  else:
+    g_log.warning("Missing twitter user ids file=%s; tweets will be tagged "
+                  "only on cashtags", userIdsPath)
+
+  taggingMap = twitter_direct_agent.buildTaggingMap(
+    dict((spec.symbol, spec.metric) for spec in metricSpecs),
+    userIdToMetricsMap)
+
+  _declareMessageBusTargets()
+
+  # Forward only the replayed tweets
+  sqlEngine = collectorsdb.engineFactory()
+  maxSeq = sqlEngine.execute(
+    sql.select([sql.func.max(schema.twitterTweetSamples.c.seq)])).scalar()
+  metric_utils.updateLastEmittedNonMetricSequence(
+    twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+    maxSeq or 0)
+
+  aggRefDatetime = metric_utils.establishLastEmittedSampleDatetime(
+    key=twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+    aggSec=aggSec)
+
+  g_log.info("Loading recording from file=%s", path)
+  replayStartEpoch = time.time() + 1
+  statuses = _loadStatuses(path, rateMultiplier, replayStartEpoch)
+
+  msgQ = Queue.Queue(maxsize=twitter_direct_agent._MAX_HOLDING_QUEUE_SIZE)
+
+  storer = twitter_direct_agent.TweetStorer(taggingMap=taggingMap,
+                                            aggSec=aggSec,
+                                            msgQ=msgQ,
+                                            echoData=False)
+  storerThread = threading.Thread(target=storer._run)
+  storerThread.setDaemon(True)
+  storerThread.start()
+
+  # Replay and wait for the storer to save all the tagged tweets
+  g_log.info("Replaying numMessages=%d at rate=%s", len(statuses),
+             rateMultiplier or "unthrottled")
+
+  startTime = time.time()
+
+  numStalls, stallSec = _feedStatuses(msgQ, statuses)
+
+  numFed = len(statuses) + 1  # including ConnectionMarker
+  while storer._numReapedMessages < numFed:
+    time.sleep(0.1)
+
+  storer._writerQ.join()
+
+  storedTime = time.time()
+
+  # Forward the replayed tweets
+  tweetForwarder = twitter_direct_agent.TweetForwarder()
+  with MessageBusConnector() as bus:
+    tweetForwarder._forwardTweetsViaRabbitmq(bus)
+
+  tweetsForwardedTime = time.time()
+
+  # Forward the replayed tweet volume metrics
+  if statuses:
+    aggStartDatetime, aggStopDatetime = (
+      metric_utils.aggTimestampFromSampleTimestamp(
+        sampleDatetime=datetime.utcfromtimestamp(epoch),
+        aggRefDatetime=aggRefDatetime,
+        aggSec=aggSec)
+      for epoch in (statuses[0][0], statuses[-1][0] + aggSec))
+
+    twitter_direct_agent.MetricDataForwarder(
+      metricSpecs, aggSec).aggregateAndForward(aggStartDatetime,
+                                               aggStopDatetime)
+
+  metricsForwardedTime = time.time()
+
+  runtimeStats = storer._runtimeStreamingStats
+
+  return dict(
+    numMessages=len(statuses),
+    numTweets=runtimeStats.numTweets,
+    numTaggedTweets=storer._numSavedTweets,
+    numStalls=numStalls,
+    stallSec=stallSec,
+    storeSec=storedTime - startTime,
+    reapSec=storer._reapDurationSec,
+    numSavedBatches=storer._numSavedBatches,
+    saveSec=storer._saveDurationSec,
+    numForwardedTweets=tweetForwarder._numForwardedTweets,
+    tweetForwardSec=tweetsForwardedTime - storedTime,
+    metricForwardSec=metricsForwardedTime - tweetsForwardedTime)
+
+
+
+def main():
+  logging_support.LoggingSupport().initTool()
+
+  try:
+    options = _parseArgs()
+
+    if options["record"]:
+      numRecorded = recordStatuses(path=options["path"],
+                                   durationSec=options["durationSec"])
+      g_log.info("Recorded numMessages=%d", numRecorded)
+      return
+
+    if not options["allowRemote"]:
+      _checkLocalHosts()
+
+    results = runReplay(path=options["path"],
+                        rateMultiplier=options["rateMultiplier"],
+                        aggSec=options["aggPeriod"])
+
+    g_log.info("numMessages=%d; numTweets=%d; numTaggedTweets=%d; "
+               "queueFullStalls=%d; queueFullStallSec=%.1f",
+               results["numMessages"], results["numTweets"],
+               results["numTaggedTweets"], results["numStalls"],
+               results["stallSec"])
+
+    g_log.info("endToEnd: storeSec=%.1f; tweetsPerSec=%.0f",
+               results["storeSec"],
+               results["numTweets"] / max(results["storeSec"], 1e-6))
+
+    g_log.info("tagging: totalSec=%.2f; usecPerTweet=%.1f",
+               results["reapSec"],
+               results["reapSec"] * 1e6 / max(results["numTweets"], 1))
+
+    g_log.info("dbInsert: numBatches=%d; meanBatchLatencySec=%.3f",
+               results["numSavedBatches"],
+               results["saveSec"] / max(results["numSavedBatches"], 1))
+
+    g_log.info("forwarding: numForwardedTweets=%d; tweetForwardLagSec=%.1f; "
+               "metricForwardSec=%.1f",
+               results["numForwardedTweets"], results["tweetForwardSec"],
+               results["metricForwardSec"])
+  except SystemExit as e:
+    # OptionParser uses SystemExit on option-parsing error
+    if e.code != 0:
+      g_log.exception("Failed!")
+    raise
+  except Exception:
+    g_log.exception("Failed!")
+    raise
+
+
+
+if __name__ == "__main__":
+  main()
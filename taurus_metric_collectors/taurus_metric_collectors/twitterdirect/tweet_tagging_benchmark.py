@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of tweet tagging throughput in tweets/sec per core: compares decoding
+and tagging every raw status (as TweetStorer did originally) with screening raw
+statuses through TweetTagPrefilter first.
+
+Statuses are synthesized from the twitter metrics configuration, using fake
+user ids in place of twitter's users/lookup results, so no twitter credentials
+or network access are needed.
+"""
+
+import json
+import logging
+from optparse import OptionParser
+import os
+import random
+
+from taurus_metric_collectors import logging_support
+from taurus_metric_collectors.twitterdirect import twitter_direct_agent
+
+
+
+g_log = logging.getLogger("tweet_tagging_benchmark")
+
+
+_DEFAULT_NUM_TWEETS = 20000
+
+_DEFAULT_HIT_RATIO = 0.05
+
+_FILLER_WORDS = ("market", "today", "news", "great", "check", "this", "out",
+                 "lol", "weekend", "coffee", "ticket", "deal", "live", "now")
+
+
+
+def _parseArgs():
+  """
+  :returns: dict of arg names and values:
+    numTweets - number of synthetic statuses
+    hitRatio - fraction of statuses that match a metric
+  """
+  helpString = ("%prog [options] Measures tweet tagging throughput in "
+                "tweets/sec per core with and without the raw status "
+                "pre-filter.")
+
+  parser = OptionParser(helpString)
+
+  parser.add_option(
+    "--tweets",
+    action="store",
+    type="int",
+    dest="numTweets",
+    default=_DEFAULT_NUM_TWEETS,
+    help="Number of synthetic statuses [default: %default]")
+
+  parser.add_option(
+    "--hit-ratio",
+    action="store",
+    type="float",
+    dest="hitRatio",
+    default=_DEFAULT_HIT_RATIO,
+    help="Fraction of statuses that match a metric [default: %default]")
+
+  options, remainingArgs = parser.parse_args()
+  if remainingArgs:
+    parser.error("Unexpected remaining args: {}".format(remainingArgs))
+
+  if not 0 <= options.hitRatio <= 1:
+    parser.error("--hit-ratio must be between 0 and 1")
+
+  return dict(
+    numTweets=options.numTweets,
+    hitRatio=options.hitRatio)
+
+
+
+def _makeTaggingMap(metricSpecs, rng):
+  """ Build a tagging map for the given metric specs with fake user ids
+
+  :returns: two-tuple (<taggingMap>, <userIds>)
+  """
+  symbolToMetricMap = dict()
+  userIdToMetricsMap = dict()
+
+  for spec in metricSpecs:
+    symbolToMetricMap[spec.symbol] = spec.metric
+    for _screenName in spec.screenNames:
+      userId = str(rng.randint(10 ** 7, 10 ** 10))
+      userIdToMetricsMap.setdefault(userId, set()).add(spec.metric)
+
+  return (twitter_direct_agent.buildTaggingMap(symbolToMetricMap,
+                                               userIdToMetricsMap),
+          userIdToMetricsMap.keys())
+
+
+def _makeStatus(rng, symbol, userId, mentionId):
+  """ Synthesize a JSON-encoded twitter status resembling a streamed one
+
+  :param symbol: cashtag ticker to include or None
+  :param userId: author's user id
+  :param mentionId: mentioned user's id or None
+  """
+  words = [rng.choice(_FILLER_WORDS) for _ in xrange(rng.randint(8, 20))]
+  symbols = []
+  mentions = []
+  if symbol is not None:
+    words.append("$" + symbol.upper())
+    symbols.append({"indices": [0, 0], "text": symbol.upper()})
+  if mentionId is not None:
+    words.append("@someone")
+    mentions.append({"id": int(mentionId), "id_str": mentionId,
+                     "indices": [0, 0], "name": "Someone",
+                     "screen_name": "someone"})
+
+  tweetId = rng.randint(10 ** 17, 10 ** 18)
+  status = {
+    "created_at": "Wed Aug 05 14:44:32 +0000 2015",
+    "id": tweetId,
+    "id_str": str(tweetId),
+    "text": " ".join(words),
+    "source": "<a href=\"http://twitter.com\" rel=\"nofollow\">Twitter</a>",
+    "truncated": False,
+    "in_reply_to_status_id": None,
+    "in_reply_to_status_id_str": None,
+    "in_reply_to_user_id": None,
+    "in_reply_to_user_id_str": None,
+    "in_reply_to_screen_name": None,
+    "user": {
+      "id": int(userId),
+      "id_str": userId,
+      "name": "User %s" % (userId,),
+      "screen_name": "user%s" % (userId,),
+      "location": "",
+      "description": " ".join(rng.choice(_FILLER_WORDS) for _ in xrange(10)),
+      "followers_count": rng.randint(0, 10000),
+      "friends_count": rng.randint(0, 1000),
+      "lang": "en",
+      "profile_image_url": "http://pbs.twimg.com/profile_images/1/x.png",
+    },
+    "geo": None,
+    "coordinates": None,
+    "place": None,
+    "retweet_count": 0,
+    "favorite_count": 0,
+    "entities": {
+      "hashtags": [],
+      "urls": [],
+      "user_mentions": mentions,
+      "symbols": symbols
+    },
+    "favorited": False,
+    "retweeted": False,
+    "filter_level": "low",
+    "lang": "en",
+    "timestamp_ms": "1438785872858"
+  }
+
+  return json.dumps(status)
+
+
+def _makeStatuses(metricSpecs, userIds, numTweets, hitRatio, rng):
+  """ Synthesize JSON-encoded statuses, `hitRatio` of which match a metric via
+  a cashtag, the author or a mention
+  """
+  symbols = [spec.symbol for spec in metricSpecs]
+
+  statuses = []
+  for _ in xrange(numTweets):
+    authorId = str(rng.randint(10 ** 7, 10 ** 10))
+    if rng.random() < hitRatio:
+      how = rng.randint(0, 2)
+      if how == 0 and symbols:
+        statuses.append(_makeStatus(rng, rng.choice(symbols), authorId, None))
+      elif how == 1 and userIds:
+        statuses.append(_makeStatus(rng, None, rng.choice(userIds), None))
+      elif userIds:
+        statuses.append(_makeStatus(rng, None, authorId, rng.choice(userIds)))
+      else:
+        statuses.append(_makeStatus(rng, None, authorId, None))
+    else:
+      statuses.append(_makeStatus(rng, None, authorId, None))
+
+  return statuses
+
+
+def _cpuTime():
+  """
+  :returns: user + system CPU time of this process in seconds
+  """
+  times = os.times()
+  return times[0] + times[1]
+
+
+def _tagAll(statuses, taggingMap, tagPrefilter):
+  """ Decode and tag the given raw statuses like TweetStorer._reapMessages
+
+  :param tagPrefilter: TweetTagPrefilter instance or None to decode and tag
+    every status
+  :returns: number of tagged statuses
+  """
+  numTagged = 0
+  for raw in statuses:
+    if tagPrefilter is not None and not tagPrefilter.mayMatch(raw):
+      continue
+
+    msg = json.loads(raw)
+    msg["metricTagSet"] = set()
+    for tagger, mappings in taggingMap.iteritems():
+      tagger(msg, mappings)
+
+    if msg["metricTagSet"]:
+      numTagged += 1
+
+  return numTagged
+
+
+def runBenchmark(numTweets, hitRatio):
+  """ Measure tagging throughput with and without TweetTagPrefilter
+
+  :param int numTweets: number of synthetic statuses
+  :param float hitRatio: fraction of statuses that match a metric
+  :returns: dict of results
+  """
+  rng = random.Random(42)
+
+  metricSpecs = twitter_direct_agent.loadMetricSpecs()
+  taggingMap, userIds = _makeTaggingMap(metricSpecs, rng)
+
+  statuses = _makeStatuses(metricSpecs, userIds, numTweets, hitRatio, rng)
+
+  startTime = _cpuTime()
+  tagPrefilter = twitter_direct_agent.TweetTagPrefilter(taggingMap)
+  compileSec = _cpuTime() - startTime
+
+  results = dict(numTweets=numTweets,
+                 numStatusBytes=sum(len(s) for s in statuses),
+                 numMetrics=len(metricSpecs),
+                 numUserIds=len(userIds),
+                 compileSec=compileSec)
+
+  for label, prefilter in (("full", None), ("prefiltered", tagPrefilter)):
+    startTime = _cpuTime()
+    numTagged = _tagAll(statuses, taggingMap, prefilter)
+    elapsedSec = max(_cpuTime() - startTime, 1e-6)
+
+    results[label] = dict(numTagged=numTagged,
+                          tweetsPerSec=numTweets / elapsedSec)
+
+  if results["full"]["numTagged"] != results["prefiltered"]["numTagged"]:
+    raise AssertionError("Prefiltering changed tagging results: %r" % results)
+
+  return results
+
+
+
+def main():
+  logging_support.LoggingSupport().initTool()
+
+  try:
+    options = _parseArgs()
+
+    results = runBenchmark(numTweets=options["numTweets"],
+                           hitRatio=options["hitRatio"])
+
+    g_log.info("numTweets=%d; avgStatusBytes=%d; numMetrics=%d; numUserIds=%d;"
+               " prefilterCompileSec=%.3f",
+               results["numTweets"],
+               results["numStatusBytes"] // max(results["numTweets"], 1),
+               results["numMetrics"], results["numUserIds"],
+               results["compileSec"])
+
+    for label in ("full", "prefiltered"):
+      g_log.info("%s: tweetsPerSecPerCore=%.0f; numTagged=%d",
+                 label, results[label]["tweetsPerSec"],
+                 results[label]["numTagged"])
+
+    g_log.info("speedup=%.2fx",
+               results["prefiltered"]["tweetsPerSec"] /
+               results["full"]["tweetsPerSec"])
+  except SystemExit as e:
+    # OptionParser uses SystemExit on option-parsing error
+    if e.code != 0:
+      g_log.exception("Failed!")
+    raise
+  except Exception:
+    g_log.exception("Failed!")
+    raise
+
+
+
+if __name__ == "__main__":
+  main()
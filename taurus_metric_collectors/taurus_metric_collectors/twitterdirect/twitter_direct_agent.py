@@ -23,7 +23,6 @@
 from collections import namedtuple
 from collections import defaultdict
 from datetime import datetime, timedelta
-from itertools import islice
 import json
 import logging
 import multiprocessing
@@ -31,6 +30,7 @@ from optparse import OptionParser
 import os
 import pprint
 import Queue
+import re
 import sys
 import threading
 import time
@@ -72,6 +72,21 @@ DEFAULT_ACCESS_TOKEN_SECRET = os.environ.get(
 # Our tracker key in the emitted_sample_tracker table
 _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY = "twitter-tweets-volume"
 
+# Maximum number of tweet volume aggregation intervals covered by a single
+# range aggregation query (one day of 5-minute intervals); when catching up,
+# the emitted sample tracker is advanced once per such chunk
+_MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY = 288
+
+
+# Maximum number of raw messages held between a TwitterStreamListener and its
+# TweetStorer; when full, the listener blocks, pushing back on the stream
+_MAX_HOLDING_QUEUE_SIZE = 20000
+
+
+# Window of most recent tweet samples over which the tweet rates of metrics
+# are averaged for balancing metrics among the stream listeners
+_METRIC_LOAD_WINDOW_SEC = 24 * 3600
+
 
 # Initialize logging
 g_log = logging.getLogger("twitter_direct_agent")
@@ -109,50 +124,104 @@ def loadMetricSpecs():
 
 
 
-def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
-  """ Build tweet tag processing map and the corresponding twitter stream filter
-  params
+def _buildTrieRegexPattern(words):
+  """ Build a regular expression pattern that matches any of the given words,
+  with alternatives factored by common prefix. Unlike a flat alternation, the
+  regex engine examines each input character at most once per starting
+  position, regardless of the number of words.
 
-  :param metricSpecs: sequence of TwitterMetricSpec objects
+  :param words: non-empty iterable of non-empty strings
+  :returns: regular expression pattern string
+  """
+  trie = dict()
+  for word in words:
+    node = trie
+    for char in word:
+      node = node.setdefault(char, dict())
+    # End-of-word marker
+    node[""] = None
+
+  def nodeToPattern(node):
+    alternatives = [re.escape(char) + nodeToPattern(node[char])
+                    for char in sorted(node) if char]
+    if not alternatives:
+      return ""
+
+    if len(alternatives) == 1:
+      pattern = alternatives[0]
+    else:
+      pattern = "(?:%s)" % ("|".join(alternatives),)
 
-  :returns: a two-tuple (<taggingMap>, <streamFilterParams>)
-    <taggingMap>: a dict of callables to corresponding mapping dictionaries;
-      each mapping dictionary key is a target value of interest (e.g., stock
-      ticker) and the corresponding value is the name(s) of the metric(s)
-      corresonding to that value; the callable is passed each message and
-      the mapping dictionary corresponding to the callable, and is responsible
-      for adding metric names to the metricTagSet of the message for any hits
-      that it finds. This example demonstrates the structure of the
-      <taggingMap>:
-        {
-          tagOnSymbols: {
-            "ACN": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
-            "IRBT": "TWITTER.TWEET.HANDLE.IRBT.VOLUME",
-            . . .
-          },
-          tagOnSourceUsers: {
-            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
-            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
-                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
-            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
-            . . .
-          },
-          tagOnMentions: {
-            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
-            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
-                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
-            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
-            . . .
-          }
-        }
-    <streamFilterParams>: a dictionary of parameters to pass to
-      tweepy.Stream.filter(); for examle:
-        {
-          "track": ["@Accenture", "@iRobot", "@RoombaLove", "$ACN", "$IRBT",],
-          "follow": ["10194682", "62515374", "111682122",]
-        }
+    if "" in node:
+      pattern = "(?:%s)?" % (pattern,)
+
+    return pattern
+
+  return nodeToPattern(trie)
+
+
+
+class TweetTagPrefilter(object):
+  """ Fast, conservative pre-filter for raw JSON-encoded twitter statuses.
+
+  Scans the raw status for any of the mapping keys of a tagging map as the
+  value of an "id_str" or "text" field (case-insensitively), using a single
+  compiled prefix-factored pattern. The taggers from
+  `buildTaggingMapAndStreamFilterParams()` only tag a status when a user's
+  "id_str" or a cashtag's "text" equals a mapping key, so a status that this
+  pre-filter rejects cannot be tagged and needn't be decoded. A match doesn't
+  guarantee that the status will be tagged; e.g., the key may belong to an
+  embedded retweeted status.
+  """
+
+  # Names of the status fields whose values the taggers look up in their
+  # mapping dictionaries
+  _TAGGED_FIELD_NAMES = ("id_str", "text")
+
+  def __init__(self, taggingMap):
+    """
+    :param taggingMap: tweet tagging map as returned by
+      `buildTaggingMapAndStreamFilterParams()`
+    """
+    tokens = set()
+    for mappings in taggingMap.itervalues():
+      for key in mappings:
+        token = key.lower()
+        tokens.add(token)
+        # JSON encoders may escape the forward slash
+        if "/" in token:
+          tokens.add(token.replace("/", "\\/"))
+
+    if tokens:
+      self._regex = re.compile(
+        r'"(?:%s)"\s*:\s*"%s"' % ("|".join(self._TAGGED_FIELD_NAMES),
+                                   _buildTrieRegexPattern(tokens)))
+    else:
+      self._regex = None
+
+
+  def mayMatch(self, rawStatus):
+    """
+    :param basestring rawStatus: JSON-encoded twitter status
+    :returns: False if the status cannot match any tagging map key; True if it
+      might
+    :rtype: bool
+    """
+    return (self._regex is not None and
+            self._regex.search(rawStatus.lower()) is not None)
+
+
+
+def buildTaggingMap(symbolToMetricMap, userIdToMetricsMap):
+  """ Build tweet tag processing map from the given mappings; see
+  `buildTaggingMapAndStreamFilterParams()`
+
+  :param dict symbolToMetricMap: lower-case stock ticker to metric name map
+  :param dict userIdToMetricsMap: twitter user id to set of metric names map
+  :returns: <taggingMap> as described in
+    `buildTaggingMapAndStreamFilterParams()`; it references the given
+    mapping dicts, so later updates to them apply to the tagging map.
   """
-  g_log.info("Building Metric Tagging Map and Stream Filter Params")
 
   def tagOnSymbols(msg, mappings):
     """ Adds metric names to msg["metricTagSet"] for each cashtag in msg with a
@@ -207,22 +276,116 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
         msg["metricTagSet"].update(metricNames)
 
 
-  symbolToMetricMap = dict()
-  userIdToMetricsMap = dict()
-
-  taggingMap = {
+  return {
     tagOnSymbols: symbolToMetricMap,
     tagOnSourceUsers: userIdToMetricsMap,
     tagOnMentions: userIdToMetricsMap
   }
 
+
+
+def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
+  """ Build tweet tag processing map and the corresponding twitter stream filter
+  params
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
+
+  :returns: a two-tuple (<taggingMap>, <streamFilterParams>)
+    <taggingMap>: a dict of callables to corresponding mapping dictionaries;
+      each mapping dictionary key is a target value of interest (e.g., stock
+      ticker) and the corresponding value is the name(s) of the metric(s)
+      corresonding to that value; the callable is passed each message and
+      the mapping dictionary corresponding to the callable, and is responsible
+      for adding metric names to the metricTagSet of the message for any hits
+      that it finds. This example demonstrates the structure of the
+      <taggingMap>:
+        {
+          tagOnSymbols: {
+            "ACN": "TWITTER.TWEET.HANDLE.ACN.VOLUME",
+            "IRBT": "TWITTER.TWEET.HANDLE.IRBT.VOLUME",
+            . . .
+          },
+          tagOnSourceUsers: {
+            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
+            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
+            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
+            . . .
+          },
+          tagOnMentions: {
+            "10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"]),  # @Accenture
+            "20536157": set(["TWITTER.TWEET.HANDLE.GOOGL.VOLUME",
+                             "TWITTER.TWEET.HANDLE.GOOG.VOLUME"]), # @google
+            "111682122": set(["TWITTER.TWEET.HANDLE.IRBT.VOLUME"]) # @RoombaLove
+            . . .
+          }
+        }
+      NOTE: each tagger must only tag a message when the value of an "id_str"
+      or "text" field in the message equals (case-insensitively) a key of its
+      mapping dictionary; see `TweetTagPrefilter`.
+    <streamFilterParams>: a dictionary of parameters to pass to
+      tweepy.Stream.filter(); for examle:
+        {
+          "track": ["@Accenture", "@iRobot", "@RoombaLove", "$ACN", "$IRBT",],
+          "follow": ["10194682", "62515374", "111682122",]
+        }
+  """
+  g_log.info("Building Metric Tagging Map and Stream Filter Params")
+
+  symbolToMetricMap = dict(
+    (spec.symbol, spec.metric) for spec in metricSpecs)
+
+  userIdToMetricsMap = lookupUserIdToMetricsMap(metricSpecs, authHandler)
+
+  taggingMap = buildTaggingMap(symbolToMetricMap, userIdToMetricsMap)
+
+  streamFilterParams = buildStreamFilterParams(metricSpecs, userIdToMetricsMap)
+
+  return taggingMap, streamFilterParams
+
+
+
+def buildStreamFilterParams(metricSpecs, userIdToMetricsMap):
+  """ Build twitter stream filter params for the given metrics; see
+  `buildTaggingMapAndStreamFilterParams()`
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
+  :param dict userIdToMetricsMap: twitter user id to set of metric names map as
+    returned by `lookupUserIdToMetricsMap()`
+  :returns: <streamFilterParams> as described in
+    `buildTaggingMapAndStreamFilterParams()`
+  """
+  screenNames = set(screenName.lower()
+                    for spec in metricSpecs
+                    for screenName in spec.screenNames)
+
+  symbols = set(spec.symbol for spec in metricSpecs)
+
+  return dict(
+    track=([("@" + screen) for screen in screenNames] +
+           [("$" + ticker) for ticker in symbols]),
+    follow=userIdToMetricsMap.keys(),
+    stall_warnings=True
+  )
+
+
+
+def lookupUserIdToMetricsMap(metricSpecs, authHandler):
+  """ Look up the twitter user ids of the screen names of the given metrics
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
+  :param tweepy.OAuthHandler authHandler: twitter API authorization
+
+  :returns: twitter user id to set of metric names map
+  :rtype: dict
+  """
+  userIdToMetricsMap = dict()
+
   screenNameToMetricsMap = dict()
 
   tweepyApi = tweepy.API(authHandler)
 
   for spec in metricSpecs:
-    symbolToMetricMap[spec.symbol] = spec.metric
-
     for screenName in spec.screenNames:
       screenNameToMetricsMap.setdefault(screenName.lower(), set()).add(
         spec.metric)
@@ -255,16 +418,49 @@ def buildTaggingMapAndStreamFilterParams(metricSpecs, authHandler):
   if unmappedScreenNames:
     g_log.error("No mappings for screenNames=%s", unmappedScreenNames)
 
-  # Generate stream filter parameters
-  streamFilterParams = dict(
-    track=([("@" + screen) for screen in screenNameToMetricsMap] +
-           [("$" + ticker) for ticker in symbolToMetricMap]),
-    follow=userIdToMetricsMap.keys(),
-    stall_warnings=True
-  )
+  return userIdToMetricsMap
 
 
-  return taggingMap, streamFilterParams
+
+class _AdaptiveBatchSizer(object):
+  """ Thread-safe batch size that adapts to storage latency: it's halved when
+  saving a batch takes longer than the target latency, and doubled when a full
+  batch (i.e., there is a backlog) is saved well within the target latency.
+  """
+
+  def __init__(self, minSize, maxSize, targetLatencySec):
+    """
+    :param int minSize: lower bound on batch size; also the initial size
+    :param int maxSize: upper bound on batch size
+    :param float targetLatencySec: desired upper bound on the time it takes to
+      save a batch
+    """
+    self._minSize = minSize
+    self._maxSize = maxSize
+    self._targetLatencySec = targetLatencySec
+    self._size = minSize
+    self._lock = threading.Lock()
+
+
+  @property
+  def size(self):
+    """ Current batch size """
+    return self._size
+
+
+  def update(self, batchSize, numItems, latencySec):
+    """ Adjust batch size based on the outcome of saving a batch
+
+    :param int batchSize: batch size in effect when the batch was collected
+    :param int numItems: number of items collected in the batch
+    :param float latencySec: time it took to save the batch
+    """
+    with self._lock:
+      if latencySec > self._targetLatencySec:
+        self._size = max(self._minSize, self._size // 2)
+      elif (numItems >= batchSize and
+            latencySec < self._targetLatencySec / 2):
+        self._size = min(self._maxSize, max(self._size, batchSize * 2))
 
 
 
@@ -281,8 +477,21 @@ class TwitterStreamListener(tweepy.StreamListener):
     pass
 
 
+  class TaggingMapUpdate(object):
+    """ We enqueue instances of this class to notify our tweet storage thread
+    that the messages that follow are to be tagged using a new tagging map
+    following reassignment of metrics to this listener
+    """
+    def __init__(self, taggingMap):
+      self.taggingMap = taggingMap
+
+
+  # Minimum interval between backpressure warnings
+  _BACKPRESSURE_LOG_INTERVAL_SEC = 60
+
+
   def __init__(self, metricSpecs, aggPeriod, consumerKey, consumerSecret,
-               accessToken, accessTokenSecret, echoData):
+               accessToken, accessTokenSecret, echoData, metricSpecsQ=None):
     """
     :param metricSpecs: The metrics for which this Twitter Stream Listener
       instance is responsible.
@@ -293,6 +502,9 @@ class TwitterStreamListener(tweepy.StreamListener):
     :param accessToken: Twitter access token
     :param accessTokenSecret: Twitter access token secret
     :param echoData: Echo processed Twitter messages to stdout for debugging
+    :param metricSpecsQ: OPTIONAL queue delivering replacement sequences of
+      TwitterMetricSpec objects from the stream rebalancer; when one arrives,
+      the stream is reconnected with filter params for the new metrics
     """
     super(TwitterStreamListener, self).__init__()
 
@@ -303,6 +515,11 @@ class TwitterStreamListener(tweepy.StreamListener):
     self._accessToken=accessToken
     self._accessTokenSecret=accessTokenSecret
     self._echoData = echoData
+    self._metricSpecsQ = metricSpecsQ
+
+    # Replacement metric specs received from the rebalancer, pending
+    # reconnection of the stream
+    self._pendingMetricSpecs = None
 
     # See OP_MODE_ACTIVE, etc. in ApplicationConfig
     self._opMode = config.get("twitter_direct_agent", "opmode")
@@ -313,7 +530,12 @@ class TwitterStreamListener(tweepy.StreamListener):
                                        self._accessTokenSecret)
 
     self._storageThread = None
-    self._messageHoldingQ = Queue.Queue()
+    self._messageHoldingQ = Queue.Queue(maxsize=_MAX_HOLDING_QUEUE_SIZE)
+    # Backpressure stats: number of times and total duration that on_data
+    # blocked on a full message holding queue
+    self._numBackpressureStalls = 0
+    self._backpressureStallSec = 0
+    self._nextBackpressureLogTime = 0
     self._streamFilterParams = None
 
     # tweepy.Stream object
@@ -359,8 +581,24 @@ class TwitterStreamListener(tweepy.StreamListener):
     """
     self._checkHealth()
     #print json.dumps(json.loads(data), indent=4)
-    self._messageHoldingQ.put(data)
-    return True
+    try:
+      self._messageHoldingQ.put_nowait(data)
+    except Queue.Full:
+      # Apply backpressure to the stream until TweetStorer catches up
+      stallStart = time.time()
+      self._messageHoldingQ.put(data)
+      now = time.time()
+      self._numBackpressureStalls += 1
+      self._backpressureStallSec += now - stallStart
+      if now >= self._nextBackpressureLogTime:
+        self._nextBackpressureLogTime = now + self._BACKPRESSURE_LOG_INTERVAL_SEC
+        g_log.warning("Message holding queue full: numStalls=%d; "
+                      "totalStallSec=%.1f",
+                      self._numBackpressureStalls, self._backpressureStallSec)
+
+    # Stop the stream if metrics were reassigned, in case the disconnect
+    # request from `_runMetricSpecsWatcher()` raced with connecting
+    return self._pendingMetricSpecs is None
 
 
   def _checkHealth(self):
@@ -398,19 +636,64 @@ class TwitterStreamListener(tweepy.StreamListener):
     self._storageThread.setDaemon(True)
     self._storageThread.start()
 
-    # Stream
-    self._stream = tweepy.Stream(self._authHandler, self)
+    # Start the thread that applies metric reassignments from the rebalancer
+    if self._metricSpecsQ is not None:
+      watcherThread = threading.Thread(target=self._runMetricSpecsWatcher)
+      watcherThread.setDaemon(True)
+      watcherThread.start()
+
+    while True:
+      # Stream
+      self._stream = tweepy.Stream(self._authHandler, self)
+
+      g_log.info("Filtering via params=%s", self._streamFilterParams)
+
+      # See https://dev.twitter.com/streaming/reference/post/statuses/filter
+      self._stream.filter(**self._streamFilterParams)
+
+      metricSpecs = self._pendingMetricSpecs
+      if metricSpecs is None:
+        break
 
-    g_log.info("Filtering via params=%s", self._streamFilterParams)
+      # Reconnect with the metrics reassigned by the rebalancer
+      self._pendingMetricSpecs = None
+      self._metricSpecs = metricSpecs
 
-    # See https://dev.twitter.com/streaming/reference/post/statuses/filter
-    self._stream.filter(**self._streamFilterParams)
+      g_log.info("Reconnecting stream for reassigned numMetrics=%d",
+                 len(metricSpecs))
+
+      taggingMap, self._streamFilterParams = (
+        buildTaggingMapAndStreamFilterParams(self._metricSpecs,
+                                             self._authHandler))
+
+      # NOTE: messages from the previous stream that are still queued will be
+      # tagged using the previous tagging map
+      self._messageHoldingQ.put(self.TaggingMapUpdate(taggingMap))
 
     msg = "%s exited unexpectedly" % (self._stream.__class__.__name__)
     g_log.error(msg)
     raise RuntimeError(msg)
 
 
+  @logExceptions(g_log)
+  def _runMetricSpecsWatcher(self):
+    """ Thread function; receives replacement metric specs from the rebalancer
+    via self._metricSpecsQ and disconnects the stream so that `run()` may
+    reconnect it for the new metrics
+    """
+    while True:
+      metricSpecs = self._metricSpecsQ.get()
+
+      g_log.info("Received reassigned numMetrics=%d from rebalancer",
+                 len(metricSpecs))
+
+      self._pendingMetricSpecs = metricSpecs
+
+      stream = self._stream
+      if stream is not None:
+        stream.disconnect()
+
+
 
 class TweetStorer(object):
   """ This class is responsible to dequeueing messages from
@@ -419,6 +702,21 @@ class TweetStorer(object):
 
   _MAX_SAVED_TEXT_LEN = 2000
 
+  # Bounds on the number of messages per storage batch; the batch size adapts
+  # between them based on the latency of saving tweets
+  _MIN_BATCH_SIZE = 100
+  _MAX_BATCH_SIZE = 2000
+
+  # Latency of saving a batch of tweets that the adaptive batch size aims for
+  _TARGET_SAVE_LATENCY_SEC = 1.0
+
+  # Number of writer threads saving tweets, each over its own connection
+  _NUM_WRITERS = 3
+
+  # Maximum number of tweet batches awaiting writers; when full, message
+  # reaping blocks, and the backpressure propagates to the stream listener
+  _MAX_PENDING_WRITER_BATCHES = _NUM_WRITERS * 2
+
 
   class _StreamingStatsBase(object):
     def __init__(self):
@@ -510,6 +808,7 @@ class TweetStorer(object):
     :param bool echoData: wheter we should log incoming messages
     """
     self._taggingMap = taggingMap
+    self._tagPrefilter = TweetTagPrefilter(taggingMap)
     self._aggSec = aggSec
     self._msgQ = msgQ
     self._echoData = echoData
@@ -522,6 +821,33 @@ class TweetStorer(object):
     # Overall runtime streaming stats
     self._runtimeStreamingStats = self._RuntimeStreamingStats()
 
+    self._batchSizer = _AdaptiveBatchSizer(
+      minSize=self._MIN_BATCH_SIZE,
+      maxSize=self._MAX_BATCH_SIZE,
+      targetLatencySec=self._TARGET_SAVE_LATENCY_SEC)
+
+    # Batches of tweets for writer threads: (<tweets>, <deletion requests>,
+    # <batch size>, <number of messages in batch>) four-tuples
+    self._writerQ = Queue.Queue(maxsize=self._MAX_PENDING_WRITER_BATCHES)
+
+    # Serializes commits of tweet references so that they become visible in
+    # the order of their sequence numbers; see `_saveTweets()`
+    self._referencesCommitLock = threading.Lock()
+
+    # Message reaping stats, updated by the storage thread
+    self._numReapedMessages = 0
+    self._reapDurationSec = 0
+
+    # Storage stats, updated by writer threads
+    self._storageStatsLock = threading.Lock()
+    self._numSavedTweets = 0
+    self._numSavedBatches = 0
+    self._saveDurationSec = 0
+
+    # Storage stats as of the last `_logStreamStats()` call
+    self._lastStatsTime = time.time()
+    self._lastStatsNumSavedTweets = 0
+
 
   @classmethod
   @logExceptions(g_log)
@@ -552,14 +878,22 @@ class TweetStorer(object):
       key=_EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
       aggSec=self._aggSec)
 
+    for i in xrange(self._NUM_WRITERS):
+      writerThread = threading.Thread(
+        target=self._runWriter,
+        name="%s-writer-%d" % (self.__class__.__name__, i),
+        kwargs=dict(aggRefDatetime=aggRefDatetime))
+      writerThread.setDaemon(True)
+      writerThread.start()
+
     statsIntervalSec = 600
     nextStatsUpdateEpoch = time.time()
 
-    maxBatchSize = 100
     while True:
       # Accumulate batch of incoming messages for SQL insert performance
+      batchSize = self._batchSizer.size
       messages = []
-      while len(messages) < maxBatchSize:
+      while len(messages) < batchSize:
         # Get the next incoming message
         timeout = 0.5 if messages else None
         try:
@@ -572,27 +906,30 @@ class TweetStorer(object):
 
       # Process the batch
       tweets = deletes = None
+      reapStartTime = time.time()
       try:
         tweets, deletes = self._reapMessages(messages)
       except Exception:  # pylint: disable=W0703
         g_log.exception("_reapMessages failed")
-
-      # Save (re)tweets
+      self._reapDurationSec += time.time() - reapStartTime
+
+      # Hand off (re)tweets to writer threads along with the batch's deletion
+      # requests, which are saved after the tweets; blocks while the writers
+      # are backlogged.
+      # NOTE: a deletion request that's saved before a tweet of an earlier
+      # batch is still effective, since process_tweet_deletions purges matching
+      # tweets until the request expires
       if tweets:
-        try:
-          self._saveTweets(messages=tweets, aggRefDatetime=aggRefDatetime)
-        except Exception:  # pylint: disable=W0703
-          g_log.exception("Failed to save numTweets=%d", len(tweets))
+        self._writerQ.put((tweets, deletes, batchSize, len(messages)))
+      else:
+        self._batchSizer.update(batchSize=batchSize,
+                                numItems=len(messages),
+                                latencySec=0)
 
-      # Save deletion requests
-      if deletes:
-        try:
-          self._saveTweetDeletionRequests(messages=deletes)
-        except Exception:  # pylint: disable=W0703
-          g_log.exception("Failed to save deletion numRequests=%d",
-                          len(deletes))
-          for msg in deletes:
-            g_log.error("Failed to save deletion msg=%s", msg)
+        if deletes:
+          self._saveTweetDeletionRequestsAndLogErrors(deletes)
+
+      self._numReapedMessages += len(messages)
 
       # Echo messages to stdout if requested
       if self._echoData:
@@ -607,11 +944,75 @@ class TweetStorer(object):
         self._logStreamStats()
 
 
+  @logExceptions(g_log)
+  def _runWriter(self, aggRefDatetime):
+    """ Writer thread function; saves batches of tweets and then their deletion
+    requests from self._writerQ
+
+    :param datetime aggRefDatetime: aggregation reference time for determining
+      aggregation timestamp of tweets
+    """
+    while True:
+      tweets, deletes, batchSize, numMessages = self._writerQ.get()
+
+      try:
+        startTime = time.time()
+        try:
+          self._saveTweets(messages=tweets, aggRefDatetime=aggRefDatetime)
+        except Exception:  # pylint: disable=W0703
+          g_log.exception("Failed to save numTweets=%d", len(tweets))
+        else:
+          with self._storageStatsLock:
+            self._numSavedTweets += len(tweets)
+            self._numSavedBatches += 1
+            self._saveDurationSec += time.time() - startTime
+        finally:
+          self._batchSizer.update(batchSize=batchSize,
+                                  numItems=numMessages,
+                                  latencySec=time.time() - startTime)
+
+        if deletes:
+          self._saveTweetDeletionRequestsAndLogErrors(deletes)
+      finally:
+        self._writerQ.task_done()
+
+
+  def _saveTweetDeletionRequestsAndLogErrors(self, deletes):
+    """ Save tweet deletion requests, logging them if that fails
+
+    :param deletes: sequence of Twitter "delete" status dicts
+    """
+    try:
+      self._saveTweetDeletionRequests(messages=deletes)
+    except Exception:  # pylint: disable=W0703
+      g_log.exception("Failed to save deletion numRequests=%d", len(deletes))
+      for msg in deletes:
+        g_log.error("Failed to save deletion msg=%s", msg)
+
+
   def _logStreamStats(self):
     g_log.info("Current stream stats: %s", self._currentStreamStats)
 
     g_log.info("Runtime streaming stats: %s", self._runtimeStreamingStats)
 
+    now = time.time()
+    with self._storageStatsLock:
+      numSavedTweets = self._numSavedTweets
+      saveDurationSec = self._saveDurationSec
+
+    g_log.info(
+      "Storage stats: queueDepth=%d; maxQueueDepth=%s; "
+      "pendingWriterBatches=%d; batchSize=%d; savedTweets=%d; "
+      "saveRate=%.1f tweets/sec; totalSaveSec=%.1f; totalReapSec=%.1f",
+      self._msgQ.qsize(), self._msgQ.maxsize or None,
+      self._writerQ.qsize(), self._batchSizer.size, numSavedTweets,
+      ((numSavedTweets - self._lastStatsNumSavedTweets) /
+       max(now - self._lastStatsTime, 1e-6)),
+      saveDurationSec, self._reapDurationSec)
+
+    self._lastStatsTime = now
+    self._lastStatsNumSavedTweets = numSavedTweets
+
 
   def _reapMessages(self, messages):
     """ Process the messages from TwitterStreamListener and update stats; they
@@ -626,7 +1027,8 @@ class TweetStorer(object):
 
     :param messages: messages received from our TwitterStreamListener
     :type messages: sequence of JSON strings representing twitter statuses
-      and/or TwitterStreamListener.ConnectionMarker
+      and/or TwitterStreamListener.ConnectionMarker and/or
+      TwitterStreamListener.TaggingMapUpdate
 
     :returns: a pair (tweets, deletes), where `tweets` is a possibly empty
       sequence of tweet status dicts each matching at least one metric and
@@ -641,11 +1043,22 @@ class TweetStorer(object):
     streamStats = self._currentStreamStats
     runtimeStats = self._runtimeStreamingStats
 
+    tagPrefilter = self._tagPrefilter
+
     tweets = []
     deletes = []
     for msg in messages:
       if isinstance(msg, basestring):
         # Got Twitter Status
+        if (not tagPrefilter.mayMatch(msg) and
+            '"in_reply_to_status_id"' in msg):
+          # A tweet that can't match any metrics; skip the costly decoding
+          streamStats.numTweets += 1
+          runtimeStats.numTweets += 1
+          streamStats.numUntaggedTweets += 1
+          runtimeStats.numUntaggedTweets += 1
+          continue
+
         try:
           msg = json.loads(msg)
         except ValueError:
@@ -720,6 +1133,13 @@ class TweetStorer(object):
           self._runtimeStreamingStats.streamNumber = 1
         else:
           self._runtimeStreamingStats.streamNumber += 1
+
+      elif isinstance(msg, TwitterStreamListener.TaggingMapUpdate):
+        # Got new tagging map for the messages that follow
+        g_log.info("%s: got tagging map update", self.__class__.__name__)
+
+        self._taggingMap = msg.taggingMap
+        self._tagPrefilter = tagPrefilter = TweetTagPrefilter(msg.taggingMap)
       else:
         errorMsg = "Unexpected message from listener: %r" % (msg,)
         g_log.error(errorMsg)
@@ -861,6 +1281,8 @@ class TweetStorer(object):
   def _saveTweets(self, messages, aggRefDatetime):
     """ Save tweets and references in database
 
+    NOTE: called concurrently by writer threads
+
     See https://dev.twitter.com/overview/api/tweets
 
     :param messages: sequence of tweet dict received from twitter with an
@@ -883,23 +1305,38 @@ class TweetStorer(object):
 
     g_log.debug("tweetRows=%s, referenceRows=%s", tweetRows, referenceRows)
 
+    if not tweetRows:
+      return
+
+    # NOTE: we use "IGNORE" to avoid errors due to occasional duplicate tweets
+    # from twitter stream
+
     @collectorsdb.retryOnTransientErrors
     def saveWithRetries():
-      # NOTE: we use "IGNORE" to avoid errors due to occasional duplicate tweets
-      # from twitter stream
-      with self._sqlEngine.begin() as conn:
-        # Save twitter message
-        conn.execute(
-          schema.twitterTweets.insert(  # pylint: disable=E1120
-            ).prefix_with("IGNORE", dialect="mysql"),
-          tweetRows)
-
-        # Save corresponding references
-        # NOTE: some tweets may match multiple metrics
-        conn.execute(
-          schema.twitterTweetSamples.insert(  # pylint: disable=E1120
-            ).prefix_with("IGNORE", dialect="mysql"),
-          referenceRows)
+      with self._sqlEngine.connect() as conn:
+        # Save the tweets and their references in one transaction, so that
+        # neither becomes visible without the other
+        with conn.begin() as transaction:
+          # Save twitter message
+          # NOTE: the bulky tweets are inserted concurrently by writer threads
+          # ahead of taking the lock
+          conn.execute(
+            schema.twitterTweets.insert(  # pylint: disable=E1120
+              ).prefix_with("IGNORE", dialect="mysql"),
+            tweetRows)
+
+          # NOTE: TweetForwarder forwards tweets in the order of reference
+          # sequence numbers, so references of concurrent writers must not be
+          # committed out of that order
+          with self._referencesCommitLock:
+            # Save corresponding references
+            # NOTE: some tweets may match multiple metrics
+            conn.execute(
+              schema.twitterTweetSamples.insert(  # pylint: disable=E1120
+                ).prefix_with("IGNORE", dialect="mysql"),
+              referenceRows)
+
+            transaction.commit()
 
     saveWithRetries()
 
@@ -954,10 +1391,29 @@ class TweetForwarder(object):
   # Sleep duration between forwarding cycles
   _SLEEP_SEC = 5
 
+  # Maximum number of tweet sample rows read per keyset-paginated query
+  _READ_BATCH_SIZE = 2000
+
+  # Maximum number of tweet items per published message
+  _PUBLISH_BATCH_SIZE = 100
+
+  # Number of published messages between updates of the last forwarded
+  # sequence in the database; upon restart, up to this many messages may be
+  # forwarded again
+  _PUBLISHED_BATCHES_PER_TRACKER_UPDATE = 50
+
+  # Interval between forwarding stats reports
+  _STATS_INTERVAL_SEC = 600
+
 
   def __init__(self):
     self._sqlEngine = collectorsdb.engineFactory()
 
+    # Forwarding stats
+    self._numForwardedTweets = 0
+    self._lastStatsTime = time.time()
+    self._lastStatsNumForwardedTweets = 0
+
 
   @classmethod
   @logExceptions(g_log)
@@ -1006,20 +1462,34 @@ class TweetForwarder(object):
 
 
     # Run the forwarding loop
+    nextStatsUpdateEpoch = time.time() + self._STATS_INTERVAL_SEC
     with MessageBusConnector() as messageBus:
       while True:
-        self._forwardTweetsViaRabbitmq(messageBus)
+        lastForwardedSeq = self._forwardTweetsViaRabbitmq(messageBus)
+
+        now = time.time()
+        if now >= nextStatsUpdateEpoch:
+          nextStatsUpdateEpoch = now + self._STATS_INTERVAL_SEC
+          self._logForwardingStats(lastForwardedSeq)
 
         time.sleep(self._SLEEP_SEC)
 
 
   def _forwardTweetsViaRabbitmq(self, messageBus):
     """ Forward all unforwarded tweets to non-metric data exchange
+
+    Tweets are read in pages of up to _READ_BATCH_SIZE rows keyed on sequence
+    number, and each page is published as messages of up to
+    _PUBLISH_BATCH_SIZE tweets with a single wait for publisher
+    acknowledgments. The last forwarded sequence is saved every
+    _PUBLISHED_BATCHES_PER_TRACKER_UPDATE messages and upon return.
+
     :param messageBus: message bus connection
     :type messageBus: nta.utils.message_bus_connector.MessageBusConnector
-    """
-    batchSizeLimit = 100
 
+    :returns: sequence number of the last forwarded tweet sample
+    :rtype: int
+    """
     # Find out where to resume forwarding
     lastForwardedSeq = metric_utils.queryLastEmittedNonMetricSequence(
       _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY)
@@ -1027,28 +1497,78 @@ class TweetForwarder(object):
       # This should have been bootstrapped already
       raise Exception("Last emitted non-metric sequence not bootstrapped!")
 
-    while True:
-      # Load and build a batch of tweet items conforming to the interface
-      # defined by Taurus's dynamodb_service
-      lastForwardedSeq, batch = self.queryNonMetricTweetBatch(
-        sqlEngine=self._sqlEngine,
-        minSeq=lastForwardedSeq + 1,
-        maxItems=batchSizeLimit)
-
-      if not batch:
-        # No more rows - done!
-        break
+    savedSeq = lastForwardedSeq
+    numBatchesSinceTrackerUpdate = 0
 
-      # Forward the batch
-      self.publishNonMetricTweetBatch(messageBus, batch)
+    try:
+      while True:
+        # Load a page of tweet items conforming to the interface defined by
+        # Taurus's dynamodb_service
+        pageEndSeq, items = self.queryNonMetricTweetBatch(
+          sqlEngine=self._sqlEngine,
+          minSeq=lastForwardedSeq + 1,
+          maxItems=self._READ_BATCH_SIZE)
+
+        if pageEndSeq is None:
+          # No more rows - done!
+          break
 
-      # Update the last-forwarded sequence number
-      metric_utils.updateLastEmittedNonMetricSequence(
-        _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
-        lastForwardedSeq)
+        # Forward the page
+        batches = [items[i:i + self._PUBLISH_BATCH_SIZE]
+                   for i in xrange(0, len(items), self._PUBLISH_BATCH_SIZE)]
+        if batches:
+          self.publishNonMetricTweetBatches(messageBus, batches)
+
+        lastForwardedSeq = pageEndSeq
+        numBatchesSinceTrackerUpdate += len(batches)
+        self._numForwardedTweets += len(items)
+
+        g_log.info("Forwarded numTweets=%d ending with seq=%d",
+                   len(items), lastForwardedSeq)
+
+        # Update the last-forwarded sequence number periodically
+        if (numBatchesSinceTrackerUpdate >=
+            self._PUBLISHED_BATCHES_PER_TRACKER_UPDATE):
+          metric_utils.updateLastEmittedNonMetricSequence(
+            _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+            lastForwardedSeq)
+          savedSeq = lastForwardedSeq
+          numBatchesSinceTrackerUpdate = 0
+    finally:
+      # Save progress, including when bailing out on error
+      if lastForwardedSeq != savedSeq:
+        metric_utils.updateLastEmittedNonMetricSequence(
+          _EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
+          lastForwardedSeq)
+
+    return lastForwardedSeq
+
+
+  def _logForwardingStats(self, lastForwardedSeq):
+    """ Log tweet forwarding rate and lag
+
+    :param int lastForwardedSeq: sequence number of the last forwarded tweet
+      sample
+    """
+    @collectorsdb.retryOnTransientErrors
+    def queryMaxSeq():
+      sel = sql.select([sql.func.max(schema.twitterTweetSamples.c.seq)])
+      return self._sqlEngine.execute(sel).scalar()
+
+    maxSeq = queryMaxSeq() or 0
 
-      g_log.info("Forwarded numTweets=%d ending with seq=%d",
-                 len(batch), lastForwardedSeq)
+    now = time.time()
+    g_log.info(
+      "Tweet forwarding stats: forwardedTweets=%d; "
+      "forwardRate=%.1f tweets/sec; lastForwardedSeq=%d; maxSeq=%d; "
+      "lagSamples=%d",
+      self._numForwardedTweets,
+      ((self._numForwardedTweets - self._lastStatsNumForwardedTweets) /
+       max(now - self._lastStatsTime, 1e-6)),
+      lastForwardedSeq, maxSeq, max(maxSeq - lastForwardedSeq, 0))
+
+    self._lastStatsTime = now
+    self._lastStatsNumForwardedTweets = self._numForwardedTweets
 
 
   @classmethod
@@ -1157,6 +1677,26 @@ class TweetForwarder(object):
                   cls._NON_METRIC_EXCHANGE, cls._TWEET_NON_METRIC_ROUTING_KEY)
 
 
+  @classmethod
+  def publishNonMetricTweetBatches(cls, messageBus, batches):
+    """ Publish non-metric tweet batches via RabbitMQ, one message per batch,
+    waiting for the broker's publisher acknowledgments once for all of them
+
+    :param messageBus: message bus connection
+    :type messageBus: nta.utils.message_bus_connector.MessageBusConnector
+    :param batches: sequence of batches, each a sequence of dicts as returned
+      by cls.queryNonMetricTweetBatch
+    """
+    delivered = messageBus.publishExgMany(
+      exchange=cls._NON_METRIC_EXCHANGE,
+      routingKey=cls._TWEET_NON_METRIC_ROUTING_KEY,
+      bodies=[json.dumps(batch) for batch in batches],
+      properties=cls._TWEET_BASIC_AMQP_PROPERTIES)
+    if not delivered:
+      g_log.error("Failed to deliver messages to exchange=%s; routing_key=%s",
+                  cls._NON_METRIC_EXCHANGE, cls._TWEET_NON_METRIC_ROUTING_KEY)
+
+
 
 class MetricDataForwarder(object):
   """ This class is responsible for aggregating and forwarding metric data """
@@ -1221,6 +1761,10 @@ class MetricDataForwarder(object):
     """ Aggregate tweet volume metrics in the given datetime range and forward
     them to Taurus Engine.
 
+    Tweet volumes are aggregated with one range query per chunk of up to
+    _MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY aggregation intervals rather than
+    one query per interval.
+
     NOTE: this may be called by tooling
 
     NOTE: does not updateLastEmittedSampleDatetime
@@ -1231,41 +1775,55 @@ class MetricDataForwarder(object):
       forwarding
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
+
+    :returns: UTC datetime of the last emitted aggregation interval; None if
+      the range contained no aggregation intervals
+    :rtype: datetime.datetime or None
     """
+    periodTimedelta = timedelta(seconds=self._aggSec)
+    lastAggDatetime = [None]
+
     def getSamples(aggStartDatetime):
       """Retrieve and yield metric data samples of interest"""
-      periodTimedelta = timedelta(seconds=self._aggSec)
+      maxChunkTimedelta = (periodTimedelta *
+                           _MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY)
 
       while aggStartDatetime < stopDatetime:
-        # Query Tweet Volume metrics for one aggregation interval
-        metricToVolumeMap = defaultdict(
-          int,
-          self._queryTweetVolumes(aggStartDatetime, metrics))
-
-        # Generate metric samples
-        epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
-          aggStartDatetime)
-
-        samples = tuple(
-          dict(
-            metricName=spec.metric,
-            value=metricToVolumeMap[spec.metric],
-            epochTimestamp=epochTimestamp)
-          for spec in self._metricSpecs
-          if metrics is None or spec.metric in metrics
-        )
+        # Query Tweet Volume metrics for a chunk of aggregation intervals
+        chunkStopDatetime = min(stopDatetime,
+                                aggStartDatetime + maxChunkTimedelta)
+
+        aggAndMetricToVolumeMap = defaultdict(int)
+        for aggDatetime, metric, volume in self._queryTweetVolumeRange(
+            aggStartDatetime, chunkStopDatetime, metrics):
+          aggAndMetricToVolumeMap[(aggDatetime, metric)] = volume
+
+        while aggStartDatetime < chunkStopDatetime:
+          # Generate metric samples
+          epochTimestamp = date_time_utils.epochFromNaiveUTCDatetime(
+            aggStartDatetime)
 
-        if g_log.isEnabledFor(logging.DEBUG):
-          g_log.debug("samples=%s", pprint.pformat(samples))
+          samples = tuple(
+            dict(
+              metricName=spec.metric,
+              value=aggAndMetricToVolumeMap[(aggStartDatetime, spec.metric)],
+              epochTimestamp=epochTimestamp)
+            for spec in self._metricSpecs
+            if metrics is None or spec.metric in metrics
+          )
 
-        for sample in samples:
-          yield sample
+          if g_log.isEnabledFor(logging.DEBUG):
+            g_log.debug("samples=%s", pprint.pformat(samples))
 
-        g_log.info("Yielded numSamples=%d for agg=%s",
-                   len(samples), aggStartDatetime)
+          for sample in samples:
+            yield sample
 
-        # Set up for next iteration
-        aggStartDatetime += periodTimedelta
+          g_log.info("Yielded numSamples=%d for agg=%s",
+                     len(samples), aggStartDatetime)
+
+          # Set up for next iteration
+          lastAggDatetime[0] = aggStartDatetime
+          aggStartDatetime += periodTimedelta
 
 
     # Emit samples to Taurus Engine
@@ -1278,12 +1836,15 @@ class MetricDataForwarder(object):
                           sample)
           raise
 
+    return lastAggDatetime[0]
+
 
   def _forwardTweetVolumeMetrics(self, lastEmittedAggTime, stopDatetime):
     """ Query tweet volume metrics since the given last emitted aggregation time
     through stopDatetime and forward them to Taurus. Update
     the datetime of the last successfully-emitted tweet volume metric batch in
-    the database.
+    the database once per chunk of up to
+    _MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY aggregation intervals.
 
     NOTE: Upon failure during forwarding, an error will be logged, and the
       function will return the UTC timestamp of the last successfully-emitted
@@ -1301,50 +1862,60 @@ class MetricDataForwarder(object):
     :rtype: datetime.datetime
     """
     periodTimedelta = timedelta(seconds=self._aggSec)
+    maxChunkTimedelta = (periodTimedelta *
+                         _MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY)
     aggStartDatetime = lastEmittedAggTime + periodTimedelta
 
     while aggStartDatetime < stopDatetime:
-      # Aggregate and forward Tweet Volume metrics for one aggregation interval
+      # Aggregate and forward Tweet Volume metrics for a chunk of aggregation
+      # intervals
       try:
-        self.aggregateAndForward(
+        chunkLastAggDatetime = self.aggregateAndForward(
           aggStartDatetime=aggStartDatetime,
-          stopDatetime=aggStartDatetime + periodTimedelta)
+          stopDatetime=min(stopDatetime, aggStartDatetime + maxChunkTimedelta))
       except Exception:  # pylint: disable=W0703
         return lastEmittedAggTime
 
       # Update db with last successfully-emitted datetime
       metric_utils.updateLastEmittedSampleDatetime(
         key=_EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY,
-        sampleDatetime=aggStartDatetime)
+        sampleDatetime=chunkLastAggDatetime)
 
       # Set up for next iteration
-      lastEmittedAggTime = aggStartDatetime
-      aggStartDatetime += periodTimedelta
+      lastEmittedAggTime = chunkLastAggDatetime
+      aggStartDatetime = chunkLastAggDatetime + periodTimedelta
 
 
     return lastEmittedAggTime
 
 
   @collectorsdb.retryOnTransientErrors
-  def _queryTweetVolumes(self, aggDatetime, metrics):
-    """ Query the database for the counts of tweet metric volumes for the
-    specified aggregation.
+  def _queryTweetVolumeRange(self, aggStartDatetime, stopDatetime, metrics):
+    """ Query the database for the counts of tweet metric volumes for all
+    aggregations in the given datetime range using a single
+    `GROUP BY agg_ts, metric` query over the (agg_ts, metric) index.
 
-    :param datetime aggDatetime: aggregation timestamp
+    :param datetime aggStartDatetime: UTC datetime of the first aggregation
+    :param datetime stopDatetime: non-inclusive upper bound UTC datetime
     :param metrics: optional sequence of metric names; if specified (non-None),
       the operation will be limited to the given metric names
-    :returns: a sparse sequence of two-tuples: (metric_name, count); metrics
-      that have no tweets in the given aggregation period will be absent from
-      the result.
+    :returns: a sparse sequence of three-tuples: (agg_ts, metric_name, count)
+      ordered by agg_ts; metrics that have no tweets in a given aggregation
+      period will be absent from the result for that period.
     """
+    aggTsColumn = schema.twitterTweetSamples.c.agg_ts
+    metricColumn = schema.twitterTweetSamples.c.metric
+
     sel = (
-      sql.select([schema.twitterTweetSamples.c.metric, sql.func.count()])
-      .where(schema.twitterTweetSamples.c.agg_ts == aggDatetime)
-      .group_by(schema.twitterTweetSamples.c.metric)
+      sql.select([aggTsColumn, metricColumn, sql.func.count()])
+      .where(aggTsColumn >= aggStartDatetime)
+      .where(aggTsColumn < stopDatetime)
+      .group_by(aggTsColumn, metricColumn)
+      .order_by(aggTsColumn, metricColumn)
     )
 
     if metrics is not None:
-      sel = sel.where(schema.twitterTweetSamples.c.metric.in_(metrics))
+      sel = sel.where(metricColumn.in_(metrics))
 
     return self._sqlEngine.execute(sel).fetchall()
 
@@ -1486,24 +2057,221 @@ def _parseArgs():
 
 
 
-def _partition(l, numParts):
-  """ Partition a sequence into the given number of parts. The last
-  partition will get any of the leftovers.
+def _queryMetricTweetRates(windowSec):
+  """ Query historical tweet rates of metrics from twitter_tweet_samples
+
+  :param int windowSec: rates are averaged over this many most recent seconds
+
+  :returns: dict of metric names to their tweet rates in tweets per hour;
+    metrics without any samples in the window are omitted
+  """
+  samplesSchema = schema.twitterTweetSamples
+
+  sel = (
+    sql.select([samplesSchema.c.metric, sql.func.count()])
+    .where(samplesSchema.c.agg_ts >=
+           datetime.utcnow() - timedelta(seconds=windowSec))
+    .group_by(samplesSchema.c.metric)
+  )
+
+  @collectorsdb.retryOnTransientErrors
+  def queryWithRetries():
+    return collectorsdb.engineFactory().execute(sel).fetchall()
+
+  windowHours = windowSec / 3600.0
 
-  :param sequence l:
+  return dict((metric, count / windowHours)
+              for metric, count in queryWithRetries())
+
+
+
+def _estimateMetricLoads(metricSpecs):
+  """ Estimate the stream load of each metric by its historical tweet rate.
+
+  NOTE: failure to query the rates is logged, and the metrics are then assumed
+  to have no load, which results in an equal-count partitioning by
+  `_partitionByLoad()`
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
+
+  :returns: dict of metric names to their estimated loads
+  """
+  try:
+    metricRates = _queryMetricTweetRates(_METRIC_LOAD_WINDOW_SEC)
+  except Exception:  # pylint: disable=W0703
+    g_log.exception("Failed to query metric tweet rates")
+    metricRates = dict()
+
+  return dict((spec.metric, metricRates.get(spec.metric, 0))
+              for spec in metricSpecs)
+
+
+
+def _partitionByLoad(metricSpecs, numParts, metricLoads):
+  """ Partition metric specs into the given number of parts of approximately
+  equal total load. Metrics are assigned in order of decreasing load, each to
+  the part with the least total load so far and, between equally loaded parts,
+  to the one with fewer metrics.
+
+  :param metricSpecs: sequence of TwitterMetricSpec objects
   :param int numParts:
-  :returns: tuple of sequences
+  :param dict metricLoads: metric names to their loads, as returned by
+    `_estimateMetricLoads()`
+
+  :returns: tuple of lists of TwitterMetricSpec objects
   """
-  size = len(l) / numParts
-  partitions = tuple(
-    list(islice(l, i * size, (i + 1) * size)) for i in xrange(numParts))
+  partitions = tuple([] for _ in xrange(numParts))
+  partitionLoads = [0] * numParts
 
-  partitions[-1].extend(l[size * numParts:])
+  for spec in sorted(metricSpecs, key=lambda spec: -metricLoads[spec.metric]):
+    i = min(xrange(numParts),
+            key=lambda i: (partitionLoads[i], len(partitions[i])))
+    partitions[i].append(spec)
+    partitionLoads[i] += metricLoads[spec.metric]
 
   return partitions
 
 
 
+def _getPartitionLoads(partitions, metricLoads):
+  """
+  :param partitions: sequence of sequences of TwitterMetricSpec objects
+  :param dict metricLoads: metric names to their loads, as returned by
+    `_estimateMetricLoads()`
+
+  :returns: tuple of total loads of the given partitions
+  """
+  return tuple(sum(metricLoads[spec.metric] for spec in part)
+               for part in partitions)
+
+
+
+def _matchPartitions(currentMetrics, candidateMetrics):
+  """ Match candidate partitions to the current ones with the most metrics in
+  common, so as to retain most of the metrics of the current partitions. Pairs
+  are matched greedily in order of decreasing number of common metrics, which
+  takes O(n^2 log n) time in the number of partitions, unlike trying all of the
+  n! matchings, at the cost of possibly retaining fewer metrics than the best
+  matching would.
+
+  :param currentMetrics: sequence of sets of metric names of the current
+    partitions
+  :param candidateMetrics: sequence of sets of metric names of the candidate
+    partitions; as many as there are current partitions
+
+  :returns: list of candidate partition indexes matched to the current
+    partitions by their positions
+  """
+  numParts = len(currentMetrics)
+  pairs = sorted(
+    ((len(currentMetrics[i] & candidateMetrics[j]), i, j)
+     for i in xrange(numParts)
+     for j in xrange(numParts)),
+    key=lambda pair: (-pair[0], pair[1], pair[2]))
+
+  order = [None] * numParts
+  matchedCandidates = set()
+  for _, i, j in pairs:
+    if order[i] is None and j not in matchedCandidates:
+      order[i] = j
+      matchedCandidates.add(j)
+
+  return order
+
+
+
+class _StreamRebalancer(object):
+  """ Periodically repartitions metrics among the stream listeners by their
+  historical tweet rates, so that a few high-volume metrics don't overload one
+  of the streams
+  """
+
+  # How many seconds to sleep between rebalancing checks
+  _REBALANCE_INTERVAL_SEC = 6 * 3600
+
+  # Repartition only if that reduces the load of the busiest partition by at
+  # least this fraction, since it involves reconnecting the streams, and Twitter
+  # penalizes clients that reconnect too often
+  _MIN_REBALANCE_GAIN = 0.2
+
+
+  def __init__(self, partitions, metricSpecsQueues):
+    """
+    :param partitions: the current partitioning of metrics; sequence of
+      sequences of TwitterMetricSpec objects
+    :param metricSpecsQueues: queues for sending replacement metric specs to the
+      stream listeners of the corresponding partitions
+    """
+    self._partitions = tuple(list(part) for part in partitions)
+    self._metricSpecsQueues = metricSpecsQueues
+
+
+  @classmethod
+  @logExceptions(g_log)
+  def runInThread(cls, partitions, metricSpecsQueues):
+    """ The thread target function; instantiates and runs _StreamRebalancer
+
+    :param partitions: see `__init__()`
+    :param metricSpecsQueues: see `__init__()`
+    """
+    g_log.info("%s thread is running", cls.__name__)
+    cls(partitions=partitions, metricSpecsQueues=metricSpecsQueues)._run()
+
+
+  def _run(self):
+    """ Thread function; periodically rebalances the partitions """
+    while True:
+      time.sleep(self._REBALANCE_INTERVAL_SEC)
+
+      self._rebalance()
+
+
+  def _rebalance(self):
+    """ Repartition the metrics by their current loads and send reassigned
+    metrics to the stream listeners of the changed partitions, if the new
+    partitioning is worth the reconnections.
+
+    :returns: True if the metrics were repartitioned; False if not
+    """
+    metricSpecs = [spec for part in self._partitions for spec in part]
+    metricLoads = _estimateMetricLoads(metricSpecs)
+
+    currentLoads = _getPartitionLoads(self._partitions, metricLoads)
+
+    candidate = _partitionByLoad(metricSpecs, len(self._partitions),
+                                 metricLoads)
+    candidateLoads = _getPartitionLoads(candidate, metricLoads)
+
+    g_log.info("Stream partition loads (tweets/hr): current=%s; candidate=%s",
+               currentLoads, candidateLoads)
+
+    if not (max(candidateLoads) <
+            max(currentLoads) * (1 - self._MIN_REBALANCE_GAIN)):
+      return False
+
+    currentMetrics = [set(spec.metric for spec in part)
+                      for part in self._partitions]
+    candidateMetrics = [set(spec.metric for spec in part)
+                        for part in candidate]
+
+    # Match candidate partitions to the current ones with the most metrics in
+    # common to minimize reconnections
+    order = _matchPartitions(currentMetrics, candidateMetrics)
+
+    for i, j in enumerate(order):
+      if currentMetrics[i] == candidateMetrics[j]:
+        continue
+
+      g_log.info("Reassigning numMetrics=%d with load=%.1f tweets/hr to "
+                 "stream partition=%d", len(candidate[j]), candidateLoads[j], i)
+
+      self._partitions[i][:] = candidate[j]
+      self._metricSpecsQueues[i].put(list(candidate[j]))
+
+    return True
+
+
+
 @logExceptions(g_log)
 def _runStreamWorker(task):
   """ Run the pool worker; called in a multiprocessing pool process"""
@@ -1565,16 +2333,28 @@ def main():
     g_log.info("Creating multiprocessing pool with numWorkers=%d",
                numPartitions)
     workerPool = multiprocessing.Pool(processes=numPartitions)
+
+    # Manages the queues for sending rebalanced metric specs to the workers
+    metricSpecsQueueManager = multiprocessing.Manager()
     try:
 
       metricSpecs = loadMetricSpecs()
 
-      metricPartitions = _partition(metricSpecs, numPartitions)
+      metricLoads = _estimateMetricLoads(metricSpecs)
+
+      metricPartitions = _partitionByLoad(metricSpecs, numPartitions,
+                                          metricLoads)
 
       assert len(metricPartitions) == numPartitions, (
         len(metricPartitions), numPartitions)
       assert len(metricSpecs) == sum(len(part) for part in metricPartitions)
 
+      g_log.info("Stream partition loads (tweets/hr)=%s",
+                 _getPartitionLoads(metricPartitions, metricLoads))
+
+      metricSpecsQueues = [metricSpecsQueueManager.Queue()
+                           for _ in xrange(numPartitions)]
+
       # Create a process pool with number of processes equal to the number of
       # partitions
       taskOptions = dict(options.iteritems())
@@ -1583,8 +2363,8 @@ def main():
 
       tasks = [
         dict(
-          [["metricSpecs", part]] + taskOptions.items())
-        for part in metricPartitions
+          [["metricSpecs", part], ["metricSpecsQ", q]] + taskOptions.items())
+        for part, q in zip(metricPartitions, metricSpecsQueues)
       ]
 
       # Start tweet streamers
@@ -1599,6 +2379,17 @@ def main():
       poolRunnerThread.start()
       g_log.info("Started Pool Runner thread")
 
+      # Start Stream Rebalancer
+      streamRebalancerThread = None
+      if numPartitions > 1:
+        streamRebalancerThread = threading.Thread(
+          target=_StreamRebalancer.runInThread,
+          kwargs=dict(partitions=metricPartitions,
+                      metricSpecsQueues=metricSpecsQueues))
+        streamRebalancerThread.setDaemon(True)
+        streamRebalancerThread.start()
+        g_log.info("Started StreamRebalancer thread")
+
       # Start Tweet Garbage Collector
       tweetGarbageCollectorThread = threading.Thread(
         target=_TweetGarbageCollector.run)
@@ -1637,6 +2428,10 @@ def main():
         tweetGarbageCollectorThread.join(10)
         assert tweetGarbageCollectorThread.isAlive()
 
+        if streamRebalancerThread is not None:
+          streamRebalancerThread.join(10)
+          assert streamRebalancerThread.isAlive()
+
         if metricDataForwarderThread is not None:
           metricDataForwarderThread.join(10)
           assert metricDataForwarderThread.isAlive()
@@ -1650,6 +2445,8 @@ def main():
       g_log.info("Terminating multiprocessing.Pool")
       workerPool.terminate()
       g_log.info("Multiprocessing.Pool terminated")
+
+      metricSpecsQueueManager.shutdown()
   except KeyboardInterrupt:
     # Log with exception info to help debug deadlocks
     g_log.info("Observed KeyboardInterrupt", exc_info=True)
@@ -25,12 +25,13 @@ from collections import namedtuple
 import copy
 import datetime
 from functools import partial
+import heapq
 import itertools
 import json
-from multiprocessing import Pool
 from optparse import OptionParser
 import os
 import Queue
+import threading
 import time
 import urllib
 import urllib2
@@ -68,6 +69,8 @@ DEFAULT_SERVER = os.environ.get("TAURUS_HTM_SERVER", "127.0.0.1")
 DEFAULT_PORT = 2003
 DEFAULT_DAYS = 20
 DEFAULT_DRYRUN = False
+DEFAULT_NUM_POLLERS = 8
+DEFAULT_NUM_FORWARDERS = 4
 
 NAIVE_MARKET_OPEN_TIME = datetime.time(9, 30)    # 9:30 AM
 NAIVE_MARKET_CLOSE_TIME = datetime.time(16, 00)  # 4 PM
@@ -555,6 +558,12 @@ def transmitMetricData(metricSpecs, symbol, engine):
   :param symbol: stock symbol
   :param sqlalchemy.engine.Engine engine:
   """
+  startTime = time.time()
+  numSamples = 0
+  numChunks = 0
+  sendDuration = 0
+  historyDuration = 0
+
   try:
     @collectorsdb.retryOnTransientErrors
     def _fetchUnsentSamples():
@@ -600,8 +609,14 @@ def transmitMetricData(metricSpecs, symbol, engine):
         # No more unsent samples
         break
 
-      # Send samples to Taurus
-      with metricDataBatchWrite(log=_LOG) as putSample:
+      numChunks += 1
+      numSamples += len(specSymbolSampleList)
+
+      # Send samples to Taurus; the chunk holds many samples of each of the
+      # symbol's few metrics, so use the compact encoding, which spells out
+      # each metric name once per batch
+      chunkStartTime = time.time()
+      with metricDataBatchWrite(log=_LOG, compact=True) as putSample:
         for spec, symbol, sample in specSymbolSampleList:
           if spec.sampleKey in sample:
             epochTs = epochFromLocalizedDatetime(
@@ -614,52 +629,77 @@ def transmitMetricData(metricSpecs, symbol, engine):
                       value=value,
                       epochTimestamp=epochTs)
 
+      historyStartTime = time.time()
+      sendDuration += historyStartTime - chunkStartTime
+
       # Update history of emitted samples
       #
       # NOTE: If this fails once in a while and we end up resending the samples,
       # htmengine's Metric Storer will discard duplicate-timestamp and
       # out-of-order samples
-      for spec, symbol, sample in specSymbolSampleList:
-        _updateMetricDataHistory(spec=spec, symbol=symbol, sample=sample,
-                                 engine=engine)
+      _updateMetricDataHistory(specSymbolSampleList=specSymbolSampleList,
+                               engine=engine)
+
+      historyDuration += time.time() - historyStartTime
   except Exception:
     _LOG.exception("Unexpected error while attempting to send metric "
                    "data sample(s) to remote Taurus instance.")
+  finally:
+    if numSamples:
+      _LOG.info("Transmitted symbol=%s; numSamples=%d; numChunks=%d; "
+                "sendDuration=%.3fs; historyDuration=%.3fs; duration=%.3fs",
+                symbol, numSamples, numChunks, sendDuration, historyDuration,
+                time.time() - startTime)
+
 
 
+def _updateMetricDataHistory(specSymbolSampleList, engine):
+  """ Update history of emitted samples, designating the given samples as sent.
 
-@collectorsdb.retryOnTransientErrors
-def _updateMetricDataHistory(spec, symbol, sample, engine):
-  """ Update history of emitted samples, designating the given sample as sent.
+  The samples are recorded with one multi-row INSERT IGNORE per target table
+  in a single transaction.
 
-  :param StockMetricSpec spec: metric spec object associated
-    with the emitted sample
-  :param symbol: stock symbol associated with the data sample
-  :param sample: RowProxy object containing the sample's StartDate/Time,
-    EndDate/Time and UTCOffset fields
+  :param specSymbolSampleList: sequence of (spec, symbol, sample) tuples, where
+    spec is the StockMetricSpec object associated with the emitted sample,
+    symbol is the stock symbol associated with the data sample, and sample is a
+    RowProxy object containing the sample's StartDate/Time, EndDate/Time and
+    UTCOffset fields
   :param sqlalchemy.engine.Engine engine:
   """
-  if spec.sampleKey == "Close":
-    target = emittedStockPrice
-  elif spec.sampleKey == "Volume":
-    target = emittedStockVolume
-  else:
-    _LOG.error("Unexpected sampleKey (%r).  Not recording record (%r)"
-               " as being sent.", spec.sampleKey, sample)
-    return
-
   sentTs = datetime.datetime.utcnow().replace(microsecond=0)
 
-  ins = (target.insert()
-         .values(symbol=symbol,
-                 StartDate=sample.StartDate,
-                 StartTime=sample.StartTime,
-                 EndDate=sample.EndDate,
-                 EndTime=sample.EndTime,
-                 UTCOffset=sample.UTCOffset,
-                 sent=sentTs))
+  targetToRows = defaultdict(list)
+  for spec, symbol, sample in specSymbolSampleList:
+    if spec.sampleKey == "Close":
+      target = emittedStockPrice
+    elif spec.sampleKey == "Volume":
+      target = emittedStockVolume
+    else:
+      _LOG.error("Unexpected sampleKey (%r).  Not recording record (%r)"
+                 " as being sent.", spec.sampleKey, sample)
+      continue
+
+    targetToRows[target].append(dict(symbol=symbol,
+                                     StartDate=sample.StartDate,
+                                     StartTime=sample.StartTime,
+                                     EndDate=sample.EndDate,
+                                     EndTime=sample.EndTime,
+                                     UTCOffset=sample.UTCOffset,
+                                     sent=sentTs))
+
+  if not targetToRows:
+    return
+
+  @collectorsdb.retryOnTransientErrors
+  def insertWithRetries():
+    with engine.begin() as conn:
+      for target, rows in targetToRows.iteritems():
+        # NOTE: MySQLdb's executemany sends the rows as a single multi-row
+        # INSERT statement
+        conn.execute(target.insert().prefix_with("IGNORE", dialect="mysql"),
+                     rows)
 
-  engine.execute(ins)
+  insertWithRetries()
 
 
 
@@ -694,6 +734,254 @@ def _purgeOldRecords():
 
 
 
+class _StageStats(object):
+  """ Thread-safe latency statistics of a _PollForwardPipeline stage """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._count = 0
+    self._totalSec = 0.0
+    self._maxSec = 0.0
+
+
+  def record(self, durationSec):
+    with self._lock:
+      self._count += 1
+      self._totalSec += durationSec
+      self._maxSec = max(self._maxSec, durationSec)
+
+
+  def reset(self):
+    """ Reset the statistics
+
+    :returns: count, mean duration and max duration since last reset
+    :rtype: 3-tuple
+    """
+    with self._lock:
+      stats = (self._count,
+               self._totalSec / self._count if self._count else 0.0,
+               self._maxSec)
+      self._count = 0
+      self._totalSec = 0.0
+      self._maxSec = 0.0
+
+    return stats
+
+
+
+class _PollForwardPipeline(object):
+  """ Polls XIgnite and forwards new data to Taurus for each symbol on
+  long-lived poller and forwarder threads.
+
+  Each symbol is polled when its deadline comes due and its new data, if any,
+  is handed to the forwarders. The symbol's next deadline is scheduled one
+  period later only after its data has been forwarded, so a symbol is never
+  polled while its previous data is still being stored, and a slow symbol or
+  slow database delays only that symbol rather than the whole cycle.
+  """
+
+  # Schedule key for garbage collection of our tables
+  _PURGE = None
+
+
+  def __init__(self, symbolToMetricSpecs, pollFn, forwardFn, periodSec,
+               numPollers, numForwarders):
+    """
+    :param dict symbolToMetricSpecs: stock symbol to sequence of
+      StockMetricSpec objects associated with that symbol
+    :param pollFn: callable that takes a sequence of StockMetricSpec objects
+      and returns the 2-tuple (security, data); see poll()
+    :param forwardFn: callable with signature (metricSpecs, data, security);
+      see forward()
+    :param periodSec: polling period in seconds
+    :param int numPollers: number of poller threads
+    :param int numForwarders: number of forwarder threads
+    """
+    self._symbolToMetricSpecs = symbolToMetricSpecs
+    self._pollFn = pollFn
+    self._forwardFn = forwardFn
+    self._periodSec = periodSec
+    self._numPollers = numPollers
+    self._numForwarders = numForwarders
+
+    # (symbol, deadline) items due for polling
+    self._pollQ = Queue.Queue()
+
+    # Callables to run on forwarder threads
+    self._forwardQ = Queue.Queue()
+
+    # (deadline, symbol) items to schedule, from worker threads
+    self._rescheduleQ = Queue.Queue()
+
+    self._stopEvent = threading.Event()
+
+    self._threads = []
+
+    # Delay of polls past their deadlines
+    self._pollLagStats = _StageStats()
+    self._pollStats = _StageStats()
+    # Time that polled data waits for a forwarder
+    self._forwardWaitStats = _StageStats()
+    self._forwardStats = _StageStats()
+
+
+  def run(self):
+    """ Start worker threads and schedule polling until stop() is called """
+    for i in xrange(self._numPollers):
+      self._startThread(self._runPollerThread, "Poller-%d" % (i,))
+
+    for i in xrange(self._numForwarders):
+      self._startThread(self._runForwarderThread, "Forwarder-%d" % (i,))
+
+    now = time.time()
+    schedule = [(now, symbol) for symbol in self._symbolToMetricSpecs]
+    schedule.append((now, self._PURGE))
+    heapq.heapify(schedule)
+
+    nextStatsTime = now + self._periodSec
+
+    while not self._stopEvent.isSet():
+      now = time.time()
+
+      while schedule and schedule[0][0] <= now:
+        deadline, symbol = heapq.heappop(schedule)
+        if symbol is self._PURGE:
+          self._forwardQ.put(partial(self._purge, deadline=deadline))
+        else:
+          self._pollQ.put((symbol, deadline))
+
+      if now >= nextStatsTime:
+        self._logStats()
+        nextStatsTime = now + self._periodSec
+
+      timeout = nextStatsTime - now
+      if schedule:
+        timeout = min(timeout, schedule[0][0] - now)
+
+      # NOTE: Queue.get with a timeout may be interrupted by KeyboardInterrupt
+      try:
+        item = self._rescheduleQ.get(timeout=max(timeout, 0.001))
+      except Queue.Empty:
+        continue
+
+      heapq.heappush(schedule, item)
+
+
+  def stop(self):
+    """ Stop scheduling and wait for worker threads to finish their current
+    tasks.
+    """
+    self._stopEvent.set()
+
+    for _ in xrange(self._numPollers):
+      self._pollQ.put(None)
+
+    for _ in xrange(self._numForwarders):
+      self._forwardQ.put(None)
+
+    for thread in self._threads:
+      # Passing a timeout value allows the join call to be interrupted by
+      # SIGINT, which results in KeyboardInterrupt exception.
+      while thread.isAlive():
+        thread.join(10)
+
+
+  def _startThread(self, target, name):
+    thread = threading.Thread(target=target, name=name)
+    thread.setDaemon(True)
+    thread.start()
+    self._threads.append(thread)
+
+
+  def _reschedule(self, symbol, deadline):
+    """ Schedule the next poll of the symbol one period after the given
+    deadline, or right away if that's already past.
+    """
+    self._rescheduleQ.put((max(deadline + self._periodSec, time.time()),
+                           symbol))
+
+
+  def _runPollerThread(self):
+    while True:
+      item = self._pollQ.get()
+      if item is None:
+        return
+
+      symbol, deadline = item
+
+      startTime = time.time()
+      self._pollLagStats.record(startTime - deadline)
+
+      try:
+        security, data = self._pollFn(self._symbolToMetricSpecs[symbol])
+      except Exception:
+        # Already logged by poll(); try again next period
+        self._reschedule(symbol, deadline)
+        continue
+      finally:
+        self._pollStats.record(time.time() - startTime)
+
+      if data:
+        self._forwardQ.put(partial(self._forward,
+                                   symbol=symbol,
+                                   deadline=deadline,
+                                   security=security,
+                                   data=data,
+                                   enqueueTime=time.time()))
+      else:
+        _LOG.info("No new data for %s", symbol)
+        self._reschedule(symbol, deadline)
+
+
+  def _runForwarderThread(self):
+    while True:
+      task = self._forwardQ.get()
+      if task is None:
+        return
+
+      task()
+
+
+  def _forward(self, symbol, deadline, security, data, enqueueTime):
+    startTime = time.time()
+    self._forwardWaitStats.record(startTime - enqueueTime)
+
+    try:
+      self._forwardFn(self._symbolToMetricSpecs[symbol], data, security)
+    except Exception:
+      # Already logged by forward(); try again next period
+      pass
+    finally:
+      self._forwardStats.record(time.time() - startTime)
+      self._reschedule(symbol, deadline)
+
+
+  def _purge(self, deadline):
+    try:
+      _purgeOldRecords()
+    except Exception:
+      # Already logged by _purgeOldRecords(); try again next period
+      pass
+    finally:
+      self._reschedule(self._PURGE, deadline)
+
+
+  def _logStats(self):
+    numPolls, pollMean, pollMax = self._pollStats.reset()
+    _, pollLagMean, pollLagMax = self._pollLagStats.reset()
+    numForwards, forwardMean, forwardMax = self._forwardStats.reset()
+    _, forwardWaitMean, forwardWaitMax = self._forwardWaitStats.reset()
+
+    _LOG.info(
+      "{TAG:XIGNITE.PIPELINE} numPolls=%d; poll=%.3f/%.3fs; "
+      "pollLag=%.3f/%.3fs; numForwards=%d; forward=%.3f/%.3fs; "
+      "forwardWait=%.3f/%.3fs; pollQ=%d; forwardQ=%d (mean/max)",
+      numPolls, pollMean, pollMax, pollLagMean, pollLagMax, numForwards,
+      forwardMean, forwardMax, forwardWaitMean, forwardWaitMax,
+      self._pollQ.qsize(), self._forwardQ.qsize())
+
+
+
 def main():
   logging_support.LoggingSupport.initService()
 
@@ -711,59 +999,26 @@ def main():
                       port=options.port,
                       dryrun=options.dryrun)
 
-  pool = Pool()
-
-  sleepDuration = 60 * options.barlength
-
   # Load metric specs from metric configuration
   symbolToMetricSpecs = defaultdict(list)
   for spec in loadMetricSpecs():
     symbolToMetricSpecs[spec.symbol].append(spec)
   _LOG.info("Collecting stock data for %s", symbolToMetricSpecs.keys())
 
+  pipeline = _PollForwardPipeline(symbolToMetricSpecs=symbolToMetricSpecs,
+                                  pollFn=pollFn,
+                                  forwardFn=forwardFn,
+                                  periodSec=60 * options.barlength,
+                                  numPollers=options.numPollers,
+                                  numForwarders=options.numForwarders)
 
   try:
-    while True:
-      # Run poll() for each symbol in the process pool
-      pendingAsyncResults = []
-      for security, data in pool.imap_unordered(
-          pollFn,
-          symbolToMetricSpecs.itervalues()):
-        # Forward result (if available) to HTM-IT/Taurus instance
-        if data:
-          pendingAsyncResults.append(
-            pool.apply_async(
-              forwardFn,
-              (symbolToMetricSpecs[security["Symbol"]], data, security)))
-        else:
-          _LOG.info("No new data for %s", security["Symbol"])
-
-
-      # Run garbage collection on our tables
-      pendingAsyncResults.append(pool.apply_async(_purgeOldRecords))
-
-      _LOG.info("Sleeping for %d seconds. zzzzzzzz....", sleepDuration)
-      time.sleep(sleepDuration)
-
-      # Wait for all async tasks to complete to avoid out-of-order metric data
-      if pendingAsyncResults:
-        for r in pendingAsyncResults:
-          try:
-            r.get()
-          except Exception:
-            # Async task failed - log and suppress
-            _LOG.exception("Async task failed.")
-
-        _LOG.info("Async numTasks=%d completed", len(pendingAsyncResults))
-
+    pipeline.run()
   except KeyboardInterrupt:
     # Log the traceback to help with debugging in case we were deadlocked
     _LOG.info("KeyboardInterrupt detected, exiting...", exc_info=True)
-    pass
-
   finally:
-    pool.close()
-    pool.join()
+    pipeline.stop()
 
 
 
@@ -812,6 +1067,23 @@ def _parseArgs():
       dest="dryrun",
       help="Use this flag to do a dry run [default: %default]")
 
+  parser.add_option(
+      "--pollers",
+      action="store",
+      type="int",
+      default=DEFAULT_NUM_POLLERS,
+      dest="numPollers",
+      help="Number of threads polling XIgnite [default: %default]")
+
+  parser.add_option(
+      "--forwarders",
+      action="store",
+      type="int",
+      default=DEFAULT_NUM_FORWARDERS,
+      dest="numForwarders",
+      help=("Number of threads storing and forwarding polled data "
+            "[default: %default]"))
+
   parser.add_option(
       "--apitoken",
       action="store",
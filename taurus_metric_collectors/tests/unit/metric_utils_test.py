@@ -647,63 +647,155 @@ class MetricUtilsTestCase(unittest.TestCase):
       verify=ANY, auth=("taurus", ""))
 
 
+  @staticmethod
+  def _makeMessageBusMock():
+    messageBusConnectorClass = (
+      metric_utils.message_bus_connector.MessageBusConnector)
+    messageBusMock = MagicMock(
+      spec_set=messageBusConnectorClass,
+      publishMany=Mock(spec_set=messageBusConnectorClass.publishMany))
+    messageBusMock.__enter__.return_value = messageBusMock
+    return messageBusMock
+
+
+  @patch.object(metric_utils, "_metricDataPublisherPool",
+                metric_utils._MessageBusConnectorPool(maxIdle=1))
   @patch(("taurus_metric_collectors.metric_utils.message_bus_connector"
           ".MessageBusConnector"), autospec=True)
   def testMetricDataBatchWrite(self, messageBusConnectorClassMock):
+    batchSize = metric_utils._METRIC_DATA_BATCH_WRITE_SIZE
+    pipelineDepth = metric_utils._METRIC_DATA_PUBLISH_PIPELINE_DEPTH
 
     samples = [
       ("FOO.BAR.%d" % i, i * 3.789, i * 300)
-      for i in xrange((metric_utils._METRIC_DATA_BATCH_WRITE_SIZE * 3) / 2)
+      for i in xrange(batchSize * pipelineDepth + batchSize / 2)
     ]
 
-    messageBusConnectorClass = (
-      metric_utils.message_bus_connector.MessageBusConnector)
-    messageBusMock = MagicMock(
-      spec_set=messageBusConnectorClass,
-      publish=Mock(spec_set=messageBusConnectorClass.publish))
-    messageBusMock.__enter__.return_value = messageBusMock
+    def makePlainBody(samples):
+      return json.dumps(
+        dict(protocol="plain",
+             data=["%s %r %d" % (m, v, t) for m, v, t in samples]))
 
+    messageBusMock = self._makeMessageBusMock()
     messageBusConnectorClassMock.return_value = messageBusMock
 
     loggerMock = Mock(spec_set=logging.Logger)
     with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
-      # put enough for the first batch
-      for sample in samples[:metric_utils._METRIC_DATA_BATCH_WRITE_SIZE]:
+      # put enough for a full pipeline of batches
+      for sample in samples[:batchSize * pipelineDepth]:
         putSample(*sample)
 
-      # The first publish call should be for a full batch
-      self.assertEqual(messageBusMock.publish.call_count, 1)
+      # The full batches should have been published together
+      self.assertEqual(messageBusMock.publishMany.call_count, 1)
       call0 = mock.call(
         mqName="taurus.metric.custom.data",
         persistent=True,
-        body=json.dumps(
-          dict(
-            protocol="plain",
-            data=["%s %r %d" % (m, v, t)
-                  for m, v, t
-                  in samples[:metric_utils._METRIC_DATA_BATCH_WRITE_SIZE]])))
-      self.assertEqual(messageBusMock.publish.call_args_list[0], call0)
+        bodies=[makePlainBody(samples[i * batchSize:(i + 1) * batchSize])
+                for i in xrange(pipelineDepth)])
+      self.assertEqual(messageBusMock.publishMany.call_args_list[0], call0)
 
       # put the remaining samples
-      for sample in samples[metric_utils._METRIC_DATA_BATCH_WRITE_SIZE:]:
+      for sample in samples[batchSize * pipelineDepth:]:
         putSample(*sample)
 
       # the remaining incomplete batch will be sent upon exit from the context,
       # but not yet
-      self.assertEqual(messageBusMock.publish.call_count, 1)
+      self.assertEqual(messageBusMock.publishMany.call_count, 1)
 
     # Now, the remainder should be sent, too
-    self.assertEqual(messageBusMock.publish.call_count, 2)
+    self.assertEqual(messageBusMock.publishMany.call_count, 2)
     call1 = mock.call(
       mqName="taurus.metric.custom.data",
       persistent=True,
-      body=json.dumps(
-        dict(
-          protocol="plain",
-          data=["%s %r %d" % (m, v, t)
-                for m, v, t
-                in samples[metric_utils._METRIC_DATA_BATCH_WRITE_SIZE:]])))
-    self.assertEqual(messageBusMock.publish.call_args_list[1], call1)
+      bodies=[makePlainBody(samples[batchSize * pipelineDepth:])])
+    self.assertEqual(messageBusMock.publishMany.call_args_list[1], call1)
+
+    # The connection should have been returned to the pool and reused by the
+    # next batch write instead of connecting anew
+    self.assertFalse(messageBusMock.close.called)
+    with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+      putSample(*samples[0])
+
+    self.assertEqual(messageBusConnectorClassMock.call_count, 1)
+    self.assertEqual(messageBusMock.publishMany.call_count, 3)
+
+
+  @patch.object(metric_utils, "_metricDataPublisherPool",
+                metric_utils._MessageBusConnectorPool(maxIdle=1))
+  @patch(("taurus_metric_collectors.metric_utils.message_bus_connector"
+          ".MessageBusConnector"), autospec=True)
+  def testMetricDataBatchWriteCompact(self, messageBusConnectorClassMock):
+    messageBusMock = self._makeMessageBusMock()
+    messageBusConnectorClassMock.return_value = messageBusMock
+
+    loggerMock = Mock(spec_set=logging.Logger)
+    with metric_utils.metricDataBatchWrite(loggerMock,
+                                           compact=True) as putSample:
+      putSample("FOO.BAR.1", 1.5, 1386792175)
+      putSample("FOO.BAR.2", 72001L, 1386792175)
+      putSample("FOO.BAR.1", 0.1, 1386792475)
+
+    self.assertEqual(messageBusMock.publishMany.call_count, 1)
+    (body,) = messageBusMock.publishMany.call_args[1]["bodies"]
+    self.assertEqual(
+      json.loads(body),
+      dict(protocol="compact",
+           data={"FOO.BAR.1": [[1.5, 1386792175], [0.1, 1386792475]],
+                 "FOO.BAR.2": [[72001.0, 1386792175]]}))
+
+
+  @patch.object(metric_utils, "_metricDataPublisherPool",
+                metric_utils._MessageBusConnectorPool(maxIdle=1))
+  @patch(("taurus_metric_collectors.metric_utils.message_bus_connector"
+          ".MessageBusConnector"), autospec=True)
+  def testMetricDataBatchWriteLimitsBatchBytes(self,
+                                               messageBusConnectorClassMock):
+    messageBusMock = self._makeMessageBusMock()
+    messageBusConnectorClassMock.return_value = messageBusMock
+
+    # Metric names long enough for the byte limit to cut batches well short of
+    # the sample count limit
+    metricNameLength = (metric_utils._METRIC_DATA_BATCH_WRITE_MAX_BYTES * 4 /
+                        metric_utils._METRIC_DATA_BATCH_WRITE_SIZE)
+    numSamples = metric_utils._METRIC_DATA_BATCH_WRITE_SIZE
+
+    loggerMock = Mock(spec_set=logging.Logger)
+    with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+      for i in xrange(numSamples):
+        putSample("%0*d" % (metricNameLength, i), i, i * 300)
+
+    bodies = [body
+              for publishCall in messageBusMock.publishMany.call_args_list
+              for body in publishCall[1]["bodies"]]
+    self.assertGreaterEqual(len(bodies), 4)
+    self.assertEqual(sum(len(json.loads(body)["data"]) for body in bodies),
+                     numSamples)
+    for body in bodies:
+      self.assertLess(len(body),
+                      metric_utils._METRIC_DATA_BATCH_WRITE_MAX_BYTES +
+                      metricNameLength + 64)
+
+
+  @patch.object(metric_utils, "_metricDataPublisherPool",
+                metric_utils._MessageBusConnectorPool(maxIdle=1))
+  @patch(("taurus_metric_collectors.metric_utils.message_bus_connector"
+          ".MessageBusConnector"), autospec=True)
+  def testMetricDataBatchWriteDiscardsConnectionOnError(
+      self, messageBusConnectorClassMock):
+    messageBusMock = self._makeMessageBusMock()
+    messageBusMock.publishMany.side_effect = (
+      metric_utils.message_bus_connector.MessageQueueNotFound)
+    messageBusConnectorClassMock.return_value = messageBusMock
+
+    loggerMock = Mock(spec_set=logging.Logger)
+    with self.assertRaises(
+        metric_utils.message_bus_connector.MessageQueueNotFound):
+      with metric_utils.metricDataBatchWrite(loggerMock) as putSample:
+        putSample("FOO.BAR", 1.0, 1386792175)
+
+    # The failed connection must not be reused
+    messageBusMock.close.assert_called_once_with()
+    self.assertEqual(metric_utils._metricDataPublisherPool._idle, [])
 
 
 
@@ -26,6 +26,7 @@
 # pylint: disable=W0212
 
 
+from datetime import datetime, timedelta
 import itertools
 import unittest
 
@@ -42,132 +43,133 @@ def setUpModule():
 
 
 
+@patch("taurus_metric_collectors.twitterdirect.purge_old_tweets.time",
+       autospec=True)
 @patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
        "._deleteRows", autospec=True)
 @patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
        "._queryCandidateRows", autospec=True)
 @patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
-       "._estimateNumTweetsToDelete", autospec=True)
+       "._queryThresholdDatetime", autospec=True,
+       return_value=datetime(2015, 5, 1))
 @patch("taurus_metric_collectors.twitterdirect.purge_old_tweets"
        ".collectorsdb",
        new=mock.Mock(spec_set=taurus_metric_collectors.collectorsdb))
 class PurgeOldTweetsUnitTestCase(unittest.TestCase):
 
 
+  @staticmethod
+  def _makeCandidates(count):
+    """
+    :returns: sequence of (created_at, uid) pairs in sweep order
+    """
+    return tuple((datetime(2015, 1, 1) + timedelta(seconds=i // 2), str(i))
+                 for i in xrange(count))
+
+
+  @classmethod
+  def _makeCandidateRowsSideEffect(cls, candidates):
+    def queryCandidateRows(resumeAfter, limit, **_kwargs):
+      start = 0 if resumeAfter is None else candidates.index(resumeAfter) + 1
+      return candidates[start:start + limit]
+
+    return queryCandidateRows
+
 
   def testPurgeOldTweetsWithoutOldRecords(self,
-                                          estimateNumTweetsToDeleteMock,
+                                          _queryThresholdDatetimeMock,
                                           queryCandidateRowsMock,
-                                          deleteRowsMock):
-    estimateNumTweetsToDeleteMock.return_value = 0
+                                          deleteRowsMock,
+                                          timeMock):
+    queryCandidateRowsMock.return_value = ()
 
     # These should not be called in this test
-    queryCandidateRowsMock.side_effect = []
     deleteRowsMock.side_effect = []
 
     numDeleted = purge_old_tweets.purgeOldTweets(thresholdDays=90)
 
     self.assertEqual(numDeleted, 0)
 
-    self.assertEqual(estimateNumTweetsToDeleteMock.call_count, 1)
-
-    self.assertEqual(queryCandidateRowsMock.call_count, 0)
+    self.assertEqual(queryCandidateRowsMock.call_count, 1)
     self.assertEqual(deleteRowsMock.call_count, 0)
+    self.assertEqual(timeMock.sleep.call_count, 0)
 
 
-  def testPurgeOldTweetsDeletedLessThanExpected(self,
-                                                estimateNumTweetsToDeleteMock,
-                                                queryCandidateRowsMock,
-                                                deleteRowsMock):
-
-    estimate = purge_old_tweets._MAX_DELETE_BATCH_SIZE * 3
-
-    estimateNumTweetsToDeleteMock.return_value = estimate
+  def testPurgeOldTweetsSweepsInBatches(self,
+                                        queryThresholdDatetimeMock,
+                                        queryCandidateRowsMock,
+                                        deleteRowsMock,
+                                        timeMock):
+    batchSize = purge_old_tweets._MAX_DELETE_BATCH_SIZE
 
+    candidates = self._makeCandidates(batchSize * 2 + batchSize // 2)
 
-    uidsIter = iter(xrange(estimate))
+    queryCandidateRowsMock.side_effect = self._makeCandidateRowsSideEffect(
+      candidates)
 
-    queryCandidateRowsMock.side_effect = (
-      lambda limit, **kwargs: tuple(itertools.islice(uidsIter, limit)))
-
-    deletedCounts = [
-      purge_old_tweets._MAX_DELETE_BATCH_SIZE,
-      purge_old_tweets._MAX_DELETE_BATCH_SIZE // 2,
-      purge_old_tweets._MAX_DELETE_BATCH_SIZE
-    ]
+    deleteRowsMock.side_effect = lambda uids, **kwargs: len(uids)
 
-    deleteRowsMock.side_effect = iter(deletedCounts)
+    # Each delete takes 2 seconds
+    timeMock.time.side_effect = itertools.count(step=2)
 
     # Execute
-    numDeleted = purge_old_tweets.purgeOldTweets(thresholdDays=90)
-
-    self.assertEqual(numDeleted, sum(deletedCounts))
-
-    self.assertEqual(estimateNumTweetsToDeleteMock.call_count, 1)
-
-    self.assertEqual(queryCandidateRowsMock.call_count, 4)
-    self.assertEqual(deleteRowsMock.call_count, 3)
+    numDeleted = purge_old_tweets.purgeOldTweets(thresholdDays=90,
+                                                 maxDutyCycle=0.25)
 
+    self.assertEqual(numDeleted, len(candidates))
 
-  def testPurgeOldTweetsFewerCandidatesThanExpected(
-      self,
-      estimateNumTweetsToDeleteMock,
-      queryCandidateRowsMock,
-      deleteRowsMock):
+    queryThresholdDatetimeMock.assert_called_once_with(sqlEngine=mock.ANY,
+                                                       thresholdDays=90)
 
-    estimate = purge_old_tweets._MAX_DELETE_BATCH_SIZE * 2
+    # Each batch resumes after the last candidate of the previous one and
+    # there's no need to query again after a partial batch
+    self.assertEqual(
+      [c[1]["resumeAfter"] for c in queryCandidateRowsMock.call_args_list],
+      [None, candidates[batchSize - 1], candidates[batchSize * 2 - 1]])
 
-    estimateNumTweetsToDeleteMock.return_value = estimate
+    for c in queryCandidateRowsMock.call_args_list:
+      self.assertEqual(c[1]["thresholdDatetime"],
+                       queryThresholdDatetimeMock.return_value)
 
+    self.assertEqual(
+      [c[1]["uids"] for c in deleteRowsMock.call_args_list],
+      [tuple(uid for _, uid in candidates[i:i + batchSize])
+       for i in xrange(0, len(candidates), batchSize)])
 
-    uidsIter = iter(xrange(estimate // 2))
+    # Throttled after each full batch to spend at most 25% of time deleting
+    self.assertEqual(timeMock.sleep.call_args_list,
+                     [mock.call(6.0), mock.call(6.0)])
 
-    queryCandidateRowsMock.side_effect = (
-      lambda limit, **kwargs: tuple(itertools.islice(uidsIter, limit)))
 
-    deleteRowsMock.side_effect = lambda uids, **kwargs: len(uids)
-
-    # Execute
-    numDeleted = purge_old_tweets.purgeOldTweets(thresholdDays=90)
-
-    self.assertEqual(numDeleted, estimate // 2)
-
-    self.assertEqual(estimateNumTweetsToDeleteMock.call_count, 1)
-
-    self.assertEqual(queryCandidateRowsMock.call_count, 2)
-    self.assertEqual(deleteRowsMock.call_count, 1)
-
-
-  def testPurgeOldTweetsStopAtEstimated(
-      self,
-      estimateNumTweetsToDeleteMock,
-      queryCandidateRowsMock,
-      deleteRowsMock):
-
-    estimate = purge_old_tweets._MAX_DELETE_BATCH_SIZE * 2
+  def testPurgeOldTweetsDeletedLessThanExpected(self,
+                                                _queryThresholdDatetimeMock,
+                                                queryCandidateRowsMock,
+                                                deleteRowsMock,
+                                                timeMock):
+    batchSize = purge_old_tweets._MAX_DELETE_BATCH_SIZE
 
-    estimateNumTweetsToDeleteMock.return_value = estimate
+    candidates = self._makeCandidates(batchSize * 3)
 
+    queryCandidateRowsMock.side_effect = self._makeCandidateRowsSideEffect(
+      candidates)
 
-    uidsIter = iter(xrange(estimate + 1))
+    deletedCounts = [
+      batchSize,
+      batchSize // 2,
+      batchSize
+    ]
 
-    queryCandidateRowsMock.side_effect = (
-      lambda limit, **kwargs: tuple(itertools.islice(uidsIter, limit)))
+    deleteRowsMock.side_effect = iter(deletedCounts)
 
-    deleteRowsMock.side_effect = lambda uids, **kwargs: len(uids)
+    timeMock.time.return_value = 0
 
     # Execute
     numDeleted = purge_old_tweets.purgeOldTweets(thresholdDays=90)
 
-    self.assertEqual(numDeleted, estimate)
-
-    self.assertEqual(estimateNumTweetsToDeleteMock.call_count, 1)
-
-    self.assertEqual(queryCandidateRowsMock.call_count, 2)
-    self.assertEqual(deleteRowsMock.call_count, 2)
+    self.assertEqual(numDeleted, sum(deletedCounts))
 
-    # Make sure it didn't try to retrieve candidates beyond estimated number
-    self.assertEqual(len(tuple(uidsIter)), 1)
+    self.assertEqual(queryCandidateRowsMock.call_count, 4)
+    self.assertEqual(deleteRowsMock.call_count, 3)
 
 
 
@@ -24,16 +24,22 @@
 unit tests for taurus_metric_collectors.twitterdirect.twitter_direct_agent
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import re
 import unittest
 
-from mock import Mock
+from mock import call, MagicMock, Mock, patch
 
 from taurus_metric_collectors.twitterdirect import twitter_direct_agent
 
 
 
+class _StopWriter(Exception):
+  """ Raised to stop a writer thread's loop in tests """
+
+
+
 class TweetStorerTestCase(unittest.TestCase):
 
 
@@ -83,7 +89,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of empty message sequence by TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      taggingMap=dict(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -98,7 +104,7 @@ class TweetStorerTestCase(unittest.TestCase):
     """ Test handling of "limit" notifications in TweetStorer._reapMessages
     """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      taggingMap=dict(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -170,7 +176,7 @@ class TweetStorerTestCase(unittest.TestCase):
     `twitter_tweets` table with null values, causing the agent to crash later
     in the pipeline """
     storer = twitter_direct_agent.TweetStorer(
-      taggingMap=Mock(),
+      taggingMap=dict(),
       aggSec=300,
       msgQ=Mock(),
       echoData=False)
@@ -262,5 +268,567 @@ class TweetStorerTestCase(unittest.TestCase):
     self.assertEqual(tweetRow["created_at"], datetime(2015, 8, 5, 14, 44, 32))
 
 
+
+class TweetStorerStorageTestCase(unittest.TestCase):
+
+
+  def testAdaptiveBatchSizer(self):
+    sizer = twitter_direct_agent._AdaptiveBatchSizer(minSize=100,
+                                                     maxSize=350,
+                                                     targetLatencySec=1.0)
+    self.assertEqual(sizer.size, 100)
+
+    # A partial batch doesn't indicate a backlog
+    sizer.update(batchSize=100, numItems=99, latencySec=0.1)
+    self.assertEqual(sizer.size, 100)
+
+    # Full batches saved quickly grow the batch size up to the limit
+    sizer.update(batchSize=100, numItems=100, latencySec=0.1)
+    self.assertEqual(sizer.size, 200)
+    sizer.update(batchSize=200, numItems=200, latencySec=0.1)
+    self.assertEqual(sizer.size, 350)
+    sizer.update(batchSize=350, numItems=350, latencySec=0.1)
+    self.assertEqual(sizer.size, 350)
+
+    # Full batches within, but close to, the target latency keep the size
+    sizer.update(batchSize=350, numItems=350, latencySec=0.9)
+    self.assertEqual(sizer.size, 350)
+
+    # Slow saves shrink the batch size down to the limit
+    sizer.update(batchSize=350, numItems=350, latencySec=1.5)
+    self.assertEqual(sizer.size, 175)
+    sizer.update(batchSize=175, numItems=10, latencySec=1.5)
+    self.assertEqual(sizer.size, 100)
+    sizer.update(batchSize=100, numItems=100, latencySec=1.5)
+    self.assertEqual(sizer.size, 100)
+
+
+  @patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+                autospec=True)
+  def testSaveTweetsCommitsReferencesUnderLock(self, engineFactoryMock):
+    storer = twitter_direct_agent.TweetStorer(
+      taggingMap=dict(),
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    lockMock = MagicMock()
+    storer._referencesCommitLock = lockMock
+
+    conn = MagicMock()
+    (engineFactoryMock.return_value.connect.return_value.__enter__
+     .return_value) = conn
+    transaction = conn.begin.return_value.__enter__.return_value
+
+    def commit():
+      # The transaction must be committed while holding the lock
+      self.assertEqual(lockMock.__enter__.call_count, 1)
+      self.assertEqual(lockMock.__exit__.call_count, 0)
+
+    transaction.commit.side_effect = commit
+
+    msg = dict(metricTagSet=set(["TWITTER.TWEET.HANDLE.IBM.VOLUME"]))
+    with patch.object(storer, "_createTweetAndReferenceRows", autospec=True,
+                      return_value=(dict(uid="1"), [dict(msg_uid="1")])):
+      storer._saveTweets(messages=[msg],
+                         aggRefDatetime=datetime(2015, 8, 5, 14, 0))
+
+    # Tweets and references are saved in one transaction
+    self.assertEqual(conn.begin.call_count, 1)
+    self.assertEqual(transaction.commit.call_count, 1)
+    self.assertEqual(lockMock.__exit__.call_count, 1)
+    self.assertEqual(conn.execute.call_count, 2)
+    (tweetsInsert, tweetRows), (samplesInsert, referenceRows) = [
+      c[0] for c in conn.execute.call_args_list]
+    self.assertIs(tweetsInsert.table,
+                  twitter_direct_agent.schema.twitterTweets)
+    self.assertEqual(tweetRows, [dict(uid="1")])
+    self.assertIs(samplesInsert.table,
+                  twitter_direct_agent.schema.twitterTweetSamples)
+    self.assertEqual(referenceRows, [dict(msg_uid="1")])
+
+
+  @patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+                autospec=True)
+  def testWriterSavesDeletionRequestsAfterTweets(self, _engineFactoryMock):
+    storer = twitter_direct_agent.TweetStorer(
+      taggingMap=dict(),
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    tweets = [dict(metricTagSet=set(["TWITTER.TWEET.HANDLE.IBM.VOLUME"]))]
+    deletes = [dict(delete=dict(status=dict(id_str="1", user_id_str="2")))]
+
+    # Stop the writer loop after one batch
+    storer._writerQ = Mock(
+      get=Mock(side_effect=[(tweets, deletes, 100, 2), _StopWriter()]))
+
+    saveMock = Mock()
+    with patch.object(storer, "_saveTweets", saveMock.tweets), \
+        patch.object(storer, "_saveTweetDeletionRequests", saveMock.deletes):
+      with self.assertRaises(_StopWriter):
+        storer._runWriter(aggRefDatetime=datetime(2015, 8, 5, 14, 0))
+
+    self.assertEqual(
+      saveMock.mock_calls,
+      [call.tweets(messages=tweets,
+                   aggRefDatetime=datetime(2015, 8, 5, 14, 0)),
+       call.deletes(messages=deletes)])
+    self.assertEqual(storer._writerQ.task_done.call_count, 1)
+
+
+
+class TweetTagPrefilterTestCase(unittest.TestCase):
+
+
+  def setUp(self):
+    self.taggingMap = twitter_direct_agent.buildTaggingMap(
+      symbolToMetricMap={"ibm": "TWITTER.TWEET.HANDLE.IBM.VOLUME",
+                         "low": "TWITTER.TWEET.HANDLE.LOW.VOLUME",
+                         "brk.b": "TWITTER.TWEET.HANDLE.BRK.B.VOLUME"},
+      userIdToMetricsMap={"10194682": set(["TWITTER.TWEET.HANDLE.ACN.VOLUME"])})
+
+
+  @staticmethod
+  def _makeStatus(symbols=(), userId="111", mentionIds=()):
+    return dict(
+      in_reply_to_status_id=None,
+      filter_level="low",
+      text="Low $IBM brk.b 10194682 tweet",
+      user=dict(id_str=userId, name="low"),
+      entities=dict(
+        symbols=[dict(text=symbol, indices=[0, 0]) for symbol in symbols],
+        user_mentions=[dict(id_str=mentionId) for mentionId in mentionIds]))
+
+
+  def _tag(self, rawStatus):
+    msg = json.loads(rawStatus)
+    msg["metricTagSet"] = set()
+    for tagger, mappings in self.taggingMap.iteritems():
+      tagger(msg, mappings)
+    return msg["metricTagSet"]
+
+
+  def testTaggableStatusesPassPrefilter(self):
+    prefilter = twitter_direct_agent.TweetTagPrefilter(self.taggingMap)
+
+    statuses = [
+      self._makeStatus(symbols=["IBM"]),
+      self._makeStatus(symbols=["AAPL", "Ibm"]),
+      self._makeStatus(symbols=["BRK.B"]),
+      self._makeStatus(symbols=["LOW"]),
+      self._makeStatus(userId="10194682"),
+      self._makeStatus(mentionIds=["222", "10194682"])
+    ]
+
+    for status in statuses:
+      for separators in ((",", ":"), (", ", ": ")):
+        rawStatus = json.dumps(status, separators=separators)
+        self.assertTrue(self._tag(rawStatus))
+        self.assertTrue(prefilter.mayMatch(rawStatus), rawStatus)
+        self.assertTrue(prefilter.mayMatch(rawStatus.decode("utf-8")))
+
+
+  def testUntaggableStatusesAreRejectedByPrefilter(self):
+    prefilter = twitter_direct_agent.TweetTagPrefilter(self.taggingMap)
+
+    statuses = [
+      self._makeStatus(),
+      self._makeStatus(symbols=["AAPL", "IBMX", "BRK"]),
+      self._makeStatus(userId="101946820", mentionIds=["1019468"])
+    ]
+
+    for status in statuses:
+      rawStatus = json.dumps(status)
+      self.assertFalse(self._tag(rawStatus))
+      self.assertFalse(prefilter.mayMatch(rawStatus), rawStatus)
+
+
+  def testEmptyTaggingMapRejectsAll(self):
+    prefilter = twitter_direct_agent.TweetTagPrefilter(
+      twitter_direct_agent.buildTaggingMap(dict(), dict()))
+
+    self.assertFalse(
+      prefilter.mayMatch(json.dumps(self._makeStatus(symbols=["IBM"]))))
+
+
+  @patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+                autospec=True)
+  def testReapMessagesSkipsDecodingUntaggableTweets(self, _engineFactoryMock):
+    storer = twitter_direct_agent.TweetStorer(
+      taggingMap=self.taggingMap,
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    taggedStatus = self._makeStatus(symbols=["IBM"])
+
+    with patch.object(twitter_direct_agent.json, "loads",
+                      autospec=True, side_effect=json.loads) as loadsMock:
+      tweets, deletes = storer._reapMessages(
+        [
+          twitter_direct_agent.TwitterStreamListener.ConnectionMarker,
+          json.dumps(taggedStatus),
+          json.dumps(self._makeStatus(symbols=["AAPL"])),
+          json.dumps(dict(delete=dict(status=dict(id_str="1"))))
+        ])
+
+    # Only the tagged tweet and the delete notification were decoded
+    self.assertEqual(loadsMock.call_count, 2)
+
+    self.assertEqual(len(tweets), 1)
+    self.assertEqual(tweets[0]["metricTagSet"],
+                     set(["TWITTER.TWEET.HANDLE.IBM.VOLUME"]))
+    self.assertEqual(len(deletes), 1)
+
+    self.assertEqual(storer._currentStreamStats.numTweets, 2)
+    self.assertEqual(storer._currentStreamStats.numUntaggedTweets, 1)
+    self.assertEqual(storer._currentStreamStats.numDeleteStatuses, 1)
+
+
+  @patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+                autospec=True)
+  def testReapMessagesAppliesTaggingMapUpdate(self, _engineFactoryMock):
+    storer = twitter_direct_agent.TweetStorer(
+      taggingMap=self.taggingMap,
+      aggSec=300,
+      msgQ=Mock(),
+      echoData=False)
+
+    newTaggingMap = twitter_direct_agent.buildTaggingMap(
+      symbolToMetricMap={"aapl": "TWITTER.TWEET.HANDLE.AAPL.VOLUME"},
+      userIdToMetricsMap=dict())
+
+    tweets, _deletes = storer._reapMessages(
+      [
+        twitter_direct_agent.TwitterStreamListener.ConnectionMarker,
+        json.dumps(self._makeStatus(symbols=["IBM"])),
+        json.dumps(self._makeStatus(symbols=["AAPL"])),
+        twitter_direct_agent.TwitterStreamListener.TaggingMapUpdate(
+          newTaggingMap),
+        json.dumps(self._makeStatus(symbols=["IBM"])),
+        json.dumps(self._makeStatus(symbols=["AAPL"]))
+      ])
+
+    # Messages are tagged with the tagging map in effect when they arrived
+    self.assertEqual([tweet["metricTagSet"] for tweet in tweets],
+                     [set(["TWITTER.TWEET.HANDLE.IBM.VOLUME"]),
+                      set(["TWITTER.TWEET.HANDLE.AAPL.VOLUME"])])
+
+    self.assertIs(storer._taggingMap, newTaggingMap)
+
+
+  def testBuildTrieRegexPattern(self):
+    words = ["a", "ab", "abc", "b.c", "bd", "x/y"]
+    regex = re.compile(
+      "^%s$" % (twitter_direct_agent._buildTrieRegexPattern(words),))
+
+    for word in words:
+      self.assertTrue(regex.match(word), word)
+
+    for word in ["", "abcd", "bxc", "b", "ac", "x"]:
+      self.assertFalse(regex.match(word), word)
+
+
+
+class StreamPartitioningTestCase(unittest.TestCase):
+
+
+  @staticmethod
+  def _makeMetricSpecs(numMetrics):
+    return [
+      twitter_direct_agent.TwitterMetricSpec(resource="R%d" % i,
+                                             metric="M%d" % i,
+                                             screenNames=[],
+                                             symbol="s%d" % i)
+      for i in xrange(numMetrics)
+    ]
+
+
+  def testPartitionByLoadBalancesSkewedLoads(self):
+    metricSpecs = self._makeMetricSpecs(6)
+    metricLoads = dict(M0=1, M1=100, M2=2, M3=3, M4=60, M5=30)
+
+    partitions = twitter_direct_agent._partitionByLoad(metricSpecs, 2,
+                                                       metricLoads)
+
+    self.assertEqual(
+      [sorted(spec.metric for spec in part) for part in partitions],
+      [["M1"], ["M0", "M2", "M3", "M4", "M5"]])
+
+    self.assertEqual(
+      twitter_direct_agent._getPartitionLoads(partitions, metricLoads),
+      (100, 96))
+
+
+  def testPartitionByLoadWithoutLoadsSplitsEvenly(self):
+    metricSpecs = self._makeMetricSpecs(7)
+    metricLoads = dict((spec.metric, 0) for spec in metricSpecs)
+
+    partitions = twitter_direct_agent._partitionByLoad(metricSpecs, 2,
+                                                       metricLoads)
+
+    self.assertEqual([len(part) for part in partitions], [4, 3])
+    self.assertItemsEqual([spec for part in partitions for spec in part],
+                          metricSpecs)
+
+
+  def testMatchPartitionsRetainsMostMetrics(self):
+    currentMetrics = [set(["M0", "M1"]), set(["M2", "M3"]), set(["M4"])]
+    candidateMetrics = [set(["M4"]), set(["M0", "M1"]), set(["M2", "M3"])]
+
+    self.assertEqual(
+      twitter_direct_agent._matchPartitions(currentMetrics, candidateMetrics),
+      [1, 2, 0])
+
+
+  def testMatchPartitionsScalesToManyPartitions(self):
+    numParts = 50
+    currentMetrics = [set(["M%d" % i]) for i in xrange(numParts)]
+
+    # Trying all of the matchings of this many partitions wouldn't finish
+    self.assertEqual(
+      twitter_direct_agent._matchPartitions(currentMetrics,
+                                            currentMetrics[::-1]),
+      range(numParts)[::-1])
+
+
+  @patch.object(twitter_direct_agent, "_queryMetricTweetRates", autospec=True,
+                side_effect=Exception("db failure"))
+  def testEstimateMetricLoadsWithoutRates(self, _queryMetricTweetRatesMock):
+    self.assertEqual(
+      twitter_direct_agent._estimateMetricLoads(self._makeMetricSpecs(2)),
+      dict(M0=0, M1=0))
+
+
+  @patch.object(twitter_direct_agent, "_queryMetricTweetRates", autospec=True)
+  def testRebalanceReassignsChangedPartitions(self, queryMetricTweetRatesMock):
+    metricSpecs = self._makeMetricSpecs(4)
+    queues = [Mock(spec_set=["put"]), Mock(spec_set=["put"])]
+
+    rebalancer = twitter_direct_agent._StreamRebalancer(
+      partitions=[metricSpecs[:2], metricSpecs[2:]],
+      metricSpecsQueues=queues)
+
+    # Moderately skewed: not worth reconnecting the streams
+    queryMetricTweetRatesMock.return_value = dict(M0=60, M1=40, M2=50, M3=30)
+
+    self.assertFalse(rebalancer._rebalance())
+    self.assertFalse(queues[0].put.called)
+    self.assertFalse(queues[1].put.called)
+
+    # Hot metrics in one partition
+    queryMetricTweetRatesMock.return_value = dict(M0=100, M1=90, M2=10, M3=5)
+
+    self.assertTrue(rebalancer._rebalance())
+
+    queues[0].put.assert_called_once_with([metricSpecs[0], metricSpecs[3]])
+    queues[1].put.assert_called_once_with([metricSpecs[1], metricSpecs[2]])
+
+    # Balanced now
+    self.assertFalse(rebalancer._rebalance())
+    self.assertEqual(queues[0].put.call_count, 1)
+    self.assertEqual(queues[1].put.call_count, 1)
+
+
+
+@patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+              autospec=True)
+@patch.object(twitter_direct_agent.metric_utils,
+              "updateLastEmittedNonMetricSequence", autospec=True)
+@patch.object(twitter_direct_agent.metric_utils,
+              "queryLastEmittedNonMetricSequence", autospec=True,
+              return_value=10)
+class TweetForwarderTestCase(unittest.TestCase):
+
+
+  @staticmethod
+  def _makePage(firstSeq, numItems):
+    items = [dict(seq=firstSeq + i) for i in xrange(numItems)]
+    return (firstSeq + numItems - 1, items)
+
+
+  @patch.object(twitter_direct_agent.TweetForwarder, "_READ_BATCH_SIZE", 5)
+  @patch.object(twitter_direct_agent.TweetForwarder, "_PUBLISH_BATCH_SIZE", 2)
+  @patch.object(twitter_direct_agent.TweetForwarder,
+                "_PUBLISHED_BATCHES_PER_TRACKER_UPDATE", 4)
+  def testForwardTweetsInPagesAndUpdateTrackerPeriodically(
+      self, _queryLastEmittedMock, updateLastEmittedMock, _engineFactoryMock):
+    messageBusMock = Mock(spec_set=["publishExgMany"])
+    messageBusMock.publishExgMany.return_value = True
+
+    forwarder = twitter_direct_agent.TweetForwarder()
+
+    pages = [self._makePage(11, 5), self._makePage(16, 5),
+             self._makePage(21, 3), (None, None)]
+
+    with patch.object(twitter_direct_agent.TweetForwarder,
+                      "queryNonMetricTweetBatch", autospec=True,
+                      side_effect=pages) as queryMock:
+      result = forwarder._forwardTweetsViaRabbitmq(messageBusMock)
+
+    self.assertEqual(result, 23)
+
+    # Keyset pagination over seq
+    self.assertEqual(
+      [(c[1]["minSeq"], c[1]["maxItems"]) for c in queryMock.call_args_list],
+      [(11, 5), (16, 5), (21, 5), (24, 5)])
+
+    # One pipelined publish per page, split into messages of up to 2 items
+    publishedBatches = [
+      [json.loads(body) for body in c[1]["bodies"]]
+      for c in messageBusMock.publishExgMany.call_args_list]
+    self.assertEqual(
+      [[[item["seq"] for item in batch] for batch in bodies]
+       for bodies in publishedBatches],
+      [[[11, 12], [13, 14], [15]],
+       [[16, 17], [18, 19], [20]],
+       [[21, 22], [23]]])
+
+    # Tracker is updated once 4 messages are published and upon return
+    self.assertEqual(
+      [c[0][1] for c in updateLastEmittedMock.call_args_list],
+      [20, 23])
+
+    self.assertEqual(forwarder._numForwardedTweets, 13)
+
+
+  def testForwardTweetsSavesProgressOnPublishFailure(
+      self, _queryLastEmittedMock, updateLastEmittedMock, _engineFactoryMock):
+    messageBusMock = Mock(spec_set=["publishExgMany"])
+    messageBusMock.publishExgMany.side_effect = [True, Exception("amqp error")]
+
+    forwarder = twitter_direct_agent.TweetForwarder()
+
+    pages = [self._makePage(11, 3), self._makePage(14, 3)]
+
+    with patch.object(twitter_direct_agent.TweetForwarder,
+                      "queryNonMetricTweetBatch", autospec=True,
+                      side_effect=pages):
+      with self.assertRaises(Exception):
+        forwarder._forwardTweetsViaRabbitmq(messageBusMock)
+
+    # Only the published page is recorded as forwarded
+    updateLastEmittedMock.assert_called_once_with(
+      twitter_direct_agent._EMITTED_TWEET_VOLUME_SAMPLE_TRACKER_KEY, 13)
+
+
+  def testForwardTweetsWhenCaughtUp(
+      self, _queryLastEmittedMock, updateLastEmittedMock, _engineFactoryMock):
+    messageBusMock = Mock(spec_set=["publishExgMany"])
+
+    forwarder = twitter_direct_agent.TweetForwarder()
+
+    with patch.object(twitter_direct_agent.TweetForwarder,
+                      "queryNonMetricTweetBatch", autospec=True,
+                      return_value=(None, None)):
+      result = forwarder._forwardTweetsViaRabbitmq(messageBusMock)
+
+    self.assertEqual(result, 10)
+    self.assertFalse(messageBusMock.publishExgMany.called)
+    self.assertFalse(updateLastEmittedMock.called)
+
+
+
+@patch.object(twitter_direct_agent.collectorsdb, "engineFactory",
+              autospec=True)
+class MetricDataForwarderTestCase(unittest.TestCase):
+
+
+  @patch.object(twitter_direct_agent,
+                "_MAX_TWEET_VOLUME_AGG_INTERVALS_PER_QUERY", 3)
+  @patch.object(twitter_direct_agent.metric_utils,
+                "updateLastEmittedSampleDatetime", autospec=True)
+  @patch.object(twitter_direct_agent.metric_utils, "metricDataBatchWrite",
+                autospec=True)
+  def testForwardTweetVolumeMetricsInChunks(self,
+                                            metricDataBatchWriteMock,
+                                            updateLastEmittedMock,
+                                            _engineFactoryMock):
+    putSampleMock = Mock()
+    metricDataBatchWriteMock.return_value = MagicMock()
+    (metricDataBatchWriteMock.return_value.__enter__
+     .return_value) = putSampleMock
+
+    metricSpecs = [
+      twitter_direct_agent.TwitterMetricSpec(resource="R%d" % i,
+                                             metric="M%d" % i,
+                                             screenNames=[],
+                                             symbol="s%d" % i)
+      for i in xrange(2)
+    ]
+
+    aggSec = 300
+    period = timedelta(seconds=aggSec)
+    lastEmittedAggTime = datetime(2015, 8, 5, 14, 0)
+    aggTimes = [lastEmittedAggTime + period * (i + 1) for i in xrange(5)]
+
+    forwarder = twitter_direct_agent.MetricDataForwarder(metricSpecs, aggSec)
+
+    with patch.object(forwarder, "_queryTweetVolumeRange", autospec=True,
+                      side_effect=[
+                        [(aggTimes[0], "M0", 3), (aggTimes[2], "M1", 7)],
+                        [(aggTimes[4], "M0", 1)]]) as queryMock:
+      result = forwarder._forwardTweetVolumeMetrics(
+        lastEmittedAggTime=lastEmittedAggTime,
+        stopDatetime=aggTimes[-1] + period)
+
+    self.assertEqual(result, aggTimes[-1])
+
+    # One range query per chunk of up to 3 aggregation intervals
+    self.assertEqual(
+      [c[0] for c in queryMock.call_args_list],
+      [(aggTimes[0], aggTimes[3], None),
+       (aggTimes[3], aggTimes[4] + period, None)])
+
+    # The emitted sample tracker is advanced once per chunk
+    self.assertEqual(
+      [c[1]["sampleDatetime"] for c in updateLastEmittedMock.call_args_list],
+      [aggTimes[2], aggTimes[4]])
+
+    # Every interval gets a sample for every metric, zero when absent
+    expectedVolumes = {
+      (aggTimes[0], "M0"): 3,
+      (aggTimes[2], "M1"): 7,
+      (aggTimes[4], "M0"): 1
+    }
+    self.assertEqual(
+      [c[1] for c in putSampleMock.call_args_list],
+      [dict(metricName=metric,
+            value=expectedVolumes.get((aggTime, metric), 0),
+            epochTimestamp=(
+              twitter_direct_agent.date_time_utils.epochFromNaiveUTCDatetime(
+                aggTime)))
+       for aggTime in aggTimes
+       for metric in ("M0", "M1")])
+
+
+  @patch.object(twitter_direct_agent.metric_utils,
+                "updateLastEmittedSampleDatetime", autospec=True)
+  @patch.object(twitter_direct_agent.metric_utils, "metricDataBatchWrite",
+                autospec=True)
+  def testForwardTweetVolumeMetricsStopsOnFailure(self,
+                                                  metricDataBatchWriteMock,
+                                                  updateLastEmittedMock,
+                                                  _engineFactoryMock):
+    metricDataBatchWriteMock.return_value = MagicMock()
+
+    forwarder = twitter_direct_agent.MetricDataForwarder(metricSpecs=[],
+                                                         aggSec=300)
+
+    lastEmittedAggTime = datetime(2015, 8, 5, 14, 0)
+
+    with patch.object(forwarder, "_queryTweetVolumeRange", autospec=True,
+                      side_effect=Exception("db failure")):
+      result = forwarder._forwardTweetVolumeMetrics(
+        lastEmittedAggTime=lastEmittedAggTime,
+        stopDatetime=lastEmittedAggTime + timedelta(hours=1))
+
+    self.assertEqual(result, lastEmittedAggTime)
+    self.assertFalse(updateLastEmittedMock.called)
+
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -22,13 +22,15 @@
 from collections import defaultdict
 import datetime
 import json
-from mock import call, Mock, patch
+from mock import ANY, call, MagicMock, Mock, patch
 import StringIO
 import sys
+import threading
 import unittest
 import urlparse
 
 import pytz
+from sqlalchemy.dialects import mysql
 
 import taurus_metric_collectors
 from taurus_metric_collectors import logging_support
@@ -47,30 +49,92 @@ def setUpModule():
   autospec=True)
 class XigniteStockAgentTestCase(unittest.TestCase):
 
-  @patch("taurus_metric_collectors.xignite.xignite_stock_agent.Pool",
+  @patch(
+    "taurus_metric_collectors.xignite.xignite_stock_agent._PollForwardPipeline",
     autospec=True)
-  @patch("taurus_metric_collectors.xignite.xignite_stock_agent.time",
-  autospec=True)
-  def testMain(self, time, Pool, urllib2, metricDataBatchWriter):
+  def testMain(self, _PollForwardPipeline, urllib2, metricDataBatchWriter):
     # Load metric specs from metric configuration
     symbolToMetricSpecs = defaultdict(list)
     for spec in xignite_stock_agent.loadMetricSpecs():
       symbolToMetricSpecs[spec.symbol].append(spec)
 
-    symbolIter = symbolToMetricSpecs.itervalues()
+    _PollForwardPipeline.return_value.run.side_effect = KeyboardInterrupt()
 
-    time.sleep.side_effect = [None, None, KeyboardInterrupt()]
-    Pool.return_value.imap_unordered.return_value = iter([
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()]),
-      ({"Symbol": next(symbolIter)[0].symbol}, [Mock()])
-    ])
-    with patch.object(sys, "argv", [None, "--apitoken=foobar"]):
+    with patch.object(sys, "argv", [None, "--apitoken=foobar",
+                                    "--pollers=3", "--forwarders=2"]):
       xignite_stock_agent.main()
 
-    self.assertTrue(Pool.called)
-    self.assertEqual(Pool.return_value.imap_unordered.call_count, 3)
-    self.assertEqual(Pool.return_value.apply_async.call_count, 6)
+    _PollForwardPipeline.assert_called_once_with(
+      symbolToMetricSpecs=symbolToMetricSpecs,
+      pollFn=ANY,
+      forwardFn=ANY,
+      periodSec=60 * xignite_stock_agent.DEFAULT_BARLENGTH,
+      numPollers=3,
+      numForwarders=2)
+    self.assertTrue(_PollForwardPipeline.return_value.run.called)
+    self.assertTrue(_PollForwardPipeline.return_value.stop.called)
+
+
+  @patch(
+    "taurus_metric_collectors.xignite.xignite_stock_agent._purgeOldRecords",
+    autospec=True)
+  def testPollForwardPipeline(self, _purgeOldRecords, urllib2,
+                              metricDataBatchWriter):
+    """ Each symbol is polled once per period and forwarded in between, and
+    symbols without new data aren't forwarded
+    """
+    symbolToMetricSpecs = {"AAPL": [Mock()], "MSFT": [Mock()], "IBM": [Mock()]}
+    specsToSymbol = dict((id(specs), symbol)
+                         for symbol, specs in symbolToMetricSpecs.iteritems())
+
+    lock = threading.Lock()
+    events = []
+    done = threading.Event()
+
+    def pollFn(metricSpecs):
+      symbol = specsToSymbol[id(metricSpecs)]
+      with lock:
+        events.append(("poll", symbol))
+      if symbol == "IBM":
+        return {"Symbol": symbol}, []
+      return {"Symbol": symbol}, [Mock()]
+
+    def forwardFn(metricSpecs, data, security):
+      symbol = specsToSymbol[id(metricSpecs)]
+      with lock:
+        events.append(("forward", symbol))
+        if sum(1 for event in events if event[0] == "forward") >= 6:
+          done.set()
+
+    pipeline = xignite_stock_agent._PollForwardPipeline(
+      symbolToMetricSpecs=symbolToMetricSpecs,
+      pollFn=pollFn,
+      forwardFn=forwardFn,
+      periodSec=0.05,
+      numPollers=2,
+      numForwarders=2)
+
+    runner = threading.Thread(target=pipeline.run)
+    runner.setDaemon(True)
+    runner.start()
+    try:
+      self.assertTrue(done.wait(10))
+    finally:
+      pipeline.stop()
+      runner.join(10)
+
+    self.assertFalse(runner.isAlive())
+    self.assertTrue(_purgeOldRecords.called)
+
+    with lock:
+      for symbol in ("AAPL", "MSFT"):
+        symbolEvents = [event for event, s in events if s == symbol]
+        # Polls and forwards of a symbol alternate
+        self.assertEqual(symbolEvents[:4],
+                         ["poll", "forward", "poll", "forward"])
+
+      self.assertNotIn(("forward", "IBM"), events)
+      self.assertIn(("poll", "IBM"), events)
 
 
   def testGetEasternLocalizedTimestampFromSample(self,
@@ -433,6 +497,9 @@ class XigniteStockAgentTestCase(unittest.TestCase):
 
     xignite_stock_agent.forward((msft,), data, security)
 
+    # Samples are sent in the compact encoding
+    metricDataBatchWriter.assert_called_once_with(log=ANY, compact=True)
+
     metricDataBatchWriter.return_value.__enter__.return_value.call_args_list
     self.assertEqual(
       metricDataBatchWriter.return_value.__enter__.return_value.call_count, 2)
@@ -543,6 +610,59 @@ class XigniteStockAgentTestCase(unittest.TestCase):
       "transmitMetricData() was not called as expected.")
 
 
+  def testUpdateMetricDataHistory(self, urllib2, metricDataBatchWriter):
+    """ Emitted samples are recorded with one INSERT IGNORE per target table
+    in a single transaction
+    """
+    engine = Mock(begin=Mock(return_value=MagicMock()))
+    conn = engine.begin.return_value.__enter__.return_value
+
+    specs = [
+      xignite_stock_agent.StockMetricSpec(
+        metricName="XIGNITE.MSFT.CLOSINGPRICE", symbol="MSFT",
+        stockExchange="NASDAQ", sampleKey="Close"),
+      xignite_stock_agent.StockMetricSpec(
+        metricName="XIGNITE.MSFT.VOLUME", symbol="MSFT",
+        stockExchange="NASDAQ", sampleKey="Volume")
+    ]
+
+    samples = [
+      Mock(StartDate=datetime.date(2015, 1, 15),
+           StartTime=datetime.time(9, 30 + 5 * i),
+           EndDate=datetime.date(2015, 1, 15),
+           EndTime=datetime.time(9, 35 + 5 * i),
+           UTCOffset=-5.0)
+      for i in xrange(3)
+    ]
+
+    xignite_stock_agent._updateMetricDataHistory(
+      specSymbolSampleList=[(spec, "MSFT", sample)
+                            for sample in samples
+                            for spec in specs],
+      engine=engine)
+
+    self.assertEqual(engine.begin.call_count, 1)
+    self.assertEqual(conn.execute.call_count, 2)
+
+    tableToRows = dict()
+    for (ins, rows), _kwargs in conn.execute.call_args_list:
+      self.assertIn("IGNORE", str(ins.compile(dialect=mysql.dialect())))
+      tableToRows[ins.table] = rows
+
+    for table in (xignite_stock_agent.emittedStockPrice,
+                  xignite_stock_agent.emittedStockVolume):
+      rows = tableToRows[table]
+      self.assertEqual(len(rows), 3)
+      for row, sample in zip(rows, samples):
+        self.assertEqual(row["symbol"], "MSFT")
+        self.assertEqual(row["StartDate"], sample.StartDate)
+        self.assertEqual(row["StartTime"], sample.StartTime)
+        self.assertEqual(row["EndDate"], sample.EndDate)
+        self.assertEqual(row["EndTime"], sample.EndTime)
+        self.assertEqual(row["UTCOffset"], sample.UTCOffset)
+        self.assertIsNotNone(row["sent"])
+
+
   @unittest.skip("TAUR-1335")
   @patch(
     "taurus_metric_collectors.xignite.xignite_stock_agent._getLatestSample",
@@ -22,6 +22,8 @@
 from collections import namedtuple
 import logging
 import datetime
+from multiprocessing.pool import ThreadPool
+import threading
 
 import boto.dynamodb2
 from boto.dynamodb2.table import Table
@@ -50,6 +52,11 @@ SIGMA_MULTIPLIER = 3 # Standard deviation multiplier.  According to 68-95-99.7
                      # purposes, intervals greater than 3 x stddev are
                      # exceptional for that data set
 FIXED_WINDOW = 14 # Number of days over which to calculate stddev.
+NUM_WORKERS = 8 # Number of models whose metric data is queried and checked
+                # concurrently
+
+# Attributes of metric data items needed by the checks; the rest aren't fetched
+_METRIC_DATA_ATTRIBUTES = ("timestamp", "metric_value")
 
 # UTC datetime objects will be converted to US/Eastern local time for purposes
 # of determining market closure
@@ -216,6 +223,13 @@ class ModelLatencyChecker(MonitorDispatcher):
                     type="int",
                     dest="days",
                     help="Default: {}".format(FIXED_WINDOW))
+  parser.add_option("--workers",
+                    default=NUM_WORKERS,
+                    type="int",
+                    dest="workers",
+                    help=("Number of models to check concurrently, each "
+                          "worker reusing its own DynamoDB connection "
+                          "(Default: {})").format(NUM_WORKERS))
 
 
   def __init__(self):
@@ -230,6 +244,9 @@ class ModelLatencyChecker(MonitorDispatcher):
     if not options.metricDataTable:
       self.parser.error("You must specify a --metricDataTable argument.")
 
+    if options.workers < 1:
+      self.parser.error("--workers must be at least 1.")
+
     self.config = loadConfig(options)
     self.emailParams = loadEmailParamsFromConfig(self.config)
     self.apiKey = self.config.get("S1", "TAURUS_API_KEY")
@@ -242,8 +259,12 @@ class ModelLatencyChecker(MonitorDispatcher):
 
     self.metricDataTable = options.metricDataTable
     self.days = options.days
+    self.workers = options.workers
     self.options = options
 
+    # Holds the DynamoDB metric data table object of each worker thread
+    self._threadLocal = threading.local()
+
     g_logger.info("Initialized %r", repr(self))
 
 
@@ -304,14 +325,29 @@ class ModelLatencyChecker(MonitorDispatcher):
       aws_secret_access_key=self.awsSecretAccessKey)
 
 
+  def _getMetricDataTable(self):
+    """ Get the metric data table object of the calling thread, connecting to
+    DynamoDB on first use in the thread; boto connections aren't thread-safe,
+    so each worker thread reuses its own.
+
+    :returns: boto.dynamodb2.table.Table
+    """
+    metricDataTable = getattr(self._threadLocal, "metricDataTable", None)
+    if metricDataTable is None:
+      metricDataTable = Table(self.metricDataTable,
+                              connection=self._connectDynamoDB())
+      self._threadLocal.metricDataTable = metricDataTable
+
+    return metricDataTable
+
+
   def getMetricData(self, metricUid):
     """ Retrieve and return metric data from dynamodb
 
     :param str metricUid: Metric uid
-    :param str timestamp: Timestamp representing the lower bounds for metric
-      data samples to retrieve
     :returns: DynamoDB ResultSet (see
       http://boto.readthedocs.org/en/latest/dynamodb2_tut.html#the-resultset)
+      of items with only the "timestamp" and "metric_value" attributes
     """
     # Query recent DynamoDB metric data for each model
     now = datetime.datetime.now(_UTC_TZ)
@@ -319,11 +355,98 @@ class ModelLatencyChecker(MonitorDispatcher):
     then = now - datetime.timedelta(days=self.days,
                                     microseconds=now.microsecond)
 
-    conn = self._connectDynamoDB()
-    metricDataTable = Table(self.metricDataTable, connection=conn)
+    metricDataTable = self._getMetricDataTable()
 
     return retryOnTransientDynamoDBError(g_logger)(metricDataTable.query_2)(
-      uid__eq=metricUid, timestamp__gte=then.strftime("%Y-%m-%d %H:%M:%S"))
+      uid__eq=metricUid, timestamp__gte=then.strftime("%Y-%m-%d %H:%M:%S"),
+      attributes=_METRIC_DATA_ATTRIBUTES)
+
+
+  @staticmethod
+  def _getIntervalStats(resultSet):
+    """ Compute statistics of the time intervals between valid (e.g. non-zero)
+    samples
+
+    :param resultSet: metric data samples in ascending timestamp order
+    :returns: None if there are no intervals; otherwise three-tuple (<mean
+      interval in seconds>, <interval standard deviation in seconds>,
+      <UTC-localized timestamp of the last valid sample>)
+    """
+    # NOTE: the timestamps are UTC without an explicit offset, which numpy
+    # versions prior to 1.11 would parse as local time, so mark them as UTC
+    # before parsing them all at once into epoch seconds
+    timestamps = numpy.array(
+      [sample["timestamp"] + "Z"
+       for sample in resultSet if sample["metric_value"]],
+      dtype="datetime64[s]").astype(numpy.int64)
+
+    if len(timestamps) < 2:
+      return None
+
+    intervals = numpy.diff(timestamps).astype(numpy.float64)
+
+    lastSampleTimestamp = datetime.datetime.fromtimestamp(int(timestamps[-1]),
+                                                          _UTC_TZ)
+
+    return (numpy.mean(intervals),  # pylint: disable=E1101
+            numpy.nanstd(intervals),  # pylint: disable=E1101
+            lastSampleTimestamp)
+
+
+  def _checkModelLatency(self, model):
+    """ Check the latency of a model
+
+    :param dict model: model per Taurus API
+    :returns: LatencyMonitorErrorParams if the model doesn't have recent data;
+      None otherwise
+    """
+    # Calculate current UTC timestamp adjusted to account for acceptable
+    # 10-minute delay in processing.
+    utcnow = datetime.datetime.now(_UTC_TZ) - datetime.timedelta(minutes=10)
+
+    # Skip processing of models outside of market hours to avoid false
+    # positives
+    if isOutsideMarketHours(utcnow):
+      g_logger.debug("Skipping %s.  Reason: outside market hours",
+                     model["name"])
+      return None
+
+    intervalStats = self._getIntervalStats(
+      self.getMetricData(metricUid=model["uid"]))
+
+    if intervalStats is None:
+      # There are no intervals between samples, indicating there is no data at
+      # all!  No point in calculating stddev.
+      return LatencyMonitorErrorParams(model["name"], model["uid"], None, None)
+
+    # Even though we only apply this to stock metrics during approximate
+    # market hours, we still count intervals included in off-market hours.
+    # It's ok, though.  The math still works out and we'll catch metrics for
+    # which we stop receiving data anyway.
+    mean, stddev, lastSampleTimestamp = intervalStats
+
+    # Fabricate a hypothetical interval representing the amount of time since
+    # the most recent valid timestamp
+    currentInterval = (utcnow - lastSampleTimestamp).total_seconds()
+
+    # Only consider intervals that are more than N sigma AND above an
+    # arbitrary minimum threshold.  More frequent companies will have a
+    # lower stddev and therefore required a higher, if artifical, threshold
+    # to avoid too many false positives
+    acceptableThreshold = (
+      max(self.threshold, mean + self.sigmaMultiplier * stddev)
+    )
+
+    # If the hypothetical interval exceeds the acceptable threshold, then we
+    # have a reasonable expectation that there may be a problem with the
+    # model
+    if currentInterval > acceptableThreshold:
+      return LatencyMonitorErrorParams(model["name"],
+                                       model["uid"],
+                                       acceptableThreshold,
+                                       lastSampleTimestamp)
+
+    return None
 
 
   @MonitorDispatcher.registerCheck
@@ -336,77 +459,15 @@ class ModelLatencyChecker(MonitorDispatcher):
 
     models = self.getModels()
 
-    errors = []
-
-    for model in models:
-
-      # Calculate current UTC timestamp adjusted to account for acceptable
-      # 10-minute delay in processing.
-      utcnow = datetime.datetime.now(_UTC_TZ) - datetime.timedelta(minutes=10)
-
-      # Skip processing of models outside of market hours to avoid false
-      # positives
-      if isOutsideMarketHours(utcnow):
-        g_logger.debug("Skipping %s.  Reason: outside market hours",
-                       model["name"])
-        continue
-
-      resultSet = self.getMetricData(metricUid=model["uid"])
-      # Track all time intervals between valid (e.g. non-zero) samples
-      intervals = []
-
-      lastSampleTimestamp = None
-      for sample in resultSet:
-
-        if not sample["metric_value"]:
-          continue
-
-        timestamp = (
-          _UTC_TZ.localize(datetime.datetime.strptime(sample["timestamp"],
-                                                      "%Y-%m-%dT%H:%M:%S"))
-        )
-
-        if lastSampleTimestamp is None:
-          lastSampleTimestamp = timestamp
-          continue
-
-        intervals.append((timestamp - lastSampleTimestamp).total_seconds())
-        lastSampleTimestamp = timestamp
-
-      if not intervals:
-        errors.append(
-          LatencyMonitorErrorParams(model["name"], model["uid"], None, None)
-        )
-        continue # There are no intervals between samples, indicating there is
-                 # no data at all!  No point in calculating stddev.
-
-      # Even though we only apply this to stock metrics during approximate
-      # market hours, we still count intervals included in off-market hours.
-      # It's ok, though.  The math still works out and we'll catch metrics for
-      # which we stop receiving data anyway.
-      stddev = numpy.nanstd(intervals)  # pylint: disable=E1101
-      mean = numpy.mean(intervals)  # pylint: disable=E1101
-
-      # Fabricate a hypothetical interval representing the amount of time since
-      # the most recent valid timestamp
-      currentInterval = (utcnow - lastSampleTimestamp).total_seconds()
-
-      # Only consider intervals that are more than N sigma AND above an
-      # arbitrary minimum threshold.  More frequent companies will have a
-      # lower stddev and therefore required a higher, if artifical, threshold
-      # to avoid too many false positives
-      acceptableThreshold = (
-        max(self.threshold, mean + self.sigmaMultiplier * stddev)
-      )
-
-      # If the hypothetical interval exceeds the acceptable threshold, then we
-      # have a reasonable expectation that there may be a problem with the
-      # model
-      if currentInterval > acceptableThreshold:
-        errors.append(LatencyMonitorErrorParams(model["name"],
-                                                model["uid"],
-                                                acceptableThreshold,
-                                                lastSampleTimestamp))
+    # Check the models concurrently, preserving their order in the results
+    pool = ThreadPool(processes=min(self.workers, max(len(models), 1)))
+    try:
+      results = pool.map(self._checkModelLatency, models)
+    finally:
+      pool.close()
+      pool.join()
+
+    errors = [error for error in results if error is not None]
 
     g_logger.info("Processed statistics for %d model%s, found %d error%s.",
                   len(models),
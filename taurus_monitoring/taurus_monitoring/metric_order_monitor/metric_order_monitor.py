@@ -27,12 +27,15 @@ import os
 import traceback
 
 import sqlalchemy
+from sqlalchemy import and_, func, select
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import column, table
 
 from nta.utils import error_reporting
 from nta.utils.config import Config
 from taurus_engine import logging_support
 
+from taurus_monitoring import monitorsdb
 from taurus_monitoring import taurus_monitor_utils as monitorUtils
 from taurus_monitoring.monitorsdb import schema
 
@@ -47,18 +50,72 @@ _FLAG_DATABASE_ISSUE = OperationalError.__module__ + OperationalError.__name__
 _DB_ERROR_FLAG_FILE = "dbErrorFlagFile.csv"
 _MONITOR_NAME = __file__.split("/")[-1]
 
-# SELECT a.uid, count(rowid), min(rowid), max(rowid), min(timestamp),
-#   max(timestamp), m.name FROM metric_data a
-#     JOIN metric m on a.uid = m.uid
-#      WHERE a.timestamp > (SELECT b.timestamp FROM metric_data b WHERE
-#          a.uid = b.uid AND b.rowid = (a.rowid + "1")) group by uid;""
-_SQL_QUERY = ("SELECT a.uid, count(rowid), min(rowid), max(rowid), "
-              "min(timestamp),\n"
-              "max(timestamp), m.name FROM metric_data a \n"
-              "JOIN metric m on a.uid = m.uid\n"
-              "WHERE a.timestamp > (SELECT b.timestamp FROM metric_data b "
-              "WHERE\n"
-              "a.uid = b.uid AND b.rowid = (a.rowid + \"1\")) group by uid;")
+# Columns of the monitored taurus db tables used by the checks
+_metric = table("metric",
+                column("uid"),
+                column("name"))
+_metricData = table("metric_data",
+                    column("uid"),
+                    column("rowid"),
+                    column("timestamp"))
+
+
+
+def _buildOutOfOrderQuery(uid=None, minRowid=None, maxRowid=None):
+  """
+  Builds a query of the rows of metric_data whose timestamp is later than that
+  of the metric's next row (rowid + 1), aggregated per metric as: uid,
+  count(rowid), min(rowid), max(rowid), min(timestamp), max(timestamp), metric
+  name. Without arguments, it checks the whole table; otherwise, it only checks
+  the given metric's rows with rowids in the given range via a keyset range
+  over the (uid, rowid) primary key.
+
+  NOTE: a metric's rowids may have gaps where rowids reserved by a writer were
+  abandoned (see htmengine.repository.reserveMetricRowids); rows on either side
+  of a gap aren't compared, as they don't have consecutive rowids.
+
+  :param uid: Metric uid to check; None to check all metrics
+  :type uid: string
+  :param minRowid: Lowest rowid of a row to compare with its next row; None
+                   for no lower bound
+  :type minRowid: int
+  :param maxRowid: Highest rowid of a next row to compare with; None for no
+                   upper bound
+  :type maxRowid: int
+  :return: Query
+  :rtype: sqlalchemy.sql.expression.Select
+  """
+  a = _metricData.alias("a")
+  b = _metricData.alias("b")
+
+  query = (
+    select([a.c.uid,
+            func.count(a.c.rowid),
+            func.min(a.c.rowid),
+            func.max(a.c.rowid),
+            func.min(a.c.timestamp),
+            func.max(a.c.timestamp),
+            _metric.c.name])
+    .select_from(
+      a.join(b, and_(b.c.uid == a.c.uid, b.c.rowid == a.c.rowid + 1))
+      .join(_metric, _metric.c.uid == a.c.uid))
+    .where(a.c.timestamp > b.c.timestamp)
+    .group_by(a.c.uid, _metric.c.name)
+    .order_by(a.c.uid))
+
+  if uid is not None:
+    query = query.where(a.c.uid == uid)
+  if minRowid is not None:
+    query = query.where(a.c.rowid >= minRowid)
+  if maxRowid is not None:
+    query = query.where(b.c.rowid <= maxRowid)
+
+  return query
+
+
+
+# Query of all out-of-order rows of the metric_data table; see --fullScan
+_FULL_SCAN_QUERY = _buildOutOfOrderQuery()
 
 
 
@@ -78,6 +135,139 @@ def _getOutOfOrderMetrics(connection, query):
 
 
 
+def _getMaxRowids(connection):
+  """
+  Gets the highest rowid of each metric in the metric_data table of the taurus
+  db; this is served from the (uid, rowid) primary key.
+
+  :param connection: DB connection
+  :type connection: sqlalchemy.engine.base.Connection
+  :return: Highest rowid by metric uid
+  :rtype: dict
+  """
+  query = (select([_metricData.c.uid, func.max(_metricData.c.rowid)])
+           .group_by(_metricData.c.uid))
+  return dict(connection.execute(query).fetchall())
+
+
+
+def _getNewOutOfOrderMetrics(connection, highWaterRowids, maxRowids):
+  """
+  Checks the timestamp order of only the rows of the metric_data table in the
+  taurus db that were observed by the previous check but haven't been checked
+  yet, per metric: rows from the metric's last checked rowid (so that the last
+  checked row is compared with the first new one) through the highest rowid
+  observed by the previous check.
+
+  Rows are checked one check later than they were first observed, because
+  rowids are reserved before their rows are inserted in separate transactions
+  (see htmengine.repository.reserveMetricRowids), so rows with lower rowids
+  than those observed may still be committed in the meantime.
+
+  :param connection: DB connection
+  :type connection: sqlalchemy.engine.base.Connection
+  :param highWaterRowids: Pairs of (last checked rowid, highest observed rowid)
+    from the previous check by metric uid; see _loadHighWaterRowids
+  :type highWaterRowids: dict
+  :param maxRowids: Current highest rowid by metric uid; see _getMaxRowids
+  :type maxRowids: dict
+  :return: Out-of-order rows per metric; same columns as _FULL_SCAN_QUERY
+  :rtype: list
+  """
+  metrics = []
+  for uid in sorted(maxRowids):
+    if uid not in highWaterRowids:
+      # New metric; its rows will be checked next time
+      continue
+
+    lastCheckedRowid, observedRowid = highWaterRowids[uid]
+
+    if observedRowid > maxRowids[uid]:
+      # The metric's data was replaced since the previous check, so its rows
+      # will be checked again from the start next time
+      g_logger.info("Rechecking all rows of %s whose highest rowid=%d is "
+                    "below observed rowid=%d", uid, maxRowids[uid],
+                    observedRowid)
+      continue
+
+    if lastCheckedRowid == observedRowid:
+      # No new rows
+      continue
+
+    metrics.extend(
+      _getOutOfOrderMetrics(connection,
+                            _buildOutOfOrderQuery(uid=uid,
+                                                  minRowid=lastCheckedRowid,
+                                                  maxRowid=observedRowid)))
+
+  return metrics
+
+
+
+def _getNextHighWaterRowids(highWaterRowids, maxRowids):
+  """
+  Gets the high water rowids following a check by _getNewOutOfOrderMetrics.
+
+  :param highWaterRowids: Pairs of (last checked rowid, highest observed rowid)
+    from the previous check by metric uid
+  :type highWaterRowids: dict
+  :param maxRowids: Current highest rowid by metric uid; see _getMaxRowids
+  :type maxRowids: dict
+  :return: Pairs of (last checked rowid, highest observed rowid) by metric uid;
+    metrics that no longer have data are dropped. A last checked rowid of 0
+    means that none of the metric's rows have been checked.
+  :rtype: dict
+  """
+  nextHighWaterRowids = dict()
+  for uid, maxRowid in maxRowids.iteritems():
+    _, observedRowid = highWaterRowids.get(uid, (0, 0))
+    if observedRowid > maxRowid:
+      # Replaced metric data
+      observedRowid = 0
+
+    nextHighWaterRowids[uid] = (observedRowid, maxRowid)
+
+  return nextHighWaterRowids
+
+
+
+@monitorsdb.retryOnTransientErrors
+def _loadHighWaterRowids():
+  """
+  Loads the last checked rowid and highest observed rowid of each metric from
+  the previous check from monitorsdb.
+
+  :return: Pairs of (last checked rowid, highest observed rowid) by metric uid
+  :rtype: dict
+  """
+  table = schema.metricOrderMonitorHighWater
+  query = select([table.c.uid, table.c.last_rowid, table.c.max_rowid])
+  return {uid: (lastRowid, maxRowid) for uid, lastRowid, maxRowid
+          in monitorsdb.engineFactory().execute(query).fetchall()}
+
+
+
+@monitorsdb.retryOnTransientErrors
+def _saveHighWaterRowids(highWaterRowids):
+  """
+  Replaces the high water rowids in monitorsdb, dropping those of metrics
+  that no longer exist.
+
+  :param highWaterRowids: Pairs of (last checked rowid, highest observed rowid)
+    by metric uid
+  :type highWaterRowids: dict
+  """
+  table = schema.metricOrderMonitorHighWater
+  with monitorsdb.engineFactory().begin() as connection:
+    connection.execute(table.delete())
+    if highWaterRowids:
+      connection.execute(
+        table.insert(),
+        [dict(uid=uid, last_rowid=lastRowid, max_rowid=maxRowid)
+         for uid, (lastRowid, maxRowid) in highWaterRowids.iteritems()])
+
+
+
 def _reportMetrics(monitoredResource, metrics, emailParams):
   """
   Sends email notification of specified out-of-order metrics. Avoids sending
@@ -194,6 +384,10 @@ def _getArgs():
                       default="INFO")
   parser.add_argument("--testEmail", help="Forces a warning email to be sent.",
                       action="store_true")
+  parser.add_argument("--fullScan", help="Check the order of all rows of the "
+                      "metric_data table instead of only those added since "
+                      "the previous check.",
+                      action="store_true")
   return parser.parse_args()
 
 
@@ -244,9 +438,21 @@ def main():
     g_logger.debug("Connecting to resource: %s", monitoredResourceNoPwd)
     engine = sqlalchemy.create_engine(monitoredResource)
     connection = engine.connect()
-    metrics = _getOutOfOrderMetrics(connection, _SQL_QUERY)
+    maxRowids = _getMaxRowids(connection)
+    if args.fullScan:
+      metrics = _getOutOfOrderMetrics(connection, _FULL_SCAN_QUERY)
+      highWaterRowids = {uid: (maxRowid, maxRowid)
+                         for uid, maxRowid in maxRowids.iteritems()}
+    else:
+      highWaterRowids = _loadHighWaterRowids()
+      metrics = _getNewOutOfOrderMetrics(connection, highWaterRowids,
+                                         maxRowids)
+      highWaterRowids = _getNextHighWaterRowids(highWaterRowids, maxRowids)
     _reportMetrics(monitoredResourceNoPwd, metrics, emailParams)
 
+    # The checked rows have been reported
+    _saveHighWaterRowids(highWaterRowids)
+
     # If previous method does not throw exception, then we come here and clear
     # the database issue flag
     _clearDatabaseIssue(_FLAG_DATABASE_ISSUE)
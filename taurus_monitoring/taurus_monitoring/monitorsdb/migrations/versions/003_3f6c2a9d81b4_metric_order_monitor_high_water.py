@@ -0,0 +1,30 @@
+"""Metric order monitor high water
+
+Revision ID: 3f6c2a9d81b4
+Revises: 247aa1a6a0c3
+Create Date: 2016-03-07 10:12:31.527314
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a9d81b4'
+down_revision = '247aa1a6a0c3'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+def upgrade():
+  op.create_table('metric_order_monitor_high_water',
+  sa.Column('uid', mysql.VARCHAR(length=40), nullable=False),
+  sa.Column('last_rowid', sa.INTEGER(), nullable=False),
+  sa.Column('max_rowid', sa.INTEGER(), nullable=False),
+  sa.PrimaryKeyConstraint('uid', name='metric_order_monitor_high_water_pk'),
+  mysql_CHARSET='utf8',
+  mysql_COLLATE='utf8_unicode_ci'
+  )
+
+
+def downgrade():
+  raise NotImplementedError("Rollback is not supported.")
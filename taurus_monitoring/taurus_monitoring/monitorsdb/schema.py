@@ -101,6 +101,37 @@ metricOrderMonitorErrorFlags = _createMonitorErrorFlagsSchema(
   "metric_order_monitor_error_flags", metadata)
 
 
+# Per-metric rowid of metric_data through which the Taurus metric-order monitor
+# has checked timestamp order; see metric_order_monitor.py
+metricOrderMonitorHighWater = Table(
+  "metric_order_monitor_high_water",
+  metadata,
+
+  # Metric UID
+  Column("uid",
+         mysql.VARCHAR(length=_MAX_MONITOR_ISSUES_ID_LEN),
+         primary_key=True,
+         nullable=False),
+
+  PrimaryKeyConstraint("uid",
+                       name="metric_order_monitor_high_water_pk"),
+
+  # Highest rowid of the metric's data that has been checked; 0 if none
+  Column("last_rowid",
+         INTEGER,
+         nullable=False),
+
+  # Highest rowid of the metric's data observed by the last check, through
+  # which the next check checks
+  Column("max_rowid",
+         INTEGER,
+         nullable=False),
+
+  mysql_CHARSET=MYSQL_CHARSET,
+  mysql_COLLATE=MYSQL_COLLATE,
+)
+
+
 # See monitor_dispatcher.py for use-case and coordinate any changes there
 monitorDispatcherTable = Table("monitor_dispatcher",
                                metadata,
@@ -24,14 +24,83 @@
 Unittest of taurus_monitoring/metric_order/metric_order_monitor.py
 """
 
+import datetime
 import json
 import os
+import random
+import shutil
+import tempfile
 import unittest
 
 from mock import Mock, patch
 import sqlalchemy
 
 from taurus_monitoring.metric_order_monitor import metric_order_monitor as monitor
+from taurus_monitoring.monitorsdb import schema
+
+
+
+# The original full-table query of the monitor, with column references
+# qualified for sqlite
+_LEGACY_SQL_QUERY = (
+  "SELECT a.uid, count(a.rowid), min(a.rowid), max(a.rowid), "
+  "min(a.timestamp), max(a.timestamp), m.name FROM metric_data a "
+  "JOIN metric m on a.uid = m.uid "
+  "WHERE a.timestamp > (SELECT b.timestamp FROM metric_data b WHERE "
+  "a.uid = b.uid AND b.rowid = (a.rowid + 1)) group by a.uid")
+
+
+
+def _createTaurusTables(engine):
+  """ Create the metric and metric_data tables of the taurus db """
+  engine.execute("CREATE TABLE metric (uid VARCHAR(40) PRIMARY KEY, "
+                 "name VARCHAR(255))")
+  engine.execute("CREATE TABLE metric_data (uid VARCHAR(40), rowid INTEGER, "
+                 "timestamp DATETIME, PRIMARY KEY (uid, rowid))")
+
+
+
+def _seedMetricData(engine, rng, numMetrics, numRows, outOfOrderRate,
+                    firstRowid=1):
+  """ Append rows to each metric, moving a fraction of the timestamps back in
+  time to put them out of order
+  """
+  for i in xrange(numMetrics):
+    uid = "uid%02d" % (i,)
+    engine.execute("INSERT OR IGNORE INTO metric VALUES (?, ?)",
+                   uid, "METRIC.%02d" % (i,))
+
+    rows = []
+    for rowid in xrange(firstRowid, firstRowid + numRows):
+      timestamp = (datetime.datetime(2015, 1, 1) +
+                   datetime.timedelta(minutes=5 * rowid))
+      if rng.random() < outOfOrderRate:
+        timestamp -= datetime.timedelta(minutes=rng.randint(6, 60))
+      rows.append((uid, rowid, timestamp.strftime("%Y-%m-%d %H:%M:%S")))
+
+    if rows:
+      engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)", rows)
+
+
+
+def _mergeMetrics(*metricLists):
+  """ Merge per-metric results of several checks of disjoint rows """
+  merged = {}
+  for metrics in metricLists:
+    for (uid, count, minRowid, maxRowid, minTimestamp, maxTimestamp,
+         name) in metrics:
+      if uid in merged:
+        (_, prevCount, prevMinRowid, prevMaxRowid, prevMinTimestamp,
+         prevMaxTimestamp, _) = merged[uid]
+        count += prevCount
+        minRowid = min(minRowid, prevMinRowid)
+        maxRowid = max(maxRowid, prevMaxRowid)
+        minTimestamp = min(minTimestamp, prevMinTimestamp)
+        maxTimestamp = max(maxTimestamp, prevMaxTimestamp)
+      merged[uid] = (uid, count, minRowid, maxRowid, minTimestamp,
+                     maxTimestamp, name)
+
+  return [merged[uid] for uid in sorted(merged)]
 
 
 
@@ -42,9 +111,20 @@ class MetricOrderMonitorTest(unittest.TestCase):
     monitor._EMAIL_PARAMS = {}
     monitor._MONITORED_RESOURCE = "db"
 
-    if not os.path.isfile(monitor._DB_ERROR_FLAG_FILE):
-      with open(monitor._DB_ERROR_FLAG_FILE, "wb") as fp:
-        json.dump({}, fp)
+    # Keep the flag file out of the current directory
+    self._tempDir = tempfile.mkdtemp()
+    flagFilePath = os.path.join(
+      self._tempDir, os.path.basename(monitor._DB_ERROR_FLAG_FILE))
+    flagFilePatch = patch.object(monitor, "_DB_ERROR_FLAG_FILE", flagFilePath)
+    flagFilePatch.start()
+    self.addCleanup(flagFilePatch.stop)
+
+    with open(monitor._DB_ERROR_FLAG_FILE, "wb") as fp:
+      json.dump({}, fp)
+
+
+  def tearDown(self):
+    shutil.rmtree(self._tempDir)
 
 
   @patch("nta.utils.error_reporting.sendMonitorErrorEmail")
@@ -215,5 +295,171 @@ class MetricOrderMonitorTest(unittest.TestCase):
 
 
 
+class MetricOrderMonitorQueryTest(unittest.TestCase):
+  """ Checks of out-of-order rows in seeded sqlite databases """
+
+
+  def setUp(self):
+    self.engine = sqlalchemy.create_engine("sqlite://")
+    _createTaurusTables(self.engine)
+
+    self.monitorsdbEngine = sqlalchemy.create_engine("sqlite://")
+    schema.metricOrderMonitorHighWater.create(self.monitorsdbEngine)
+
+    patcher = patch("taurus_monitoring.monitorsdb.engineFactory",
+                    autospec=True, return_value=self.monitorsdbEngine)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+
+  def _getLegacyOutOfOrderMetrics(self):
+    return [tuple(row) for row in
+            self.engine.execute(_LEGACY_SQL_QUERY).fetchall()]
+
+
+  def _check(self):
+    """ Perform an incremental check and save its high water rowids """
+    connection = self.engine.connect()
+    try:
+      maxRowids = monitor._getMaxRowids(connection)
+      highWaterRowids = monitor._loadHighWaterRowids()
+      metrics = monitor._getNewOutOfOrderMetrics(
+        connection, highWaterRowids, maxRowids)
+      monitor._saveHighWaterRowids(
+        monitor._getNextHighWaterRowids(highWaterRowids, maxRowids))
+    finally:
+      connection.close()
+
+    return [tuple(row) for row in metrics]
+
+
+  def testFullScanMatchesLegacyQuery(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=10,
+                    numRows=500, outOfOrderRate=0.02)
+
+    metrics = monitor._getOutOfOrderMetrics(self.engine.connect(),
+                                            monitor._FULL_SCAN_QUERY)
+
+    legacyMetrics = self._getLegacyOutOfOrderMetrics()
+    self.assertGreater(len(legacyMetrics), 0)
+    self.assertEqual([tuple(row) for row in metrics], legacyMetrics)
+
+
+  def testFirstIncrementalCheckMatchesLegacyQuery(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=10,
+                    numRows=500, outOfOrderRate=0.02)
+
+    # The first check only observes the rows, which the next one checks
+    self.assertEqual(self._check(), [])
+    self.assertEqual(monitor._loadHighWaterRowids(),
+                     {"uid%02d" % (i,): (0, 500) for i in xrange(10)})
+
+    legacyMetrics = self._getLegacyOutOfOrderMetrics()
+    self.assertGreater(len(legacyMetrics), 0)
+    self.assertEqual(self._check(), legacyMetrics)
+
+    self.assertEqual(monitor._loadHighWaterRowids(),
+                     {"uid%02d" % (i,): (500, 500) for i in xrange(10)})
+
+
+  def testIncrementalChecksMatchLegacyQuery(self):
+    rng = random.Random(42)
+
+    # Seed, check, and repeat with more rows, including a new metric
+    checks = []
+    for firstRowid, numMetrics, numRows in ((1, 8, 300),
+                                            (301, 9, 1),
+                                            (302, 9, 200),
+                                            (502, 9, 0),
+                                            (502, 9, 0)):
+      _seedMetricData(self.engine, rng, numMetrics=numMetrics,
+                      numRows=numRows, outOfOrderRate=0.05,
+                      firstRowid=firstRowid)
+      checks.append(self._check())
+
+    # Each pair of consecutive rows was checked exactly once
+    legacyMetrics = self._getLegacyOutOfOrderMetrics()
+    self.assertGreater(len(legacyMetrics), 0)
+    self.assertEqual(_mergeMetrics(*checks), legacyMetrics)
+
+    # There were no new rows to check
+    self.assertEqual(checks[-1], [])
+
+
+  def testIncrementalCheckComparesLastCheckedRowWithNewRows(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=1,
+                    numRows=10, outOfOrderRate=0)
+    self.assertEqual(self._check(), [])
+    self.assertEqual(self._check(), [])
+
+    # The new row precedes the last checked one in time
+    self.engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)",
+                        "uid00", 11, "2015-01-01 00:00:00")
+
+    self.assertEqual(self._check(), [])
+    self.assertEqual(self._check(),
+                     [("uid00", 1, 10, 10, "2015-01-01 00:50:00",
+                       "2015-01-01 00:50:00", "METRIC.00")])
+
+
+  def testIncrementalCheckRechecksReplacedMetricData(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=1,
+                    numRows=10, outOfOrderRate=0)
+    self.assertEqual(self._check(), [])
+    self.assertEqual(self._check(), [])
+
+    # Replace the metric data with fewer rows, out of order
+    self.engine.execute("DELETE FROM metric_data")
+    _seedMetricData(self.engine, random.Random(42), numMetrics=1,
+                    numRows=5, outOfOrderRate=1)
+
+    self.assertEqual(self._check(), [])
+
+    legacyMetrics = self._getLegacyOutOfOrderMetrics()
+    self.assertGreater(len(legacyMetrics), 0)
+    self.assertEqual(self._check(), legacyMetrics)
+
+
+  def testIncrementalCheckIncludesRowsCommittedBelowObservedRowid(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=1,
+                    numRows=10, outOfOrderRate=0)
+
+    # Row 12 is committed before row 11, whose rowid was reserved first
+    self.engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)",
+                        "uid00", 12, "2015-01-01 02:00:00")
+    self.assertEqual(self._check(), [])
+
+    # Row 11 precedes row 10 in time
+    self.engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)",
+                        "uid00", 11, "2015-01-01 00:00:00")
+
+    self.assertEqual(self._check(),
+                     [("uid00", 1, 10, 10, "2015-01-01 00:50:00",
+                       "2015-01-01 00:50:00", "METRIC.00")])
+
+
+
+  def testIncrementalCheckDoesNotCompareRowsAcrossRowidGaps(self):
+    _seedMetricData(self.engine, random.Random(42), numMetrics=1,
+                    numRows=10, outOfOrderRate=0)
+
+    # Rowid 11 was abandoned, and row 12 precedes row 10 in time, while row 13
+    # precedes row 12
+    self.engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)",
+                        "uid00", 12, "2015-01-01 02:00:00")
+    self.engine.execute("INSERT INTO metric_data VALUES (?, ?, ?)",
+                        "uid00", 13, "2015-01-01 01:00:00")
+
+    self.assertEqual(self._check(), [])
+
+    # Only the consecutive rows 12 and 13 are compared
+    self.assertEqual(self._check(),
+                     [("uid00", 1, 12, 12, "2015-01-01 02:00:00",
+                       "2015-01-01 02:00:00", "METRIC.00")])
+    self.assertEqual(self._getLegacyOutOfOrderMetrics(),
+                     [("uid00", 1, 12, 12, "2015-01-01 02:00:00",
+                       "2015-01-01 02:00:00", "METRIC.00")])
+
+
 if __name__ == "__main__":
   unittest.main()
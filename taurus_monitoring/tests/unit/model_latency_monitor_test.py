@@ -25,6 +25,7 @@ Unittest of taurus_monitoring/latency_monitor/model_latency_monitor.py
 import datetime
 from mock import Mock, patch
 import pickle
+import time
 import unittest
 import os
 
@@ -59,6 +60,58 @@ METRIC_DATA_BY_ID = {
 }
 
 
+# Fixed "now" of the synthetic metric data tests below; a Monday during market
+# hours
+_SYNTHETIC_NOW = pytz.timezone("UTC").localize(
+  datetime.datetime(2015, 11, 2, 20, 41, 0, 0))
+
+
+
+class _LocalMetricDataTable(object):
+  """ Local stand-in for a boto.dynamodb2.table.Table of taurus metric data
+  seeded with items keyed by uid (hash key) and timestamp (range key); honors
+  query_2 key conditions and attribute projection
+  """
+
+  def __init__(self, itemsByUid, connection):
+    self.itemsByUid = itemsByUid
+    self.connection = connection
+
+
+  # Disable pylint warning about improperly named arguments
+  # pylint: disable=C0103
+  def query_2(self, uid__eq, timestamp__gte, attributes=None):
+    # Range keys are "YYYY-MM-DDTHH:MM:SS" strings, which compare like the
+    # "YYYY-MM-DD HH:MM:SS" lower bound up to the separator
+    items = sorted((item for item in self.itemsByUid.get(uid__eq, [])
+                    if item["timestamp"] >= timestamp__gte),
+                   key=lambda item: item["timestamp"])
+
+    if attributes is None:
+      return items
+
+    return [{key: item[key] for key in attributes} for item in items]
+
+
+
+def _synthesizeMetricData(uid, lastTimestamp, numSamples, intervalSec,
+                          metricValue=1):
+  """ Synthesize metric data items at regular intervals up to lastTimestamp
+
+  :returns: list of metric data item dicts
+  """
+  return [
+    {"uid": uid,
+     "timestamp": (
+       lastTimestamp - datetime.timedelta(seconds=i * intervalSec)
+     ).strftime("%Y-%m-%dT%H:%M:%S"),
+     "metric_value": metricValue,
+     "display_value": metricValue,
+     "anomaly_score": 0.5}
+    for i in xrange(numSamples)
+  ]
+
+
 
 class ModelLatencyCheckerTest(unittest.TestCase):
 
@@ -93,7 +146,7 @@ class ModelLatencyCheckerTest(unittest.TestCase):
     # See data/*-data.pickle
     # Disable pylint warning about unused, and improperly named arguments
     # pylint: disable=W0613,C0103
-    def query2SideEffect(uid__eq, timestamp__gte):
+    def query2SideEffect(uid__eq, timestamp__gte, attributes):
       return METRIC_DATA_BY_ID[uid__eq]
 
     tableMock.return_value = (
@@ -147,7 +200,7 @@ class ModelLatencyCheckerTest(unittest.TestCase):
     # See data/*-data.pickle
     # Disable pylint warning about unused, and improperly named arguments
     # pylint: disable=W0613,C0103
-    def query2SideEffect(uid__eq, timestamp__gte):
+    def query2SideEffect(uid__eq, timestamp__gte, attributes):
       return METRIC_DATA_BY_ID[uid__eq]
 
     tableMock.return_value = (
@@ -201,7 +254,7 @@ class ModelLatencyCheckerTest(unittest.TestCase):
     # See data/*-data.pickle
     # Disable pylint warning about unused, and improperly named arguments
     # pylint: disable=W0613,C0103
-    def query2SideEffect(uid__eq, timestamp__gte):
+    def query2SideEffect(uid__eq, timestamp__gte, attributes):
       return METRIC_DATA_BY_ID[uid__eq]
 
     tableMock.return_value = (
@@ -284,7 +337,7 @@ class ModelLatencyCheckerTest(unittest.TestCase):
     # See data/*-data.pickle
     # Disable pylint warning about unused, and improperly named arguments
     # pylint: disable=W0613,C0103
-    def query2SideEffect(uid__eq, timestamp__gte):
+    def query2SideEffect(uid__eq, timestamp__gte, attributes):
       return []
 
     tableMock.return_value = (
@@ -308,6 +361,126 @@ class ModelLatencyCheckerTest(unittest.TestCase):
       "=None seconds, last_timestamp=None)")
 
 
+  # Mock command line arguments, specifying test config file, bogus metric
+  # data table name and fewer workers than models
+  @patch_helpers.patchCLIArgs("taurus-model-latency-monitor",
+                              "--monitorConfPath",
+                              _TEST_CONF_FILEPATH,
+                              "--metricDataTable",
+                              "taurus.metric_data.test",
+                              "--workers",
+                              "4")
+  # Prevent Taurus HTTP API calls
+  @patch("requests.get", autospec=True)
+  # Prevent boto dynamodb API calls
+  @patch("boto.dynamodb2", autospec=True)
+  @patch("taurus_monitoring.latency_monitor.model_latency_monitor.Table",
+         autospec=True)
+  @patch_helpers.patchNow(_SYNTHETIC_NOW)
+  def testCheckAllModelLatencyWithLocalMetricDataTable(self, tableMock,
+      botoDynamoDB2Mock, requestsGetMock):
+
+    recentTimestamp = _SYNTHETIC_NOW - datetime.timedelta(minutes=10)
+    staleTimestamp = _SYNTHETIC_NOW - datetime.timedelta(days=1)
+
+    # Every fifth model stopped receiving data a day ago, and one has only
+    # zero-valued samples
+    models = []
+    itemsByUid = {}
+    for i in xrange(40):
+      model = {"name": "SYNTHETIC.%02d" % (i,), "uid": "uid%02d" % (i,)}
+      models.append(model)
+      itemsByUid[model["uid"]] = _synthesizeMetricData(
+        uid=model["uid"],
+        lastTimestamp=(staleTimestamp if i % 5 == 0 else recentTimestamp),
+        numSamples=500,
+        intervalSec=300,
+        metricValue=(0 if i == 7 else 1))
+
+    requestsGetMock.return_value = Mock(status_code=200,
+                                        json=Mock(return_value=models))
+
+    # Each DynamoDB connection is a distinct object
+    botoDynamoDB2Mock.connect_to_region.side_effect = lambda *a, **kw: object()
+
+    tables = []
+    def tableSideEffect(tableName, connection):
+      self.assertEqual(tableName, "taurus.metric_data.test")
+      table = _LocalMetricDataTable(itemsByUid, connection)
+      table.query_2 = Mock(wraps=table.query_2, __name__="query_2")
+      tables.append(table)
+      return table
+
+    tableMock.side_effect = tableSideEffect
+
+    with self.assertRaises(LatencyMonitorError) as exc:
+      ModelLatencyChecker().checkAllModelLatency()
+
+    # Errors are reported in model order
+    self.assertEqual(
+      exc.exception.message,
+      "The following models have exceeded the acceptable threshold for time "
+      "since last timestamp in taurus.metric_data.test DynamoDB table:\n" +
+      "\n".join(
+        ("    LatencyMonitorErrorParams(model_name=SYNTHETIC.07, model_uid="
+         "uid07, threshold=None seconds, last_timestamp=None)") if i == 7 else
+        ("    LatencyMonitorErrorParams(model_name=SYNTHETIC.%02d, model_uid="
+         "uid%02d, threshold=3600 seconds, last_timestamp=%s)" % (
+           i, i, staleTimestamp))
+        for i in xrange(40) if i % 5 == 0 or i == 7))
+
+    # Each worker created one connection and table, and reused it for every
+    # model it checked
+    self.assertGreaterEqual(len(tables), 1)
+    self.assertLessEqual(len(tables), 4)
+    self.assertEqual(len(set(id(table.connection) for table in tables)),
+                     len(tables))
+    self.assertEqual(botoDynamoDB2Mock.connect_to_region.call_count,
+                     len(tables))
+
+    # Every model was queried exactly once, for only the needed attributes
+    queriedUids = []
+    for table in tables:
+      for (_, kwargs) in table.query_2.call_args_list:
+        queriedUids.append(kwargs["uid__eq"])
+        self.assertItemsEqual(kwargs["attributes"],
+                              ("timestamp", "metric_value"))
+
+    self.assertItemsEqual(queriedUids,
+                          [synthModel["uid"] for synthModel in models])
+
+
+  def testGetIntervalStatsParsesTimestampsAsUTC(self):
+    # Run in a timezone with a UTC offset, so that parsing the timestamps as
+    # local time would shift them
+    originalTZ = os.environ.get("TZ")
+    def restoreTZ():
+      if originalTZ is None:
+        os.environ.pop("TZ", None)
+      else:
+        os.environ["TZ"] = originalTZ
+      time.tzset()
+    self.addCleanup(restoreTZ)
+    os.environ["TZ"] = "America/Los_Angeles"
+    time.tzset()
+
+    resultSet = [
+      {"timestamp": "2015-11-02T20:25:00", "metric_value": 1.0},
+      {"timestamp": "2015-11-02T20:30:00", "metric_value": 0.0},
+      {"timestamp": "2015-11-02T20:35:00", "metric_value": 2.0},
+      {"timestamp": "2015-11-02T20:40:00", "metric_value": 3.0},
+    ]
+
+    mean, stddev, lastSampleTimestamp = (
+      ModelLatencyChecker._getIntervalStats(resultSet))
+
+    self.assertEqual(mean, 450.0)
+    self.assertEqual(stddev, 150.0)
+    self.assertEqual(
+      lastSampleTimestamp,
+      pytz.timezone("UTC").localize(datetime.datetime(2015, 11, 2, 20, 40)))
+
+
   # Mock command line arguments, specifying test config file and ommitting
   # metric data table name
   @patch_helpers.patchCLIArgs("taurus-model-latency-monitor",
@@ -40,6 +40,8 @@ import logging
 import os
 import pkg_resources
 import sys
+import threading
+import time
 import traceback
 
 import validictory
@@ -57,6 +59,19 @@ from unicorn_backend.utils import na
 g_log = logging.getLogger(__name__)
 
 
+# Input file buffer size in batch mode
+_BATCH_INPUT_BUFFER_SIZE = 1024 * 1024
+
+# Upper bound on the size of an output frame in batch mode; writes of up to
+# PIPE_BUF bytes to a pipe are atomic, so the reader never observes a partial
+# frame
+_BATCH_OUTPUT_FRAME_MAX_BYTES = 4096
+
+# Upper bound on how long a result may be held back in batch mode before its
+# frame is emitted
+_BATCH_OUTPUT_FRAME_MAX_LATENCY_SEC = 1.0
+
+
 
 class _CommandLineArgError(Exception):
   """ Error parsing command-line options """
@@ -68,16 +83,18 @@ class _Options(object):
   """Options returned by _parseArgs"""
 
 
-  def __init__(self, inputSpec, aggSpec, modelSpec):
+  def __init__(self, inputSpec, aggSpec, modelSpec, batch):
     """
     :param dict inputSpec: Input data specification per input_opt_schema.json
     :param dict aggSpec: Optional aggregation specification per
       agg_otp_schema.json or None if no aggregation is requested
     :param dict modelSpec: Model specification per model_opt_schema.json
+    :param bool batch: True for batch mode; False for per-row mode
     """
     self.inputSpec = inputSpec
     self.aggSpec = aggSpec
     self.modelSpec = modelSpec
+    self.batch = batch
 
 
 def _parseArgs():
@@ -120,6 +137,16 @@ def _parseArgs():
     help=("REQUIRED: JSON object describing the model per "
           "model_opt_schema.json."))
 
+  parser.add_argument(
+    "--batch",
+    action="store_true",
+    dest="batch",
+    default=False,
+    help=("OPTIONAL: batch mode for bulk input, such as a large historical "
+          "CSV file: read input in large blocks and emit results in frames of "
+          "multiple rows bounded by size and latency; if omitted, each result "
+          "is emitted as soon as it's computed, which suits live streaming."))
+
   options = parser.parse_args()
 
 
@@ -176,7 +203,121 @@ def _parseArgs():
                    .format(exc))
 
 
-  return _Options(inputSpec=inputSpec, aggSpec=aggSpec, modelSpec=modelSpec)
+  return _Options(inputSpec=inputSpec, aggSpec=aggSpec, modelSpec=modelSpec,
+                  batch=options.batch)
+
+
+
+class _FramedOutputWriter(object):
+  """ Accumulates output messages and writes them out in frames of whole
+  messages, flushing each frame
+  """
+
+
+  def __init__(self, outFileObj, maxFrameBytes, maxFrameLatencySec,
+               flushInBackground=False):
+    """
+    :param outFileObj: A file-like object for writing the output frames
+    :param int maxFrameBytes: Frame size that triggers writing the frame out;
+      a frame exceeds it only if a single message does; 0 to write each message
+      out as its own frame
+    :param float maxFrameLatencySec: Maximum age of the oldest message of a
+      frame that is checked when adding messages to the frame
+    :param bool flushInBackground: also write out frames that reach
+      maxFrameLatencySec from a background thread, so that they aren't held
+      back while no messages are being added (e.g., while waiting for input);
+      call `close()` to stop the thread
+    """
+    self._outFileObj = outFileObj
+    self._maxFrameBytes = maxFrameBytes
+    self._maxFrameLatencySec = maxFrameLatencySec
+
+    self._messages = []
+    self._frameBytes = 0
+    self._frameStartTime = None
+
+    # Guards the frame and the output file object; notified when a frame is
+    # started or the writer is closed
+    self._frameCondition = threading.Condition()
+    self._closed = False
+
+    self._flusherThread = None
+    if flushInBackground:
+      self._flusherThread = threading.Thread(target=self._runFlusher,
+                                             name="FramedOutputWriterFlusher")
+      self._flusherThread.setDaemon(True)
+      self._flusherThread.start()
+
+
+  def write(self, message):
+    """ Add a message to the current frame, writing out frames as needed
+
+    :param str message: output message
+    """
+    with self._frameCondition:
+      if self._messages and (self._frameBytes + len(message) >
+                             self._maxFrameBytes):
+        self._flushFrame()
+
+      if not self._messages:
+        self._frameStartTime = time.time()
+        self._frameCondition.notify()
+
+      self._messages.append(message)
+      self._frameBytes += len(message)
+
+      if (self._frameBytes >= self._maxFrameBytes or
+          time.time() - self._frameStartTime >= self._maxFrameLatencySec):
+        self._flushFrame()
+
+
+  def flush(self):
+    """ Write out the current frame, if any """
+    with self._frameCondition:
+      self._flushFrame()
+
+
+  def close(self):
+    """ Write out the current frame, if any, and stop the background flusher
+    thread, if any
+    """
+    with self._frameCondition:
+      self._closed = True
+      self._frameCondition.notify()
+      self._flushFrame()
+
+    if self._flusherThread is not None:
+      self._flusherThread.join()
+
+
+  def _flushFrame(self):
+    """ Write out the current frame, if any; the caller must hold
+    self._frameCondition
+    """
+    if self._messages:
+      self._outFileObj.write("".join(self._messages))
+      self._outFileObj.flush()
+
+      self._messages = []
+      self._frameBytes = 0
+
+
+  def _runFlusher(self):
+    """ Background flusher thread function: writes out frames that reach
+    self._maxFrameLatencySec until the writer is closed
+    """
+    with self._frameCondition:
+      while not self._closed:
+        if not self._messages:
+          self._frameCondition.wait()
+          continue
+
+        remainingSec = (self._frameStartTime + self._maxFrameLatencySec -
+                        time.time())
+        if remainingSec > 0:
+          self._frameCondition.wait(remainingSec)
+        else:
+          self._flushFrame()
 
 
 
@@ -186,14 +327,25 @@ class _ModelRunner(object):
   """
 
 
-  def __init__(self, inputFileObj, inputSpec, aggSpec, modelSpec):
+  def __init__(self, inputFileObj, inputSpec, aggSpec, modelSpec,
+               outputWriter=None):
     """
     :param inputFileObj: A file-like object that contains input metric data
     :param dict inputSpec: Input data specification per input_opt_schema.json
     :param dict aggSpec: Optional aggregation specification per
       agg_opt_schema.json or None if no aggregation is requested
     :param dict modelSpec: Model specification per model_opt_schema.json
+    :param outputWriter: Optional _FramedOutputWriter for the output messages;
+      if None, each output message is written to stdout as soon as it's
+      computed
     """
+    if outputWriter is None:
+      outputWriter = _FramedOutputWriter(outFileObj=sys.stdout,
+                                         maxFrameBytes=0,
+                                         maxFrameLatencySec=0)
+
+    self._outputWriter = outputWriter
+
     self._inputSpec = inputSpec
 
     self._aggSpec = aggSpec
@@ -260,9 +412,8 @@ class _ModelRunner(object):
     return csv.reader(fileObj, dialect="excel")
 
 
-  @classmethod
-  def _emitOutputMessage(cls, dataRow, anomalyProbability):
-    """Emit output message to stdout
+  def _emitOutputMessage(self, dataRow, anomalyProbability):
+    """Emit output message via the output writer
 
     :param list dataRow: the two-tuple data row on which anomalyProbability was
       computed, whose first element is datetime timestamp and second element is
@@ -274,8 +425,7 @@ class _ModelRunner(object):
                                     dataRow[1],
                                     anomalyProbability]),)
 
-    sys.stdout.write(message)
-    sys.stdout.flush()
+    self._outputWriter.write(message)
 
 
   def _computeAnomalyProbability(self, fields):
@@ -304,9 +454,20 @@ class _ModelRunner(object):
     """ Run the model: ingest and process the input metric data and emit output
     messages containing anomaly scores
     """
+    try:
+      self._processInput()
+    finally:
+      # Emit the results held back in the current frame, if any, even if
+      # processing failed
+      self._outputWriter.flush()
+
+
+  def _processInput(self):
+    """ Implementation of `run()` """
 
     numRowsToSkip = self._inputSpec["rowOffset"]
-    datetimeFormat = self._inputSpec["datetimeFormat"]
+    parseDatetime = date_time_utils.compileDatetimeParser(
+      self._inputSpec["datetimeFormat"])
     inputRowTimestampIndex = self._inputSpec["timestampIndex"]
     inputRowValueIndex = self._inputSpec["valueIndex"]
 
@@ -329,8 +490,7 @@ class _ModelRunner(object):
           # Aggregator constructor
   
           fields = [
-            date_time_utils.parseDatetime(inputRow[inputRowTimestampIndex],
-                                          datetimeFormat),
+            parseDatetime(inputRow[inputRowTimestampIndex]),
             float(inputRow[inputRowValueIndex])
           ]
   
@@ -401,18 +561,33 @@ def main():
   try:
     options = _parseArgs()
 
-    # Create an input file object with the desired properties
+    # Create an input file object with the desired properties; use the
+    # default buffering unless in batch mode
+    bufferSize = _BATCH_INPUT_BUFFER_SIZE if options.batch else -1
     if "csv" in options.inputSpec:
-      inputFileObj = open(options.inputSpec["csv"], mode="rU")
+      inputFileObj = open(options.inputSpec["csv"], "rU", bufferSize)
     else:
-      inputFileObj = os.fdopen(os.dup(sys.stdin.fileno()), "rU")
+      inputFileObj = os.fdopen(os.dup(sys.stdin.fileno()), "rU", bufferSize)
+
+    outputWriter = None
+    if options.batch:
+      outputWriter = _FramedOutputWriter(
+        outFileObj=sys.stdout,
+        maxFrameBytes=_BATCH_OUTPUT_FRAME_MAX_BYTES,
+        maxFrameLatencySec=_BATCH_OUTPUT_FRAME_MAX_LATENCY_SEC,
+        flushInBackground=True)
 
     # Invoke the model runner
-    _ModelRunner(
-      inputFileObj=inputFileObj,
-      inputSpec=options.inputSpec,
-      aggSpec=options.aggSpec,
-      modelSpec=options.modelSpec).run()
+    try:
+      _ModelRunner(
+        inputFileObj=inputFileObj,
+        inputSpec=options.inputSpec,
+        aggSpec=options.aggSpec,
+        modelSpec=options.modelSpec,
+        outputWriter=outputWriter).run()
+    finally:
+      if outputWriter is not None:
+        outputWriter.close()
   except Exception as ex:  # pylint: disable=W0703
     g_log.exception("ModelRunner failed")
 
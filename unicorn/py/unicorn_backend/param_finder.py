@@ -66,6 +66,10 @@ MIN_ROW_AFTER_AGGREGATION = 1000
 # encoder
 DISABLE_DAY_OF_WEEK_ENCODER = True
 
+# Maximum number of FFT coefficients per block of widths in _fftCwt; bounds
+# the memory used by the batched transforms
+_FFT_CWT_BLOCK_MAX_COEFFICIENTS = 2 ** 22
+
 def _convolve(vector1, vector2, mode):
   """
   Returns the discrete, linear convolution of two one-dimensional sequences.
@@ -180,12 +184,71 @@ def _cwt(data, wavelet, widths):
 
 
 
+def _fftCwt(data, wavelet, widths):
+  """
+  Continuous wavelet transform via FFT; same result as `_cwt` up to floating
+  point error, but in O(N log N) per width instead of O(N * M).
+
+  The data is transformed once; the wavelets for a block of widths are
+  transformed, multiplied with the data's transform and inverse-transformed
+  together. Blocks are sized to hold at most _FFT_CWT_BLOCK_MAX_COEFFICIENTS
+  coefficients.
+
+  @param data (ndarray) data on which to perform the transform
+
+  @param wavelet Wavelet function per `_cwt`
+
+  @param widths (sequence) Widths to use for transform
+
+  @return (ndarray) Will have shape of (len(widths), len(data))
+
+  """
+  data = numpy.asarray(data, dtype=numpy.float64)
+  numPoints = len(data)
+
+  waveletDataList = [wavelet(min(10 * width, numPoints), width)
+                     for width in widths]
+
+  # Size the transforms for the full linear convolution with the longest
+  # wavelet, rounded up to a power of two
+  maxWaveletLength = max(len(waveletData) for waveletData in waveletDataList)
+  fftSize = 1 << int(numpy.ceil(numpy.log2(numPoints + maxWaveletLength - 1)))
+
+  dataFft = numpy.fft.rfft(data, fftSize)
+
+  widthsPerBlock = max(1,
+                       _FFT_CWT_BLOCK_MAX_COEFFICIENTS // (fftSize // 2 + 1))
+
+  output = numpy.zeros([len(widths), numPoints])
+  for blockStart in xrange(0, len(widths), widthsPerBlock):
+    block = waveletDataList[blockStart:blockStart + widthsPerBlock]
+
+    kernels = numpy.zeros([len(block), fftSize])
+    for ind, waveletData in enumerate(block):
+      kernels[ind, :len(waveletData)] = waveletData
+
+    convolutions = numpy.fft.irfft(numpy.fft.rfft(kernels, axis=1) * dataFft,
+                                   fftSize, axis=1)
+
+    # Keep the center part of each convolution, as in
+    # _CORRELATION_MODE_SAME
+    for ind, waveletData in enumerate(block):
+      offset = (len(waveletData) - 1) // 2
+      output[blockStart + ind, :] = convolutions[ind,
+                                                 offset:offset + numPoints]
+
+  return output
+
+
+
 def findParameters(samples):
   """
   Find parameters for a given time series dataset with heuristics.
 
   @param samples Sequence of two tuples (timestamp, value), where
-    timestamp of type datetime.datetime and value is a number (int of float)
+    timestamp of type datetime.datetime and value is a number (int of float);
+    or numpy structured array with two fields: timestamp of type datetime64
+    and numeric value
 
   @return: JSON object with the following properties:
 
@@ -211,15 +274,7 @@ def findParameters(samples):
       "valueFieldName": The name of the field in 'modelConfig'
       corresponding to the metric value (string)
   """
-  (timestamps, values) = zip(*samples)
-  numRecords = len(timestamps)
-
-  if not isinstance(timestamps[0], datetime.datetime):
-    raise TypeError("timestamps must be datetime type")
-
-  if numRecords > MAX_NUM_ROWS:
-    timestamps = timestamps[:MAX_NUM_ROWS]
-    values = values[:MAX_NUM_ROWS]
+  (timestampsInMs, values, numRecords) = _convertSamples(samples)
 
   if numRecords < MIN_NUM_ROWS:
     outputInfo = {
@@ -228,16 +283,12 @@ def findParameters(samples):
     }
     return outputInfo
 
-  # make sure that timestamps are parsed in ms
-  timestampsInMs = numpy.array(timestamps, dtype="datetime64[ms]")
-  values = numpy.array(values).astype("float64")
-
   assert len(values) == len(timestampsInMs)
   numDataPts = len(values)
 
   medianSamplingIntervalInMs = _getMedianSamplingInterval(timestampsInMs)
   
-  if medianSamplingIntervalInMs > 0:
+  if medianSamplingIntervalInMs > numpy.timedelta64(0, "ms"):
     values = _resampleData(timestampsInMs,
                            values,
                            medianSamplingIntervalInMs)
@@ -280,6 +331,48 @@ def findParameters(samples):
 
 
 
+def _convertSamples(samples):
+  """
+  Convert the input samples to arrays, keeping the first MAX_NUM_ROWS
+
+  @param samples input samples per `findParameters`
+
+  @return: (tuple) Contains:
+    "timestamps" (numpy array) timestamps in datetime64 format in ms
+    "values" (numpy array) float64 values
+    "numRecords" (int) number of input samples
+  """
+  if isinstance(samples, numpy.ndarray):
+    if samples.dtype.names is None or len(samples.dtype.names) != 2:
+      raise TypeError("samples array must have two fields: timestamp and "
+                      "value")
+
+    timestampField, valueField = samples.dtype.names
+    if samples.dtype[timestampField].kind != "M":
+      raise TypeError("timestamps must be datetime64 type")
+
+    numRecords = len(samples)
+    samples = samples[:MAX_NUM_ROWS]
+
+    timestamps = samples[timestampField].astype("datetime64[ms]")
+    values = samples[valueField].astype("float64")
+
+  else:
+    (timestamps, values) = zip(*samples)
+    numRecords = len(timestamps)
+
+    if not isinstance(timestamps[0], datetime.datetime):
+      raise TypeError("timestamps must be datetime type")
+
+    # make sure that timestamps are parsed in ms
+    timestamps = numpy.array(timestamps[:MAX_NUM_ROWS],
+                             dtype="datetime64[ms]")
+    values = numpy.array(values[:MAX_NUM_ROWS]).astype("float64")
+
+  return timestamps, values, numRecords
+
+
+
 def _getAggInfo(medianSamplingInterval, suggestedSamplingInterval, aggFunc):
   """
   Return a JSON object containing the aggregation window size and
@@ -369,7 +462,7 @@ def _resampleData(timestamps, values, newSamplingInterval):
 
   @return "newValues" (numpy array) data values after resamplings
   """
-  if newSamplingInterval == 0.0:
+  if newSamplingInterval == numpy.timedelta64(0, "ms"):
     return values  # don't resample in this case
   else:
     assert timestamps.dtype == numpy.dtype("datetime64[ms]")
@@ -379,11 +472,11 @@ def _resampleData(timestamps, values, newSamplingInterval):
   
     nSampleNew = numpy.floor(totalDuration / newSamplingInterval) + 1
     nSampleNew = nSampleNew.astype("int")
-    newTimeStamps = numpy.empty(nSampleNew, dtype="datetime64[ms]")
-    for sampleI in xrange(nSampleNew):
-      newTimeStamps[sampleI] = timestamps[0] + sampleI * newSamplingInterval
-  
-    newValues = numpy.interp((newTimeStamps - timestamps[0]).astype("float32"),
+
+    # Offsets of the new timestamps from the first one
+    newOffsets = numpy.arange(nSampleNew) * newSamplingInterval
+
+    newValues = numpy.interp(newOffsets.astype("float32"),
                              (timestamps - timestamps[0]).astype("float32"),
                              values)
   
@@ -418,7 +511,7 @@ def _calculateContinuousWaveletTransform(samplingInterval, values):
   assert timeScale.dtype == numpy.dtype('timedelta64[ms]')
 
   # continuous wavelet transformation with ricker wavelet
-  cwtMatrix = _cwt(values, _rickerWavelet, widths)
+  cwtMatrix = _fftCwt(values, _rickerWavelet, widths)
   # clip wavelet coefficients to minimize boundary effect
   maxTimeScale = int(widths[-1])
   cwtMatrix = cwtMatrix[:, 4 * maxTimeScale:-4 * maxTimeScale]
@@ -595,9 +688,34 @@ def _getAggregationFunction(values):
 
   @return aggFunc (string) "sum" or "mean"
   """
-  if len(numpy.unique(values)) <= 2:
+  if _hasAtMostTwoUniqueValues(numpy.ravel(values)):
     aggFunc = "sum"  # "transactional"
   else:
     aggFunc = "mean"  # "non-transactional"
 
   return aggFunc
+
+
+
+def _hasAtMostTwoUniqueValues(values):
+  """
+  Check whether there are at most two unique values, counting each NaN as
+  unique like `numpy.unique` does; linear in the number of values, unlike
+  sorting them
+
+  @param values (numpy array) one-dimensional data values
+
+  @return (bool) True if there are at most two unique values
+  """
+  nanMask = numpy.isnan(values)
+  numUnique = numpy.count_nonzero(nanMask)
+
+  values = values[~nanMask]
+  if len(values) > 0:
+    values = values[values != values[0]]
+    numUnique += 1
+
+  if len(values) > 0:
+    numUnique += 1 if numpy.all(values == values[0]) else 2
+
+  return numUnique <= 2
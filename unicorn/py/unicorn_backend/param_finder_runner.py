@@ -173,25 +173,32 @@ def _readCSVFile(fileName,
     for _ in xrange(rowOffset):
       fileReader.next()  # skip header line
 
-    samples = []
-    numRows = 0
+    timestampStrings = []
+    values = []
     for row in fileReader:
       if len(row) > valueIndex:
         if not (na.isNA(str(row[valueIndex])) or
          na.isNA(str(row[timestampIndex]))):
-          timestamp = date_time_utils.parseDatetime(row[timestampIndex],
-                                                    datetimeFormat)
-  
-          # use utc timezone if timezone information is not provided
-          if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=tz.tzutc())
-  
-          samples.append((timestamp, float(row[valueIndex])))
-  
-          numRows += 1
-          if numRows >= MAX_NUM_ROWS:
+          timestampStrings.append(row[timestampIndex])
+          values.append(row[valueIndex])
+
+          if len(values) >= MAX_NUM_ROWS:
             break
-    return samples
+
+  # Parse the whole timestamp column at once
+  timestamps = date_time_utils.parseDatetimeColumn(timestampStrings,
+                                                   datetimeFormat)
+
+  samples = []
+  utc = tz.tzutc()
+  for timestamp, value in zip(timestamps, values):
+    # use utc timezone if timezone information is not provided
+    if timestamp.tzinfo is None:
+      timestamp = timestamp.replace(tzinfo=utc)
+
+    samples.append((timestamp, float(value)))
+
+  return samples
 
 
 def main():
@@ -28,6 +28,7 @@ from datetime import datetime
 import re
 
 from dateutil import tz
+import numpy
 
 
 # unicorn_backend's format string for Unix Timestamp (seconds)
@@ -56,6 +57,30 @@ _MAX_UTC_OFFSET_IN_SECONDS = ((_MAX_UTC_OFFSET_PARTS[0] * 60 +
 # datetime.utcfromtimestamp() parses UNIX seconds
 _MAX_UNIX_SECONDS = 253402300799.0
 
+# Regex patterns of the `datetime.strptime` format directives supported by the
+# compiled parsers' fast path; the patterns accept a subset of what strptime
+# accepts for the same directive
+_FAST_DIRECTIVE_PATTERNS = {
+  "Y": r"\d\d\d\d",
+  "y": r"\d\d",
+  "m": r"\d\d",
+  "d": r"\d\d",
+  "H": r"\d\d",
+  "M": r"\d\d",
+  "S": r"\d\d",
+  "f": r"\d{1,6}",
+}
+
+# Directives that strptime also accepts as a single digit; the fast path does
+# the same when the directive is followed by a non-digit literal or ends the
+# format, so that field boundaries are unambiguous
+_ONE_OR_TWO_DIGIT_DIRECTIVES = frozenset("mdHMS")
+
+# Compiled parsers keyed by date format
+_compiledParsers = dict()
+
+
+
 def parseDatetime(dateString, dateFormat):
   """ Utility for parsing timestamps. Supports `datetime.strptime` formats
   with extensions as well as custom formats described below.
@@ -87,96 +112,377 @@ def parseDatetime(dateString, dateFormat):
     a naive datetime.
   :rtype: `datetime.datetime`
   """
-  originalDateString = dateString
-  originalDateFormat = dateFormat
-
   if dateFormat in [UNIX_TIMESTAMP_SEC, UNIX_TIMESTAMP_MILLISEC]:
-    # Our custom formats: Seconds or milliseconds since Unix Epoch as int or
-    # float
-    timestampFloat = float(dateString)
-    if timestampFloat < 0:
-      raise ValueError(
-        "Expected non-negative Unix Timestamp, but got {}".format(dateString))
-
-    if dateFormat == UNIX_TIMESTAMP_MILLISEC:
-      # Convert from milliseconds to seconds
-      timestampFloat /= 1000
-
-    try:
-      return datetime.utcfromtimestamp(timestampFloat)
-    except ValueError as exc:
-      raise ValueError(
-        "Unable to parse {} from format {}: {}".format(
-          dateString, dateFormat, exc))
+    return _parseUnixTimestamp(dateString, dateFormat)
 
   # Handle datetime.strptime formats with extensions
 
   # If timestamp is not naive, parse tzinfo and strip it from date and format
   tzinfo = None
   if dateFormat.endswith("%z"):
+    dateString, tzinfo = _splitUtcOffset(dateString, dateFormat)
+
     # Strip UTC offset pattern from date format so datetime.strptime won't choke
     dateFormat = dateFormat[:-2]
 
-    if dateString.endswith("Z"):
-      tzname = "Z"
-      offsetInSeconds = 0  # Z=UTC
+  result = datetime.strptime(dateString, dateFormat)
+  if tzinfo is not None:
+    result = result.replace(tzinfo=tzinfo)
 
-      # Strip UTC offset from date string so datetime.strptime won't choke
-      dateString = dateString[:-1]
+  return result
 
-    else:
-      parts = None
 
-      match = (_BASIC_HHMM_UTC_OFFSET.search(dateString) or
-               _EXTENDED_HHMM_UTC_OFFSET.search(dateString))
+
+def compileDatetimeParser(dateFormat):
+  """ Get a parser specialized for the given date format; the parser returns
+  the same results and raises the same exceptions as `parseDatetime` for that
+  format, but is faster for the common formats: Unix Timestamps and formats
+  made up of the numeric directives %Y, %y, %m, %d, %H, %M, %S and %f (with
+  optional %z at end) are parsed without `datetime.strptime`, which remains
+  the fallback for everything else. Parsers are compiled once per format.
+
+  :param str dateFormat: date format per `parseDatetime`
+
+  :returns: function that takes a date string and returns the parsed datetime
+    per `parseDatetime`
+  """
+  parser = _compiledParsers.get(dateFormat)
+  if parser is None:
+    parser = _compiledParsers[dateFormat] = _compileDatetimeParser(dateFormat)
+
+  return parser
+
+
+
+def parseDatetimeColumn(dateStrings, dateFormat):
+  """ Parse a column of date strings with the same results and exceptions as
+  calling `parseDatetime` on each of them in order. Columns in formats
+  supported by the fast path of `compileDatetimeParser` (without %z) are parsed
+  with numpy when their date strings share the layout of the first one; the
+  remaining date strings are parsed one at a time by the compiled parser.
+
+  :param dateStrings: sequence of date strings to parse
+  :param str dateFormat: date format per `parseDatetime`
+
+  :returns: list of parsed datetimes per `parseDatetime`
+  """
+  parser = compileDatetimeParser(dateFormat)
+
+  results = None
+  if (dateFormat not in [UNIX_TIMESTAMP_SEC, UNIX_TIMESTAMP_MILLISEC] and
+      len(dateStrings) > 0):
+    fastPath = _compileFastPath(dateFormat)
+    if fastPath is not None:
+      results = _parseColumnLayout(dateStrings, *fastPath)
+
+  if results is None:
+    return [parser(dateString) for dateString in dateStrings]
+
+  return [result if result is not None else parser(dateString)
+          for dateString, result in zip(dateStrings, results)]
+
+
+
+def _parseUnixTimestamp(dateString, dateFormat):
+  """ Parse a date string in one of our custom Unix Timestamp formats per
+  `parseDatetime`
+
+  :param str dateString: date string to parse
+  :param str dateFormat: UNIX_TIMESTAMP_SEC or UNIX_TIMESTAMP_MILLISEC
+
+  :returns: parsed naive datetime
+  :rtype: `datetime.datetime`
+  """
+  # Our custom formats: Seconds or milliseconds since Unix Epoch as int or
+  # float
+  timestampFloat = float(dateString)
+  if timestampFloat < 0:
+    raise ValueError(
+      "Expected non-negative Unix Timestamp, but got {}".format(dateString))
+
+  if dateFormat == UNIX_TIMESTAMP_MILLISEC:
+    # Convert from milliseconds to seconds
+    timestampFloat /= 1000
+
+  try:
+    return datetime.utcfromtimestamp(timestampFloat)
+  except ValueError as exc:
+    raise ValueError(
+      "Unable to parse {} from format {}: {}".format(
+        dateString, dateFormat, exc))
+
+
+
+def _splitUtcOffset(dateString, dateFormat):
+  """ Parse the UTC offset at the end of a date string per `parseDatetime`
+
+  :param str dateString: date string to parse
+  :param str dateFormat: date format ending with %z
+
+  :returns: two-tuple (<date string without the UTC offset>, <tzinfo>)
+  """
+  originalDateString = dateString
+  originalDateFormat = dateFormat
+
+  if dateString.endswith("Z"):
+    tzname = "Z"
+    offsetInSeconds = 0  # Z=UTC
+
+    # Strip UTC offset from date string so datetime.strptime won't choke
+    dateString = dateString[:-1]
+
+  else:
+    parts = None
+
+    match = (_BASIC_HHMM_UTC_OFFSET.search(dateString) or
+             _EXTENDED_HHMM_UTC_OFFSET.search(dateString))
+    if match is not None:
+      parts = match.groups()
+
+    if match is None:
+      match = _ONLY_HH_UTC_OFFSET.search(dateString)
       if match is not None:
-        parts = match.groups()
+        parts = match.groups() + ("00",)
 
-      if match is None:
-        match = _ONLY_HH_UTC_OFFSET.search(dateString)
-        if match is not None:
-          parts = match.groups() + ("00",)
+    if match is None:
+      raise ValueError(
+        "time data {!r} does not match format {!r}".format(
+          originalDateString,
+          originalDateFormat))
 
-      if match is None:
-        raise ValueError(
-          "time data {!r} does not match format {!r}".format(
-            originalDateString,
-            originalDateFormat))
+    tzname = match.group()
 
-      tzname = match.group()
+    # Strip UTC offset from date string so datetime.strptime won't choke
+    dateString = dateString[:match.start()]
 
-      # Strip UTC offset from date string so datetime.strptime won't choke
-      dateString = dateString[:match.start()]
+    # Convert offset parts to offset in seconds
+    assert len(parts) == 3, len(parts)
 
-      # Convert offset parts to offset in seconds
-      assert len(parts) == 3, len(parts)
+    sign, hours, minutes = parts[0], int(parts[1]), int(parts[2])
 
-      sign, hours, minutes = parts[0], int(parts[1]), int(parts[2])
+    if minutes > 59:
+      raise ValueError(
+        "time data {!r} does not match format {!r}: UTC offset minutes "
+        "exceed 59".format(originalDateString, originalDateFormat))
 
-      if minutes > 59:
-        raise ValueError(
-          "time data {!r} does not match format {!r}: UTC offset minutes "
-          "exceed 59".format(originalDateString, originalDateFormat))
+    offsetInSeconds = (hours * 60 + minutes) * 60
+    if sign == "-":
+      offsetInSeconds = -offsetInSeconds
 
-      offsetInSeconds = (hours * 60 + minutes) * 60
-      if sign == "-":
-        offsetInSeconds = -offsetInSeconds
+    if abs(offsetInSeconds) > _MAX_UTC_OFFSET_IN_SECONDS:
+      raise ValueError(
+        "time data {!r} does not match format {!r}: UTC offset {}{}:{} is "
+        "out of bounds; must be in -{} .. +{}"
+        .format(originalDateString, originalDateFormat,
+                sign, hours, minutes,
+                ":".join(str(i) for i in _MAX_UTC_OFFSET_PARTS),
+                ":".join(str(i) for i in _MAX_UTC_OFFSET_PARTS)))
 
-      if abs(offsetInSeconds) > _MAX_UTC_OFFSET_IN_SECONDS:
-        raise ValueError(
-          "time data {!r} does not match format {!r}: UTC offset {}{}:{} is "
-          "out of bounds; must be in -{} .. +{}"
-          .format(originalDateString, originalDateFormat,
-                  sign, hours, minutes,
-                  ":".join(str(i) for i in _MAX_UTC_OFFSET_PARTS),
-                  ":".join(str(i) for i in _MAX_UTC_OFFSET_PARTS)))
 
+  tzinfo = tz.tzoffset(name=tzname, offset=offsetInSeconds)
 
-    tzinfo = tz.tzoffset(name=tzname, offset=offsetInSeconds)
+  return dateString, tzinfo
 
 
-  result = datetime.strptime(dateString, dateFormat)
-  if tzinfo is not None:
-    result = result.replace(tzinfo=tzinfo)
 
-  return result
+def _compileDatetimeParser(dateFormat):
+  """ Compile a parser for the given date format; see `compileDatetimeParser`
+  """
+  if dateFormat in [UNIX_TIMESTAMP_SEC, UNIX_TIMESTAMP_MILLISEC]:
+    return lambda dateString: _parseUnixTimestamp(dateString, dateFormat)
+
+  hasUtcOffset = dateFormat.endswith("%z")
+  naiveDateFormat = dateFormat[:-2] if hasUtcOffset else dateFormat
+
+  fastPath = _compileFastPath(naiveDateFormat)
+
+  def parseDatetimeCompiled(dateString):
+    tzinfo = None
+    if hasUtcOffset:
+      dateString, tzinfo = _splitUtcOffset(dateString, dateFormat)
+
+    result = None
+    if fastPath is not None:
+      result = _parseFastPath(dateString, *fastPath)
+
+    if result is None:
+      result = datetime.strptime(dateString, naiveDateFormat)
+
+    if tzinfo is not None:
+      result = result.replace(tzinfo=tzinfo)
+
+    return result
+
+  return parseDatetimeCompiled
+
+
+
+def _compileFastPath(dateFormat):
+  """ Compile a regex for date strings in the given naive date format that
+  matches only date strings that `datetime.strptime` parses the same way
+
+  :param str dateFormat: `datetime.strptime` format
+
+  :returns: None if the format isn't supported by the fast path; otherwise
+    two-tuple (<compiled regex>, <sequence of directive letters, one per regex
+    group>)
+  """
+  # Split format into directives and literals
+  elements = []
+  i = 0
+  while i < len(dateFormat):
+    if dateFormat[i] == "%":
+      if i + 1 >= len(dateFormat):
+        return None
+      if dateFormat[i + 1] == "%":
+        elements.append(("literal", "%"))
+      elif dateFormat[i + 1] in _FAST_DIRECTIVE_PATTERNS:
+        elements.append(("directive", dateFormat[i + 1]))
+      else:
+        return None
+      i += 2
+    else:
+      elements.append(("literal", dateFormat[i]))
+      i += 1
+
+  directives = [value for kind, value in elements if kind == "directive"]
+  if (len(set(directives)) != len(directives) or
+      ("Y" in directives and "y" in directives)):
+    # strptime's choice between repeated fields is arbitrary
+    return None
+
+  pattern = []
+  for index, (kind, value) in enumerate(elements):
+    if kind == "literal":
+      pattern.append(re.escape(value))
+      continue
+
+    following = elements[index + 1] if index + 1 < len(elements) else None
+    if value in _ONE_OR_TWO_DIGIT_DIRECTIVES and (
+        following is None or
+        (following[0] == "literal" and not following[1].isdigit())):
+      pattern.append(r"(\d\d?)")
+    else:
+      pattern.append("(" + _FAST_DIRECTIVE_PATTERNS[value] + ")")
+
+  return re.compile("".join(pattern) + r"\Z"), tuple(directives)
+
+
+
+def _parseFastPath(dateString, regex, directives):
+  """ Parse a naive date string via the fast path
+
+  :param str dateString: date string
+  :param regex: compiled regex per `_compileFastPath`
+  :param directives: directive letters per `_compileFastPath`
+
+  :returns: parsed naive datetime; None if the date string doesn't match the
+    regex or has out-of-range fields, leaving it to `datetime.strptime`
+  """
+  match = regex.match(dateString)
+  if match is None:
+    return None
+
+  # Defaults per datetime.strptime
+  fields = {"Y": 1900, "m": 1, "d": 1, "H": 0, "M": 0, "S": 0, "f": 0}
+
+  for directive, text in zip(directives, match.groups()):
+    if directive == "f":
+      fields["f"] = int(text + "0" * (6 - len(text)))
+    elif directive == "y":
+      year = int(text)
+      fields["Y"] = year + 2000 if year <= 68 else year + 1900
+    else:
+      fields[directive] = int(text)
+
+  try:
+    return datetime(fields["Y"], fields["m"], fields["d"],
+                    fields["H"], fields["M"], fields["S"], fields["f"])
+  except ValueError:
+    return None
+
+
+
+def _parseColumnLayout(dateStrings, regex, directives):
+  """ Parse the naive date strings that share the layout of the first one, all
+  at once with numpy
+
+  :param dateStrings: non-empty sequence of date strings
+  :param regex: compiled regex per `_compileFastPath`
+  :param directives: directive letters per `_compileFastPath`
+
+  :returns: None if the column can't be parsed this way; otherwise list with a
+    naive datetime for each parsed date string and None for each of the rest
+  """
+  match = regex.match(dateStrings[0])
+  if match is None:
+    return None
+
+  column = numpy.array(dateStrings)
+  if column.dtype.kind == "S":
+    charCodes = column.view(numpy.uint8)
+  elif column.dtype.kind == "U":
+    charCodes = column.view(numpy.uint32)
+  else:
+    return None
+
+  width = len(dateStrings[0])
+  charCodes = charCodes.reshape(len(column), -1)[:, :width].astype(numpy.int64)
+  layoutCodes = charCodes[0]
+
+  # Date strings with the first one's layout - same length, digits at the
+  # first one's field positions and its literals elsewhere - match the regex
+  # with the same field boundaries
+  digitPositions = numpy.zeros(width, dtype=bool)
+  for group in xrange(1, len(directives) + 1):
+    digitPositions[match.start(group):match.end(group)] = True
+
+  digits = charCodes[:, digitPositions] - ord("0")
+  ok = ((numpy.char.str_len(column) == width) &
+        numpy.all((digits >= 0) & (digits <= 9), axis=1) &
+        numpy.all(charCodes[:, ~digitPositions] == layoutCodes[~digitPositions],
+                  axis=1))
+
+  # Defaults per datetime.strptime
+  fields = {"Y": 1900, "m": 1, "d": 1, "H": 0, "M": 0, "S": 0, "f": 0}
+
+  for group, directive in enumerate(directives, 1):
+    start, end = match.start(group), match.end(group)
+    value = numpy.zeros(len(column), dtype=numpy.int64)
+    for position in xrange(start, end):
+      value = value * 10 + (charCodes[:, position] - ord("0"))
+
+    if directive == "f":
+      fields["f"] = value * 10 ** (6 - (end - start))
+    elif directive == "y":
+      fields["Y"] = numpy.where(value <= 68, value + 2000, value + 1900)
+    else:
+      fields[directive] = value
+
+  # NOTE: numpy.broadcast_to requires numpy 1.10
+  fields = dict((directive, numpy.zeros(ok.shape, dtype=numpy.int64) + value)
+                for directive, value in fields.iteritems())
+
+  ok &= ((fields["Y"] >= 1) &
+         (fields["m"] >= 1) & (fields["m"] <= 12) &
+         (fields["d"] >= 1) & (fields["d"] <= 31) &
+         (fields["H"] <= 23) & (fields["M"] <= 59) & (fields["S"] <= 59))
+
+  # Substitute a valid date for the rest so the conversions below can't fail
+  year = numpy.where(ok, fields["Y"], 1970)
+  month = numpy.where(ok, fields["m"], 1)
+  day = numpy.where(ok, fields["d"], 1)
+
+  months = ((year - 1970) * 12 + (month - 1)).astype("datetime64[M]")
+  days = months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+
+  # Reject days past the end of the month
+  ok &= days.astype("datetime64[M]") == months
+
+  microseconds = (((fields["H"] * 60 + fields["M"]) * 60 + fields["S"]) *
+                  1000000 + fields["f"])
+  timestamps = (days.astype("datetime64[us]") +
+                numpy.where(ok, microseconds, 0).astype("timedelta64[us]"))
+
+  return [timestamp if isOk else None
+          for timestamp, isOk in zip(timestamps.astype(object).tolist(), ok)]
@@ -0,0 +1,218 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of model_runner_2 throughput over a synthetic CSV file: compares the
+per-row output mode with the batch mode (--batch).
+
+Usage:
+
+$ python tests/py/benchmark/model_runner_2_benchmark.py --rows=20000 [--agg=300]
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from nupic.frameworks.opf.common_models.cluster_params import (
+  getScalarMetricWithTimeOfDayAnomalyParams)
+
+
+
+_DEFAULT_NUM_ROWS = 10000
+
+# Interval between synthetic input rows
+_ROW_INTERVAL_SEC = 60
+
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Size of reads from the model runner's stdout pipe
+_READ_SIZE = 65536
+
+
+
+def _writeSyntheticCsv(fileObj, numRows):
+  """ Write a synthetic metric with a daily cycle plus noise
+
+  :param fileObj: file-like object to write CSV rows to
+  :param int numRows: number of rows to write
+  """
+  rng = random.Random(42)
+  timestamp = datetime(2016, 1, 1)
+  step = timedelta(seconds=_ROW_INTERVAL_SEC)
+
+  for i in xrange(numRows):
+    phase = 2 * math.pi * i * _ROW_INTERVAL_SEC / (24 * 3600.0)
+    value = 50 + 40 * math.sin(phase) + rng.gauss(0, 5)
+    fileObj.write("%s,%.3f\n" % (timestamp.strftime(_DATETIME_FORMAT), value))
+    timestamp += step
+
+
+def _runModelRunner(csvPath, aggOpt, batch):
+  """ Run model_runner_2 over the given CSV file and consume its output
+
+  :param str csvPath: path of the input CSV file
+  :param dict aggOpt: aggregation options per agg_opt_schema.json; None if no
+    aggregation
+  :param bool batch: True to run model_runner_2 in batch mode
+  :returns: dict of results: numOutputRows, numReads, elapsedSec
+  """
+  swarmParams = getScalarMetricWithTimeOfDayAnomalyParams(
+    metricData=[0],
+    minVal=0,
+    maxVal=100,
+    minResolution=None)
+
+  inputOpt = dict(
+    csv=csvPath,
+    rowOffset=0,
+    timestampIndex=0,
+    valueIndex=1,
+    datetimeFormat=_DATETIME_FORMAT)
+
+  modelOpt = dict(
+    modelId="benchmark",
+    modelConfig=swarmParams["modelConfig"],
+    inferenceArgs=swarmParams["inferenceArgs"],
+    timestampFieldName="c0",
+    valueFieldName="c1")
+
+  args = [
+    sys.executable,
+    "-m", "unicorn_backend.model_runner_2",
+    "--input={}".format(json.dumps(inputOpt)),
+    "--model={}".format(json.dumps(modelOpt)),
+  ]
+
+  if aggOpt is not None:
+    args.append("--agg={}".format(json.dumps(aggOpt)))
+
+  if batch:
+    args.append("--batch")
+
+  startTime = time.time()
+
+  process = subprocess.Popen(args=args, stdout=subprocess.PIPE, close_fds=True)
+
+  # Read the way ModelService.js does: one chunk per pipe read
+  numReads = 0
+  numOutputRows = 0
+  try:
+    while True:
+      data = os.read(process.stdout.fileno(), _READ_SIZE)
+      if not data:
+        break
+      numReads += 1
+      numOutputRows += data.count("\n")
+  finally:
+    process.stdout.close()
+    process.wait()
+
+  elapsedSec = time.time() - startTime
+
+  if process.returncode != 0:
+    raise RuntimeError("model_runner_2 failed with returncode={}"
+                       .format(process.returncode))
+
+  return dict(numOutputRows=numOutputRows,
+              numReads=numReads,
+              elapsedSec=elapsedSec)
+
+
+def runBenchmark(numRows, aggWindowSec):
+  """ Measure model_runner_2 throughput in per-row and batch modes
+
+  :param int numRows: number of synthetic input rows
+  :param int aggWindowSec: aggregation window size in seconds; None for no
+    aggregation
+  :returns: dict of per-mode results keyed by "perRow" and "batch"
+  """
+  aggOpt = None
+  if aggWindowSec is not None:
+    aggOpt = dict(windowSize=aggWindowSec, func="mean")
+
+  fd, csvPath = tempfile.mkstemp(suffix=".csv")
+  try:
+    with os.fdopen(fd, "w") as csvFile:
+      _writeSyntheticCsv(csvFile, numRows)
+
+    results = dict()
+    for label, batch in (("perRow", False), ("batch", True)):
+      results[label] = _runModelRunner(csvPath, aggOpt, batch)
+
+    if results["perRow"]["numOutputRows"] != results["batch"]["numOutputRows"]:
+      raise AssertionError("Batch mode changed output: %r" % (results,))
+
+    return results
+  finally:
+    os.unlink(csvPath)
+
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Measures model_runner_2 throughput over a synthetic CSV file "
+                "in per-row and batch modes.")
+
+  parser.add_argument(
+    "--rows",
+    type=int,
+    default=_DEFAULT_NUM_ROWS,
+    dest="numRows",
+    help="Number of synthetic input rows [default: %(default)s]")
+
+  parser.add_argument(
+    "--agg",
+    type=int,
+    default=None,
+    dest="aggWindowSec",
+    help=("Aggregation window size in seconds; input rows are {} seconds "
+          "apart [default: no aggregation]".format(_ROW_INTERVAL_SEC)))
+
+  options = parser.parse_args()
+
+  results = runBenchmark(numRows=options.numRows,
+                         aggWindowSec=options.aggWindowSec)
+
+  for label in ("perRow", "batch"):
+    result = results[label]
+    print ("{}: inputRowsPerSec={:.0f}; outputRows={}; outputReads={}; "
+           "elapsedSec={:.2f}".format(
+             label,
+             options.numRows / max(result["elapsedSec"], 1e-6),
+             result["numOutputRows"],
+             result["numReads"],
+             result["elapsedSec"]))
+
+  print "speedup={:.2f}x".format(results["perRow"]["elapsedSec"] /
+                                 max(results["batch"]["elapsedSec"], 1e-6))
+
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,144 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2016, Numenta, Inc.  Unless you have purchased from
+# Numenta, Inc. a separate commercial license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Benchmark of param_finder's continuous wavelet transform: compares the direct
+convolution per width (_cwt) with the FFT-based one (_fftCwt) over synthetic
+data with the widths that _calculateContinuousWaveletTransform would use.
+
+Usage:
+
+$ python tests/py/benchmark/param_finder_benchmark.py \
+  --rows=10000,100000,1000000
+"""
+
+# Disable pylint warnings concerning access to protected members
+# pylint: disable=W0212
+
+import argparse
+import time
+
+import numpy
+
+from unicorn_backend import param_finder
+
+
+
+_DEFAULT_NUM_ROWS = "10000,100000,1000000"
+
+# The direct transform is quadratic; skip it for larger inputs by default
+_DEFAULT_MAX_DIRECT_ROWS = 100000
+
+# Sampling interval of the synthetic data
+_SAMPLING_INTERVAL_MS = 300000
+
+
+
+def _makeValues(numRows):
+  """ Synthesize a metric with a daily cycle plus noise
+
+  :param int numRows: number of samples
+  :returns: numpy array of float64 values
+  """
+  randomState = numpy.random.RandomState(42)
+  period = param_finder._ONE_DAY_IN_SEC * 1000 / _SAMPLING_INTERVAL_MS
+  return (numpy.sin(numpy.arange(numRows) * 2 * numpy.pi / period) +
+          0.3 * randomState.randn(numRows))
+
+
+def _getWidths(numRows):
+  """
+  :returns: widths per _calculateContinuousWaveletTransform
+  """
+  maxTimeScaleN = min(
+    float(param_finder.MAX_WAVELET_TIME_WINDOW_MS) / _SAMPLING_INTERVAL_MS,
+    numRows / 10)
+  return numpy.logspace(0, numpy.log10(maxTimeScaleN), 50)
+
+
+def runBenchmark(numRows, maxDirectRows):
+  """ Time the direct and FFT-based transforms
+
+  :param int numRows: number of samples
+  :param int maxDirectRows: skip the direct transform above this many samples
+  :returns: dict of results: directSec (None if skipped), fftSec and
+    maxAbsDiff (None if skipped)
+  """
+  values = _makeValues(numRows)
+  widths = _getWidths(numRows)
+
+  startTime = time.time()
+  fftResult = param_finder._fftCwt(values, param_finder._rickerWavelet, widths)
+  fftSec = time.time() - startTime
+
+  directSec = None
+  maxAbsDiff = None
+  if numRows <= maxDirectRows:
+    startTime = time.time()
+    directResult = param_finder._cwt(values, param_finder._rickerWavelet,
+                                     widths)
+    directSec = time.time() - startTime
+
+    maxAbsDiff = numpy.max(numpy.abs(directResult - fftResult))
+
+  return dict(directSec=directSec, fftSec=fftSec, maxAbsDiff=maxAbsDiff)
+
+
+
+def main():
+  parser = argparse.ArgumentParser(
+    description="Measures the direct and FFT-based continuous wavelet "
+                "transforms of param_finder over synthetic data.")
+
+  parser.add_argument(
+    "--rows",
+    default=_DEFAULT_NUM_ROWS,
+    dest="numRows",
+    help="Comma-separated numbers of samples [default: %(default)s]")
+
+  parser.add_argument(
+    "--max-direct-rows",
+    type=int,
+    default=_DEFAULT_MAX_DIRECT_ROWS,
+    dest="maxDirectRows",
+    help=("Skip the direct transform for inputs with more samples "
+          "[default: %(default)s]"))
+
+  options = parser.parse_args()
+
+  for numRows in [int(n) for n in options.numRows.split(",")]:
+    results = runBenchmark(numRows=numRows,
+                           maxDirectRows=options.maxDirectRows)
+
+    if results["directSec"] is None:
+      print "rows={}: fftSec={:.3f}; directSec=skipped".format(
+        numRows, results["fftSec"])
+    else:
+      print ("rows={}: fftSec={:.3f}; directSec={:.3f}; speedup={:.1f}x; "
+             "maxAbsDiff={:.2e}".format(
+               numRows, results["fftSec"], results["directSec"],
+               results["directSec"] / max(results["fftSec"], 1e-6),
+               results["maxAbsDiff"]))
+
+
+
+if __name__ == "__main__":
+  main()
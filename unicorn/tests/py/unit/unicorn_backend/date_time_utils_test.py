@@ -1298,3 +1298,148 @@ class ExtendedStrptimeTestCase(unittest.TestCase):
       excCtx.exception.args[0],
       "time data '2016-01-29T23:00:00.123+' does not match format "
       "'%Y-%m-%dT%H:%M:%S.%f%z'")
+
+
+
+class CompiledParserTestCase(unittest.TestCase):
+  # Each element is a two-tuple: format, input; these are parsed (or rejected)
+  # by parseDatetime and must be parsed (or rejected) the same way by the
+  # compiled parsers
+  _EXTRA_SAMPLES = [
+    # Unix Timestamps
+    ("#T", "1465257536.142103"),
+    ("#T", "0"),
+    ("#T", str(date_time_utils._MAX_UNIX_SECONDS)),
+    ("#T", str(date_time_utils._MAX_UNIX_SECONDS + 1)),
+    ("#T", "-5"),
+    ("#T", "xyz"),
+    ("#t", "1465257536142.103"),
+    ("#t", "0"),
+    ("#t", "-1465257536142.103"),
+    ("#t", "xyz"),
+
+    # Fields that strptime accepts, but the fast path leaves to it
+    ("%Y-%m-%d %H:%M:%S", "2016-1-2 3:04:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-01-02  03:04:05"),
+    ("%Y-%m-%dT%H:%M:%S", "2016-01-02t03:04:05"),
+    ("%m/%d/%Y", " 1/ 2/2016"),
+    ("%Y%m%d%H%M", "201601021204"),
+
+    # Out-of-range fields
+    ("%Y-%m-%d %H:%M:%S", "0000-01-02 03:04:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-13-02 03:04:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-02-30 03:04:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-02-29 24:04:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-02-29 23:60:05"),
+    ("%Y-%m-%d %H:%M:%S", "2016-02-29 23:59:60"),
+    ("%m/%d/%y", "02/29/00"),
+    ("%m/%d/%y", "02/29/69"),
+    ("%m/%d", "02/29"),
+
+    # Malformed input
+    ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29T23:00:00."),
+    ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29T23:00:00.1234567"),
+    ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29T23:00:00.123\n"),
+    ("%Y-%m-%dT%H:%M:%S.%f", "2016-01-29 23:00:00.123"),
+    ("%Y-%m-%dT%H:%M:%S.%f%z", "2016-01-29T23:00:00.123+000"),
+    ("%Y-%m-%dT%H:%M:%S.%f%z", "2016-01-29T23:00:00.123+00:60"),
+    ("%Y-%m-%dT%H:%M:%S.%f%z", "2016-01-29T23:00:00.123+25:00"),
+    ("%Y-%m-%dT%H:%M:%S.%f%z", "2016-01-29T23:00+01:00"),
+    ("%m-%d-%Y %I:%M:%S.%f %W", "01-29-2016 11:01:59.01 AM"),
+  ]
+
+
+  @classmethod
+  def _getSamples(cls):
+    return ([(fmt, timestamp) for fmt, timestamp, _ in
+             ExtendedStrptimeTestCase._GOOD_SAMPLES] +
+            cls._EXTRA_SAMPLES)
+
+
+  @staticmethod
+  def _parse(parser, *args):
+    """
+    :returns: two-tuple ("result", <result and its isoformat()>) or
+      ("exception", <type and args>)
+    """
+    try:
+      result = parser(*args)
+    except (TypeError, ValueError) as exc:
+      return "exception", (type(exc), exc.args)
+
+    return "result", (result, result.isoformat())
+
+
+  def testCompiledParserMatchesParseDatetime(self):
+    for fmt, timestamp in self._getSamples():
+      self.assertEqual(
+        self._parse(date_time_utils.compileDatetimeParser(fmt), timestamp),
+        self._parse(date_time_utils.parseDatetime, timestamp, fmt),
+        msg="ts={!r} fmt={!r}".format(timestamp, fmt))
+
+
+  def testParserIsCompiledOncePerFormat(self):
+    self.assertIs(
+      date_time_utils.compileDatetimeParser("%Y-%m-%d %H:%M:%S"),
+      date_time_utils.compileDatetimeParser("%Y-%m-%d %H:%M:%S"))
+
+
+  def testColumnMatchesParseDatetime(self):
+    samplesByFormat = dict()
+    for fmt, timestamp in self._getSamples():
+      samplesByFormat.setdefault(fmt, []).append(timestamp)
+
+    for fmt, timestamps in samplesByFormat.iteritems():
+      # Parse the good ones as a column; also with the layout of each one first
+      expected = [self._parse(date_time_utils.parseDatetime, timestamp, fmt)
+                  for timestamp in timestamps]
+      goodTimestamps = [timestamp
+                        for timestamp, (kind, _) in zip(timestamps, expected)
+                        if kind == "result"]
+
+      for i in xrange(len(goodTimestamps)):
+        column = goodTimestamps[i:] + goodTimestamps[:i]
+        self.assertEqual(
+          [(result, result.isoformat()) for result in
+           date_time_utils.parseDatetimeColumn(column, fmt)],
+          [result for _, result in
+           (self._parse(date_time_utils.parseDatetime, timestamp, fmt)
+            for timestamp in column)],
+          msg="fmt={!r} column={!r}".format(fmt, column))
+
+      # Each bad one raises the same exception following the good ones
+      for timestamp, (kind, result) in zip(timestamps, expected):
+        if kind == "exception":
+          self.assertEqual(
+            self._parse(date_time_utils.parseDatetimeColumn,
+                        goodTimestamps + [timestamp] + goodTimestamps, fmt),
+            (kind, result),
+            msg="ts={!r} fmt={!r}".format(timestamp, fmt))
+
+
+  def testColumnOfSameLayout(self):
+    timestamps = ["2016-01-02 03:04:05",
+                  "2016-12-31 23:59:59",
+                  "2016-02-29 00:00:00",
+                  "2016-2-29 00:00:00",
+                  "2016-01-02 03:04:05.1"]
+
+    fmt = "%Y-%m-%d %H:%M:%S"
+
+    self.assertEqual(
+      date_time_utils.parseDatetimeColumn(timestamps[:4], fmt),
+      [datetime(2016, 1, 2, 3, 4, 5),
+       datetime(2016, 12, 31, 23, 59, 59),
+       datetime(2016, 2, 29),
+       datetime(2016, 2, 29)])
+
+    with self.assertRaises(ValueError) as excCtx:
+      date_time_utils.parseDatetimeColumn(timestamps, fmt)
+
+    self.assertEqual(excCtx.exception.args[0], "unconverted data remains: .1")
+
+
+  def testEmptyColumn(self):
+    self.assertEqual(
+      date_time_utils.parseDatetimeColumn([], "%Y-%m-%d %H:%M:%S"),
+      [])
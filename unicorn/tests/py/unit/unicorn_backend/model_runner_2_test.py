@@ -21,9 +21,11 @@
 
 """Unit test of the unicorn_backend.model_runner_2 module"""
 
+import json
 import logging
-from mock import patch
+from mock import Mock, patch
 import sys
+import time
 import unittest
 
 from unicorn_backend import model_runner_2
@@ -80,3 +82,129 @@ class ModelRunnerTestCase(unittest.TestCase):
                                 "argument --input is required")
 
     _assertArgumentPatternFails(['--input="{}"', '--model="{}"'])
+
+
+  def testParseArgsBatch(self):
+    """ --batch selects batch mode; per-row mode is the default
+    """
+    inputSpec = dict(rowOffset=0, timestampIndex=0, valueIndex=1,
+                     datetimeFormat="%Y-%m-%dT%H:%M:%S.%f")
+    modelSpec = dict(modelId="m", modelConfig={}, inferenceArgs={},
+                     timestampFieldName="c0", valueFieldName="c1")
+
+    argv = ["unicorn_backend/model_runner_2.py",
+            "--input={}".format(json.dumps(inputSpec)),
+            "--model={}".format(json.dumps(modelSpec))]
+
+    with patch.object(sys, "argv", argv):
+      # pylint: disable=W0212
+      self.assertFalse(model_runner_2._parseArgs().batch)
+
+    with patch.object(sys, "argv", argv + ["--batch"]):
+      # pylint: disable=W0212
+      self.assertTrue(model_runner_2._parseArgs().batch)
+
+
+
+class FramedOutputWriterTestCase(unittest.TestCase):
+
+
+  def testPerRowWritesEachMessage(self):
+    outFileObj = Mock(spec_set=file)
+
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedOutputWriter(outFileObj=outFileObj,
+                                                maxFrameBytes=0,
+                                                maxFrameLatencySec=0)
+    writer.write("a\n")
+    writer.write("b\n")
+
+    self.assertEqual([c[0][0] for c in outFileObj.write.call_args_list],
+                     ["a\n", "b\n"])
+    self.assertEqual(outFileObj.flush.call_count, 2)
+
+
+  def testFramesAreBoundedBySize(self):
+    outFileObj = Mock(spec_set=file)
+
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedOutputWriter(outFileObj=outFileObj,
+                                                maxFrameBytes=10,
+                                                maxFrameLatencySec=60)
+    for message in ("1234\n", "5678\n", "abc\n", "defghijklmno\n", "z\n"):
+      writer.write(message)
+
+    # "abc\n" doesn't fit the first frame; the oversized message is a frame of
+    # its own
+    self.assertEqual([c[0][0] for c in outFileObj.write.call_args_list],
+                     ["1234\n5678\n", "abc\n", "defghijklmno\n"])
+
+    writer.flush()
+
+    self.assertEqual(outFileObj.write.call_args[0][0], "z\n")
+    self.assertEqual(outFileObj.flush.call_count, 4)
+
+    # Nothing left to write
+    writer.flush()
+    self.assertEqual(outFileObj.write.call_count, 4)
+
+
+  @patch.object(model_runner_2.time, "time", autospec=True)
+  def testFramesAreBoundedByLatency(self, timeMock):
+    outFileObj = Mock(spec_set=file)
+
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedOutputWriter(outFileObj=outFileObj,
+                                                maxFrameBytes=4096,
+                                                maxFrameLatencySec=1)
+
+    timeMock.return_value = 100
+    writer.write("a\n")
+    timeMock.return_value = 100.5
+    writer.write("b\n")
+    self.assertFalse(outFileObj.write.called)
+
+    timeMock.return_value = 101
+    writer.write("c\n")
+    outFileObj.write.assert_called_once_with("a\nb\nc\n")
+
+
+  def testBackgroundFlushWritesIdleFrames(self):
+    outFileObj = Mock(spec_set=file)
+
+    # pylint: disable=W0212
+    writer = model_runner_2._FramedOutputWriter(outFileObj=outFileObj,
+                                                maxFrameBytes=4096,
+                                                maxFrameLatencySec=0.01,
+                                                flushInBackground=True)
+    self.addCleanup(writer.close)
+
+    writer.write("a\n")
+
+    # The frame is written out without waiting for another message
+    deadline = time.time() + 10
+    while not outFileObj.write.called and time.time() < deadline:
+      time.sleep(0.01)
+
+    outFileObj.write.assert_called_once_with("a\n")
+
+    writer.write("b\n")
+    writer.close()
+
+    self.assertEqual(outFileObj.write.call_args[0][0], "b\n")
+    self.assertEqual(outFileObj.write.call_count, 2)
+
+
+  def testRunFlushesOutputOnError(self):
+    outputWriter = Mock(spec_set=model_runner_2._FramedOutputWriter)
+
+    # pylint: disable=W0212
+    runner = model_runner_2._ModelRunner.__new__(model_runner_2._ModelRunner)
+    runner._outputWriter = outputWriter
+
+    with patch.object(runner, "_processInput", autospec=True,
+                      side_effect=ValueError):
+      with self.assertRaises(ValueError):
+        runner.run()
+
+    outputWriter.flush.assert_called_once_with()
@@ -26,12 +26,17 @@
 
 import datetime
 import dateutil.tz
+import glob
+import json
+from mock import patch
+import os
 import random
 import unittest
 
 import numpy
 
 from unicorn_backend import param_finder
+from unicorn_backend import param_finder_runner
 
 
 
@@ -99,6 +104,28 @@ class ParamFinderTestCase(unittest.TestCase):
     self.assertTrue(abs(targetPeriod - calculatedPeriodInS) / targetPeriod < .1)
 
 
+  def testFftCwtMatchesCwt(self):
+    """
+    Verify that the FFT-based CWT matches the direct one, including when the
+    widths are split into multiple blocks
+    """
+    randomState = numpy.random.RandomState(42)
+    values = (numpy.sin(numpy.arange(3000) * 2 * numpy.pi / 288.0) +
+              randomState.randn(3000))
+    widths = numpy.logspace(0, numpy.log10(300), 50)
+
+    expected = param_finder._cwt(values, param_finder._rickerWavelet, widths)
+
+    numpy.testing.assert_allclose(
+      param_finder._fftCwt(values, param_finder._rickerWavelet, widths),
+      expected, rtol=0, atol=1e-9)
+
+    with patch.object(param_finder, "_FFT_CWT_BLOCK_MAX_COEFFICIENTS", 10000):
+      numpy.testing.assert_allclose(
+        param_finder._fftCwt(values, param_finder._rickerWavelet, widths),
+        expected, rtol=0, atol=1e-9)
+
+
   def testDetermineEncoderTypes(self):
     # daily and weekly periodicity in units of seconds
     dayPeriod = 86400.0
@@ -253,6 +280,70 @@ class ParamFinderTestCase(unittest.TestCase):
                       ["sensorParams"]["encoders"]["c0_dayOfWeek"])
 
 
+  def testFindParametersGolden(self):
+    """
+    Verify findParameters against the expected results of the compatibility
+    test datasets, with samples given as tuples and as a numpy array
+    """
+    compatibilityTestDir = os.path.join(
+      os.path.abspath(os.path.dirname(__file__)),
+      os.path.pardir,
+      os.path.pardir,
+      "integration",
+      "compatibility_test")
+
+    resultPaths = glob.glob(os.path.join(compatibilityTestDir, "results",
+                                         "*_model_params.json"))
+    self.assertGreater(len(resultPaths), 0)
+
+    for resultPath in resultPaths:
+      name = os.path.basename(resultPath)[:-len("_model_params.json")]
+
+      with open(resultPath) as resultFile:
+        expectedOutputInfo = json.load(resultFile)
+
+      samples = param_finder_runner._readCSVFile(
+        fileName=os.path.join(compatibilityTestDir, "data", name + ".csv"),
+        rowOffset=1,
+        timestampIndex=0,
+        valueIndex=1,
+        datetimeFormat="%Y-%m-%d %H:%M:%S")
+
+      samplesArray = numpy.array(
+        [(timestamp.replace(tzinfo=None), value)
+         for timestamp, value in samples],
+        dtype=[("timestamp", "datetime64[ms]"), ("value", "float64")])
+
+      for inputSamples in (samples, samplesArray):
+        outputInfo = json.loads(
+          json.dumps(param_finder.findParameters(inputSamples)))
+
+        self.assertEqual(outputInfo, expectedOutputInfo, msg=name)
+
+
+  def testFindParametersRejectsBadArray(self):
+    with self.assertRaises(TypeError):
+      param_finder.findParameters(numpy.zeros(200))
+
+    with self.assertRaises(TypeError):
+      param_finder.findParameters(
+        numpy.zeros(200, dtype=[("timestamp", "float64"),
+                                ("value", "float64")]))
+
+
+  def testGetAggregationFunctionCountsNaNsAsUnique(self):
+    self.assertEqual(
+      param_finder._getAggregationFunction(numpy.array([numpy.nan, 1.0])),
+      "sum")
+    self.assertEqual(
+      param_finder._getAggregationFunction(
+        numpy.array([numpy.nan, numpy.nan, 1.0])),
+      "mean")
+    self.assertEqual(
+      param_finder._getAggregationFunction(numpy.array([0.0, -0.0, 1.0])),
+      "sum")
+
+
   def testGetModelParams(self):
     values = numpy.linspace(0, 10, 10)
     modelParams = param_finder._getModelParams(